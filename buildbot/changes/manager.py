@@ -40,7 +40,7 @@ from twisted.python import log
 from twisted.internet import defer
 from twisted.application import service
 
-from buildbot import interfaces, util
+from buildbot import interfaces
 
 class ChangeManager(service.MultiService):
 
@@ -61,7 +61,8 @@ class ChangeManager(service.MultiService):
     to point at the ChangeMaster. When the application begins, these will 
     be started with .start() . At shutdown time, they will be terminated 
     with .stop() . They must be persistable. They are expected to call 
-    self.changemaster.addChange() with Change objects.
+    self.changemaster.addChange() with Change objects, or addChanges() with
+    a list of them when they find many at once.
 
     There are several different variants of the second type of source:
 
@@ -83,7 +84,6 @@ class ChangeManager(service.MultiService):
 
     def __init__(self):
         service.MultiService.__init__(self)
-        self._cache = util.LRUCache()
 
     def addSource(self, source):
         assert interfaces.IChangeSource.providedBy(source)
@@ -112,6 +112,15 @@ class ChangeManager(service.MultiService):
         # wakes up the Schedulers.
         self.parent.addChange(change)
 
+    def addChanges(self, changes):
+        """Deliver a list of Change objects all at once, as a ChangeSource
+        that has fallen behind will find them, without blocking the reactor
+        while they are stored. Returns a Deferred that fires with the list
+        once the changes are numbered and in the database."""
+        if changes:
+            log.msg("adding %d changes, %d files"
+                    % (len(changes), sum([len(c.files) for c in changes])))
+        return self.parent.addChanges(changes)
 
     # IEventSource methods
 
@@ -463,8 +463,9 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         return changes
 
     def submit_changes(self, changes):
-        for c in changes:
-            self.parent.addChange(c)
+        # all of the revisions found by one poll (many of them, after an
+        # outage) are added in one transaction
+        return self.parent.addChanges(changes)
 
     def finished_ok(self, res):
         log.msg("SVNPoller finished polling %s" % res)
@@ -36,7 +36,7 @@
 #
 # ***** END LICENSE BLOCK *****
 
-import sys, time, collections, base64, textwrap, os, cgi, re
+import sys, time, collections, base64, textwrap, os, cgi, re, traceback
 
 try:
     import simplejson
@@ -252,6 +252,123 @@ TABLES = [
 
     ]
 
+# This is the schema version written by create_db() and required by
+# open_db(). TABLES above always creates a version-1 database, which is then
+# brought up to date by the UPGRADES steps below.
+CURRENT_VERSION = 3
+
+# Secondary indexes, as (name, table, columns). Each column is either a name
+# or a (name, prefixlength) tuple: MySQL refuses to index more than 767 bytes
+# of a VARCHAR column, so those columns are indexed by prefix there. The
+# prefix is ignored for sqlite, which has no such limit.
+INDEXES_V2 = [
+    # get_unclaimed_buildrequests: buildername=? AND complete=0 AND claimed_at<?
+    ("buildrequests_buildername", "buildrequests",
+     [("buildername", 128), "complete", "claimed_at"]),
+    # _check_buildset, examine_buildset, get_buildrequestids_for_buildset
+    ("buildrequests_buildsetid", "buildrequests", ["buildsetid", "complete"]),
+    # get_active_buildset_ids
+    ("buildsets_complete", "buildsets", ["complete"]),
+    # scheduler_get_classified_changes, scheduler_retire_changes
+    ("scheduler_changes_schedulerid", "scheduler_changes",
+     ["schedulerid", "changeid"]),
+    # scheduler_get_subscribed_buildsets
+    ("scheduler_upstream_buildsets_schedulerid", "scheduler_upstream_buildsets",
+     ["schedulerid", "active"]),
+    # changeEventGenerator, with branch= and ORDER BY changeid DESC
+    ("changes_branch", "changes", [("branch", 128), "changeid"]),
+    ("changes_when_timestamp", "changes", ["when_timestamp"]),
+    # per-change lookups in _txn_getChangeNumberedNow
+    ("change_links_changeid", "change_links", ["changeid"]),
+    ("change_files_changeid", "change_files", ["changeid"]),
+    ("change_properties_changeid", "change_properties", ["changeid"]),
+    # _txn_getSourceStampNumbered, get_properties_from_db(buildset_properties)
+    ("sourcestamp_changes_sourcestampid", "sourcestamp_changes",
+     ["sourcestampid"]),
+    ("buildset_properties_buildsetid", "buildset_properties", ["buildsetid"]),
+    # get_buildnums_for_brid
+    ("builds_brid", "builds", ["brid"]),
+    ]
+
+def index_sql(dbapiName, name, table, columns):
+    """Return a CREATE INDEX statement suitable for the given dbapi."""
+    cols = []
+    for col in columns:
+        if isinstance(col, tuple):
+            col, prefix = col
+            if 'MySQLdb' in dbapiName:
+                col = "%s(%d)" % (col, prefix)
+        cols.append(col)
+    return "CREATE INDEX %s ON %s (%s)" % (name, table, ", ".join(cols))
+
+def _index_exists(t, dbapiName, table, name):
+    if 'MySQLdb' in dbapiName:
+        t.execute("SHOW INDEX FROM %s WHERE Key_name = %%s" % table, (name,))
+    else:
+        t.execute("SELECT name FROM sqlite_master"
+                  " WHERE type='index' AND name = ?", (name,))
+    return bool(t.fetchall())
+
+def _table_exists(t, dbapiName, table):
+    if 'MySQLdb' in dbapiName:
+        t.execute("SHOW TABLES LIKE %s", (table,))
+    else:
+        t.execute("SELECT name FROM sqlite_master"
+                  " WHERE type='table' AND name = ?", (table,))
+    return bool(t.fetchall())
+
+def create_index(t, dbapiName, name, table, columns):
+    """Create the given index, unless an earlier, interrupted upgrade
+    already did."""
+    if not _index_exists(t, dbapiName, table, name):
+        t.execute(index_sql(dbapiName, name, table, columns))
+
+def upgrade_1_to_2(t, dbapiName):
+    # version 2 only adds indexes; the tables themselves are unchanged
+    for (name, table, columns) in INDEXES_V2:
+        create_index(t, dbapiName, name, table, columns)
+    t.execute("UPDATE version SET version = 2")
+
+BUILD_SUMMARIES_TABLE = textwrap.dedent("""
+    -- one row for each finished build, with what the status displays need
+    -- to know about it without loading its pickle. 'number' is scoped to
+    -- the buildmaster (master_name, like buildrequests.claimed_by_name) and
+    -- the builder.
+    CREATE TABLE build_summaries (
+        `master_name` VARCHAR(256) NOT NULL,
+        `buildername` VARCHAR(256) NOT NULL,
+        `number` INTEGER NOT NULL,
+        `start_time` DOUBLE,
+        `finish_time` DOUBLE,
+        `results` SMALLINT, -- 0=SUCCESS,1=WARNINGS,etc, from status/builder.py
+        `branch` VARCHAR(256) default NULL,
+        `revision` VARCHAR(256) default NULL,
+        `got_revision` VARCHAR(256) default NULL,
+        `has_patch` SMALLINT NOT NULL default 0,
+        `changeids` TEXT, -- comma-separated, NULL if unknown
+        `slavename` VARCHAR(256) default NULL,
+        `text` TEXT -- JSON-encoded list of strings
+    );
+""")
+
+def upgrade_2_to_3(t, dbapiName):
+    # version 3 adds the build_summaries table
+    if not _table_exists(t, dbapiName, "build_summaries"):
+        t.execute(BUILD_SUMMARIES_TABLE)
+    create_index(t, dbapiName, "build_summaries_number", "build_summaries",
+                 [("master_name", 128), ("buildername", 128), "number"])
+    t.execute("UPDATE version SET version = 3")
+
+# UPGRADES[n] brings a version-n database to version n+1. The steps cannot
+# rely on a transaction to make them all-or-nothing: MySQL commits before
+# each CREATE statement, and so does pysqlite. Instead each step skips the
+# tables and indexes that are already there, so a step that was interrupted
+# can be run again from the start.
+UPGRADES = {
+    1: upgrade_1_to_2,
+    2: upgrade_2_to_3,
+    }
+
 # garbage-collection rules: the following rows can be GCed:
 #  a patch that isn't referenced by any sourcestamps
 #  a sourcestamp that isn't referenced by any buildsets
@@ -365,6 +482,8 @@ def create_db(spec):
     c = conn.cursor()
     try:
         c.execute("SELECT version FROM version")
+        # release the read lock before anybody tries to upgrade this db
+        conn.close()
         raise DBAlreadyExistsError("Refusing to touch an existing database")
     except (dbapi.OperationalError, dbapi.ProgrammingError):
         # mysql gives _mysql_exceptions.ProgrammingError
@@ -379,6 +498,10 @@ def create_db(spec):
             log.msg("error executing SQL: %s" % t)
             raise
     conn.commit()
+    # TABLES creates a version-1 database: bring it up to date
+    for ver in range(1, CURRENT_VERSION):
+        UPGRADES[ver](c, spec.dbapiName)
+    conn.commit()
 
 def create_or_upgrade_db(spec):
     try:
@@ -393,16 +516,17 @@ def create_or_upgrade_db(spec):
     db = DBConnector(spec)
     db.start()
     ver = db.get_version()
-    # this will eventually have a structure like follows:
-    #if ver == 1:
-    #    upgrade_1_to_2(db) # modify tables, update version table to 2
-    #    ver = 2
-    #if ver == 2:
-    #    upgrade_2_to_3(db) # ditto
-    #    ver = 3
-    #assert ver == 3
-    #return db
-    assert ver == 1
+    if ver > CURRENT_VERSION:
+        db.stop()
+        raise DatabaseNotReadyError("db is at version %d, I only know %d"
+                                    % (ver, CURRENT_VERSION))
+    while ver < CURRENT_VERSION:
+        log.msg("upgrading db from version %d to %d" % (ver, ver+1))
+        # the version is only bumped at the end of each step, and the steps
+        # skip whatever they already did, so an interrupted upgrade can
+        # simply be restarted
+        db.runInteractionNow(UPGRADES[ver], spec.dbapiName)
+        ver = db.get_version()
     # great, we're done!
     return db
 
@@ -414,9 +538,11 @@ def open_db(spec):
     if ver is None:
         db.stop()
         raise DatabaseNotReadyError("cannot use empty database")
-    if ver != 1:
+    if ver != CURRENT_VERSION:
         db.stop()
-        raise DatabaseNotReadyError("db is at version %d, I only know 1" % ver)
+        raise DatabaseNotReadyError("db is at version %d, I only know %d "
+                                    "(run 'buildbot upgrade-master')"
+                                    % (ver, CURRENT_VERSION))
     log.msg("using db version %d" % ver)
     return db
 
@@ -429,14 +555,153 @@ class DatabaseNotReadyError(Exception):
 # ConnectionPool to reconnect next time.
 
 class MyTransaction(adbapi.Transaction):
+    def reopen(self):
+        adbapi.Transaction.reopen(self)
+        # DBConnector sets .query_stats on its ConnectionPool
+        self._cursor = TimedCursor(self._cursor, self._pool.query_stats)
     def execute(self, *args, **kwargs):
         #print "Q", args, kwargs
         return self._cursor.execute(*args, **kwargs)
+    def executemany(self, *args, **kwargs):
+        return self._cursor.executemany(*args, **kwargs)
     def fetchall(self):
         rc = self._cursor.fetchall()
         #print " F", rc
         return rc
 
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_parmlist_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+def query_shape(query):
+    """Return the fingerprint of an SQL query: the query with its literal
+    values and placeholders replaced by '?', IN-lists of any length folded
+    into '(...)', and whitespace normalized. Queries that differ only in
+    their parameters have the same shape."""
+    q = query.replace("%s", "?")
+    q = _literal_re.sub("?", q)
+    q = _parmlist_re.sub("(...)", q)
+    return " ".join(q.split())
+
+class QueryStats:
+    """
+    I collect the number of executions, latency and rows returned of each
+    query shape (see query_shape), and the latency of each kind of
+    interaction (named after the _txn_* method that was run). Only the
+    latest MAX_SAMPLES latencies of each are kept, for the percentiles.
+    """
+
+    synchronized = ["record_query", "record_interaction", "asDict"]
+    MAX_SAMPLES = 1000
+    MAX_SHAPES = 10000
+
+    def __init__(self):
+        self._queries = {} # maps shape to [count, rows, total, samples]
+        self._interactions = {} # maps name to [count, total, samples]
+        self._shapes = {} # memoizes query_shape
+
+    def record_query(self, query, elapsed, rows):
+        shape = self._shapes.get(query)
+        if shape is None:
+            if len(self._shapes) >= self.MAX_SHAPES:
+                # queries with inlined values never repeat: start over
+                self._shapes.clear()
+            shape = self._shapes[query] = query_shape(query)
+        s = self._queries.get(shape)
+        if s is None:
+            s = self._queries[shape] = [0, 0, 0.0, collections.deque()]
+        s[0] += 1
+        if rows:
+            s[1] += rows
+        s[2] += elapsed
+        self._add_sample(s[3], elapsed)
+
+    def record_interaction(self, interaction, elapsed):
+        name = getattr(interaction, "__name__", repr(interaction))
+        s = self._interactions.get(name)
+        if s is None:
+            s = self._interactions[name] = [0, 0.0, collections.deque()]
+        s[0] += 1
+        s[1] += elapsed
+        self._add_sample(s[2], elapsed)
+
+    def _add_sample(self, samples, elapsed):
+        samples.append(elapsed)
+        if len(samples) > self.MAX_SAMPLES:
+            samples.popleft()
+
+    def _latencies(self, samples):
+        samples = sorted(samples)
+        def pct(p):
+            return samples[min(len(samples)-1, int(len(samples) * p))]
+        return {'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99),
+                'max': samples[-1]}
+
+    def asDict(self):
+        queries = {}
+        for (shape, (count, rows, total, samples)) in self._queries.items():
+            d = self._latencies(samples)
+            d.update(count=count, rows=rows, total_time=total)
+            queries[shape] = d
+        interactions = {}
+        for (name, (count, total, samples)) in self._interactions.items():
+            d = self._latencies(samples)
+            d.update(count=count, total_time=total)
+            interactions[name] = d
+        return {'queries': queries, 'interactions': interactions}
+
+    def describe(self, limit=20):
+        """Return a text table of the LIMIT query shapes with the highest
+        total time, for use from the manhole."""
+        queries = self.asDict()['queries'].items()
+        queries.sort(key=lambda item: item[1]['total_time'], reverse=True)
+        lines = ["%8s %9s %8s %8s %8s  %s"
+                 % ("count", "total", "p50", "p95", "p99", "query")]
+        for (shape, d) in queries[:limit]:
+            lines.append("%8d %9.3f %8.4f %8.4f %8.4f  %s"
+                         % (d['count'], d['total_time'], d['p50'], d['p95'],
+                            d['p99'], shape))
+        return "\n".join(lines)
+
+threadable.synchronize(QueryStats)
+
+class TimedCursor:
+    """I wrap a DBAPI cursor, reporting the time taken by each query (from
+    execute() until its rows are fetched or the next query starts) and the
+    number of rows it returned to a QueryStats."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._pending = None
+
+    def _finish(self, rows=None):
+        if self._pending:
+            query, start = self._pending
+            self._pending = None
+            self._stats.record_query(query, time.time() - start, rows)
+
+    def execute(self, query, *args, **kwargs):
+        self._finish()
+        self._pending = (query, time.time())
+        return self._cursor.execute(query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        self._finish()
+        self._pending = (query, time.time())
+        return self._cursor.executemany(query, *args, **kwargs)
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._finish(len(rows))
+        return rows
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
 def _one_or_else(res, default=None, process_f=lambda x: x):
     if not res:
         return default
@@ -447,6 +712,22 @@ def str_or_none(s):
         return None
     return str(s)
 
+def change_size(change):
+    # approximate memory use of a Change, for the change cache
+    size = 500 + len(change.comments or "")
+    for s in change.files + change.links:
+        size += 50 + len(s)
+    size += 100 * len(change.properties.asList())
+    return size
+
+def sourcestamp_size(ss):
+    # approximate memory use of a SourceStamp, not counting its Changes
+    # (which live in the change cache)
+    size = 300
+    if ss.patch:
+        size += len(ss.patch[1])
+    return size
+
 class Token: # used for _start_operation/_end_operation
     pass
 
@@ -455,10 +736,15 @@ class DBConnector(util.ComparableMixin):
     compare_attrs = ["args", "kwargs"]
     synchronized = ["notify", "_end_operation"]
     MAX_QUERY_TIMES = 1000
+    MAX_IN_PARAMS = 500
+    # runInteractionNow() blocks the reactor: calls that take longer than
+    # this many seconds are logged, along with their caller
+    SYNC_STALL_THRESHOLD = 0.5
 
     def __init__(self, spec):
         # typical args = (dbmodule, dbname, username, password)
         self._query_times = collections.deque()
+        self.query_stats = QueryStats()
         self._spec = spec
 
         # this is for synchronous calls: runQueryNow, runInteractionNow
@@ -484,18 +770,24 @@ class DBConnector(util.ComparableMixin):
         self._pool = adbapi.ConnectionPool(spec.dbapiName,
                                            *spec.connargs, **connkw)
         self._pool.transactionFactory = MyTransaction
+        self._pool.query_stats = self.query_stats
         # the pool must be started before it can be used. The real
         # buildmaster process will do this at reactor start. CLI tools (like
         # "buildbot upgrade-master") must do it manually. Unit tests are run
         # in an environment in which it is already started.
 
-        self._change_cache = util.LRUCache()
-        self._sourcestamp_cache = util.LRUCache()
+        self._change_cache = util.LRUCache(sizefunc=change_size)
+        self._sourcestamp_cache = util.LRUCache(sizefunc=sourcestamp_size)
         self._active_operations = set() # protected by synchronized=
         self._pending_notifications = []
         self._subscribers = bbcollections.defaultdict(set)
+        # when other buildmasters share this database, this is set to a
+        # DBNotificationClient's publish method
+        self._notification_publisher = None
 
         self._pending_operation_count = 0
+        # count of runInteractionNow calls over SYNC_STALL_THRESHOLD
+        self._sync_stalls = 0
 
         self._started = False
 
@@ -517,6 +809,20 @@ class DBConnector(util.ComparableMixin):
         self._started = False
         del self._pool
 
+    def setCacheSizes(self, sizes):
+        """Configure the change and sourcestamp caches. SIZES maps 'changes'
+        and/or 'sourcestamps' to a dict with max_size (a number of items)
+        and/or max_bytes (an approximate memory budget). Caches that are
+        not mentioned go back to their default size."""
+        for (name, cache) in [("changes", self._change_cache),
+                              ("sourcestamps", self._sourcestamp_cache)]:
+            cache.resize(**sizes.get(name, {}))
+
+    def getCacheStats(self):
+        """Return a dict mapping cache name to its LRUCache.getStats()."""
+        return {"changes": self._change_cache.getStats(),
+                "sourcestamps": self._sourcestamp_cache.getStats()}
+
     def quoteq(self, query):
         """
         Given a query that contains qmark-style placeholders, like::
@@ -540,6 +846,23 @@ class DBConnector(util.ComparableMixin):
         p = self.quoteq("?")
         return "(" + ",".join([p]*count) + ")"
 
+    def _txn_select_in(self, t, query, ids):
+        """
+        Run QUERY, which must end in 'IN ', against the given ids and return
+        all of the resulting rows. Long lists of ids are split into several
+        queries of at most MAX_IN_PARAMS placeholders each, to stay inside
+        the backends' limits on query parameters. No query is run at all for
+        an empty list.
+        """
+        ids = list(ids)
+        rows = []
+        q = self.quoteq(query)
+        for i in range(0, len(ids), self.MAX_IN_PARAMS):
+            chunk = ids[i:i+self.MAX_IN_PARAMS]
+            t.execute(q + self.parmlist(len(chunk)), tuple(chunk))
+            rows.extend(t.fetchall())
+        return rows
+
     def get_version(self):
         """Returns None for an empty database, or a number (probably 1) for
         the database's version"""
@@ -573,9 +896,10 @@ class DBConnector(util.ComparableMixin):
         if self._active_operations:
             return
         for (category, args) in self._pending_notifications:
-            # in the distributed system, this will be a
-            # transport.write(" ".join([category] + [str(a) for a in args]))
             eventually(self.send_notification, category, args)
+            if self._notification_publisher:
+                # tell the other buildmasters too
+                eventually(self._notification_publisher, category, args)
         self._pending_notifications = []
 
     def runInteractionNow(self, interaction, *args, **kwargs):
@@ -588,12 +912,29 @@ class DBConnector(util.ComparableMixin):
         finally:
             self._end_operation(t)
             self._add_query_time(start)
+            self.query_stats.record_interaction(interaction,
+                                                self._getCurrentTime() - start)
+            self._check_sync_stall(start, interaction, args)
+
+    def _check_sync_stall(self, start, interaction, args):
+        elapsed = self._getCurrentTime() - start
+        if elapsed < self.SYNC_STALL_THRESHOLD:
+            return
+        self._sync_stalls += 1
+        name = getattr(interaction, "__name__", repr(interaction))
+        if name == "_runQuery" and args:
+            name = "query %r" % (args[0],)
+        # show the few frames above runInteractionNow: usually a public
+        # wrapper method like getBuildRequestWithNumber and its callers
+        caller = "".join(traceback.format_stack(limit=5)[:-2]).rstrip()
+        log.msg("synchronous database call %s blocked the reactor for %.3fs,"
+                " called from:\n%s" % (name, elapsed, caller))
 
     def _runInteractionNow(self, interaction, *args, **kwargs):
         if not self._nonpool:
             spec = self._spec
             self._nonpool = self._dbapi.connect(*spec.connargs, **spec.connkw)
-        c = self._nonpool.cursor()
+        c = TimedCursor(self._nonpool.cursor(), self.query_stats)
         try:
             result = interaction(c, *args, **kwargs)
             c.close()
@@ -621,21 +962,28 @@ class DBConnector(util.ComparableMixin):
         self._pending_notifications.append( (category,args) )
 
     def send_notification(self, category, args):
-        # in the distributed system, this will be invoked by lineReceived()
-        #print "SEND", category, args
+        # this delivers notifications to local subscribers. It is invoked for
+        # our own notifications by _end_operation(), and for those of other
+        # buildmasters by DBNotificationClient.notification_received()
         for observer in self._subscribers[category]:
             eventually(observer, category, *args)
 
     def subscribe_to(self, category, observer):
         self._subscribers[category].add(observer)
 
+    def set_notification_publisher(self, publisher):
+        """Arrange for publisher(category, args) to be called with every
+        notification fired by this DBConnector, in addition to delivering it
+        to local subscribers. Pass None to stop publishing."""
+        self._notification_publisher = publisher
+
     def runQuery(self, *args, **kwargs):
         assert self._started
         self._pending_operation_count += 1
         start = self._getCurrentTime()
-        #t = self._start_operation()
+        t = self._start_operation()
         d = self._pool.runQuery(*args, **kwargs)
-        #d.addBoth(self._runQuery_done, start, t)
+        d.addBoth(self._runQuery_done, start, t)
         return d
     def _runQuery_done(self, res, start, t):
         self._end_operation(t)
@@ -655,32 +1003,63 @@ class DBConnector(util.ComparableMixin):
         start = self._getCurrentTime()
         t = self._start_operation()
         d = self._pool.runInteraction(*args, **kwargs)
-        d.addBoth(self._runInteraction_done, start, t)
+        d.addBoth(self._runInteraction_done, start, t, args[0])
         return d
-    def _runInteraction_done(self, res, start, t):
+    def _runInteraction_done(self, res, start, t, interaction):
         self._end_operation(t)
         self._add_query_time(start)
+        self.query_stats.record_interaction(interaction,
+                                            self._getCurrentTime() - start)
         self._pending_operation_count -= 1
         return res
 
     # ChangeManager methods
 
     def addChangeToDatabase(self, change):
-        self.runInteractionNow(self._txn_addChangeToDatabase, change)
+        self.runInteractionNow(self._txn_addChangesToDatabase, [change])
         self._change_cache.add(change.number, change)
 
-    def _txn_addChangeToDatabase(self, t, change):
+    def addChangesToDatabase(self, changes):
+        """Add all of CHANGES (a list of Change objects) in one transaction,
+        without blocking the reactor. Changes without a number are numbered
+        in order, from a single block of changeids. A single 'add-change'
+        notification carries all of the new numbers. Returns a Deferred that
+        fires with CHANGES once they are in the database."""
+        if not changes:
+            return defer.succeed(changes)
+        unnumbered = [c for c in changes if c.number is None]
+        d = self.runInteraction(self._txn_addChangesToDatabase, changes)
+        def _added(ign):
+            self._change_cache.add_many([(c.number, c) for c in changes])
+            return changes
+        def _failed(f):
+            # the transaction was rolled back, so those numbers were never
+            # really allocated
+            for c in unnumbered:
+                c.number = None
+            return f
+        d.addCallbacks(_added, _failed)
+        return d
+
+    def _txn_addChangesToDatabase(self, t, changes):
+        # bumping the counter before reading it takes the write lock first,
+        # so no other buildmaster can be handed the same block of changeids
+        unnumbered = [c for c in changes if c.number is None]
+        if unnumbered:
+            q = ("UPDATE changes_nextid SET next_changeid = next_changeid + ?"
+                 " WHERE 1")
+            t.execute(self.quoteq(q), (len(unnumbered),))
         t.execute("SELECT next_changeid FROM changes_nextid")
-        r = t.fetchall()
-        new_next_changeid = old_next_changeid = r[0][0]
-        if change.number is None:
-            change.number = old_next_changeid
-            new_next_changeid = old_next_changeid + 1
-        else:
-            new_next_changeid = max(old_next_changeid, change.number+1)
-        if new_next_changeid > old_next_changeid:
+        next_changeid = t.fetchall()[0][0]
+        first_changeid = next_changeid - len(unnumbered)
+        for (i, change) in enumerate(unnumbered):
+            change.number = first_changeid + i
+        # changes that came with a number (migrated from a changes.pck) move
+        # the counter past themselves
+        highest = max([c.number for c in changes])
+        if highest >= next_changeid:
             q = "UPDATE changes_nextid SET next_changeid = ? WHERE 1"
-            t.execute(self.quoteq(q), (new_next_changeid,))
+            t.execute(self.quoteq(q), (highest + 1,))
 
         q = self.quoteq("INSERT INTO changes"
                         " (changeid, author,"
@@ -689,28 +1068,33 @@ class DBConnector(util.ComparableMixin):
                         "  when_timestamp, category)"
                         " VALUES (?,?, ?,?, ?,?,?, ?,?)")
         # TODO: map None to.. empty string?
-
-        values = (change.number, change.who,
-                  change.comments, change.isdir,
-                  change.branch, change.revision, change.revlink,
-                  change.when, change.category)
-        t.execute(q, values)
-
-        for link in change.links:
-            t.execute(self.quoteq("INSERT INTO change_links (changeid, link) "
-                                  "VALUES (?,?)"),
-                      (change.number, link))
-        for filename in change.files:
-            t.execute(self.quoteq("INSERT INTO change_files (changeid,filename)"
-                                  " VALUES (?,?)"),
-                      (change.number, filename))
-        for propname,propvalue in change.properties.properties.items():
-            encoded_value = json.dumps(propvalue)
-            t.execute(self.quoteq("INSERT INTO change_properties"
-                                  " (changeid, property_name, property_value)"
-                                  " VALUES (?,?,?)"),
-                      (change.number, propname, encoded_value))
-        self.notify("add-change", change.number)
+        t.executemany(q, [(c.number, c.who,
+                           c.comments, c.isdir,
+                           c.branch, c.revision, c.revlink,
+                           c.when, c.category) for c in changes])
+
+        links = [(c.number, link) for c in changes for link in c.links]
+        if links:
+            t.executemany(self.quoteq("INSERT INTO change_links"
+                                      " (changeid, link) VALUES (?,?)"),
+                          links)
+        files = [(c.number, filename) for c in changes
+                 for filename in c.files]
+        if files:
+            t.executemany(self.quoteq("INSERT INTO change_files"
+                                      " (changeid, filename) VALUES (?,?)"),
+                          files)
+        properties = [(c.number, propname, json.dumps(propvalue))
+                      for c in changes
+                      for (propname, propvalue)
+                      in c.properties.properties.items()]
+        if properties:
+            t.executemany(self.quoteq("INSERT INTO change_properties"
+                                      " (changeid, property_name,"
+                                      "  property_value)"
+                                      " VALUES (?,?,?)"),
+                          properties)
+        self.notify("add-change", *[c.number for c in changes])
 
     def changeEventGenerator(self, branches=[], categories=[], committers=[], minTime=0):
         q = "SELECT changeid FROM changes"
@@ -779,15 +1163,65 @@ class DBConnector(util.ComparableMixin):
 
         p = self.get_properties_from_db("change_properties", "changeid",
                                         changeid, t)
-        properties = p.properties
 
         c = Change(who=who, files=files, comments=comments, isdir=isdir,
                    links=links, revision=revision, when=when,
-                   branch=branch, category=category, revlink=revlink,
-                   properties=properties)
+                   branch=branch, category=category, revlink=revlink)
+        # these already carry their sources: passing them to Change() would
+        # wrap each (value, source) pair as the value of a new one
+        c.properties.updateFromProperties(p)
         c.number = changeid
         return c
 
+    def _txn_getChangesNumberedNow(self, t, changeids):
+        """Return a dict mapping changeid to Change for each of the given
+        changeids that exists, using a fixed number of queries."""
+        changeids = set(changeids)
+        changes = self._change_cache.get_many(changeids)
+        missing = [changeid for changeid in changeids
+                   if changeid not in changes]
+        if not missing:
+            return changes
+
+        rows = self._txn_select_in(t, "SELECT changeid, author, comments,"
+                                      " is_dir, branch, revision, revlink,"
+                                      " when_timestamp, category"
+                                      " FROM changes WHERE changeid IN ",
+                                   missing)
+        links = bbcollections.defaultdict(list)
+        for (changeid, link) in \
+                self._txn_select_in(t, "SELECT changeid, link"
+                                       " FROM change_links"
+                                       " WHERE changeid IN ", missing):
+            links[changeid].append(link)
+        files = bbcollections.defaultdict(list)
+        for (changeid, filename) in \
+                self._txn_select_in(t, "SELECT changeid, filename"
+                                       " FROM change_files"
+                                       " WHERE changeid IN ", missing):
+            files[changeid].append(filename)
+        props = self._txn_get_properties_from_db_many(t, "change_properties",
+                                                      "changeid", missing)
+
+        for (changeid, who, comments,
+             isdir, branch, revision, revlink,
+             when, category) in rows:
+            c_links = links[changeid]
+            c_links.sort()
+            c_files = files[changeid]
+            c_files.sort()
+            c = Change(who=who, files=c_files, comments=comments, isdir=isdir,
+                       links=c_links, revision=str_or_none(revision),
+                       when=when, branch=str_or_none(branch),
+                       category=category, revlink=revlink)
+            c.properties.updateFromProperties(props[changeid])
+            c.number = changeid
+            changes[changeid] = c
+        self._change_cache.add_many([(changeid, changes[changeid])
+                                     for changeid in missing
+                                     if changeid in changes])
+        return changes
+
     def getChangeByNumber(self, changeid):
         # return a Deferred that fires with a Change instance, or None if
         # there is no Change with that number
@@ -795,48 +1229,10 @@ class DBConnector(util.ComparableMixin):
         c = self._change_cache.get(changeid)
         if c:
             return defer.succeed(c)
-        d1 = self.runQuery(self.quoteq("SELECT author, comments,"
-                                       " is_dir, branch, revision, revlink,"
-                                       " when_timestamp, category"
-                                       " FROM changes WHERE changeid = ?"),
-                           (changeid,))
-        d2 = self.runQuery(self.quoteq("SELECT link FROM change_links"
-                                       " WHERE changeid=?"),
-                           (changeid,))
-        d3 = self.runQuery(self.quoteq("SELECT filename FROM change_files"
-                                       " WHERE changeid=?"),
-                           (changeid,))
-        d4 = self.runQuery(self.quoteq("SELECT property_name,property_value"
-                                       " FROM change_properties"
-                                       " WHERE changeid=?"),
-                           (changeid,))
-        d = defer.gatherResults([d1,d2,d3,d4])
-        d.addCallback(self._getChangeByNumber_query_done, changeid)
+        d = self.runInteraction(self._txn_getChangesNumberedNow, [changeid])
+        d.addCallback(lambda changes: changes.get(changeid))
         return d
 
-    def _getChangeByNumber_query_done(self, res, changeid):
-        (rows, link_rows, file_rows, prop_rows) = res
-        if not rows:
-            return None
-        (who, comments,
-         isdir, branch, revision, revlink,
-         when, category) = rows[0]
-        branch = str_or_none(branch)
-        revision = str_or_none(revision)
-        links = [row[0] for row in link_rows]
-        links.sort()
-        files = [row[0] for row in file_rows]
-        files.sort()
-        properties = dict(prop_rows)
-
-        c = Change(who=who, files=files, comments=comments, isdir=isdir,
-                   links=links, revision=revision, when=when,
-                   branch=branch, category=category, revlink=revlink,
-                   properties=properties)
-        c.number = changeid
-        self._change_cache.add(changeid, c)
-        return c
-
     def getChangesGreaterThan(self, last_changeid, t=None):
         """Return a Deferred that fires with a list of all Change instances
         with numbers greater than the given value, sorted by number. This is
@@ -857,8 +1253,12 @@ class DBConnector(util.ComparableMixin):
         return changes
 
     def getChangesByNumber(self, changeids):
-        return defer.gatherResults([self.getChangeByNumber(changeid)
-                                    for changeid in changeids])
+        # returns a Deferred that fires with a list of Changes (or None for
+        # the missing ones) in the same order as CHANGEIDS
+        d = self.runInteraction(self._txn_getChangesNumberedNow, changeids)
+        d.addCallback(lambda changes: [changes.get(changeid)
+                                       for changeid in changeids])
+        return d
 
     # SourceStamp-manipulating methods
 
@@ -877,42 +1277,68 @@ class DBConnector(util.ComparableMixin):
 
     def _txn_getSourceStampNumbered(self, t, ssid):
         assert isinstance(ssid, (int, long))
-        t.execute(self.quoteq("SELECT branch,revision,patchid"
-                              " FROM sourcestamps WHERE id=?"),
-                  (ssid,))
-        r = t.fetchall()
-        if not r:
-            return None
-        (branch_u, revision_u, patchid) = r[0]
-        branch = str_or_none(branch_u)
-        revision = str_or_none(revision_u)
-
-        patch = None
-        if patchid is not None:
-            t.execute(self.quoteq("SELECT patchlevel,patch_base64,subdir"
-                                  " FROM patches WHERE id=?"),
-                      (patchid,))
-            r = t.fetchall()
-            assert len(r) == 1
-            (patch_level, patch_text_base64, subdir_u) = r[0]
+        return self._txn_getSourceStampsNumbered(t, [ssid]).get(ssid)
+
+    def _txn_getSourceStampsNumbered(self, t, ssids):
+        """Return a dict mapping ssid to SourceStamp for each of the given
+        ssids that exists. The sourcestamps, their patches and their Changes
+        are loaded with a fixed number of queries, no matter how many ssids
+        are requested."""
+        ssids = set(ssids)
+        sourcestamps = self._sourcestamp_cache.get_many(ssids)
+        missing = [ssid for ssid in ssids if ssid not in sourcestamps]
+        if not missing:
+            return sourcestamps
+
+        rows = self._txn_select_in(t, "SELECT id,branch,revision,patchid"
+                                      " FROM sourcestamps WHERE id IN ",
+                                   missing)
+        patchids = [patchid for (_, _, _, patchid) in rows
+                    if patchid is not None]
+        patches = {}
+        for (patchid, patch_level, patch_text_base64, subdir_u) in \
+                self._txn_select_in(t, "SELECT id,patchlevel,patch_base64,"
+                                       "subdir FROM patches WHERE id IN ",
+                                    patchids):
             patch_text = base64.b64decode(patch_text_base64)
             if subdir_u:
-                patch = (patch_level, patch_text, str(subdir_u))
+                patches[patchid] = (patch_level, patch_text, str(subdir_u))
             else:
-                patch = (patch_level, patch_text)
-
-        t.execute(self.quoteq("SELECT changeid FROM sourcestamp_changes"
-                              " WHERE sourcestampid=?"
-                              " ORDER BY changeid ASC"),
-                  (ssid,))
-        r = t.fetchall()
-        changes = None
-        if r:
-            changes = [self.getChangeNumberedNow(changeid, t)
-                       for (changeid,) in r]
-        ss = SourceStamp(branch, revision, patch, changes)
-        ss.ssid = ssid
-        return ss
+                patches[patchid] = (patch_level, patch_text)
+
+        ss_changeids = bbcollections.defaultdict(list)
+        for (ssid, changeid) in \
+                self._txn_select_in(t, "SELECT sourcestampid,changeid"
+                                       " FROM sourcestamp_changes"
+                                       " WHERE sourcestampid IN ", missing):
+            ss_changeids[ssid].append(changeid)
+        all_changeids = set()
+        for changeids in ss_changeids.values():
+            changeids.sort()
+            all_changeids.update(changeids)
+        changes = self._txn_getChangesNumberedNow(t, all_changeids)
+
+        for (ssid, branch_u, revision_u, patchid) in rows:
+            branch = str_or_none(branch_u)
+            revision = str_or_none(revision_u)
+            patch = None
+            if patchid is not None:
+                assert patchid in patches
+                patch = patches[patchid]
+            ss_changes = [changes[changeid] for changeid in ss_changeids[ssid]
+                          if changeid in changes]
+            if len(ss_changes) < len(ss_changeids[ssid]):
+                # the changes table may have been pruned separately
+                log.msg("sourcestamp %d refers to missing changes %s"
+                        % (ssid, [changeid for changeid in ss_changeids[ssid]
+                                  if changeid not in changes]))
+            ss = SourceStamp(branch, revision, patch, ss_changes or None)
+            ss.ssid = ssid
+            sourcestamps[ssid] = ss
+        self._sourcestamp_cache.add_many([(ssid, sourcestamps[ssid])
+                                          for ssid in missing
+                                          if ssid in sourcestamps])
+        return sourcestamps
 
     # Properties methods
 
@@ -935,6 +1361,17 @@ class DBConnector(util.ComparableMixin):
             retval.setProperty(str(key), value, source)
         return retval
 
+    def _txn_get_properties_from_db_many(self, t, tablename, idname, ids):
+        # like _txn_get_properties_from_db, but returns a dict mapping each
+        # of the given ids to a Properties instance
+        q = ("SELECT %s,property_name,property_value FROM %s WHERE %s IN "
+             % (idname, tablename, idname))
+        retval = dict([(id, Properties()) for id in ids])
+        for id, key, valuepair in self._txn_select_in(t, q, ids):
+            value, source = json.loads(valuepair)
+            retval[id].setProperty(str(key), value, source)
+        return retval
+
     # Scheduler manipulation methods
 
     def addSchedulers(self, added):
@@ -956,10 +1393,7 @@ class DBConnector(util.ComparableMixin):
                 max_sid = _one_or_else(t.fetchall(), 0)
                 sid = max_sid + 1
                 # new Schedulers are supposed to ignore pre-existing Changes
-                q = ("SELECT changeid FROM changes"
-                     " ORDER BY changeid DESC LIMIT 1")
-                t.execute(q)
-                max_changeid = _one_or_else(t.fetchall(), 0)
+                max_changeid = self.scheduler_get_max_changeid(t)
                 state = scheduler.get_initial_state(max_changeid)
                 state_json = json.dumps(state)
                 q = self.quoteq("INSERT INTO schedulers"
@@ -969,6 +1403,12 @@ class DBConnector(util.ComparableMixin):
             log.msg("scheduler '%s' got id %d" % (scheduler.name, sid))
             scheduler.schedulerid = sid
 
+    def scheduler_get_max_changeid(self, t):
+        q = ("SELECT changeid FROM changes"
+             " ORDER BY changeid DESC LIMIT 1")
+        t.execute(q)
+        return _one_or_else(t.fetchall(), 0)
+
     def scheduler_get_state(self, schedulerid, t):
         q = self.quoteq("SELECT state FROM schedulers WHERE schedulerid=?")
         t.execute(q, (schedulerid,))
@@ -981,6 +1421,22 @@ class DBConnector(util.ComparableMixin):
         q = self.quoteq("UPDATE schedulers SET state=? WHERE schedulerid=?")
         t.execute(q, (state_json, schedulerid))
 
+    def scheduler_get_states(self, schedulerids, t):
+        """Return a dict that maps each of SCHEDULERIDS to its state."""
+        rows = self._txn_select_in(t, "SELECT schedulerid, state"
+                                      " FROM schedulers"
+                                      " WHERE schedulerid IN ",
+                                   schedulerids)
+        return dict([(sid, json.loads(state_json))
+                     for (sid, state_json) in rows])
+
+    def scheduler_set_states(self, states, t):
+        """Like scheduler_set_state, for a list of (schedulerid, state)
+        pairs."""
+        q = self.quoteq("UPDATE schedulers SET state=? WHERE schedulerid=?")
+        t.executemany(q, [(json.dumps(state), schedulerid)
+                          for (schedulerid, state) in states])
+
     def get_sourcestampid(self, ss, t):
         """Given a SourceStamp (which may or may not have an ssid), make sure
         the contents are in the database, and return the ssid. If the
@@ -1049,6 +1505,16 @@ class DBConnector(util.ComparableMixin):
                         " VALUES (?,?,?)")
         t.execute(q, (schedulerid, number, bool(important)))
 
+    def scheduler_classify_changes(self, classifications, t):
+        """Like scheduler_classify_change, for a list of (schedulerid,
+        number, important) tuples."""
+        q = self.quoteq("INSERT INTO scheduler_changes"
+                        " (schedulerid, changeid, important)"
+                        " VALUES (?,?,?)")
+        t.executemany(q, [(schedulerid, number, bool(important))
+                          for (schedulerid, number, important)
+                          in classifications])
+
     def scheduler_get_classified_changes(self, schedulerid, t):
         q = self.quoteq("SELECT changeid, important"
                         " FROM scheduler_changes"
@@ -1090,6 +1556,18 @@ class DBConnector(util.ComparableMixin):
                   (schedulerid,))
         return t.fetchall()
 
+    def scheduler_get_buildset_subscribers(self, bsids):
+        # returns a Deferred that fires with the set of schedulerids that
+        # are actively subscribed to any of BSIDS
+        return self.runInteraction(self._txn_scheduler_get_buildset_subscribers,
+                                   bsids)
+    def _txn_scheduler_get_buildset_subscribers(self, t, bsids):
+        rows = self._txn_select_in(t, "SELECT DISTINCT schedulerid"
+                                      " FROM scheduler_upstream_buildsets"
+                                      " WHERE active=1 AND buildsetid IN ",
+                                   bsids)
+        return set([schedulerid for (schedulerid,) in rows])
+
     def scheduler_unsubscribe_buildset(self, schedulerid, buildsetid, t):
         t.execute(self.quoteq("UPDATE scheduler_upstream_buildsets"
                               " SET active=0"
@@ -1108,29 +1586,68 @@ class DBConnector(util.ComparableMixin):
         return br
     def _txn_getBuildRequestWithNumber(self, t, brid):
         assert isinstance(brid, (int, long))
-        t.execute(self.quoteq("SELECT br.buildsetid, bs.reason,"
-                              " bs.sourcestampid, br.buildername,"
-                              " bs.submitted_at, br.priority"
-                              " FROM buildrequests AS br, buildsets AS bs"
-                              " WHERE br.id=? AND br.buildsetid=bs.id"),
-                  (brid,))
-        r = t.fetchall()
-        if not r:
-            return None
-        (bsid, reason, ssid, builder_name, submitted_at, priority) = r[0]
-        ss = self.getSourceStampNumberedNow(ssid, t)
-        properties = self.get_properties_from_db("buildset_properties",
-                                                 "buildsetid", bsid, t)
-        br = BuildRequest(reason, ss, builder_name, properties)
-        br.submittedAt = submitted_at
-        br.priority = priority
-        br.id = brid
-        br.bsid = bsid
-        return br
+        return self._txn_getBuildRequestsWithNumbers(t, [brid])[0]
+
+    def getBuildRequestsWithNumbers(self, brids, t=None):
+        """Return a list of BuildRequests, in the same order as BRIDS, with
+        None in place of any brid that does not exist."""
+        if t:
+            return self._txn_getBuildRequestsWithNumbers(t, brids)
+        return self.runInteractionNow(self._txn_getBuildRequestsWithNumbers,
+                                      brids)
+    def _txn_getBuildRequestsWithNumbers(self, t, brids):
+        rows = self._txn_select_in(t, "SELECT br.id, br.buildsetid,"
+                                      " bs.reason, bs.sourcestampid,"
+                                      " br.buildername, bs.submitted_at,"
+                                      " br.priority"
+                                      " FROM buildrequests AS br,"
+                                      "  buildsets AS bs"
+                                      " WHERE br.buildsetid=bs.id"
+                                      "  AND br.id IN ", brids)
+        requests = dict([(br.id, br)
+                         for br in self._txn_make_buildrequests(t, rows)])
+        return [requests.get(brid) for brid in brids]
+
+    def get_buildernames_for_buildrequests(self, brids):
+        # returns a Deferred that fires with the set of builder names that
+        # BRIDS are for
+        return self.runInteraction(
+            self._txn_get_buildernames_for_buildrequests, brids)
+    def _txn_get_buildernames_for_buildrequests(self, t, brids):
+        rows = self._txn_select_in(t, "SELECT DISTINCT buildername"
+                                      " FROM buildrequests WHERE id IN ",
+                                   brids)
+        return set([name for (name,) in rows])
+
+    def _txn_make_buildrequests(self, t, rows):
+        # Build BuildRequest instances from rows of (brid, bsid, reason,
+        # ssid, buildername, submitted_at, priority). The sourcestamps (and
+        # their changes) and the buildset properties for all of the rows are
+        # fetched together, so the number of queries does not depend upon
+        # the number of rows.
+        sourcestamps = self._txn_getSourceStampsNumbered(t,
+                                                 [row[3] for row in rows])
+        properties = self._txn_get_properties_from_db_many(t,
+                                                 "buildset_properties",
+                                                 "buildsetid",
+                                                 set([row[1] for row in rows]))
+        requests = []
+        for (brid, bsid, reason, ssid, builder_name,
+             submitted_at, priority) in rows:
+            br = BuildRequest(reason, sourcestamps[ssid], builder_name,
+                              properties[bsid])
+            br.submittedAt = submitted_at
+            br.priority = priority
+            br.id = brid
+            br.bsid = bsid
+            requests.append(br)
+        return requests
 
     def get_unclaimed_buildrequests(self, buildername, old, master_name,
                                     master_incarnation, t):
-        t.execute(self.quoteq("SELECT br.id"
+        t.execute(self.quoteq("SELECT br.id, br.buildsetid, bs.reason,"
+                              " bs.sourcestampid, br.buildername,"
+                              " bs.submitted_at, br.priority"
                               " FROM buildrequests AS br, buildsets AS bs"
                               " WHERE br.buildername=? AND br.complete=0"
                               " AND br.buildsetid=bs.id"
@@ -1139,9 +1656,41 @@ class DBConnector(util.ComparableMixin):
                               "          AND br.claimed_by_incarnation!=?))"
                               " ORDER BY br.priority DESC,bs.submitted_at ASC"),
                   (buildername, old, master_name, master_incarnation))
-        requests = [self.getBuildRequestWithNumber(brid, t)
-                    for (brid,) in t.fetchall()]
-        return requests
+        return self._txn_make_buildrequests(t, t.fetchall())
+
+    def get_oldest_request_times(self, old, master_name, master_incarnation,
+                                 brids=None):
+        # return a Deferred that fires with a dict mapping buildername to the
+        # submit time of its oldest unclaimed buildrequest
+        return self.runInteraction(self._txn_get_oldest_request_times, old,
+                                   master_name, master_incarnation, brids)
+    def _txn_get_oldest_request_times(self, t, old, master_name,
+                                      master_incarnation, brids=None):
+        # "unclaimed" means the same as in get_unclaimed_buildrequests. With
+        # brids=None, every builder that has unclaimed requests is included.
+        # Otherwise only the builders of the given requests are looked at,
+        # and those with nothing left are mapped to None.
+        q = ("SELECT br.buildername, MIN(bs.submitted_at)"
+             " FROM buildrequests AS br, buildsets AS bs"
+             " WHERE br.complete=0 AND br.buildsetid=bs.id"
+             " AND (br.claimed_at<?"
+             "      OR (br.claimed_by_name=?"
+             "          AND br.claimed_by_incarnation!=?))")
+        qargs = (old, master_name, master_incarnation)
+        if brids is None:
+            t.execute(self.quoteq(q + " GROUP BY br.buildername"), qargs)
+            return dict(t.fetchall())
+        buildernames = list(
+            self._txn_get_buildernames_for_buildrequests(t, brids))
+        times = dict([(name, None) for name in buildernames])
+        for i in range(0, len(buildernames), self.MAX_IN_PARAMS):
+            chunk = buildernames[i:i+self.MAX_IN_PARAMS]
+            t.execute(self.quoteq(q + " AND br.buildername IN "
+                                  + self.parmlist(len(chunk))
+                                  + " GROUP BY br.buildername"),
+                      qargs + tuple(chunk))
+            times.update(dict(t.fetchall()))
+        return times
 
     def claim_buildrequests(self, now, master_name, master_incarnation, brids,
                             t=None):
@@ -1161,6 +1710,7 @@ class DBConnector(util.ComparableMixin):
                         " WHERE id IN " + self.parmlist(len(brids)))
         qargs = [now, master_name, master_incarnation] + list(brids)
         t.execute(q, qargs)
+        self.notify("claim-buildrequest", *brids)
 
     def build_started(self, brid, buildnumber):
         return self.runInteractionNow(self._txn_build_started, brid, buildnumber)
@@ -1271,6 +1821,8 @@ class DBConnector(util.ComparableMixin):
 
     def examine_buildset(self, bsid):
         return self.runInteractionNow(self._txn_examine_buildset, bsid)
+    def examine_buildset_async(self, bsid):
+        return self.runInteraction(self._txn_examine_buildset, bsid)
     def _txn_examine_buildset(self, t, bsid):
         # "finished" means complete=1 for all builds. Return False until
         # all builds are complete, then True.
@@ -1296,6 +1848,8 @@ class DBConnector(util.ComparableMixin):
 
     def get_active_buildset_ids(self):
         return self.runInteractionNow(self._txn_get_active_buildset_ids)
+    def get_active_buildset_ids_async(self):
+        return self.runInteraction(self._txn_get_active_buildset_ids)
     def _txn_get_active_buildset_ids(self, t):
         t.execute("SELECT id FROM buildsets WHERE complete=0")
         return [bsid for (bsid,) in t.fetchall()]
@@ -1315,6 +1869,113 @@ class DBConnector(util.ComparableMixin):
             return (external_idstring, reason, ssid, complete, results)
         return None # shouldn't happen
 
+    # build summaries
+
+    def add_build_summary(self, master_name, buildername, number, summary):
+        return self.runInteraction(self._txn_add_build_summary, master_name,
+                                   buildername, number, summary)
+    def _txn_add_build_summary(self, t, master_name, buildername, number,
+                               summary):
+        # replace any existing row, so that summarizing a build again is
+        # harmless
+        t.execute(self.quoteq("DELETE FROM build_summaries"
+                              " WHERE master_name=? AND buildername=?"
+                              "  AND number=?"),
+                  (master_name, buildername, number))
+        changeids = summary['changeids']
+        if changeids is not None:
+            changeids = ",".join([str(changeid) for changeid in changeids])
+        t.execute(self.quoteq("INSERT INTO build_summaries"
+                              " (master_name, buildername, number,"
+                              "  start_time, finish_time, results,"
+                              "  branch, revision, got_revision, has_patch,"
+                              "  changeids, slavename, text)"
+                              " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)"),
+                  (master_name, buildername, number,
+                   summary['start_time'], summary['finish_time'],
+                   summary['results'], summary['branch'],
+                   summary['revision'], summary['got_revision'],
+                   int(bool(summary['has_patch'])), changeids,
+                   summary['slavename'], json.dumps(summary['text'])))
+
+    def get_build_summaries(self, master_name, buildername, first, last,
+                            with_changes=False):
+        """Return a dict mapping build number to a summary dictionary (with
+        the same keys that add_build_summary takes) for each summarized
+        build numbered from FIRST to LAST, inclusive. With WITH_CHANGES,
+        each summary also has a 'changes' key: the list of its Changes,
+        loaded in bulk in the same transaction, or None if they are not all
+        known."""
+        return self.runInteractionNow(self._txn_get_build_summaries,
+                                      master_name, buildername, first, last,
+                                      with_changes)
+    def get_build_summaries_async(self, master_name, buildername, first, last,
+                                  with_changes=False):
+        return self.runInteraction(self._txn_get_build_summaries,
+                                   master_name, buildername, first, last,
+                                   with_changes)
+    def _txn_get_build_summaries(self, t, master_name, buildername,
+                                 first, last, with_changes=False):
+        t.execute(self.quoteq("SELECT number, start_time, finish_time,"
+                              "  results, branch, revision, got_revision,"
+                              "  has_patch, changeids, slavename, text"
+                              " FROM build_summaries"
+                              " WHERE master_name=? AND buildername=?"
+                              "  AND number>=? AND number<=?"),
+                  (master_name, buildername, first, last))
+        summaries = {}
+        for (number, start_time, finish_time, results, branch, revision,
+             got_revision, has_patch, changeids, slavename,
+             text) in t.fetchall():
+            if changeids is not None:
+                changeids = [int(c) for c in changeids.split(",") if c]
+            summaries[number] = {
+                'start_time': start_time,
+                'finish_time': finish_time,
+                'results': results,
+                'branch': str_or_none(branch),
+                'revision': str_or_none(revision),
+                'got_revision': str_or_none(got_revision),
+                'has_patch': bool(has_patch),
+                'changeids': changeids,
+                'slavename': str_or_none(slavename),
+                'text': [s.encode("utf-8") for s in json.loads(text)],
+                }
+        if with_changes:
+            changeids = set()
+            for s in summaries.values():
+                changeids.update(s['changeids'] or [])
+            changes = self._txn_getChangesNumberedNow(t, changeids)
+            for s in summaries.values():
+                s['changes'] = None
+                if s['changeids'] is not None and \
+                        not [c for c in s['changeids'] if c not in changes]:
+                    s['changes'] = [changes[c] for c in s['changeids']]
+        return summaries
+
+    def get_summarized_build_numbers(self, master_name, buildername, t=None):
+        if t:
+            return self._txn_get_summarized_build_numbers(t, master_name,
+                                                          buildername)
+        return self.runInteractionNow(self._txn_get_summarized_build_numbers,
+                                      master_name, buildername)
+    def _txn_get_summarized_build_numbers(self, t, master_name, buildername):
+        t.execute(self.quoteq("SELECT number FROM build_summaries"
+                              " WHERE master_name=? AND buildername=?"),
+                  (master_name, buildername))
+        return set([number for (number,) in t.fetchall()])
+
+    def delete_build_summaries(self, master_name, buildername, before):
+        """Forget the summaries of builds numbered below BEFORE, which have
+        been pruned."""
+        return self.runInteraction(self._txn_delete_build_summaries,
+                                   master_name, buildername, before)
+    def _txn_delete_build_summaries(self, t, master_name, buildername, before):
+        t.execute(self.quoteq("DELETE FROM build_summaries"
+                              " WHERE master_name=? AND buildername=?"
+                              "  AND number<?"),
+                  (master_name, buildername, before))
+
     # test/debug methods
 
     def has_pending_operations(self):
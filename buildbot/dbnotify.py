@@ -0,0 +1,192 @@
+# -*- test-case-name: buildbot.test.unit.test_dbnotify -*-
+
+"""
+Push-based notifications between buildmasters that share a database.
+
+Each DBConnector fires notifications like 'add-change 12' or
+'add-buildrequest 34 35' when one of its transactions modifies the database.
+Inside a single buildmaster these are delivered directly to the subscribers
+(the SchedulerManager and the BotMaster). When several buildmasters share a
+database, they also need to hear about each other's modifications.
+
+The DBNotificationServer is a small fan-out service: every line that one
+connected client writes is copied to all of the other connected clients. It
+can run inside any one of the buildmasters (or in a process of its own, see
+the 'db_notification_listen' config key). Each buildmaster runs a
+DBNotificationClient ('db_notification_server' config key), which publishes
+the local DBConnector's notifications to the server, and hands the lines it
+receives back to DBConnector.send_notification, exactly as if the
+modification had happened locally.
+
+The wire protocol is one notification per line: the category followed by its
+(integer) arguments, separated by spaces. A notification with many arguments
+is split across several lines, each well below the LineReceiver's MAX_LENGTH.
+
+Notifications are a doorbell, not a data channel: if the connection is lost
+some of them may be missed, so the client rings every local doorbell each
+time it (re)connects. Setting db_poll_interval as well provides a periodic
+safety net.
+"""
+
+from twisted.python import log
+from twisted.internet import protocol, defer
+from twisted.protocols import basic
+from twisted.application import service, strports, internet
+
+class _NotificationServerProtocol(basic.LineReceiver):
+    delimiter = "\n"
+
+    def connectionMade(self):
+        self.factory.clients.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.clients.discard(self)
+
+    def lineReceived(self, line):
+        for client in self.factory.clients:
+            if client is not self:
+                client.sendLine(line)
+
+class _NotificationServerFactory(protocol.ServerFactory):
+    protocol = _NotificationServerProtocol
+
+    def __init__(self):
+        self.clients = set()
+
+class DBNotificationServer(service.Service):
+    """I accept connections from DBNotificationClients on the given strports
+    port (like 'tcp:9988' or 'unix:/var/run/buildbot-notify'), and relay
+    each notification line to every other connected client."""
+
+    def __init__(self, port):
+        if type(port) is int:
+            port = "tcp:%d" % port
+        self.port = port
+        self.factory = _NotificationServerFactory()
+        self._port = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self._port = strports.listen(self.port, self.factory)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        for client in list(self.factory.clients):
+            client.transport.loseConnection()
+        d = defer.maybeDeferred(self._port.stopListening)
+        self._port = None
+        return d
+
+    def getPort(self):
+        # utility method for tests: figure out which TCP port we just opened.
+        return self._port.getHost().port
+
+class _NotificationClientProtocol(basic.LineReceiver):
+    delimiter = "\n"
+
+    def connectionMade(self):
+        self.factory.resetDelay()
+        self.factory.client._connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.client._disconnected(self)
+
+    def lineReceived(self, line):
+        words = line.split()
+        if not words:
+            return
+        try:
+            args = tuple([int(a) for a in words[1:]])
+        except ValueError:
+            log.msg("ignoring malformed db notification %r" % line)
+            return
+        self.factory.client.notification_received(words[0], args)
+
+class _NotificationClientFactory(protocol.ReconnectingClientFactory):
+    protocol = _NotificationClientProtocol
+    maxDelay = 60
+
+    def __init__(self, client):
+        self.client = client
+
+class DBNotificationClient(service.MultiService):
+    """I connect to a DBNotificationServer at 'host:port' (or
+    'unix:/path/to/socket'), publish the notifications of my DBConnector to
+    it, and deliver the notifications of the other buildmasters to my
+    DBConnector's subscribers.
+
+    @param on_connect: called with no arguments each time the connection is
+                       (re)established, so that the buildmaster can look for
+                       any work it missed while disconnected
+    """
+
+    def __init__(self, server, db, on_connect=None):
+        service.MultiService.__init__(self)
+        self.server = server
+        self.db = db
+        self.on_connect = on_connect
+        self.factory = _NotificationClientFactory(self)
+        self._protocol = None
+        self._connected_waiters = []
+        if server.startswith("unix:"):
+            c = internet.UNIXClient(server[len("unix:"):], self.factory)
+        else:
+            host, port = server.rsplit(":", 1)
+            c = internet.TCPClient(host, int(port), self.factory)
+        c.setServiceParent(self)
+
+    # the most arguments published on a single line. Even 20-digit ids keep
+    # a line of this many well below LineReceiver.MAX_LENGTH (16384), which
+    # drops the connection when exceeded.
+    max_args_per_line = 500
+
+    def startService(self):
+        service.MultiService.startService(self)
+        self.db.set_notification_publisher(self.publish)
+
+    def stopService(self):
+        self.db.set_notification_publisher(None)
+        self.factory.stopTrying()
+        d = service.MultiService.stopService(self)
+        # our TCPClient child drops the connection
+        self._protocol = None
+        return d
+
+    def is_connected(self):
+        return self._protocol is not None
+
+    def when_connected(self):
+        # used by unit tests
+        if self._protocol:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._connected_waiters.append(d)
+        return d
+
+    def _connected(self, p):
+        log.msg("connected to db notification server %s" % self.server)
+        self._protocol = p
+        if self.on_connect:
+            self.on_connect()
+        waiters, self._connected_waiters = self._connected_waiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _disconnected(self, p):
+        if self._protocol is p:
+            log.msg("lost connection to db notification server %s"
+                    % self.server)
+            self._protocol = None
+
+    def publish(self, category, args):
+        # notifications that are published while we are disconnected are
+        # dropped: the other masters will catch up when we reconnect
+        if not self._protocol:
+            return
+        args = [str(a) for a in args]
+        step = self.max_args_per_line
+        for i in range(0, max(len(args), 1), step):
+            self._protocol.sendLine(" ".join([category] + args[i:i+step]))
+
+    def notification_received(self, category, args):
+        self.db.send_notification(category, args)
@@ -162,6 +162,9 @@ class IStatus(Interface):
 
     def getChange(number):
         """Return an IChange object."""
+    def getChangeAsync(number):
+        """Return a Deferred that fires with an IChange object, or None if
+        there is no change with that number."""
 
     def getSchedulers():
         """Return a list of ISchedulerStatus objects for all
@@ -181,6 +184,8 @@ class IStatus(Interface):
 
     def getBuildSets():
         """Return a list of active (non-finished) IBuildSetStatus objects."""
+    def getBuildSetsAsync():
+        """Return a Deferred that fires with the same list as getBuildSets."""
 
     def generateFinishedBuilds(builders=[], branches=[],
                                num_builds=None, finished_before=None,
@@ -434,6 +439,18 @@ class IBuilderStatus(Interface):
                            of builds that will be examined.
         """
 
+    def generateBuilds(max_search=None):
+        """Return a generator that will produce an IBuildStatus object for
+        each build, starting with the most recent one (which may still be
+        running) and going backwards, or None for any build that is no
+        longer available. Finished builds are usually lightweight summaries
+        which only load the full build (steps, logs, properties) when those
+        are asked for.
+
+        @type max_search: int
+        @param max_search: if provided, stop after this many builds.
+        """
+
     def subscribe(receiver):
         """Register an IStatusReceiver to receive new status events. The
         receiver will be given builderChangedState, buildStarted, and
@@ -807,7 +824,7 @@ class IStatusLog(Interface):
         to remove a receiver which was not previously registered is a no-op.
         """
 
-    def subscribeConsumer(consumer):
+    def subscribeConsumer(consumer, offset=None, line=None, limit=None):
         """Register an L{IStatusLogConsumer} to receive all chunks of the
         logfile, including all the old entries and any that will arrive in
         the future. The consumer will first have their C{registerProducer}
@@ -820,6 +837,12 @@ class IStatusLog(Interface):
         a small amount of data could be written via C{writeChunk} even after
         C{pauseProducing} has been called.
 
+        If 'offset' or 'line' is given, the consumer starts that many bytes
+        or lines into the text of the log (header chunks are not counted),
+        and header chunks before that point are skipped. If 'limit' is
+        given, at most that many bytes of text are written before the
+        consumer is finished.
+
         To unsubscribe the consumer, use C{producer.stopProducing}."""
 
     # once the log has finished, the following methods make sense. They can
@@ -840,17 +863,34 @@ class IStatusLog(Interface):
     def readlines(channel=LOG_CHANNEL_STDOUT):
         """Read lines from one channel of the logfile. This returns an
         iterator that will provide single lines of text (including the
-        trailing newline).
+        trailing newline). The log is read as the iterator is consumed, so
+        it is never held in memory all at once.
+        """
+
+    def readTextLines():
+        """Like readlines(), but for stdout and stderr merged together, as
+        in getText(). Steps which scan their whole log (in createSummary,
+        for example) should use this rather than splitting getText(), which
+        builds a single string the size of the log.
         """
 
     def getTextWithHeaders():
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
 
-    def getChunks():
+    def getChunks(channels=[], onlyText=False, offset=None, line=None):
         """Generate a list of (channel, text) tuples. 'channel' is a number,
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
-        into stdout if PTYs are in use)."""
+        into stdout if PTYs are in use).
+
+        If 'offset' or 'line' is given, the chunks start that many bytes or
+        lines into the text of the log (as with getText), and the first
+        chunk is cut to fit. For indexed logs this does not read the part of
+        the log that is skipped."""
+
+    def getTextSize():
+        """Return a tuple of (bytes, lines) for the text of the log, not
+        counting header chunks."""
 
 class IStatusLogConsumer(Interface):
     """I am an object which can be passed to IStatusLog.subscribeConsumer().
@@ -126,6 +126,8 @@ class _BaseManhole(service.MultiService):
             namespace = {
                 'master': master,
                 'status': master.getStatus(),
+                # db.query_stats.describe() lists the costliest queries
+                'db': master.db,
                 }
             return namespace
 
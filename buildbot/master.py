@@ -20,6 +20,7 @@ from buildbot.util import now, safeTranslate
 from buildbot.pbutil import NewCredPerspective
 from buildbot.process.builder import Builder, IDLE
 from buildbot.status.builder import Status, BuildSetStatus
+from buildbot.status import logindex, layout
 from buildbot.changes.changes import Change
 from buildbot.changes.manager import ChangeManager
 from buildbot.buildslave import BuildSlave
@@ -28,11 +29,106 @@ from buildbot.process.properties import Properties
 from buildbot.config import BuilderConfig
 from buildbot.process.builder import BuilderControl
 from buildbot.db import open_db, DBSpec
+from buildbot.dbnotify import DBNotificationServer, DBNotificationClient
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.util.loop import DelegateLoop
 
 ########################################
 
+def get_master_name(basedir):
+    """Return the name that identifies the buildmaster in BASEDIR in the
+    database, which several buildmasters may share."""
+    try:
+        hostname = os.uname()[1] # only on unix
+    except AttributeError:
+        hostname = "?"
+    return "%s:%s" % (hostname, os.path.abspath(basedir))
+
+def parse_cache_sizes(caches):
+    """Check c['caches'], and return a dict that maps the name of each
+    cache it sizes to the keyword arguments for its resize() method. A
+    cache given only max_bytes is not limited to a number of items."""
+    if not isinstance(caches, dict):
+        raise ValueError("c['caches'] must be a dictionary")
+    cache_sizes = {}
+    for (name, size) in caches.items():
+        if name not in ("changes", "sourcestamps", "builds"):
+            raise ValueError("unknown cache '%s' in c['caches']" % name)
+        if isinstance(size, (int, long)):
+            size = dict(max_size=size)
+        if (not isinstance(size, dict)
+            or not set(size) <= set(["max_size", "max_bytes"])
+            or [v for v in size.values()
+                if not isinstance(v, (int, long)) or v < 0]):
+            raise ValueError("c['caches']['%s'] must be an int or a "
+                             "dict with max_size and/or max_bytes, "
+                             "none of them negative" % name)
+        size = size.copy()
+        if "max_bytes" in size:
+            size.setdefault("max_size", None)
+        cache_sizes[name] = size
+    return cache_sizes
+
+class OldestRequestIndex:
+    """I remember the submit time of the oldest unclaimed build request of
+    each builder, so that the default prioritizer can order the builders
+    without loading all of their pending requests.
+
+    The add-buildrequest, claim-buildrequest and retire-buildrequest
+    notifications tell me which requests have changed, and only the builders
+    of those requests are looked up again. A claim that times out sends no
+    notification, so I reload everything from a single aggregate query every
+    RESYNC_INTERVAL seconds, and after resync() has been called.
+    """
+
+    RESYNC_INTERVAL = 10*60
+
+    def __init__(self, db):
+        self.db = db
+        self._times = {} # maps buildername to submit time
+        self._changed_brids = set()
+        self._last_resync = None
+
+    def buildrequests_changed(self, category, *brids):
+        self._changed_brids.update(brids)
+
+    def resync(self):
+        self._last_resync = None
+
+    def get_oldest_request_times(self, master_name, master_incarnation):
+        """Return a Deferred that fires with a dict mapping builder name to
+        the submit time of that builder's oldest unclaimed build request.
+        Builders without any unclaimed requests are left out."""
+        t = now()
+        if (self._last_resync is None
+            or t - self._last_resync > self.RESYNC_INTERVAL):
+            brids = None
+        elif self._changed_brids:
+            brids = list(self._changed_brids)
+        else:
+            return defer.succeed(self._times)
+        self._changed_brids = set()
+        old = t - Builder.RECLAIM_INTERVAL
+        d = self.db.get_oldest_request_times(old, master_name,
+                                             master_incarnation, brids)
+        def _got(times):
+            if brids is None:
+                self._times = times
+                self._last_resync = t
+            else:
+                for (buildername, when) in times.items():
+                    if when is None:
+                        self._times.pop(buildername, None)
+                    else:
+                        self._times[buildername] = when
+            return self._times
+        def _failed(why):
+            # we don't know which updates were lost
+            self._last_resync = None
+            return why
+        d.addCallbacks(_got, _failed)
+        return d
+
 class BotMaster(service.MultiService):
 
     """This is the master-side service which manages remote buildbot slaves.
@@ -71,6 +167,14 @@ class BotMaster(service.MultiService):
         # traversal
         self.prioritizeBuilders = None
 
+        # self.request_index is the OldestRequestIndex used by the default
+        # prioritizer, set up along with the database
+        self.request_index = None
+
+        # the names of the builders that the next run of the loop must run,
+        # or None for all of them
+        self._builders_to_run = set()
+
         self.loop = DelegateLoop(self._get_processors)
         self.loop.setServiceParent(self)
 
@@ -92,23 +196,100 @@ class BotMaster(service.MultiService):
     def _sort_builders(self, parent, builders):
         return sorted(builders, self._sortfunc)
 
+    def _sort_builders_async(self, parent, builders):
+        # the default prioritizer: like _sort_builders, but it gets each
+        # builder's oldest request time from the request index instead of
+        # loading all of its requests, twice for every comparison
+        d = self.request_index.get_oldest_request_times(self.master_name,
+                                                        self.master_incarnation)
+        def _sort(times):
+            # builders without any requests sort at the end
+            order = [(times.get(b.name) is None, times.get(b.name), i)
+                     for (i, b) in enumerate(builders)]
+            order.sort()
+            return [builders[i] for (ignored, t, i) in order]
+        d.addCallback(_sort)
+        return d
+
     def _get_processors(self):
-        builders = self.builders.values()
-        sorter = self.prioritizeBuilders or self._sort_builders
-        try:
-            builders = sorter(self.parent, builders)
-        except:
+        # the builders must be prioritized before any of them is run, and
+        # that takes a trip to the database, so the loop gets a single
+        # processor which does both
+        return [self._run_builders]
+
+    def _run_builders(self):
+        names = self._builders_to_run
+        self._builders_to_run = set()
+        if names is None:
+            builders = self.builders.values()
+        else:
+            builders = [self.builders[name] for name in self.builderNames
+                        if name in names and name in self.builders]
+            if not builders:
+                return None
+        if self.prioritizeBuilders:
+            # this may return a Deferred
+            d = defer.maybeDeferred(self.prioritizeBuilders, self.parent,
+                                    builders)
+        else:
+            d = self._sort_builders_async(self.parent, builders)
+        def _failed(why):
             log.msg("Exception prioritizing builders")
-            log.err(Failure())
+            log.err(why)
             # leave them in the original order
-        return [b.run for b in builders]
+            return builders
+        d.addErrback(_failed)
+        d.addCallback(self._run_builders_in_order)
+        return d
+
+    def _run_builders_in_order(self, builders):
+        # run each Builder in turn, one at a time, waiting for any Deferred
+        # it returns. This iterates rather than recursing, so that a long
+        # list of idle builders does not build up a deep Deferred chain.
+        remaining = list(builders)
+        done = defer.Deferred()
+        def _next(ignored=None):
+            while remaining:
+                b = remaining.pop(0)
+                if not b.running:
+                    # removed by a reconfig while we were sorting
+                    continue
+                d = defer.maybeDeferred(b.run)
+                d.addErrback(log.err)
+                if not d.called:
+                    d.addCallback(_next)
+                    return
+            done.callback(None)
+        _next()
+        return done
 
     def trigger_add_buildrequest(self, category, *brids):
-        # a buildrequest has been added or resubmitted
+        # a buildrequest has been added or resubmitted: only the builders it
+        # is for need to look for work
+        d = self.db.get_buildernames_for_buildrequests(brids)
+        d.addCallback(self.trigger_builders)
+        def _failed(why):
+            log.err(why)
+            self.triggerNewBuildCheck()
+        d.addErrback(_failed)
+        return d
+    def trigger_builders(self, names):
+        """Run the builders named in NAMES (and only those, unless something
+        else triggers the others) to look for work."""
+        if not self.loop.running:
+            return
+        if self._builders_to_run is not None:
+            self._builders_to_run.update(names)
         self.loop.trigger()
     def triggerNewBuildCheck(self):
-        # called when a build finishes, or a slave attaches
+        # called when a build finishes, or a slave attaches. Slaves may be
+        # shared between builders, so all of them must look for work.
+        self._builders_to_run = None
         self.loop.trigger()
+    def trigger_resync(self):
+        # we may have missed notifications, so reload the request index too
+        self.request_index.resync()
+        self.triggerNewBuildCheck()
 
     # these four are convenience functions for testing
 
@@ -266,8 +447,13 @@ class BotMaster(service.MultiService):
     def stopService(self):
         for b in self.builders.values():
             b.builder_status.addPointEvent(["master", "shutdown"])
-            b.builder_status.saveYourself()
-        return service.MultiService.stopService(self)
+            b.builder_status.saveCurrentBuilds()
+            b.builder_status.saveSoon()
+        d = defer.succeed(None)
+        if self.builders:
+            d = self.parent.getStatus().builderSaver.flush()
+        d.addCallback(lambda ign: service.MultiService.stopService(self))
+        return d
 
     def getLockByID(self, lockid):
         """Convert a Lock identifier into an actual Lock instance.
@@ -393,6 +579,9 @@ class BuildMaster(service.MultiService):
     buildbotURL = None
     change_svc = None
     properties = Properties()
+    # how often to run all schedulers and builders when db_poll_interval is
+    # not set, in case a notification did not reach the ones it was for
+    SWEEP_INTERVAL = 5*60
 
     def __init__(self, basedir, configFileName="master.cfg", db_spec=None):
         service.MultiService.__init__(self)
@@ -420,11 +609,7 @@ class BuildMaster(service.MultiService):
         self.change_svc.setServiceParent(self)
         self.dispatcher.changemaster = self.change_svc
 
-        try:
-            hostname = os.uname()[1] # only on unix
-        except AttributeError:
-            hostname = "?"
-        self.master_name = "%s:%s" % (hostname, os.path.abspath(self.basedir))
+        self.master_name = get_master_name(self.basedir)
         self.master_incarnation = "pid%d-boot%d" % (os.getpid(), time.time())
 
         self.botmaster = BotMaster()
@@ -439,6 +624,8 @@ class BuildMaster(service.MultiService):
         self.db = None
         self.db_url = None
         self.db_poll_interval = _Unset
+        self.db_notification_server = _Unset
+        self.db_notification_listen = _Unset
         if db_spec:
             self.loadDatabase(db_spec)
 
@@ -457,7 +644,7 @@ class BuildMaster(service.MultiService):
             signal.signal(signal.SIGHUP, self._handleSIGHUP)
         for b in self.botmaster.builders.values():
             b.builder_status.addPointEvent(["master", "started"])
-            b.builder_status.saveYourself()
+            b.builder_status.saveSoon()
 
     def _handleSIGHUP(self, *args):
         reactor.callLater(0, self.loadTheConfigFile)
@@ -527,7 +714,10 @@ class BuildMaster(service.MultiService):
                       "buildbotURL", "properties", "prioritizeBuilders",
                       "eventHorizon", "buildCacheSize", "logHorizon", "buildHorizon",
                       "changeHorizon", "logMaxSize", "logMaxTailSize",
-                      "logCompressionMethod", "db_url",
+                      "logCompressionMethod", "db_url", "db_poll_interval",
+                      "db_notification_server", "db_notification_listen",
+                      "caches", "logCompressionWorkers", "buildFileFormat",
+                      "buildStorageLayout", "schedulerConcurrency",
                       )
         for k in config.keys():
             if k not in known_keys:
@@ -544,6 +734,10 @@ class BuildMaster(service.MultiService):
             # optional
             db_url = config.get("db_url", "sqlite:///state.sqlite")
             db_poll_interval = config.get("db_poll_interval", None)
+            db_notification_server = config.get("db_notification_server",
+                                                None)
+            db_notification_listen = config.get("db_notification_listen",
+                                                None)
             debugPassword = config.get('debugPassword')
             manhole = config.get('manhole')
             status = config.get('status', [])
@@ -560,8 +754,28 @@ class BuildMaster(service.MultiService):
                     isinstance(logCompressionLimit, int):
                 raise ValueError("logCompressionLimit needs to be bool or int")
             logCompressionMethod = config.get('logCompressionMethod', "bz2")
-            if logCompressionMethod not in ('bz2', 'gz'):
-                raise ValueError("logCompressionMethod needs to be 'bz2', or 'gz'")
+            if logCompressionMethod not in logindex.METHODS:
+                raise ValueError("logCompressionMethod needs to be 'bz2', "
+                                 "'gz', 'zstd' or 'lz4'")
+            if logCompressionMethod not in logindex.CODECS:
+                log.msg("logCompressionMethod '%s' is not available (its "
+                        "python module is not installed), using 'gz'"
+                        % logCompressionMethod)
+                logCompressionMethod = logindex.choose_method(
+                    logCompressionMethod)
+            logCompressionWorkers = config.get('logCompressionWorkers', 2)
+            if not isinstance(logCompressionWorkers, int) or \
+                    logCompressionWorkers < 1:
+                raise ValueError("logCompressionWorkers needs to be a "
+                                 "positive int")
+            buildFileFormat = config.get('buildFileFormat', "json")
+            if buildFileFormat not in ("json", "pickle"):
+                raise ValueError("buildFileFormat needs to be 'json' or "
+                                 "'pickle'")
+            buildStorageLayout = config.get('buildStorageLayout', "flat")
+            if buildStorageLayout not in layout.LAYOUTS:
+                raise ValueError("buildStorageLayout needs to be 'flat' or "
+                                 "'sharded'")
             logMaxSize = config.get('logMaxSize')
             if logMaxSize is not None and not \
                     isinstance(logMaxSize, int):
@@ -570,6 +784,11 @@ class BuildMaster(service.MultiService):
             if logMaxTailSize is not None and not \
                     isinstance(logMaxTailSize, int):
                 raise ValueError("logMaxTailSize needs to be None or int")
+            schedulerConcurrency = config.get('schedulerConcurrency', 1)
+            if not isinstance(schedulerConcurrency, int) or \
+                    schedulerConcurrency < 1:
+                raise ValueError("schedulerConcurrency needs to be a "
+                                 "positive int")
             mergeRequests = config.get('mergeRequests')
             if mergeRequests is not None and not callable(mergeRequests):
                 raise ValueError("mergeRequests must be a callable")
@@ -579,6 +798,11 @@ class BuildMaster(service.MultiService):
             changeHorizon = config.get("changeHorizon")
             if changeHorizon is not None and not isinstance(changeHorizon, int):
                 raise ValueError("changeHorizon needs to be an int")
+            cache_sizes = parse_cache_sizes(config.get("caches", {}))
+            if buildCacheSize is not None and "builds" not in cache_sizes:
+                # the old per-builder setting
+                cache_sizes["builds"] = dict(max_size=buildCacheSize
+                                             * max(len(builders), 1))
 
         except KeyError:
             log.msg("config dictionary is missing a required parameter")
@@ -624,6 +848,12 @@ class BuildMaster(service.MultiService):
                "db_poll_interval must be an integer: seconds between polls"
         assert self.db_poll_interval is _Unset or db_poll_interval == self.db_poll_interval, \
                "Cannot change db_poll_interval after master has started"
+        assert (self.db_notification_server is _Unset or
+                db_notification_server == self.db_notification_server), \
+               "Cannot change db_notification_server after master has started"
+        assert (self.db_notification_listen is _Unset or
+                db_notification_listen == self.db_notification_listen), \
+               "Cannot change db_notification_listen after master has started"
 
         assert isinstance(change_sources, (list, tuple))
         for s in change_sources:
@@ -758,8 +988,11 @@ class BuildMaster(service.MultiService):
 
         self.status.logCompressionLimit = logCompressionLimit
         self.status.logCompressionMethod = logCompressionMethod
+        self.status.logCompressor.setWorkers(logCompressionWorkers)
         self.status.logMaxSize = logMaxSize
         self.status.logMaxTailSize = logMaxTailSize
+        self.status.buildFileFormat = buildFileFormat
+        self.status.buildStorageLayout = buildStorageLayout
         # Update any of our existing builders with the current log parameters.
         # This is required so that the new value is picked up after a
         # reconfig.
@@ -768,6 +1001,8 @@ class BuildMaster(service.MultiService):
             builder.builder_status.setLogCompressionMethod(logCompressionMethod)
             builder.builder_status.setLogMaxSize(logMaxSize)
             builder.builder_status.setLogMaxTailSize(logMaxTailSize)
+            builder.builder_status.setBuildFileFormat(buildFileFormat)
+            builder.builder_status.setBuildStorageLayout(buildStorageLayout)
 
         if mergeRequests is not None:
             self.botmaster.mergeRequests = mergeRequests
@@ -775,13 +1010,17 @@ class BuildMaster(service.MultiService):
             self.botmaster.prioritizeBuilders = prioritizeBuilders
 
         self.buildCacheSize = buildCacheSize
+        self.status.buildCache.resize(**cache_sizes.get("builds", {}))
         self.eventHorizon = eventHorizon
         self.logHorizon = logHorizon
         self.buildHorizon = buildHorizon
 
         # Set up the database
         d.addCallback(lambda res:
-                      self.loadConfig_Database(db_url, db_poll_interval))
+                      self.loadConfig_Database(db_url, db_poll_interval,
+                                               db_notification_server,
+                                               db_notification_listen))
+        d.addCallback(lambda res: self.db.setCacheSizes(cache_sizes))
 
         # self.slaves: Disconnect any that were attached and removed from the
         # list. Update self.checker with the new list of passwords, including
@@ -816,6 +1055,9 @@ class BuildMaster(service.MultiService):
         d.addCallback(lambda res: self.loadConfig_status(status))
 
         # Schedulers are added after Builders in case they start right away
+        def _setSchedulerConcurrency(res):
+            self.scheduler_manager.concurrency = schedulerConcurrency
+        d.addCallback(_setSchedulerConcurrency)
         d.addCallback(lambda res:
                       self.scheduler_manager.updateSchedulers(schedulers))
         # and Sources go after Schedulers for the same reason
@@ -847,7 +1089,9 @@ class BuildMaster(service.MultiService):
         d.addErrback(log.err)
         return d
 
-    def loadDatabase(self, db_spec, db_poll_interval=None):
+    def loadDatabase(self, db_spec, db_poll_interval=None,
+                     db_notification_server=None,
+                     db_notification_listen=None):
         if self.db:
             return
         self.db = open_db(db_spec)
@@ -857,6 +1101,11 @@ class BuildMaster(service.MultiService):
 
         self.db.subscribe_to("add-buildrequest",
                              self.botmaster.trigger_add_buildrequest)
+        self.botmaster.request_index = OldestRequestIndex(self.db)
+        for category in ("add-buildrequest", "claim-buildrequest",
+                         "retire-buildrequest"):
+            self.db.subscribe_to(category,
+                self.botmaster.request_index.buildrequests_changed)
 
         sm = SchedulerManager(self, self.db, self.change_svc)
         self.db.subscribe_to("add-change", sm.trigger_add_change)
@@ -865,25 +1114,54 @@ class BuildMaster(service.MultiService):
         self.scheduler_manager = sm
         sm.setServiceParent(self)
 
-        # Set db_poll_interval (perhaps to 30 seconds) if you are using
-        # multiple buildmasters that share a common database, such that the
-        # masters need to discover what each other is doing by polling the
-        # database. TODO: this will be replaced by the DBNotificationServer.
-        if db_poll_interval:
-            # it'd be nice if TimerService let us set now=False
-            t1 = TimerService(db_poll_interval, sm.trigger)
-            t1.setServiceParent(self)
-            t2 = TimerService(db_poll_interval, self.botmaster.loop.trigger)
-            t2.setServiceParent(self)
+        # If you are using multiple buildmasters that share a common
+        # database, they need to discover what each other is doing. Point
+        # db_notification_server at a DBNotificationServer (which one of the
+        # masters can run by setting db_notification_listen) to hear about
+        # each other's changes and buildrequests as soon as they are added.
+        if db_notification_listen:
+            s = DBNotificationServer(db_notification_listen)
+            s.setServiceParent(self)
+        if db_notification_server:
+            c = DBNotificationClient(db_notification_server, self.db,
+                                     on_connect=self._triggerAllLoops)
+            c.setServiceParent(self)
+
+        # Set db_poll_interval (perhaps to 30 seconds) to also poll the
+        # database periodically, as a safety net for notifications that get
+        # lost, or as the only mechanism if there is no notification server.
+        # Notifications only run the schedulers and builders they are about,
+        # so even without it, everything is run every SWEEP_INTERVAL
+        # seconds: a build request whose claim expired, for example, sends
+        # no notification at all.
+        sweep_interval = db_poll_interval or self.SWEEP_INTERVAL
+        # it'd be nice if TimerService let us set now=False
+        t1 = TimerService(sweep_interval, sm.trigger)
+        t1.setServiceParent(self)
+        t2 = TimerService(sweep_interval, self.botmaster.trigger_resync)
+        t2.setServiceParent(self)
         # adding schedulers (like when loadConfig happens) will trigger the
         # scheduler loop at least once, which we need to jump-start things
         # like Periodic.
 
-    def loadConfig_Database(self, db_url, db_poll_interval):
+    def _triggerAllLoops(self):
+        # we may have missed notifications from other masters (e.g. while
+        # disconnected from the notification server), so look at everything
+        if self.scheduler_manager.running:
+            self.scheduler_manager.trigger()
+        if self.botmaster.loop.running:
+            self.botmaster.trigger_resync()
+
+    def loadConfig_Database(self, db_url, db_poll_interval,
+                            db_notification_server=None,
+                            db_notification_listen=None):
         self.db_url = db_url
         self.db_poll_interval = db_poll_interval
+        self.db_notification_server = db_notification_server
+        self.db_notification_listen = db_notification_listen
         db_spec = DBSpec.from_url(db_url, self.basedir)
-        self.loadDatabase(db_spec, db_poll_interval)
+        self.loadDatabase(db_spec, db_poll_interval, db_notification_server,
+                          db_notification_listen)
 
     def loadConfig_Slaves(self, new_slaves):
         # set up the Checker with the names and passwords of all valid slaves
@@ -952,7 +1230,7 @@ class BuildMaster(service.MultiService):
                 log.msg("updating builder %s: %s" % (name, "\n".join(diffs)))
 
                 statusbag = old.builder_status
-                statusbag.saveYourself() # seems like a good idea
+                statusbag.saveSoon() # seems like a good idea
                 # TODO: if the basedir was changed, we probably need to make
                 # a new statusbag
                 new_builder = Builder(data, statusbag)
@@ -970,11 +1248,6 @@ class BuildMaster(service.MultiService):
                 log.msg("builder %s is unchanged" % name)
                 pass
 
-        # regardless of whether anything changed, get each builder status
-        # to update its config
-        for builder in allBuilders.values():
-            builder.builder_status.reconfigFromBuildmaster(self)
-
         # and then tell the botmaster if anything's changed
         if somethingChanged:
             sortedAllBuilders = [allBuilders[name] for name in newBuilderNames]
@@ -1008,6 +1281,17 @@ class BuildMaster(service.MultiService):
         self.db.addChangeToDatabase(change)
         self.status.changeAdded(change)
 
+    def addChanges(self, changes):
+        # returns a Deferred that fires with CHANGES once they have all
+        # been added, in one transaction
+        d = self.db.addChangesToDatabase(changes)
+        def _added(changes):
+            for change in changes:
+                self.status.changeAdded(change)
+            return changes
+        d.addCallback(_added)
+        return d
+
     def triggerSlaveManager(self):
         self.botmaster.triggerNewBuildCheck()
 
@@ -557,6 +557,8 @@ class Builder(pb.Referenceable, service.MultiService):
 
     def getBuildable(self):
         return self.db.runInteractionNow(self._getBuildable)
+    def getBuildableAsync(self):
+        return self.db.runInteraction(self._getBuildable)
     def _getBuildable(self, t):
         now = util.now()
         old = now - self.RECLAIM_INTERVAL
@@ -569,7 +571,16 @@ class Builder(pb.Referenceable, service.MultiService):
         """Returns the timestamp of the oldest build request for this builder.
 
         If there are no build requests, None is returned."""
-        buildable = self.getBuildable()
+        return self._oldestRequestTime(self.getBuildable())
+
+    def getOldestRequestTimeAsync(self):
+        """Like getOldestRequestTime, but without blocking the reactor:
+        returns a Deferred that fires with the timestamp or None."""
+        d = self.getBuildableAsync()
+        d.addCallback(self._oldestRequestTime)
+        return d
+
+    def _oldestRequestTime(self, buildable):
         if buildable:
             # TODO: this is sorted by priority first, not strictly reqtime
             return buildable[0].getSubmitTime()
@@ -1101,8 +1101,8 @@ class LoggingBuildStep(BuildStep):
 
     def createSummary(self, log):
         """To create summary logs, do something like this:
-        warnings = grep('^Warning:', log.getText())
-        self.addCompleteLog('warnings', warnings)
+        warnings = [l for l in log.readTextLines() if l.startswith('Warning:')]
+        self.addCompleteLog('warnings', ''.join(warnings))
         """
         pass
 
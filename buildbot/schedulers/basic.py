@@ -113,30 +113,37 @@ class _Base(service.MultiService, ComparableMixin):
         return bsid
 
 class ClassifierMixin:
+    """Schedulers that pay attention to Changes record a decision about
+    each new one (irrelevant, important or unimportant) in the
+    scheduler_changes table, and the last change they decided about in the
+    'last_processed' key of their state. The SchedulerManager makes these
+    decisions for all of its schedulers at once, before running them."""
+
+    fileIsImportant = None
+
+    def classifiesChanges(self):
+        return True
+
+    def getChangeFilter(self):
+        """Return (branches, categories): only Changes on one of BRANCHES
+        and in one of CATEGORIES can be relevant to me, where None means any
+        branch, or any category. changeIsRelevant() may narrow this down
+        further. A class that overrides changeIsRelevant() is asked about
+        every Change, whatever this returns."""
+        return (None, None)
+
+    def changeIsRelevant(self, change):
+        branches, categories = self.getChangeFilter()
+        if branches is not None and change.branch not in branches:
+            return False
+        if categories is not None and change.category not in categories:
+            return False
+        return True
 
     def classify_changes(self, t):
-        db = self.parent.db
-        cm = self.parent.change_svc
-        state = self.get_state(t)
-        last_processed = state["last_processed"]
-
-        changes = cm.getChangesGreaterThan(last_processed, t)
-        for c in changes:
-            if self.changeIsRelevant(c):
-                important = True
-                if self.fileIsImportant:
-                    important = self.fileIsImportant(c)
-                db.scheduler_classify_change(self.schedulerid, c.number,
-                                             bool(important), t)
-        # now that we've recorded a decision about each, we can update the
-        # last_processed record
-        if changes:
-            max_changeid = max([c.number for c in changes])
-            state["last_processed"] = max_changeid # retain other keys
-            self.set_state(t, state)
+        self.parent.classify_changes_txn(t, [self])
 
 class Scheduler(_Base, ClassifierMixin):
-    fileIsImportant = None
     compare_attrs = ('name', 'treeStableTimer', 'builderNames', 'branch',
                      'fileIsImportant', 'properties', 'categories')
 
@@ -181,19 +188,13 @@ class Scheduler(_Base, ClassifierMixin):
     def get_initial_state(self, max_changeid):
         return {"last_processed": max_changeid}
 
-    def changeIsRelevant(self, change):
-        if change.branch != self.branch:
-            return False
-        if self.categories is not None:
-            if change.category not in self.categories:
-                return False
-        return True
+    def getChangeFilter(self):
+        return ([self.branch], self.categories)
 
     def run(self):
+        # our parent has already classified any new changes
         db = self.parent.db
-        d = db.runInteraction(self.classify_changes)
-        d.addCallback(lambda ign: db.runInteraction(self._process_changes))
-        return d
+        return db.runInteraction(self._process_changes)
 
     def _process_changes(self, t):
         db = self.parent.db
@@ -286,11 +287,8 @@ class AnyBranchScheduler(Scheduler):
             assert callable(fileIsImportant)
             self.fileIsImportant = fileIsImportant
 
-    def changeIsRelevant(self, change):
-        if self.categories is not None:
-            if change.category not in self.categories:
-                return False
-        return True
+    def getChangeFilter(self):
+        return (None, self.categories)
 
     def _process_changes(self, t):
         db = self.parent.db
@@ -40,6 +40,48 @@ from twisted.python import log
 from buildbot.util import loop
 from buildbot.util import collections
 from buildbot.util.eventual import eventually
+from buildbot.schedulers.basic import ClassifierMixin
+
+class _Any:
+    pass # a flag value, used below
+
+def _overridesChangeIsRelevant(s):
+    return s.changeIsRelevant.im_func is not \
+           ClassifierMixin.changeIsRelevant.im_func
+
+class ChangeDispatcher:
+    """I find the schedulers that a Change could be relevant to, from the
+    branches and categories they accept (see
+    ClassifierMixin.getChangeFilter), without asking each of them. A
+    scheduler whose class overrides changeIsRelevant() may accept more
+    than that, as it could before getChangeFilter() existed, so it is
+    shown every Change."""
+
+    def __init__(self, schedulers):
+        # maps branch (or _Any) to a dict that maps category (or _Any) to
+        # the schedulers that accept both
+        self.table = {}
+        for s in schedulers:
+            branches, categories = s.getChangeFilter()
+            if _overridesChangeIsRelevant(s):
+                branches = categories = None
+            if branches is None:
+                branches = [_Any]
+            if categories is None:
+                categories = [_Any]
+            for branch in set(branches):
+                by_category = self.table.setdefault(branch, {})
+                for category in set(categories):
+                    by_category.setdefault(category, []).append(s)
+
+    def getCandidates(self, change):
+        candidates = []
+        for branch in (change.branch, _Any):
+            by_category = self.table.get(branch)
+            if by_category:
+                for category in (change.category, _Any):
+                    candidates.extend(by_category.get(category, []))
+        return candidates
 
 class SchedulerManager(loop.MultiServiceLoop):
     def __init__(self, master, db, change_svc):
@@ -48,6 +90,17 @@ class SchedulerManager(loop.MultiServiceLoop):
         self.db = db
         self.change_svc = change_svc
         self.upstream_subscribers = collections.defaultdict(list)
+        self.classifier_stats = {
+            'runs': 0,
+            'changes': 0, # changes loaded
+            'candidates': 0, # (change, scheduler) pairs looked at
+            'classified': 0, # scheduler_changes rows added
+            }
+        self._trigger_count = 0
+        self._classified_count = 0 # triggers whose changes were classified
+        self._classifying = False
+        self._classified_waiters = []
+        self._active = 0 # schedulers running now
 
     def updateSchedulers(self, newschedulers):
         """Add and start any Scheduler that isn't already a child of ours.
@@ -100,15 +153,191 @@ class SchedulerManager(loop.MultiServiceLoop):
         d.addErrback(log.err)
         return d
 
+    def trigger(self):
+        # whatever rang the doorbell may have added changes
+        self._trigger_count += 1
+        loop.MultiServiceLoop.trigger(self)
+
+    def run_processor(self, p):
+        # new changes are classified for all of the schedulers before any
+        # of them runs
+        d = self.when_classified()
+        d.addCallback(self._run_scheduler, p)
+        return d
+
+    def _run_scheduler(self, ign, p):
+        self._active += 1
+        d = defer.maybeDeferred(p)
+        def _done(res):
+            self._active -= 1
+            self._maybe_classify()
+            return res
+        d.addBoth(_done)
+        return d
+
+    def when_classified(self):
+        """Return a Deferred that fires once the changes added before the
+        last trigger() have been classified. Schedulers running at the same
+        time share a single classification."""
+        target = self._trigger_count
+        if self._classified_count >= target:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._classified_waiters.append((target, d))
+        self._maybe_classify()
+        return d
+
+    def _maybe_classify(self):
+        # classifying reads and writes the schedulers' states, as running
+        # schedulers (Nightly's last_build, for one) do in transactions of
+        # their own, so it waits until none of them is running. Meanwhile
+        # no other scheduler starts: they wait for it.
+        if self._classified_waiters and not (self._classifying or
+                                             self._active):
+            self._classify()
+
+    def _classify(self):
+        self._classifying = True
+        count = self._trigger_count
+        d = defer.maybeDeferred(self.classify_changes)
+        # if that failed, the changes will be classified after the next
+        # trigger: the schedulers run meanwhile
+        d.addErrback(log.err)
+        def _done(classified):
+            self._classifying = False
+            if classified and self.running:
+                # the schedulers that were given new changes must look at
+                # them, even if they were not otherwise triggered
+                self.trigger_processors([s.run for s in classified])
+            self._classified_count = count
+            waiters = self._classified_waiters
+            self._classified_waiters = []
+            for (target, w) in waiters:
+                if target <= count:
+                    w.callback(None)
+                else:
+                    self._classified_waiters.append((target, w))
+            self._maybe_classify()
+        d.addCallback(_done)
+
+    def get_classifiers(self):
+        return [s for s in self
+                if isinstance(s, ClassifierMixin) and s.classifiesChanges()]
+
+    def classify_changes(self):
+        schedulers = self.get_classifiers()
+        if not schedulers:
+            return None
+        return self.db.runInteraction(self.classify_changes_txn, schedulers)
+
+    def classify_changes_txn(self, t, schedulers):
+        """Record, for each of SCHEDULERS, a decision about each Change it
+        has not yet processed, then update their 'last_processed' states.
+        New changes are loaded once, and each is only shown to the
+        schedulers that accept its branch and category. Return the set of
+        schedulers that a decision was recorded for."""
+        db = self.db
+        stats = self.classifier_stats
+        stats['runs'] += 1
+        states = db.scheduler_get_states([s.schedulerid for s in schedulers],
+                                         t)
+        dirty = set()
+        max_changeid = None
+        for s in schedulers:
+            state = states[s.schedulerid]
+            if "last_processed" not in state:
+                # this one has only just started paying attention to
+                # changes, so it ignores the existing ones
+                if max_changeid is None:
+                    max_changeid = db.scheduler_get_max_changeid(t)
+                state["last_processed"] = max_changeid
+                dirty.add(s.schedulerid)
+        last_processed = min([states[s.schedulerid]["last_processed"]
+                              for s in schedulers])
+
+        changes = self.change_svc.getChangesGreaterThan(last_processed, t)
+        stats['changes'] += len(changes)
+        dispatcher = ChangeDispatcher(schedulers)
+        classifications = []
+        failed = set() # schedulers whose decisions raised an exception
+        for c in changes:
+            for s in dispatcher.getCandidates(c):
+                if s in failed:
+                    continue
+                if c.number <= states[s.schedulerid]["last_processed"]:
+                    continue # decided about already
+                stats['candidates'] += 1
+                try:
+                    important = None
+                    if s.changeIsRelevant(c):
+                        important = True
+                        if s.fileIsImportant:
+                            important = bool(s.fileIsImportant(c))
+                except:
+                    # only this scheduler misses the new changes: it is
+                    # given them again next time
+                    log.msg("scheduler %s failed to classify change %d"
+                            % (s.name, c.number))
+                    log.err()
+                    failed.add(s)
+                    continue
+                if important is not None:
+                    classifications.append((s.schedulerid, c.number,
+                                            important))
+        if failed:
+            failed_ids = set([s.schedulerid for s in failed])
+            classifications = [cl for cl in classifications
+                               if cl[0] not in failed_ids]
+        classified = set()
+        if classifications:
+            db.scheduler_classify_changes(classifications, t)
+            stats['classified'] += len(classifications)
+            by_id = dict([(s.schedulerid, s) for s in schedulers])
+            classified = set([by_id[sid] for (sid, changeid, important)
+                              in classifications])
+
+        # now that we've recorded a decision about each, we can update the
+        # last_processed records
+        if changes:
+            max_changeid = max([c.number for c in changes])
+            for s in schedulers:
+                if s in failed:
+                    continue
+                state = states[s.schedulerid]
+                if state["last_processed"] < max_changeid:
+                    state["last_processed"] = max_changeid
+                    dirty.add(s.schedulerid)
+        if dirty:
+            # only last_processed is ours: the rest of each state is read
+            # again, in case its scheduler changed it meanwhile
+            current = db.scheduler_get_states(list(dirty), t)
+            for sid in dirty:
+                current[sid]["last_processed"] = states[sid]["last_processed"]
+            db.scheduler_set_states([(sid, current[sid]) for sid in dirty],
+                                    t)
+        return classified
+
     def publish_buildset(self, upstream_name, bsid, t):
         if upstream_name in self.upstream_subscribers:
             for s in self.upstream_subscribers[upstream_name]:
                 s.buildSetSubmitted(bsid, t)
 
-    def trigger_add_change(self, category, changenumber):
-        self.trigger()
+    def trigger_add_change(self, category, *changenumbers):
+        # only the schedulers that the new change is classified for need to
+        # run, and classifying it tells us which ones those are. Like any
+        # classification, it waits for the running schedulers to finish.
+        self._trigger_count += 1
+        self.when_classified()
+
     def trigger_modify_buildset(self, category, *bsids):
-        # TODO: this could just run the schedulers that have subscribed to
-        # scheduler_upstream_buildsets, or even just the ones that subscribed
-        # to hear about the specific buildsetid
-        self.trigger()
+        # only the schedulers that subscribed to hear about these buildsets
+        # (Dependent and Triggerable) need to run
+        d = self.db.scheduler_get_buildset_subscribers(bsids)
+        def _trigger(schedulerids):
+            schedulers = [s for s in self
+                          if getattr(s, 'schedulerid', None) in schedulerids]
+            if schedulers and self.running:
+                self.trigger_processors([s.run for s in schedulers])
+        d.addCallback(_trigger)
+        d.addErrback(log.err)
+        return d
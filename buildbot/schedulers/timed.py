@@ -35,12 +35,70 @@
 #
 # ***** END LICENSE BLOCK *****
 
-import time
-from twisted.internet import defer
+import time, calendar, bisect
 from twisted.python import log
 from buildbot.sourcestamp import SourceStamp
 from buildbot.schedulers.basic import _Base, ClassifierMixin
 
+# the largest change of UTC offset that daylight saving time makes at once
+MAX_OFFSET_CHANGE = 3*3600
+# any schedule that matches at all matches at least once in this many years
+# (February 29th is skipped in 2100)
+SEARCH_YEARS = 9
+
+def _utcOffset(t):
+    return calendar.timegm(time.localtime(t)) - t
+
+def _parseRange(name, spec, low, high):
+    # one part of a crontab-style field: '*', 'N', 'N-M', or any of those
+    # followed by '/STEP'
+    try:
+        step = 1
+        stepped = '/' in spec
+        if stepped:
+            spec, step = spec.split('/', 1)
+            step = int(step)
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = [int(v) for v in spec.split('-', 1)]
+        else:
+            start = end = int(spec)
+            if stepped:
+                # like cron, 'N/STEP' means from N to the end
+                end = high
+    except ValueError:
+        raise ValueError("Nightly %s: cannot parse '%s'" % (name, spec))
+    if step < 1 or start > end:
+        raise ValueError("Nightly %s: empty range '%s'" % (name, spec))
+    return range(start, end+1, step)
+
+def _parseField(name, value, low, high):
+    """Return the sorted list of values from LOW to HIGH that VALUE, a
+    Nightly field, matches. VALUE may be '*', a number, a list of numbers,
+    or a crontab-style string of comma-separated numbers, ranges ('1-5')
+    and steps ('*/15', '0-30/10')."""
+    if value == '*':
+        return range(low, high+1)
+    if isinstance(value, (int, long)):
+        values = [value]
+    elif isinstance(value, str):
+        values = []
+        for spec in value.split(','):
+            values.extend(_parseRange(name, spec.strip(), low, high))
+    else:
+        values = []
+        for v in value:
+            if isinstance(v, str):
+                values.extend(_parseField(name, v, low, high))
+            else:
+                values.append(v)
+    for v in values:
+        if not isinstance(v, (int, long)) or not low <= v <= high:
+            raise ValueError("Nightly %s must be from %d to %d, not %r"
+                             % (name, low, high, v))
+    return sorted(set(values))
+
 class TimedBuildMixin:
 
     def start_HEAD_build(self, t):
@@ -114,11 +172,12 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
     build, or one which runs are certain times of the day, week, or month.
 
     Pass some subset of minute, hour, dayOfMonth, month, and dayOfWeek; each
-    may be a single number or a list of valid values. The builds will be
-    triggered whenever the current time matches these values. Wildcards are
-    represented by a '*' string. All fields default to a wildcard except
-    'minute', so with no fields this defaults to a build every hour, on the
-    hour.
+    may be a single number, a list of valid values, or a crontab-style
+    string of numbers, ranges and steps such as '1-5' or '*/15' (several of
+    them separated by commas). The builds will be triggered whenever the
+    current time matches these values. Wildcards are represented by a '*'
+    string. All fields default to a wildcard except 'minute', so with no
+    fields this defaults to a build every hour, on the hour.
 
     For example, the following master.cfg clause will cause a build to be
     started every night at 3:00am::
@@ -134,7 +193,7 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
 
     The following runs a build every two hours::
 
-     s = Nightly('every2hours', ['builder1'], hour=range(0, 24, 2))
+     s = Nightly('every2hours', ['builder1'], hour='*/2')
 
     And this one will run only on December 24th::
 
@@ -184,6 +243,13 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
         self.dayOfMonth = dayOfMonth
         self.month = month
         self.dayOfWeek = dayOfWeek
+        self._minutes = _parseField("minute", minute, 0, 59)
+        self._hours = _parseField("hour", hour, 0, 23)
+        self._daysOfMonth = _parseField("dayOfMonth", dayOfMonth, 1, 31)
+        self._months = _parseField("month", month, 1, 12)
+        self._daysOfWeek = _parseField("dayOfWeek", dayOfWeek, 0, 6)
+        if not self._canRun():
+            raise ValueError("Nightly scheduler '%s' would never run" % name)
         self.branch = branch
         self.onlyIfChanged = onlyIfChanged
         self.delayedRun = None
@@ -197,7 +263,13 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
         self._start_time = time.time()
 
     def get_initial_state(self, max_changeid):
-        return {"last_build": None}
+        return {"last_build": None, "last_processed": max_changeid}
+
+    def classifiesChanges(self):
+        return self.onlyIfChanged
+
+    def getChangeFilter(self):
+        return ([self.branch], self.categories)
 
     def getPendingBuildTimes(self):
         now = time.time()
@@ -206,13 +278,10 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
         return [next]
 
     def run(self):
-        d = defer.succeed(None)
+        # if onlyIfChanged, our parent has already classified any new
+        # changes, as for Scheduler.
         db = self.parent.db
-        if self.onlyIfChanged:
-            # classify_changes comes from ClassifierMixin, same as Scheduler.
-            d.addCallback(lambda ign: db.runInteraction(self.classify_changes))
-        d.addCallback(lambda ign: db.runInteraction(self._check_timer))
-        return d
+        return db.runInteraction(self._check_timer)
 
     def _check_timer(self, t):
         now = time.time()
@@ -245,58 +314,117 @@ class Nightly(_Base, ClassifierMixin, TimedBuildMixin):
             # start it unconditionally
             self.start_HEAD_build(t)
 
-    def _addTime(self, timetuple, secs):
-        return time.localtime(time.mktime(timetuple)+secs)
-
-    def _isRunTime(self, timetuple):
-        def check(ourvalue, value):
-            if ourvalue == '*': return True
-            if isinstance(ourvalue, int): return value == ourvalue
-            return (value in ourvalue)
-
-        if not check(self.minute, timetuple[4]):
-            #print 'bad minute', timetuple[4], self.minute
-            return False
-
-        if not check(self.hour, timetuple[3]):
-            #print 'bad hour', timetuple[3], self.hour
-            return False
-
-        if not check(self.month, timetuple[1]):
-            #print 'bad month', timetuple[1], self.month
+    def _canRun(self):
+        if not self._minutes or not self._hours or not self._months:
             return False
+        # every month has each day of the week, but not every day of the
+        # month (2000 was a leap year)
+        someDayOfWeek = bool(self._daysOfWeek)
+        someDayOfMonth = bool([d for m in self._months
+                               for d in self._daysOfMonth
+                               if d <= calendar.monthrange(2000, m)[1]])
+        if self.dayOfMonth != '*' and self.dayOfWeek != '*':
+            return someDayOfWeek or someDayOfMonth
+        return someDayOfWeek and someDayOfMonth
 
+    def _dayMatches(self, year, month, day):
+        dom = day in self._daysOfMonth
+        dow = calendar.weekday(year, month, day) in self._daysOfWeek
         if self.dayOfMonth != '*' and self.dayOfWeek != '*':
             # They specified both day(s) of month AND day(s) of week.
-            # This means that we only have to match one of the two. If
-            # neither one matches, this time is not the right time.
-            if not (check(self.dayOfMonth, timetuple[2]) or
-                    check(self.dayOfWeek, timetuple[6])):
-                #print 'bad day'
-                return False
-        else:
-            if not check(self.dayOfMonth, timetuple[2]):
-                #print 'bad day of month'
-                return False
+            # This means that we only have to match one of the two.
+            return dom or dow
+        return dom and dow
 
-            if not check(self.dayOfWeek, timetuple[6]):
-                #print 'bad day of week'
-                return False
-
-        return True
+    def _isRunTime(self, timetuple):
+        return (timetuple[4] in self._minutes
+                and timetuple[3] in self._hours
+                and timetuple[1] in self._months
+                and self._dayMatches(timetuple[0], timetuple[1],
+                                     timetuple[2]))
+
+    def _matchingDays(self, year, month, day):
+        # generate (year, month, day) for each matching day from the given
+        # one on, skipping whole months (and, when only days of the month
+        # are given, whole days) that cannot match
+        for y in range(year, year + SEARCH_YEARS):
+            for m in self._months:
+                if (y, m) < (year, month):
+                    continue
+                first = ((y, m) == (year, month)) and day or 1
+                last = calendar.monthrange(y, m)[1]
+                if self.dayOfWeek == '*':
+                    days = [d for d in self._daysOfMonth if first <= d <= last]
+                else:
+                    days = range(first, last+1)
+                for d in days:
+                    if self._dayMatches(y, m, d):
+                        yield (y, m, d)
+
+    def _runTimeOn(self, year, month, day, threshold):
+        # return the first time at or after THRESHOLD (in seconds since the
+        # epoch, on a minute) that is a run time on the given local day, or
+        # None
+        midnight = calendar.timegm((year, month, day, 0, 0, 0))
+        local_midnight = int(time.mktime((year, month, day, 0, 0, 0,
+                                          0, 0, -1)))
+        before = _utcOffset(local_midnight - MAX_OFFSET_CHANGE)
+        after = _utcOffset(local_midnight + 24*3600 + MAX_OFFSET_CHANGE)
+        if before == after:
+            # the clocks do not change on this day, so each local time
+            # happens exactly once, in order
+            first = max(threshold + before - midnight, 0)
+            if first >= 24*3600:
+                return None
+            (h, m) = divmod((first + 59) // 60, 60)
+            i = bisect.bisect_left(self._hours, h)
+            if i < len(self._hours) and self._hours[i] == h:
+                j = bisect.bisect_left(self._minutes, m)
+                if j < len(self._minutes):
+                    return midnight + h*3600 + self._minutes[j]*60 - before
+                i += 1
+            if i < len(self._hours):
+                return (midnight + self._hours[i]*3600 + self._minutes[0]*60
+                        - before)
+            return None
+        # Otherwise some local times are skipped, or happen twice. Look at
+        # them all, as each of them under both offsets, and keep those that
+        # really are that local time.
+        best = None
+        offsets = set([before, after])
+        latest = max(offsets)
+        for h in self._hours:
+            for m in self._minutes:
+                local = midnight + h*3600 + m*60
+                if best is not None and local - latest > best:
+                    return best
+                for offset in offsets:
+                    t = local - offset
+                    if (t >= threshold and (best is None or t < best)
+                        and time.localtime(t)[:5] == (year, month, day,
+                                                      h, m)):
+                        best = t
+        return best
 
     def _calculateNextRunTimeFrom(self, now):
-        dateTime = time.localtime(now)
-
-        # Remove seconds by advancing to at least the next minue
-        dateTime = self._addTime(dateTime, 60-dateTime[5])
-
-        # Now we just keep adding minutes until we find something that matches
-
-        # It not an efficient algorithm, but it'll *work* for now
-        yearLimit = dateTime[0]+2
-        while not self._isRunTime(dateTime):
-            dateTime = self._addTime(dateTime, 60)
-            #print 'Trying', time.asctime(dateTime)
-            assert dateTime[0] < yearLimit, 'Something is wrong with this code'
-        return time.mktime(dateTime)
+        # the next run time is the first whole minute after NOW that
+        # matches. Rather than trying each minute, look at the matching
+        # days, and the first matching hour and minute on each.
+        lt = time.localtime(now)
+        threshold = int(time.mktime(lt)) - lt[5] + 60
+        # if the clocks go back across midnight, some times of the day
+        # before happen again after THRESHOLD
+        start = time.localtime(threshold - MAX_OFFSET_CHANGE)
+        best = None
+        for (y, m, d) in self._matchingDays(start[0], start[1], start[2]):
+            if best is not None:
+                # no later day can start before BEST
+                earliest = (calendar.timegm((y, m, d, 0, 0, 0))
+                            - _utcOffset(best) - MAX_OFFSET_CHANGE)
+                if earliest > best:
+                    break
+            t = self._runTimeOn(y, m, d, threshold)
+            if t is not None and (best is None or t < best):
+                best = t
+        assert best is not None, 'Something is wrong with this code'
+        return float(best)
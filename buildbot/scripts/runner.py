@@ -388,6 +388,8 @@ DB_HELP = """
 class UpgradeMasterOptions(MakerBase):
     optFlags = [
         ["replace", "r", "Replace any modified files without confirmation."],
+        ["index-logs", None,
+         "Index (and recompress) existing build logs for random access."],
         ]
     optParameters = [
         ["db", None, "sqlite:///state.sqlite",
@@ -418,8 +420,128 @@ class UpgradeMasterOptions(MakerBase):
     changes.pck.old). To revert to an older release, rename the pickle files
     back. When you are satisfied with the new version, you can delete the old
     pickle files.
+
+    Build logs written by older releases can only be read from the start.
+    With --index-logs, an index is created for each of them, and compressed
+    logs are compressed again in blocks, so that the web status can show any
+    part of a log without reading all of it. This can take a while for a
+    large buildmaster, and is safe to interrupt and run again.
+
+    The history pages read finished builds from a summary table in the
+    database. This command adds a summary for each build that finished
+    before that table existed, which also takes a while the first time.
+    """
+
+_logfile_re = re.compile(r"^\d+-log-")
+
+def index_logs(basedir, silent=False):
+    from buildbot.status import logindex, layout
+    count = 0
+    for name in sorted(os.listdir(basedir)):
+        builderdir = os.path.join(basedir, name)
+        if not os.path.isfile(os.path.join(builderdir, "builder")):
+            continue
+        if not silent: print "indexing logs in %s" % builderdir
+        for dirname in layout.list_build_dirs(builderdir):
+            logdir = os.path.join(builderdir, dirname)
+            for fn in sorted(os.listdir(logdir)):
+                if not _logfile_re.match(fn):
+                    continue
+                if fn.endswith(".idx") or fn.endswith(".tmp"):
+                    continue
+                for suffix in logindex.METHODS.values():
+                    if fn.endswith(suffix):
+                        fn = fn[:-len(suffix)]
+                if logindex.index_log(os.path.join(logdir, fn)):
+                    count += 1
+    if not silent: print "indexed %d logs" % count
+    return count
+
+def backfill_build_summaries(basedir, db, master_name, silent=False):
+    from cPickle import load
+    from twisted.persisted import styles
+    from buildbot.status import buildfile, layout
+    count = 0
+    for name in sorted(os.listdir(basedir)):
+        builderdir = os.path.join(basedir, name)
+        builderfile = os.path.join(builderdir, "builder")
+        if not os.path.isfile(builderfile):
+            continue
+        try:
+            buildername = load(open(builderfile, "rb")).name
+            styles.doUpgrade()
+        except:
+            if not silent: print "unable to load %s, skipping" % builderfile
+            continue
+        done = db.get_summarized_build_numbers(master_name, buildername)
+        filenames = {}
+        for dirname in layout.list_build_dirs(builderdir):
+            for fn in os.listdir(os.path.join(builderdir, dirname)):
+                if re.match(r"^\d+$", fn) and int(fn) not in done:
+                    filenames[int(fn)] = os.path.join(builderdir, dirname, fn)
+        if not filenames:
+            continue
+        if not silent:
+            print "summarizing %d builds of %s" % (len(filenames),
+                                                   buildername)
+        for number in sorted(filenames.keys()):
+            try:
+                build = buildfile.load_build(filenames[number])
+                if build is None:
+                    build = load(open(filenames[number], "rb"))
+                    styles.doUpgrade()
+            except:
+                if not silent: print " unable to load build %d" % number
+                continue
+            if not build.isFinished():
+                continue
+            db.runInteractionNow(db._txn_add_build_summary, master_name,
+                                 buildername, number, build.getSummary())
+            count += 1
+    if not silent: print "summarized %d builds" % count
+    return count
+
+class ShardBuildsOptions(MakerBase):
+    optParameters = [
+        ["builder", "b", None,
+         "Only move the builds of the builder with this directory name"],
+        ["delay", None, 0.0,
+         "Seconds to wait after each build is moved", float],
+        ]
+
+    def getSynopsis(self):
+        return "Usage:    buildbot shard-builds [options] [<basedir>]"
+
+    longdesc = """
+    This command moves the saved builds and logs of each builder, which are
+    all kept in the builder's directory by default, into one subdirectory
+    per 1000 builds, as the buildmaster does with
+    c['buildStorageLayout'] = 'sharded'. Set that in master.cfg and
+    reconfig the buildmaster before running this command: the buildmaster
+    can keep running while builds are moved, and will find each build
+    whether it has been moved yet or not. The command is safe to interrupt
+    and run again.
     """
 
+def shard_builds(basedir, builder=None, delay=0, silent=False):
+    from buildbot.status import layout
+    count = 0
+    for name in sorted(os.listdir(basedir)):
+        builderdir = os.path.join(basedir, name)
+        if not os.path.isfile(os.path.join(builderdir, "builder")):
+            continue
+        if builder is not None and name != builder:
+            continue
+        if not silent: print "moving builds in %s" % builderdir
+        count += layout.migrate_builder(builderdir, delay, silent)
+    if not silent: print "moved %d builds" % count
+    return count
+
+def shardBuilds(config):
+    shard_builds(config['basedir'], config['builder'], config['delay'],
+                 silent=config['quiet'])
+    return 0
+
 def migrate_changes_pickle_to_db(fn, db, silent=False):
     from cPickle import load
     if not silent: print "migrating Changes pickle to db"
@@ -465,8 +587,15 @@ def upgradeMaster(config):
         migrate_changes_pickle_to_db(changes_pickle, db, silent=config['quiet'])
         if not config['quiet']: print "moving old changes.pck to changes.pck.old"
         os.rename(changes_pickle, changes_pickle+".old")
+    # builds finished before the build_summaries table existed
+    from buildbot.master import get_master_name
+    backfill_build_summaries(basedir, db, get_master_name(basedir),
+                             silent=config['quiet'])
     db.stop()
 
+    if config['index-logs']:
+        index_logs(basedir, silent=config['quiet'])
+
     rc = m.check_master_cfg()
     if rc:
         return rc
@@ -1108,6 +1237,8 @@ class Options(usage.Options):
          "Create and populate a directory for a new buildmaster"],
         ['upgrade-master', None, UpgradeMasterOptions,
          "Upgrade an existing buildmaster directory for the current version"],
+        ['shard-builds', None, ShardBuildsOptions,
+         "Move a buildmaster's saved builds into per-1000 subdirectories"],
         ['create-slave', None, SlaveOptions,
          "Create and populate a directory for a new buildslave"],
         ['start', None, StartOptions, "Start a buildmaster or buildslave"],
@@ -1175,6 +1306,8 @@ def run():
         createMaster(so)
     elif command == "upgrade-master":
         upgradeMaster(so)
+    elif command == "shard-builds":
+        shardBuilds(so)
     elif command == "create-slave":
         createSlave(so)
     elif command == "start":
@@ -0,0 +1,75 @@
+# -*- test-case-name: buildbot.test.unit.test_status_buildcache -*-
+
+from buildbot import util
+
+def build_size(build):
+    # approximate memory use of a BuildStatus, for the build cache
+    size = 2000 + 50 * len(build.text)
+    size += 100 * len(build.properties.asList())
+    sections = build.__dict__.get('_sections', {})
+    if 'steps' in sections:
+        # not loaded from its build file yet: guess from the section length
+        return size + sections['steps'][2]
+    for step in build.steps:
+        size += 1000 + 50 * len(step.text) + 50 * len(step.text2)
+        size += 300 * len(step.logs) + 100 * len(step.urls)
+    return size
+
+class BuildCache:
+    """I keep the most recently used BuildStatus instances of all builders
+    in memory, up to MAX_SIZE builds and, optionally, about MAX_BYTES of
+    memory. Builds are identified by builder name and build number.
+
+    Besides the hit, miss and eviction counts of the underlying LRUCache, I
+    count the builds loaded from disk, how long that took, and how many of
+    them were prefetched (loaded before anybody asked for them)."""
+
+    DEFAULT_MAX_SIZE = 500
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, max_bytes=None):
+        self.lru = util.LRUCache(max_size, max_bytes, sizefunc=build_size)
+        self.loads = 0
+        self.load_failures = 0
+        self.load_time = 0.0
+        self.prefetched = 0
+
+    def resize(self, max_size=DEFAULT_MAX_SIZE, max_bytes=None):
+        self.lru.resize(max_size, max_bytes)
+
+    def get(self, buildername, number):
+        return self.lru.get((buildername, number))
+
+    def add(self, buildername, build):
+        self.lru.add((buildername, build.number), build)
+
+    def remove(self, buildername, number):
+        self.lru.remove((buildername, number))
+
+    def has(self, buildername, number):
+        return (buildername, number) in self.lru
+
+    def getNumbers(self, buildername):
+        """Return the numbers of the given builder's cached builds."""
+        return [number for (name, number) in self.lru.keys()
+                if name == buildername]
+
+    def buildLoaded(self, elapsed, prefetch=False):
+        self.loads += 1
+        self.load_time += elapsed
+        if prefetch:
+            self.prefetched += 1
+
+    def buildLoadFailed(self):
+        self.load_failures += 1
+
+    def getStats(self):
+        """Return a dict describing the cache's size and effectiveness."""
+        stats = self.lru.getStats()
+        stats['loads'] = self.loads
+        stats['load_failures'] = self.load_failures
+        stats['load_time'] = self.load_time
+        stats['prefetched'] = self.prefetched
+        stats['average_load_time'] = None
+        if self.loads:
+            stats['average_load_time'] = self.load_time / self.loads
+        return stats
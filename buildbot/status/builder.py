@@ -9,16 +9,15 @@ from buildbot.process.properties import Properties
 from buildbot.util import collections
 from buildbot.util.eventual import eventually
 
-import weakref
-import os, shutil, sys, re, urllib, itertools
-import gc
-from cPickle import load, dump
-from cStringIO import StringIO
+import os, shutil, sys, re, urllib, itertools, struct, time, heapq
+from cPickle import load, dump, dumps
 from bz2 import BZ2File
 from gzip import GzipFile
 
 # sibling imports
 from buildbot import interfaces, util, sourcestamp
+from buildbot.status import logindex, logcompressor, buildcache, buildfile
+from buildbot.status import pruner, layout, saver
 
 SUCCESS, WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY = range(6)
 Results = ["success", "warnings", "failure", "skipped", "exception", "retry"]
@@ -47,6 +46,30 @@ STDERR = interfaces.LOG_CHANNEL_STDERR
 HEADER = interfaces.LOG_CHANNEL_HEADER
 ChunkTypes = ["stdout", "stderr", "header"]
 
+def _splitLines(texts):
+    # a pull-driven version of twisted.protocols.basic.LineReceiver: turn an
+    # iterable of strings into lines (each ending in a newline, except
+    # possibly the last), only pulling in a string when the previous one has
+    # run out of lines
+    partial = []
+    for text in texts:
+        start = 0
+        while True:
+            nl = text.find("\n", start)
+            if nl == -1:
+                break
+            if partial:
+                partial.append(text[start:nl+1])
+                yield "".join(partial)
+                partial = []
+            else:
+                yield text[start:nl+1]
+            start = nl + 1
+        if start < len(text):
+            partial.append(text[start:])
+    if partial:
+        yield "".join(partial)
+
 class LogFileScanner(basic.NetstringReceiver):
     def __init__(self, chunk_cb, channels=[]):
         self.chunk_cb = chunk_cb
@@ -95,15 +118,17 @@ class LogFileProducer:
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, offset=None, line=None,
+                 limit=None):
         self.logfile = logfile
         self.consumer = consumer
-        self.chunkGenerator = self.getChunks()
+        start, skip_bytes, skip_lines = logfile._findStart(offset, line)
+        self.window = logindex.TextWindow(skip_bytes, skip_lines, limit)
+        self.chunkGenerator = self.getChunks(start)
         consumer.registerProducer(self, True)
 
-    def getChunks(self):
+    def getChunks(self, offset=0):
         f = self.logfile.getFile()
-        offset = 0
         chunks = []
         p = LogFileScanner(chunks.append)
         f.seek(offset)
@@ -112,8 +137,14 @@ class LogFileProducer:
         while data:
             p.dataReceived(data)
             while chunks:
-                c = chunks.pop(0)
-                yield c
+                channel, text = chunks.pop(0)
+                text = self.window.filter(channel, text)
+                if text:
+                    yield (channel, text)
+                if self.window.done:
+                    # the rest of the log is not wanted
+                    self.logfileFinished(self.logfile)
+                    return
             f.seek(offset)
             data = f.read(self.BUFFERSIZE)
             offset = f.tell()
@@ -128,7 +159,12 @@ class LogFileProducer:
         if self.logfile.runEntries:
             channel = self.logfile.runEntries[0][0]
             text = "".join([c[1] for c in self.logfile.runEntries])
-            yield (channel, text)
+            text = self.window.filter(channel, text)
+            if text:
+                yield (channel, text)
+            if self.window.done:
+                self.logfileFinished(self.logfile)
+                return
 
         # now we've caught up to the present. Anything further will come from
         # the logfile subscription. We add the callback *after* yielding the
@@ -180,8 +216,13 @@ class LogFileProducer:
         # pause anymore
 
     def logChunk(self, build, step, logfile, channel, chunk):
-        if self.consumer:
-            self.consumer.writeChunk((channel, chunk))
+        if self.consumer and not self.window.done:
+            chunk = self.window.filter(channel, chunk)
+            if chunk:
+                self.consumer.writeChunk((channel, chunk))
+            if self.window.done:
+                # not while the LogFile is iterating over its watchers
+                eventually(self.logfileFinished, logfile)
 
     def logfileFinished(self, logfile):
         self.done()
@@ -237,6 +278,7 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    openindex = None # the logindex.IndexWriter for openfile
     compressMethod = "bz2"
 
     def __init__(self, parent, name, logfilename):
@@ -262,18 +304,31 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.openindex = logindex.IndexWriter(fn + ".idx")
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
         self.tailBuffer = []
 
     def getFilename(self):
-        return os.path.join(self.step.build.builder.basedir, self.filename)
+        builder = self.step.build.builder
+        if builder.buildStorageLayout == "sharded" and \
+                os.path.dirname(self.filename) == "":
+            # 'buildbot shard-builds' may have moved us into our build's
+            # shard since the build was loaded. It indexes logs before moving
+            # them, so the index shows where we are now.
+            moved = os.path.join(builder.basedir,
+                                 layout.shard_name(self.step.build.number),
+                                 self.filename)
+            if os.path.exists(moved + ".idx"):
+                return moved
+        return os.path.join(builder.basedir, self.filename)
 
     def hasContents(self):
-        return os.path.exists(self.getFilename() + '.bz2') or \
-            os.path.exists(self.getFilename() + '.gz') or \
-            os.path.exists(self.getFilename())
+        for suffix in logindex.METHODS.values():
+            if os.path.exists(self.getFilename() + suffix):
+                return True
+        return os.path.exists(self.getFilename())
 
     def getName(self):
         return self.name
@@ -291,13 +346,29 @@ class LogFile:
             self.finishedWatchers.append(d)
         return d
 
+    def getIndex(self):
+        """Return a L{logindex.LogIndex} for this log, or None if it has
+        none (because it was written by an older buildbot)."""
+        try:
+            return logindex.LogIndex(self.getFilename() + ".idx")
+        except (IOError, ValueError, struct.error):
+            return None
+
     def getFile(self):
         if self.openfile:
             # this is the filehandle we're using to write to the log, so
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
-        # try a compressed log first
+        # try a log that was compressed in blocks first
+        index = self.getIndex()
+        if index is not None and index.method in logindex.CODECS:
+            suffix = logindex.CODECS[index.method][0]
+            try:
+                return logindex.BlockFile(self.getFilename() + suffix, index)
+            except IOError:
+                pass
+        # then one that was compressed all at once
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
@@ -315,7 +386,76 @@ class LogFile:
     def getTextWithHeaders(self):
         return "".join(self.getChunks(onlyText=True))
 
-    def getChunks(self, channels=[], onlyText=False):
+    def _findStart(self, offset=None, line=None):
+        # return (stream offset, bytes to skip, lines to skip) for reading
+        # the text from byte OFFSET or line LINE. Without an index, that
+        # means reading and skipping everything before it.
+        if offset is None and line is None:
+            return (0, 0, 0)
+        index = self.getIndex()
+        i = None
+        if index is not None:
+            if offset is not None:
+                i = index.findTextOffset(offset)
+            else:
+                i = index.findLine(line)
+        if i is None:
+            return (0, offset or 0, line or 0)
+        rec = index[i]
+        if offset is not None:
+            return (rec[logindex.OFFSET], offset - rec[logindex.TEXTPOS], 0)
+        return (rec[logindex.OFFSET], 0, line - rec[logindex.LINENO])
+
+    def getTextSize(self):
+        """Return (bytes, lines) for the text (stdout and stderr) of this
+        log, counting a final line that has no newline."""
+        start, size, lines = 0, 0, 0
+        index = self.getIndex()
+        if index is not None and len(index):
+            rec = index[-1]
+            start = rec[logindex.OFFSET]
+            size, lines = rec[logindex.TEXTPOS], rec[logindex.LINENO]
+        last = ""
+        for (channel, text) in self._getChunksFrom(start):
+            if channel != HEADER and text:
+                size += len(text)
+                lines += text.count("\n")
+                last = text[-1]
+        if last and last != "\n":
+            lines += 1
+        return (size, lines)
+
+    def getChunks(self, channels=[], onlyText=False, offset=None, line=None):
+        """Generate (channel, text) tuples, or just the texts if onlyText is
+        true. With offset= or line=, only the text from that byte offset or
+        line number (counting only stdout and stderr, from 0) onwards is
+        produced; with an index that does not involve reading the earlier
+        parts of the log."""
+        start, skip_bytes, skip_lines = self._findStart(offset, line)
+        chunks = self._getChunksFrom(start)
+        if skip_bytes or skip_lines:
+            window = logindex.TextWindow(skip_bytes, skip_lines)
+            chunks = self._filterChunks(chunks, window)
+        if channels or onlyText:
+            chunks = self._selectChunks(chunks, channels, onlyText)
+        return chunks
+
+    def _filterChunks(self, chunks, window):
+        for (channel, text) in chunks:
+            text = window.filter(channel, text)
+            if text:
+                yield (channel, text)
+
+    def _selectChunks(self, chunks, channels, onlyText):
+        for (channel, text) in chunks:
+            if channels and channel not in channels:
+                continue
+            if onlyText:
+                yield text
+            else:
+                yield (channel, text)
+
+    def _getChunksFrom(self, start):
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
@@ -329,29 +469,25 @@ class LogFile:
         # yield() calls.
 
         f = self.getFile()
+        offset = start
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = f.tell() - start
         else:
-            offset = 0
             remaining = None
 
         leftover = None
-        if self.runEntries and (not channels or
-                                (self.runEntries[0][0] in channels)):
+        if self.runEntries:
             leftover = (self.runEntries[0][0],
                         "".join([c[1] for c in self.runEntries]))
 
         # freeze the state of the LogFile by passing a lot of parameters into
         # a generator
-        return self._generateChunks(f, offset, remaining, leftover,
-                                    channels, onlyText)
+        return self._generateChunks(f, offset, remaining, leftover)
 
-    def _generateChunks(self, f, offset, remaining, leftover,
-                        channels, onlyText):
+    def _generateChunks(self, f, offset, remaining, leftover):
         chunks = []
-        p = LogFileScanner(chunks.append, channels)
+        p = LogFileScanner(chunks.append)
         f.seek(offset)
         if remaining is not None:
             data = f.read(min(remaining, self.BUFFERSIZE))
@@ -363,11 +499,7 @@ class LogFile:
         while data:
             p.dataReceived(data)
             while chunks:
-                channel, text = chunks.pop(0)
-                if onlyText:
-                    yield text
-                else:
-                    yield (channel, text)
+                yield chunks.pop(0)
             f.seek(offset)
             if remaining is not None:
                 data = f.read(min(remaining, self.BUFFERSIZE))
@@ -378,20 +510,19 @@ class LogFile:
         del f
 
         if leftover:
-            if onlyText:
-                yield leftover[1]
-            else:
-                yield leftover
+            yield leftover
 
     def readlines(self, channel=STDOUT):
         """Return an iterator that produces newline-terminated lines,
-        excluding header chunks."""
-        # TODO: make this memory-efficient, by turning it into a generator
-        # that retrieves chunks as necessary, like a pull-driven version of
-        # twisted.protocols.basic.LineReceiver
-        alltext = "".join(self.getChunks([channel], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        excluding header chunks. The log is read one chunk at a time, so
+        this takes little memory even for very large logs."""
+        return _splitLines(self.getChunks([channel], onlyText=True))
+
+    def readTextLines(self):
+        """Like readlines(), but for the text of both stdout and stderr, as
+        merged together by getText(). Use this instead of
+        getText().split('\\n') to look at every line of a large log."""
+        return _splitLines(self.getChunks([STDOUT, STDERR], onlyText=True))
 
     def subscribe(self, receiver, catchup):
         if self.finished:
@@ -407,8 +538,9 @@ class LogFile:
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
-    def subscribeConsumer(self, consumer):
-        p = LogFileProducer(self, consumer)
+    def subscribeConsumer(self, consumer, offset=None, line=None,
+                          limit=None):
+        p = LogFileProducer(self, consumer, offset, line, limit)
         p.resumeProducing()
 
     # interface used by the build steps to add things to the log
@@ -423,13 +555,20 @@ class LogFile:
         assert channel < 10
         f = self.openfile
         f.seek(0, 2)
+        pos = f.tell()
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
+            prefix = "%d:%d" % (1 + size, channel)
+            f.write(prefix)
             f.write(text[offset:offset+size])
             f.write(",")
+            if self.openindex:
+                self.openindex.add(pos, channel, text[offset:offset+size])
+            pos += len(prefix) + size + 1
             offset += size
+        if self.openindex:
+            self.openindex.flush()
         self.runEntries = []
         self.runLength = 0
 
@@ -502,6 +641,9 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             del self.openfile
+        if self.openindex:
+            self.openindex.close()
+            del self.openindex
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -511,47 +653,51 @@ class LogFile:
 
 
     def compressLog(self):
-        # bail out if there's no compression support
-        if self.compressMethod == "bz2":
-            compressed = self.getFilename() + ".bz2.tmp"
-        elif self.compressMethod == "gz":
-            compressed = self.getFilename() + ".gz.tmp"
-        d = threads.deferToThread(self._compressLog, compressed)
+        # the log is compressed in independent blocks, and gets a new index
+        # that says where they are. This happens in the Status' LogCompressor
+        # threads, which may refuse the job if they are too far behind.
+        suffix = logindex.CODECS[self.compressMethod][0]
+        compressed = self.getFilename() + suffix + ".tmp"
+        compressor = self.step.build.builder.status.logCompressor
+        d = compressor.submit(os.path.getsize(self.getFilename()),
+                              self._compressLog, compressed)
+        if d is None:
+            log.msg("log compression is falling behind, leaving %s "
+                    "uncompressed" % self.getFilename())
+            return None
         d.addCallback(self._renameCompressedLog, compressed)
         d.addErrback(self._cleanupFailedCompress, compressed)
         return d
 
     def _compressLog(self, compressed):
         infile = self.getFile()
-        if self.compressMethod == "bz2":
-            cf = BZ2File(compressed, 'w')
-        elif self.compressMethod == "gz":
-            cf = GzipFile(compressed, 'w')
-        bufsize = 1024*1024
-        while True:
-            buf = infile.read(bufsize)
-            cf.write(buf)
-            if len(buf) < bufsize:
-                break
+        cf = open(compressed, 'wb')
+        logindex.compress_log(infile, cf, self.getFilename() + ".idx.tmp",
+                              self.compressMethod)
         cf.close()
+        return os.path.getsize(compressed)
     def _renameCompressedLog(self, rv, compressed):
-        if self.compressMethod == "bz2":
-            filename = self.getFilename() + '.bz2'
-        else:
-            filename = self.getFilename() + '.gz'
-        if sys.platform == 'win32':
-            # windows cannot rename a file on top of an existing one, so
-            # fall back to delete-first. There are ways this can fail and
-            # lose the builder's history, so we avoid using it in the
-            # general (non-windows) case
-            if os.path.exists(filename):
-                os.unlink(filename)
-        os.rename(compressed, filename)
+        filename = self.getFilename() + logindex.CODECS[self.compressMethod][0]
+        # the new index goes first: it is only used along with the
+        # compressed file, so the uncompressed one is still readable until
+        # that is in place
+        for (src, dst) in [(self.getFilename() + ".idx.tmp",
+                            self.getFilename() + ".idx"),
+                           (compressed, filename)]:
+            if sys.platform == 'win32':
+                # windows cannot rename a file on top of an existing one, so
+                # fall back to delete-first. There are ways this can fail and
+                # lose the builder's history, so we avoid using it in the
+                # general (non-windows) case
+                if os.path.exists(dst):
+                    os.unlink(dst)
+            os.rename(src, dst)
         _tryremove(self.getFilename(), 1, 5)
     def _cleanupFailedCompress(self, failure, compressed):
         log.msg("failed to compress %s" % self.getFilename())
-        if os.path.exists(compressed):
-            _tryremove(compressed, 1, 5)
+        for fn in (compressed, self.getFilename() + ".idx.tmp"):
+            if os.path.exists(fn):
+                _tryremove(fn, 1, 5)
         failure.trap() # reraise the failure
 
     # persistence stuff
@@ -565,6 +711,8 @@ class LogFile:
             del d['finished']
         if d.has_key('openfile'):
             del d['openfile']
+        if d.has_key('openindex'):
+            del d['openindex']
         return d
 
     def __setstate__(self, d):
@@ -581,6 +729,7 @@ class LogFile:
         self.filename = logfilename
         if not os.path.exists(self.getFilename()):
             self.openfile = open(self.getFilename(), "w")
+            self.openindex = logindex.IndexWriter(self.getFilename() + ".idx")
             self.finished = False
             for channel,text in self.entries:
                 self.addEntry(channel, text)
@@ -1065,6 +1214,9 @@ class BuildStepStatus(styles.Versioned):
         # point the logs to this object
         for loog in self.logs:
             loog.step = self
+        self.watchers = []
+        self.updates = {}
+        self.finishedWatchers = []
 
     def upgradeToVersion1(self):
         if not hasattr(self, "urls"):
@@ -1117,7 +1269,6 @@ class BuildStatus(styles.Versioned):
     watchers = []
     updates = {}
     finishedWatchers = []
-    testResults = {}
 
     def __init__(self, parent, number):
         """
@@ -1137,6 +1288,15 @@ class BuildStatus(styles.Versioned):
     def __repr__(self):
         return "<%s #%s>" % (self.__class__.__name__, self.number)
 
+    def __getattr__(self, name):
+        # the steps and test results of a build loaded from a build file are
+        # only read from it when they are first used
+        sections = self.__dict__.get('_sections')
+        if sections and name in sections:
+            buildfile.load_section(self, name)
+            return self.__dict__[name]
+        raise AttributeError(name)
+
     # IBuildStatus
 
     def getBuilder(self):
@@ -1157,7 +1317,7 @@ class BuildStatus(styles.Versioned):
     def getPreviousBuild(self):
         if self.number == 0:
             return None
-        return self.builder.getBuild(self.number-1)
+        return self.builder._getBuild(self.number-1, walkingBack=True)
 
     def getSourceStamp(self, absolute=False):
         if not absolute or not self.properties.has_key('got_revision'):
@@ -1396,6 +1556,9 @@ class BuildStatus(styles.Versioned):
 
         starting_filename = "%d-log-%s-%s" % (self.number, stepname, logname)
         starting_filename = re.sub(r'[^\w\.\-]', '_', starting_filename)
+        if self.builder.buildStorageLayout == "sharded":
+            starting_filename = os.path.join(layout.shard_name(self.number),
+                                             starting_filename)
         # now make it unique
         unique_counter = 0
         filename = starting_filename
@@ -1408,6 +1571,9 @@ class BuildStatus(styles.Versioned):
         return filename
 
     def __getstate__(self):
+        # read anything not yet loaded from our build file
+        for name in self.__dict__.get('_sections', {}).keys():
+            getattr(self, name)
         d = styles.Versioned.__getstate__(self)
         # for now, a serialized Build is always "finished". We will never
         # save unfinished builds.
@@ -1417,12 +1583,15 @@ class BuildStatus(styles.Versioned):
             # was interrupted. The builder will have a 'shutdown' event, but
             # someone looking at just this build will be confused as to why
             # the last log is truncated.
-        for k in 'builder', 'watchers', 'updates', 'finishedWatchers':
+        for k in 'builder', 'watchers', 'updates', 'finishedWatchers', \
+                '_sections':
             if k in d: del d[k]
         return d
 
     def __setstate__(self, d):
         styles.Versioned.__setstate__(self, d)
+        # builds pickled before test results were recorded have none
+        self.__dict__.setdefault('testResults', {})
         # self.builder must be filled in by our parent when loading
         for step in self.steps:
             step.build = self
@@ -1474,13 +1643,32 @@ class BuildStatus(styles.Versioned):
             s.checkLogfiles()
 
     def saveYourself(self):
-        filename = os.path.join(self.builder.basedir, "%d" % self.number)
-        if os.path.isdir(filename):
+        basedir = self.builder.basedir
+        flat = os.path.join(basedir, "%d" % self.number)
+        if os.path.isdir(flat):
             # leftover from 0.5.0, which stored builds in directories
-            shutil.rmtree(filename, ignore_errors=True)
+            shutil.rmtree(flat, ignore_errors=True)
+        names = layout.build_filenames(self.number,
+                                       self.builder.buildStorageLayout)
+        filename, other = [os.path.join(basedir, fn) for fn in names]
         tmpfilename = filename + ".tmp"
         try:
-            dump(self, open(tmpfilename, "wb"), -1)
+            dirname = os.path.dirname(filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            data = None
+            if self.builder.buildFileFormat == "json":
+                try:
+                    data = buildfile.encode_build(self)
+                except buildfile.UnsupportedBuild, e:
+                    log.msg("saving build %s-#%d as a pickle: %s"
+                            % (self.builder.name, self.number, e))
+            f = open(tmpfilename, "wb")
+            if data is None:
+                dump(self, f, -1)
+            else:
+                f.write(data)
+            f.close()
             if sys.platform == 'win32':
                 # windows cannot rename a file on top of an existing one, so
                 # fall back to delete-first. There are ways this can fail and
@@ -1489,6 +1677,9 @@ class BuildStatus(styles.Versioned):
                 if os.path.exists(filename):
                     os.unlink(filename)
             os.rename(tmpfilename, filename)
+            # saved before the builder changed layouts
+            if os.path.exists(other):
+                os.unlink(other)
         except:
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
@@ -1522,6 +1713,112 @@ class BuildStatus(styles.Versioned):
             result['current_step'] = None
         return result
 
+    def getSummary(self):
+        """Return a dictionary of what history displays need to know about
+        this (finished) build, for the build_summaries table."""
+        source = self.getSourceStamp()
+        got_revision = None
+        if self.properties.has_key('got_revision'):
+            got_revision = str(self.properties['got_revision'])
+        changeids = [c.number for c in source.changes]
+        if None in changeids:
+            changeids = None
+        return {
+            'start_time': self.started,
+            'finish_time': self.finished,
+            'results': self.results,
+            'branch': source.branch,
+            'revision': source.revision,
+            'got_revision': got_revision,
+            'has_patch': source.patch is not None,
+            'changeids': changeids,
+            'slavename': self.slavename,
+            'text': self.getText(),
+            }
+
+class BuildSummary:
+    """I stand in for a finished BuildStatus in history displays, answering
+    the common questions (times, results, text, source stamp) from a row of
+    the build_summaries table. Anything else loads the full BuildStatus
+    pickle, which I then delegate to."""
+    implements(interfaces.IBuildStatus)
+
+    def __init__(self, builder, number, summary):
+        self.builder = builder
+        self.number = number
+        self.summary = summary
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def loadBuild(self):
+        """Return the full BuildStatus, or None if it is no longer
+        available."""
+        return self.builder.getBuild(self.number)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        build = self.loadBuild()
+        if build is None:
+            raise AttributeError(name)
+        return getattr(build, name)
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getPreviousBuild(self):
+        if self.number == 0:
+            return None
+        return self.builder._getBuild(self.number-1, walkingBack=True)
+
+    def getBranch(self):
+        return self.summary['branch']
+
+    def _getChanges(self):
+        # returns None if the changes are not known from the summary alone.
+        # They were loaded along with the summary, for its whole batch.
+        return self.summary.get('changes')
+
+    def getChanges(self):
+        changes = self._getChanges()
+        if changes is None:
+            return self.loadBuild().getChanges()
+        return changes
+
+    def getSourceStamp(self, absolute=False):
+        s = self.summary
+        if s['has_patch']:
+            # the patch itself is only in the pickle
+            return self.loadBuild().getSourceStamp(absolute)
+        if absolute and s['got_revision'] is not None:
+            return sourcestamp.SourceStamp(s['branch'], s['got_revision'])
+        ss = sourcestamp.SourceStamp(s['branch'], s['revision'])
+        if s['changeids']:
+            changes = self._getChanges()
+            if changes is None:
+                return self.loadBuild().getSourceStamp(absolute)
+            ss.changes = tuple(changes)
+        return ss
+
+    def getTimes(self):
+        return (self.summary['start_time'], self.summary['finish_time'])
+
+    def isFinished(self):
+        return True
+
+    def getText(self):
+        return self.summary['text']
+
+    def getResults(self):
+        return self.summary['results']
+
+    def getSlavename(self):
+        return self.summary['slavename']
+
 
 
 class BuilderStatus(styles.Versioned):
@@ -1548,14 +1845,37 @@ class BuilderStatus(styles.Versioned):
 
     # these limit the amount of memory we consume, as well as the size of the
     # main Builder pickle. The Build and LogFile pickles on disk must be
-    # handled separately.
-    buildCacheSize = 15
+    # handled separately, and the builds kept in memory are limited by the
+    # master-wide Status.buildCache.
     eventHorizon = 50 # forget events beyond this
+    summaryBatchSize = 50 # build summaries fetched per query
+    summaryWindow = 200 # newest build summaries kept in memory
+    buildPrefetch = 5 # older builds to load when walking back through history
 
     # these limit on-disk storage
     logHorizon = 40 # forget logs in steps in builds beyond this
     buildHorizon = 100 # forget builds beyond this
 
+    # the files of builds (and the logs of builds) numbered below these have
+    # been deleted by prune(). None means that self.buildFiles is not known
+    # to be complete, so the directory must be scanned before pruning.
+    buildsPrunedBelow = None
+    logsPrunedBelow = None
+    # how many of prune()'s batches of files are still waiting to be
+    # deleted. The marks above were advanced when they were queued, so a
+    # builder saved while some were pending scans its directory again when
+    # it is loaded, to find the files that were never deleted.
+    deletionsPending = 0
+    # our nextBuildNumber when we were last saved
+    buildNumberHint = None
+    # maps build number to summary, for the newest summaryWindow builds
+    _recentSummaries = None
+    # how many missing build numbers determineNextBuildNumber probes past:
+    # builds still running when the buildmaster stopped were never saved,
+    # but those that finished after them were
+    maxBuildNumberGap = 100
+    _scanning = False
+
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
@@ -1575,12 +1895,14 @@ class BuilderStatus(styles.Versioned):
         self.pendingBuilds = []
         self.nextBuild = None
         self.watchers = []
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
         self.logCompressionLimit = False # default to no compression for tests
         self.logCompressionMethod = "bz2"
         self.logMaxSize = None # No default limit
         self.logMaxTailSize = None # No tail buffering
+        self.buildFileFormat = "json"
+        self.buildStorageLayout = "flat"
+        # maps the number of each unpruned build to the names of its logfiles
+        self.buildFiles = {}
 
     # persistence
 
@@ -1591,11 +1913,9 @@ class BuilderStatus(styles.Versioned):
         # parent like .basedir and .status
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
-        del d['buildCache']
-        del d['buildCache_LRU']
-        for b in self.currentBuilds:
-            b.saveYourself()
-            # TODO: push a 'hey, build was interrupted' event
+        d.pop('_scanning', None)
+        d.pop('_recentSummaries', None)
+        d['buildNumberHint'] = self.nextBuildNumber
         del d['currentBuilds']
         del d['pendingBuilds']
         del d['currentBigState']
@@ -1608,21 +1928,15 @@ class BuilderStatus(styles.Versioned):
         # when loading, re-initialize the transient stuff. Remember that
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
         self.currentBuilds = []
         self.pendingBuilds = []
         self.watchers = []
         self.slavenames = []
+        # builders saved by older versions do not know their files
+        self.__dict__.setdefault('buildFiles', {})
         # self.basedir must be filled in by our parent
         # self.status must be filled in by our parent
 
-    def reconfigFromBuildmaster(self, buildmaster):
-        # Note that we do not hang onto the buildmaster, since this object
-        # gets pickled and unpickled.
-        if buildmaster.buildCacheSize:
-            self.buildCacheSize = buildmaster.buildCacheSize
-
     def upgradeToVersion1(self):
         if hasattr(self, 'slavename'):
             self.slavenames = [self.slavename]
@@ -1631,24 +1945,45 @@ class BuilderStatus(styles.Versioned):
             del self.nextBuildNumber # determineNextBuildNumber chooses this
 
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
-        what our self.nextBuildNumber should be. Set it one larger than the
-        highest-numbered build we discover. This is called by the top-level
-        Status object shortly after we are created or loaded from disk.
+        """Determine what our self.nextBuildNumber should be: one larger
+        than the highest-numbered build saved in our directory. This is
+        called by the top-level Status object shortly after we are created
+        or loaded from disk.
+
+        If we were loaded from disk, we only look for the builds saved after
+        we were, starting at our old nextBuildNumber, instead of listing the
+        whole directory. Those builds are missing from self.buildFiles, so
+        the next prune() will scan the directory for their logfiles. Up to
+        self.maxBuildNumberGap missing numbers are skipped, so that the
+        builds that were running when the buildmaster stopped do not hide
+        the ones that finished after them.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match("^\d+$", f)]
-        if existing_builds:
-            self.nextBuildNumber = max(existing_builds) + 1
-        else:
-            self.nextBuildNumber = 0
+        if self.deletionsPending:
+            # the buildmaster stopped before they were deleted
+            self.deletionsPending = 0
+            self.buildsPrunedBelow = self.logsPrunedBelow = None
+        if self.buildNumberHint is None:
+            last = layout.find_last_build(self.basedir)
+            if last is not None:
+                self.nextBuildNumber = last + 1
+            else:
+                self.nextBuildNumber = 0
+            self.buildsPrunedBelow = self.logsPrunedBelow = None
+            return
+        number = probe = self.buildNumberHint
+        while probe <= number + self.maxBuildNumberGap:
+            if os.path.exists(self.makeBuildFilename(probe)):
+                number = probe + 1
+            probe += 1
+        if number > self.buildNumberHint:
+            self.buildsPrunedBelow = self.logsPrunedBelow = None
+        self.nextBuildNumber = number
 
     def setLogCompressionLimit(self, lowerLimit):
         self.logCompressionLimit = lowerLimit
 
     def setLogCompressionMethod(self, method):
-        assert method in ("bz2", "gz")
+        assert method in logindex.CODECS
         self.logCompressionMethod = method
 
     def setLogMaxSize(self, upperLimit):
@@ -1657,69 +1992,174 @@ class BuilderStatus(styles.Versioned):
     def setLogMaxTailSize(self, tailSize):
         self.logMaxTailSize = tailSize
 
-    def saveYourself(self):
+    def setBuildFileFormat(self, format):
+        assert format in ("json", "pickle")
+        self.buildFileFormat = format
+
+    def setBuildStorageLayout(self, storageLayout):
+        assert storageLayout in layout.LAYOUTS
+        self.buildStorageLayout = storageLayout
+
+    def saveCurrentBuilds(self):
         for b in self.currentBuilds:
-            if not b.isFinished:
+            if not b.isFinished():
                 # interrupted build, need to save it anyway.
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
-        filename = os.path.join(self.basedir, "builder")
-        tmpfilename = filename + ".tmp"
+                # TODO: push a 'hey, build was interrupted' event
+
+    def saveYourself(self):
+        """Save this builder right away, and any builds it is running as
+        interrupted ones. Use saveSoon() instead unless the buildmaster is
+        about to stop."""
+        self.saveCurrentBuilds()
         try:
-            dump(self, open(tmpfilename, "wb"), -1)
-            if sys.platform == 'win32':
-                # windows cannot rename a file on top of an existing one
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
+            data = dumps(self, -1)
         except:
             log.msg("unable to save builder %s" % self.name)
             log.err()
-        
+            return
+        saver.write_files([(os.path.join(self.basedir, "builder"), data)])
+
+    def saveSoon(self):
+        """Save this builder in a few seconds, in the background, along with
+        any other builder that asks to be saved until then."""
+        self.status.builderSaver.save(self)
+
 
     # build cache management
 
     def makeBuildFilename(self, number):
-        return os.path.join(self.basedir, "%d" % number)
+        return layout.find_build_file(self.basedir, number,
+                                      self.buildStorageLayout)
 
     def touchBuildCache(self, build):
-        self.buildCache[build.number] = build
-        if build in self.buildCache_LRU:
-            self.buildCache_LRU.remove(build)
-        self.buildCache_LRU = self.buildCache_LRU[-(self.buildCacheSize-1):] + [ build ]
+        self.status.buildCache.add(self.name, build)
         return build
 
-    def getBuildByNumber(self, number):
+    def getBuildByNumber(self, number, walkingBack=False):
         # first look in currentBuilds
         for b in self.currentBuilds:
             if b.number == number:
                 return self.touchBuildCache(b)
 
         # then in the buildCache
-        if number in self.buildCache:
-            return self.touchBuildCache(self.buildCache[number])
+        build = self.status.buildCache.get(self.name, number)
+        if build is not None:
+            return build
 
         # then fall back to loading it from disk
+        build = self.touchBuildCache(self._loadBuild(number))
+        # if the caller is walking backwards through history, the next few
+        # builds will be wanted soon: load them once the reactor is free
+        if walkingBack and self.buildPrefetch:
+            eventually(self._prefetchBuilds, number - 1)
+        return build
+
+    def _loadBuild(self, number, prefetch=False):
+        cache = self.status.buildCache
         filename = self.makeBuildFilename(number)
+        start = time.time()
         try:
-            log.msg("Loading builder %s's build %d from on-disk pickle"
-                % (self.name, number))
-            build = load(open(filename, "rb"))
-            styles.doUpgrade()
-            build.builder = self
-            # handle LogFiles from after 0.5.0 and before 0.6.5
-            build.upgradeLogfiles()
-            # check that logfiles exist
-            build.checkLogfiles()
-            return self.touchBuildCache(build)
+            build = buildfile.load_build(filename)
+            if build is None:
+                log.msg("Loading builder %s's build %d from on-disk pickle"
+                    % (self.name, number))
+                build = load(open(filename, "rb"))
+                styles.doUpgrade()
+                build.builder = self
+                # handle LogFiles from after 0.5.0 and before 0.6.5
+                build.upgradeLogfiles()
+                # check that logfiles exist
+                build.checkLogfiles()
+            else:
+                # its logfiles are checked when its steps are loaded
+                build.builder = self
         except IOError:
+            cache.buildLoadFailed()
             raise IndexError("no such build %d" % number)
         except EOFError:
+            cache.buildLoadFailed()
             raise IndexError("corrupted build pickle %d" % number)
+        except ValueError:
+            cache.buildLoadFailed()
+            raise IndexError("corrupted build file %d" % number)
+        cache.buildLoaded(time.time() - start, prefetch)
+        return build
 
-    def prune(self):
-        gc.collect()
+    def _prefetchBuilds(self, number):
+        cache = self.status.buildCache
+        for n in range(number, max(number - self.buildPrefetch, -1), -1):
+            if cache.has(self.name, n):
+                continue
+            try:
+                self.touchBuildCache(self._loadBuild(n, prefetch=True))
+            except IndexError:
+                return
 
+    def _getCachedBuild(self, number):
+        for b in self.currentBuilds:
+            if b.number == number:
+                return b
+        cache = self.status.buildCache
+        if cache.has(self.name, number):
+            return cache.get(self.name, number)
+        return None
+
+    # build summaries
+
+    def _getSummaryIndex(self):
+        # returns (db, master_name), or None if there is no database to keep
+        # build summaries in (as in some tests)
+        status = getattr(self, 'status', None)
+        db = getattr(status, 'db', None)
+        if db is None:
+            return None
+        return (db, status.botmaster.master_name)
+
+    def _addBuildSummary(self, s):
+        index = self._getSummaryIndex()
+        if index is None:
+            return defer.succeed(None)
+        db, master_name = index
+        summary = s.getSummary()
+        recent = dict(summary)
+        recent['changes'] = None
+        if summary['changeids'] is not None:
+            recent['changes'] = list(s.getSourceStamp().changes)
+        self._rememberSummaries({s.number: recent})
+        return db.add_build_summary(master_name, self.name, s.number,
+                                    summary)
+
+    def _rememberSummaries(self, summaries, replace=True):
+        if self._recentSummaries is None:
+            self._recentSummaries = {}
+        recent = self._recentSummaries
+        for number, summary in summaries.items():
+            if replace or number not in recent:
+                recent[number] = summary
+        oldest = self.nextBuildNumber - self.summaryWindow
+        for number in [n for n in recent if n < oldest]:
+            del recent[number]
+
+    def loadRecentSummaries(self):
+        """Read the summaries of my newest summaryWindow builds into memory,
+        without blocking, so that generateBuilds can produce them without
+        reading the database. Builds that finish later are remembered as
+        they are summarized. Returns a Deferred."""
+        index = self._getSummaryIndex()
+        if index is None or self.nextBuildNumber == 0:
+            return defer.succeed(None)
+        db, master_name = index
+        first = max(0, self.nextBuildNumber - self.summaryWindow)
+        d = db.get_build_summaries_async(master_name, self.name, first,
+                                         self.nextBuildNumber - 1,
+                                         with_changes=True)
+        # those summarized meanwhile are at least as recent
+        d.addCallback(self._rememberSummaries, replace=False)
+        return d
+
+    def prune(self):
         # begin by pruning our own events
         self.events = self.events[-self.eventHorizon:]
 
@@ -1737,36 +2177,113 @@ class BuilderStatus(styles.Versioned):
         if earliest_log < earliest_build:
             earliest_log = earliest_build
 
-        if earliest_build == 0:
+        # never touch a build that is still running
+        for b in self.currentBuilds:
+            earliest_build = min(earliest_build, b.number)
+            earliest_log = min(earliest_log, b.number)
+
+        if earliest_build <= 0:
             return
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
+        index = self._getSummaryIndex()
+        if index:
+            db, master_name = index
+            d = db.delete_build_summaries(master_name, self.name,
+                                          earliest_build)
+            d.addErrback(log.err)
+        if self._recentSummaries:
+            for number in [n for n in self._recentSummaries
+                           if n < earliest_build]:
+                del self._recentSummaries[number]
+
         # if the directory doesn't exist, bail out here
         if not os.path.exists(self.basedir):
             return
 
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
-
-            if num is None: continue
-            if num in self.buildCache: continue
+        if self.buildsPrunedBelow is None:
+            self._scanBuildFiles()
+            return
+        expired_builds = range(self.buildsPrunedBelow, earliest_build)
+        expired_logs = range(max(self.logsPrunedBelow, earliest_build),
+                             earliest_log)
+        for number in expired_builds + expired_logs:
+            if number not in self.buildFiles:
+                # saved while we were not tracking our files
+                self._scanBuildFiles()
+                return
 
-            if (is_logfile and num < earliest_log) or num < earliest_build:
-                pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try: os.unlink(pathname)
-                except OSError: pass
+        cache = self.status.buildCache
+        filenames = []
+        for number in expired_builds:
+            # the build may have been saved in either layout
+            filenames.extend(layout.build_filenames(number, "flat"))
+            filenames.extend(self._pruneLogFiles(number,
+                                                 self.buildFiles.pop(number)))
+            if number % layout.SHARD_SIZE == layout.SHARD_SIZE - 1:
+                # the shard is empty now
+                filenames.append(layout.shard_name(number) + os.sep)
+            cache.remove(self.name, number)
+        for number in expired_logs:
+            filenames.extend(self._pruneLogFiles(number,
+                                                 self.buildFiles[number]))
+            self.buildFiles[number] = []
+            # a cached copy would still refer to the deleted logs
+            cache.remove(self.name, number)
+        self.buildsPrunedBelow = max(self.buildsPrunedBelow, earliest_build)
+        self.logsPrunedBelow = max(self.logsPrunedBelow, earliest_log)
+
+        if filenames:
+            log.msg("pruning builds before %d and logs before %d of "
+                    "builder %s" % (earliest_build, earliest_log, self.name))
+            self.deletionsPending += 1
+            self.status.filePruner.delete(self.basedir, filenames)
+            d = self.status.filePruner.whenIdle()
+            d.addCallback(self._deletionsDone)
+
+    def _deletionsDone(self, ign):
+        self.deletionsPending -= 1
+        if not self.deletionsPending:
+            # so that the next start does not scan our directory for nothing
+            self.saveSoon()
+
+    def _pruneLogFiles(self, number, lognames):
+        filenames = []
+        for logname in lognames:
+            filenames.extend(pruner.log_files(logname))
+            if os.path.dirname(logname) == "":
+                # it may have been moved into its shard since
+                filenames.extend(pruner.log_files(
+                    os.path.join(layout.shard_name(number), logname)))
+        return filenames
+
+    def _scanBuildFiles(self):
+        # list our directory in a thread to find the logfiles of the builds
+        # that are missing from self.buildFiles, then prune again
+        if self._scanning:
+            return
+        self._scanning = True
+        d = threads.deferToThread(pruner.scan_builds, self.basedir)
+        def scanned(builds):
+            self._scanning = False
+            lowest = self.nextBuildNumber
+            if builds:
+                lowest = min(builds.keys())
+            buildFiles = {}
+            for number in range(lowest, self.nextBuildNumber):
+                # the logs we know of, and any left behind by deletions
+                # that never happened
+                logs = set(self.buildFiles.get(number, ()))
+                logs.update(builds.get(number, ()))
+                buildFiles[number] = sorted(logs)
+            self.buildFiles = buildFiles
+            self.buildsPrunedBelow = self.logsPrunedBelow = lowest
+            self.prune()
+        def failed(f):
+            self._scanning = False
+            log.msg("unable to scan the directory of builder %s" % self.name)
+            log.err(f)
+        d.addCallbacks(scanned, failed)
+        return d
 
     # IBuilderStatus methods
     def getName(self):
@@ -1785,22 +2302,30 @@ class BuilderStatus(styles.Versioned):
         return self.currentBuilds
 
     def getLastFinishedBuild(self):
-        b = self.getBuild(-1)
-        if not (b and b.isFinished()):
-            b = self.getBuild(-2)
-        return b
+        # a BuildSummary, unless the build is already in memory
+        builds = list(self.generateBuilds(max_search=2))
+        if builds and builds[0] and builds[0].isFinished():
+            return builds[0]
+        if len(builds) > 1:
+            return builds[1]
+        return None
 
     def getCategory(self):
         return self.category
 
     def getBuild(self, number):
+        return self._getBuild(number)
+
+    def _getBuild(self, number, walkingBack=False):
+        # walkingBack is for callers stepping back through history one build
+        # at a time, whose next few builds are worth loading ahead
         if number < 0:
             number = self.nextBuildNumber + number
         if number < 0 or number >= self.nextBuildNumber:
             return None
 
         try:
-            return self.getBuildByNumber(number)
+            return self.getBuildByNumber(number, walkingBack)
         except IndexError:
             return None
 
@@ -1810,18 +2335,61 @@ class BuilderStatus(styles.Versioned):
         except IndexError:
             return None
 
+    def generateBuilds(self, max_search=None):
+        """Yield my builds, most recent first, or None for any that are no
+        longer available. Finished builds which are not already in memory
+        are produced as BuildSummary instances, so that walking through
+        history does not load every build pickle.
+
+        The summaries of the newest summaryWindow builds are kept in memory
+        (see loadRecentSummaries). Older ones are read from the database in
+        batches of summaryBatchSize, which blocks the reactor for one
+        bounded query per batch walked; callers limit this with
+        max_search."""
+        index = self._getSummaryIndex()
+        if self._recentSummaries is None:
+            self._recentSummaries = {}
+        recent = self._recentSummaries
+        summaries = {}
+        batch_start = None
+        for Nb in itertools.count(1):
+            if Nb > self.nextBuildNumber:
+                return
+            if max_search is not None and Nb > max_search:
+                return
+            number = self.nextBuildNumber - Nb
+            build = self._getCachedBuild(number)
+            if build is None and number in recent:
+                build = BuildSummary(self, number, recent[number])
+            elif build is None and index is not None:
+                if batch_start is None or number < batch_start:
+                    db, master_name = index
+                    batch_start = max(0, number - self.summaryBatchSize + 1)
+                    # one transaction for the whole batch, including the
+                    # changes of its builds
+                    summaries = db.get_build_summaries(master_name, self.name,
+                                                       batch_start, number,
+                                                       with_changes=True)
+                    self._rememberSummaries(summaries, replace=False)
+                if number in summaries:
+                    build = BuildSummary(self, number, summaries[number])
+            if build is None:
+                # running, or finished before summaries were kept
+                build = self._getBuild(number, walkingBack=True)
+            yield build
+
+    def _getBuildBranch(self, build):
+        if isinstance(build, BuildSummary):
+            return build.getBranch()
+        return build.getSourceStamp().branch
+
     def generateFinishedBuilds(self, branches=[],
                                num_builds=None,
                                max_buildnum=None,
                                finished_before=None,
                                max_search=200):
         got = 0
-        for Nb in itertools.count(1):
-            if Nb > self.nextBuildNumber:
-                break
-            if Nb > max_search:
-                break
-            build = self.getBuild(-Nb)
+        for build in self.generateBuilds(max_search):
             if build is None:
                 continue
             if max_buildnum is not None:
@@ -1834,7 +2402,7 @@ class BuilderStatus(styles.Versioned):
                 if end >= finished_before:
                     continue
             if branches:
-                if build.getSourceStamp().branch not in branches:
+                if self._getBuildBranch(build) not in branches:
                     continue
             got += 1
             yield build
@@ -1858,8 +2426,8 @@ class BuilderStatus(styles.Versioned):
 
         eventIndex = -1
         e = self.getEvent(eventIndex)
-        for Nb in range(1, self.nextBuildNumber+1):
-            b = self.getBuild(-Nb)
+        builds = self.generateBuilds()
+        for (Nb, b) in itertools.izip(itertools.count(1), builds):
             if not b:
                 # HACK: If this is the first build we are looking at, it is
                 # possible it's in progress but locked before it has written a
@@ -1869,12 +2437,17 @@ class BuilderStatus(styles.Versioned):
                 break
             if b.getTimes()[0] < minTime:
                 break
-            if branches and not b.getSourceStamp().branch in branches:
+            if branches and not self._getBuildBranch(b) in branches:
                 continue
             if categories and not b.getBuilder().getCategory() in categories:
                 continue
             if committers and not [True for c in b.getChanges() if c.who in committers]:
                 continue
+            if isinstance(b, BuildSummary):
+                # the steps are only in the pickle
+                b = b.loadBuild()
+                if not b:
+                    break
             steps = b.getSteps()
             for Ns in range(1, len(steps)+1):
                 if steps[-Ns].started:
@@ -2001,6 +2574,16 @@ class BuilderStatus(styles.Versioned):
         assert s in self.currentBuilds
         s.saveYourself()
         self.currentBuilds.remove(s)
+        if self.buildHorizon:
+            # remember its logfiles, for prune()
+            self.buildFiles[s.number] = [l.filename
+                                         for step in s.getSteps()
+                                         for l in step.getLogs()
+                                         if l.filename]
+        # remember its number and files, should we be restarted
+        self.saveSoon()
+        d = defer.maybeDeferred(self._addBuildSummary, s)
+        d.addErrback(log.err)
 
         name = self.getName()
         results = s.getResults()
@@ -2107,7 +2690,8 @@ class BuilderStatus(styles.Versioned):
         # Collect build numbers.
         # Important: Only grab the *cached* builds numbers to reduce I/O.
         current_builds = [b.getNumber() for b in self.currentBuilds]
-        cached_builds = list(set(self.buildCache.keys() + current_builds))
+        cached_builds = list(set(self.status.buildCache.getNumbers(self.name)
+                                 + current_builds))
         cached_builds.sort()
         result['cached_builds'] = cached_builds
         result['current_builds'] = current_builds
@@ -2227,9 +2811,15 @@ class Status:
         # compress logs bigger than 4k, a good default on linux
         self.logCompressionLimit = 4*1024
         self.logCompressionMethod = "bz2"
+        self.logCompressor = logcompressor.LogCompressor()
+        self.buildCache = buildcache.BuildCache()
+        self.filePruner = pruner.FilePruner()
+        self.builderSaver = saver.BuilderSaver()
         # No default limit to the log size
         self.logMaxSize = None
         self.logMaxTailSize = None
+        self.buildFileFormat = "json"
+        self.buildStorageLayout = "flat"
 
         self._buildreq_observers = collections.KeyedSets()
         self._buildset_success_waiters = collections.KeyedSets()
@@ -2312,9 +2902,25 @@ class Status:
     def getChange(self, number):
         return self.botmaster.parent.change_svc.getChangeNumberedNow(number)
 
+    def getChangeAsync(self, number):
+        """Like getChange, but returns a Deferred that fires with the Change
+        (or None) instead of blocking on the database."""
+        return self.botmaster.parent.change_svc.getChangeByNumber(number)
+
     def getSchedulers(self):
         return self.botmaster.parent.allSchedulers()
 
+    def getSchedulerStats(self):
+        """Return how the Schedulers have been running: see
+        L{buildbot.util.loop.LoopBase.getStats}, plus the 'classifier'
+        counters of the SchedulerManager."""
+        sm = getattr(self.botmaster.parent, 'scheduler_manager', None)
+        if sm is None:
+            return {}
+        stats = sm.getStats()
+        stats['classifier'] = sm.classifier_stats.copy()
+        return stats
+
     def getBuilderNames(self, categories=None):
         if categories == None:
             return self.botmaster.builderNames[:] # don't let them break it
@@ -2343,6 +2949,14 @@ class Status:
         return [BuildSetStatus(bsid, self, self.db)
                 for bsid in self.db.get_active_buildset_ids()]
 
+    def getBuildSetsAsync(self):
+        """Like getBuildSets, but returns a Deferred that fires with the
+        list of BuildSetStatus objects."""
+        d = self.db.get_active_buildset_ids_async()
+        d.addCallback(lambda bsids: [BuildSetStatus(bsid, self, self.db)
+                                     for bsid in bsids])
+        return d
+
     def generateFinishedBuilds(self, builders=[], branches=[],
                                num_builds=None, finished_before=None,
                                max_search=200):
@@ -2355,53 +2969,34 @@ class Status:
                          for bn in self.getBuilderNames()
                          if want_builder(bn)]
 
-        # 'sources' is a list of generators, one for each Builder we're
-        # using. When the generator is exhausted, it is replaced in this list
-        # with None.
-        sources = []
+        # the next build from each Builder's generator, in a heap ordered
+        # latest-finished first. The generators produce BuildSummary
+        # instances, so only the builds that are used get loaded.
+        heap = []
+        seqnum = itertools.count()
+        def push(g):
+            try:
+                build = g.next()
+            except StopIteration:
+                return
+            heapq.heappush(heap, (-build.getTimes()[1], seqnum.next(),
+                                  build, g))
+
         for bn in builder_names:
             b = self.getBuilder(bn)
-            g = b.generateFinishedBuilds(branches,
-                                         finished_before=finished_before,
-                                         max_search=max_search)
-            sources.append(g)
-
-        # next_build the next build from each source
-        next_build = [None] * len(sources)
-
-        def refill():
-            for i,g in enumerate(sources):
-                if next_build[i]:
-                    # already filled
-                    continue
-                if not g:
-                    # already exhausted
-                    continue
-                try:
-                    next_build[i] = g.next()
-                except StopIteration:
-                    next_build[i] = None
-                    sources[i] = None
+            push(b.generateFinishedBuilds(branches,
+                                          finished_before=finished_before,
+                                          max_search=max_search))
 
         got = 0
-        while True:
-            refill()
-            # find the latest build among all the candidates
-            candidates = [(i, b, b.getTimes()[1])
-                          for i,b in enumerate(next_build)
-                          if b is not None]
-            candidates.sort(lambda x,y: cmp(x[2], y[2]))
-            if not candidates:
-                return
-
-            # and remove it from the list
-            i, build, finshed_time = candidates[-1]
-            next_build[i] = None
+        while heap:
+            finished, i, build, g = heapq.heappop(heap)
             got += 1
             yield build
             if num_builds is not None:
                 if got >= num_builds:
                     return
+            push(g)
 
     def subscribe(self, target):
         self.watchers.append(target)
@@ -2448,12 +3043,16 @@ class Status:
         if not os.path.isdir(builder_status.basedir):
             os.makedirs(builder_status.basedir)
         builder_status.determineNextBuildNumber()
+        d = builder_status.loadRecentSummaries()
+        d.addErrback(log.err)
 
         builder_status.setBigState("offline")
         builder_status.setLogCompressionLimit(self.logCompressionLimit)
         builder_status.setLogCompressionMethod(self.logCompressionMethod)
         builder_status.setLogMaxSize(self.logMaxSize)
         builder_status.setLogMaxTailSize(self.logMaxTailSize)
+        builder_status.setBuildFileFormat(self.buildFileFormat)
+        builder_status.setBuildStorageLayout(self.buildStorageLayout)
 
         for t in self.watchers:
             self.announceNewBuilder(t, name, builder_status)
@@ -2539,7 +3138,12 @@ class Status:
         if (bsid not in self._buildset_success_waiters
             and bsid not in self._buildset_finished_waiters):
             return
-        successful,finished = self.db.examine_buildset(bsid)
+        d = self.db.examine_buildset_async(bsid)
+        d.addCallback(self._db_buildset_examined, bsid)
+        d.addErrback(log.err)
+
+    def _db_buildset_examined(self, res, bsid):
+        successful,finished = res
         bss = BuildSetStatus(bsid, self, self.db)
         if successful is not None:
             for d in self._buildset_success_waiters.pop(bsid):
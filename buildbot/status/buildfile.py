@@ -0,0 +1,283 @@
+# -*- test-case-name: buildbot.test.unit.test_status_buildfile -*-
+
+"""Build status files in a versioned JSON format.
+
+A build file starts with a header line: a JSON object with the format
+version, the attributes of the BuildStatus itself, and the position of each
+of the sections that follow. Each section ('steps' and 'testResults') is a
+JSON document of its own, which is only read and decoded when the build's
+steps or test results are first used, so that a status display which only
+needs a build's times, results and source stamp does not pay for the rest.
+
+Builds that cannot be stored this way (because they have attributes or
+property values that this module does not know how to encode) are pickled,
+as are all builds written by older versions of buildbot. L{load_build}
+tells the two apart by their first byte.
+"""
+
+import os, types
+
+try:
+    import simplejson
+    json = simplejson # this hushes pyflakes
+except ImportError:
+    import json
+
+from twisted.python import log
+
+from buildbot.changes.changes import Change
+from buildbot.process.properties import Properties
+from buildbot.sourcestamp import SourceStamp
+
+FORMAT = "buildbot-build"
+VERSION = 1
+
+SECTIONS = ("steps", "testResults")
+
+class UnsupportedBuild(Exception):
+    """The build has something that can only be pickled."""
+
+# the instance attributes that are saved, or (for transient ones) knowingly
+# left out. Anything else makes the build an UnsupportedBuild.
+BUILD_ATTRS = ("number", "source", "changes", "reason", "blamelist",
+               "started", "finished", "text", "results", "slavename",
+               "properties", "steps", "testResults")
+BUILD_TRANSIENT = ("builder", "watchers", "updates", "finishedWatchers",
+                   "progress", "currentStep", "_sections")
+STEP_ATTRS = ("name", "started", "finished", "text", "results", "text2",
+              "urls", "statistics", "logs")
+STEP_TRANSIENT = ("build", "progress", "watchers", "updates",
+                  "finishedWatchers")
+CHANGE_ATTRS = ("number", "who", "files", "comments", "isdir", "links",
+                "revision", "when", "branch", "category", "revlink")
+
+def _check_attrs(obj, attrs, transient):
+    unknown = [k for k in obj.__dict__
+               if k not in attrs and k not in transient]
+    if unknown:
+        raise UnsupportedBuild("%s has attributes %s"
+                               % (obj.__class__.__name__, ", ".join(unknown)))
+
+def _str(obj):
+    # JSON gives us unicode strings. The plain ASCII ones (names, keys, and
+    # most values) become the strs that buildbot mostly uses; the others
+    # stay unicode. A build may hold both kinds (changes loaded from the
+    # database have unicode authors and comments), and unicode is what the
+    # web templates can render: a non-ASCII str makes them raise
+    # UnicodeDecodeError.
+    if isinstance(obj, unicode):
+        try:
+            return obj.encode("ascii")
+        except UnicodeEncodeError:
+            return obj
+    if isinstance(obj, list):
+        return [_str(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict([(_str(k), _str(v)) for (k, v) in obj.items()])
+    return obj
+
+def _instance(klass, state):
+    # like unpickling: make an instance without calling its __init__
+    return types.InstanceType(klass, state)
+
+# encoding
+
+def _encode_properties(properties):
+    return [list(p) for p in properties.asList()]
+
+def _encode_change(change):
+    _check_attrs(change, CHANGE_ATTRS, ("properties",))
+    d = dict([(k, getattr(change, k, None)) for k in CHANGE_ATTRS])
+    d['properties'] = _encode_properties(change.properties)
+    return d
+
+def _encode_source(source):
+    if source is None:
+        return None
+    _check_attrs(source, ("branch", "revision", "patch", "changes", "ssid"),
+                 ())
+    return {'branch': source.branch,
+            'revision': source.revision,
+            'patch': source.patch,
+            'changes': [_encode_change(c) for c in source.changes],
+            'ssid': source.ssid,
+            }
+
+def _encode_log(loog):
+    from buildbot.status.builder import LogFile, HTMLLogFile
+    if loog.__class__ not in (LogFile, HTMLLogFile):
+        raise UnsupportedBuild("cannot save a %s" % loog.__class__.__name__)
+    state = loog.__getstate__()
+    state.pop('entries', None)
+    return {'class': loog.__class__.__name__, 'state': state}
+
+def _encode_step(step):
+    _check_attrs(step, STEP_ATTRS, STEP_TRANSIENT)
+    d = dict([(k, getattr(step, k)) for k in STEP_ATTRS if k != "logs"])
+    d['logs'] = [_encode_log(l) for l in step.logs]
+    return d
+
+def _encode_test_result(tr):
+    return {'name': tr.name, 'results': tr.results, 'text': tr.text,
+            'logs': tr.logs}
+
+def encode_build(build):
+    """Return the contents of a build file for BUILD, a finished
+    BuildStatus. Raises UnsupportedBuild if it can only be pickled."""
+    _check_attrs(build, BUILD_ATTRS, BUILD_TRANSIENT)
+    attrs = {
+        'number': build.number,
+        'source': _encode_source(build.source),
+        'reason': build.reason,
+        'blamelist': build.blamelist,
+        'started': build.started,
+        'finished': build.finished or True, # like BuildStatus.__getstate__
+        'text': build.text,
+        'results': build.results,
+        'slavename': build.slavename,
+        'properties': _encode_properties(build.properties),
+        }
+    steps = [_encode_step(s) for s in build.steps]
+    test_results = [_encode_test_result(tr)
+                    for tr in build.testResults.values()]
+    try:
+        sections = [json.dumps(steps) + "\n", json.dumps(test_results) + "\n"]
+        # sections are located relative to the end of the header line
+        positions = {}
+        offset = 0
+        for (name, data) in zip(SECTIONS, sections):
+            positions[name] = (offset, len(data))
+            offset += len(data)
+        header = json.dumps({'format': FORMAT, 'version': VERSION,
+                             'build': attrs, 'sections': positions})
+    except (TypeError, ValueError), e:
+        # a property or statistic that JSON cannot represent
+        raise UnsupportedBuild(str(e))
+    return header + "\n" + "".join(sections)
+
+# decoding
+
+def _decode_properties(props):
+    properties = Properties()
+    for (name, value, source) in props:
+        properties.setProperty(name, value, source)
+    return properties
+
+def _decode_change(d):
+    properties = _decode_properties(d.pop('properties'))
+    change = _instance(Change, d)
+    change.properties = properties
+    return change
+
+def _decode_source(d):
+    if d is None:
+        return None
+    ss = SourceStamp(d['branch'], d['revision'])
+    if d['patch'] is not None:
+        ss.patch = tuple(d['patch'])
+    ss.changes = tuple([_decode_change(c) for c in d['changes']])
+    ss.ssid = d['ssid']
+    return ss
+
+def _decode_log(d, step):
+    from buildbot.status.builder import LogFile, HTMLLogFile
+    state = d['state']
+    if d['class'] == "LogFile":
+        for k in ('runEntries', 'tailBuffer'):
+            if k in state:
+                state[k] = [tuple(e) for e in state[k]]
+        loog = _instance(LogFile, {})
+        loog.__setstate__(state)
+    else:
+        loog = _instance(HTMLLogFile, state)
+    loog.step = step
+    return loog
+
+def _decode_step(d, build):
+    from buildbot.status.builder import BuildStepStatus
+    logs = d.pop('logs')
+    if isinstance(d['results'], list):
+        # the (None, []) of a step that never finished
+        d['results'] = tuple(d['results'])
+    step = _instance(BuildStepStatus, d)
+    step.build = build
+    step.watchers = []
+    step.updates = {}
+    step.finishedWatchers = []
+    step.logs = [_decode_log(l, step) for l in logs]
+    return step
+
+def _decode_test_result(d):
+    from buildbot.status.builder import TestResult
+    name = tuple(d['name'])
+    return name, TestResult(name, d['results'], d['text'], d['logs'])
+
+def load_build(filename):
+    """Read the build file FILENAME, and return a BuildStatus whose steps
+    and test results will be read when first used. Return None if the file
+    is not a build file (presumably it is a pickle)."""
+    from buildbot.status.builder import BuildStatus
+    f = open(filename, "rb")
+    try:
+        if f.read(1) != "{":
+            return None
+        f.seek(0)
+        header = json.loads(f.readline())
+        start = f.tell()
+    finally:
+        f.close()
+    if header.get('format') != FORMAT or header.get('version') != VERSION:
+        raise ValueError("%s is not a version %d build file"
+                         % (filename, VERSION))
+    attrs = _str(header['build'])
+    attrs['source'] = _decode_source(attrs['source'])
+    attrs['changes'] = []
+    if attrs['source']:
+        attrs['changes'] = attrs['source'].changes
+    attrs['properties'] = _decode_properties(attrs['properties'])
+    attrs['_sections'] = dict([(name, (filename, start + offset, length))
+                               for (name, (offset, length))
+                               in header['sections'].items()])
+    build = _instance(BuildStatus, attrs)
+    build.watchers = []
+    build.updates = {}
+    build.finishedWatchers = []
+    return build
+
+def load_section(build, name):
+    """Read section NAME of the build file that BUILD came from, and set the
+    corresponding attribute of BUILD."""
+    filename, offset, length = build._sections.pop(str(name))
+    builder = getattr(build, 'builder', None)
+    if not os.path.exists(filename) and builder is not None:
+        # the file was moved to another layout (see layout.migrate_builder)
+        # and rewritten there, since the build was loaded
+        moved = builder.makeBuildFilename(build.number)
+        if moved != filename and os.path.exists(moved):
+            try:
+                other = load_build(moved)
+            except ValueError:
+                other = None
+            if other is not None:
+                for k in build._sections:
+                    build._sections[k] = other._sections[k]
+                filename, offset, length = other._sections[str(name)]
+    try:
+        f = open(filename, "rb")
+        try:
+            f.seek(offset)
+            data = _str(json.loads(f.read(length)))
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        log.msg("unable to read the %s of build %s from %s"
+                % (name, build.number, filename))
+        log.err()
+        data = []
+    if name == "steps":
+        build.steps = [_decode_step(d, build) for d in data]
+        # remove references to logs that have been deleted, as is done
+        # when a pickled build is loaded
+        build.checkLogfiles()
+    elif name == "testResults":
+        build.testResults = dict([_decode_test_result(d) for d in data])
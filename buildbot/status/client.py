@@ -413,7 +413,10 @@ class StatusClientPerspective(base.StatusReceiverPerspective):
     def perspective_getBuildSets(self):
         """This returns tuples of (buildset, bsid), because that is much more
         convenient for tryclient."""
-        return [(IRemote(s), s.getID()) for s in self.status.getBuildSets()]
+        d = self.status.getBuildSetsAsync()
+        d.addCallback(lambda buildsets: [(IRemote(s), s.getID())
+                                         for s in buildsets])
+        return d
 
     def perspective_getBuilderNames(self):
         return self.status.getBuilderNames()
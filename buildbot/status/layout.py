@@ -0,0 +1,154 @@
+# -*- test-case-name: buildbot.test.unit.test_status_layout -*-
+
+"""Where a builder's builds and logs are kept on disk.
+
+In the 'flat' layout, build N is saved in the builder's directory as N, and
+its logs as N-log-STEP-LOG (plus their index and compressed versions). In
+the 'sharded' layout, every SHARD_SIZE builds get a subdirectory of their
+own instead: build 12345 is saved as 12xxx/12345, and its logs in 12xxx/ as
+well, so that no directory grows without bound.
+
+Builds are looked up in both layouts, preferred one first, so a builder can
+switch layouts at any time. L{migrate_builder} moves the builds that were
+saved in the flat layout into their shards, one build at a time.
+"""
+
+import os, re, time
+
+from buildbot.status import logindex
+
+LAYOUTS = ("flat", "sharded")
+SHARD_SIZE = 1000
+
+shard_re = re.compile(r"^(\d+)xxx$")
+build_re = re.compile(r"^\d+$")
+build_file_re = re.compile(r"^([0-9]+)(-.*)?$")
+
+def shard_name(number):
+    """Return the name of the subdirectory for build NUMBER in the sharded
+    layout."""
+    return "%dxxx" % (number // SHARD_SIZE)
+
+def build_filenames(number, layout):
+    """Return the two names (relative to the builder's directory) that build
+    NUMBER may be saved under, the one LAYOUT uses first."""
+    flat = "%d" % number
+    sharded = os.path.join(shard_name(number), flat)
+    if layout == "sharded":
+        return [sharded, flat]
+    return [flat, sharded]
+
+def find_build_file(builderdir, number, layout):
+    """Return the filename of build NUMBER, in whichever layout it was saved
+    in, or where LAYOUT would save it if it does not exist."""
+    names = build_filenames(number, layout)
+    for name in names:
+        filename = os.path.join(builderdir, name)
+        if os.path.exists(filename):
+            return filename
+    return os.path.join(builderdir, names[0])
+
+def list_build_dirs(builderdir):
+    """Return the names (relative to BUILDERDIR) of the directories that
+    hold builds: '' for BUILDERDIR itself, then its shards, oldest first."""
+    shards = [(int(mo.group(1)), name)
+              for (mo, name) in [(shard_re.match(name), name)
+                                 for name in os.listdir(builderdir)]
+              if mo]
+    shards.sort()
+    return [""] + [name for (n, name) in shards]
+
+def find_last_build(builderdir):
+    """Return the number of the last build saved in BUILDERDIR, in either
+    layout, or None. Only the newest non-empty shard is listed."""
+    dirs = list_build_dirs(builderdir)
+    numbers = [int(fn) for fn in os.listdir(builderdir) if build_re.match(fn)]
+    for name in reversed(dirs[1:]):
+        found = [int(fn) for fn in os.listdir(os.path.join(builderdir, name))
+                 if build_re.match(fn)]
+        if found:
+            numbers.extend(found)
+            break
+    if not numbers:
+        return None
+    return max(numbers)
+
+def migrate_builder(builderdir, delay=0, silent=False):
+    """Move every build saved in BUILDERDIR in the flat layout, and its logs,
+    into its shard. Logs are indexed first (see
+    L{logindex.index_log}) if they were not already.
+
+    This is safe to run while the buildmaster is running, if it is using
+    the sharded layout: the build file is rewritten in its shard only after
+    its logs were moved, and the buildmaster finds logs that were moved from
+    under a build it had already loaded. It is also safe to interrupt and
+    run again. DELAY seconds are spent sleeping after each build, to leave
+    some disk bandwidth for everybody else. Each build is saved again in the
+    format it was found in, JSON or pickle. Return the number of builds
+    moved."""
+    from buildbot.status.builder import BuilderStatus
+    from buildbot.status import buildfile
+    from cPickle import load
+    from twisted.persisted import styles
+
+    builder = BuilderStatus(os.path.basename(builderdir))
+    builder.basedir = builderdir
+    builder.buildStorageLayout = "sharded"
+
+    builds = []
+    logs = {}
+    for filename in os.listdir(builderdir):
+        mo = build_file_re.match(filename)
+        if not mo:
+            continue
+        number = int(mo.group(1))
+        if mo.group(2):
+            logs.setdefault(number, []).append(filename)
+        else:
+            builds.append(number)
+
+    count = 0
+    for number in sorted(builds):
+        filename = os.path.join(builderdir, "%d" % number)
+        # load all of it now, while its logs are where it expects them
+        try:
+            build = buildfile.load_build(filename)
+            if build is None:
+                build = load(open(filename, "rb"))
+                styles.doUpgrade()
+                builder.buildFileFormat = "pickle"
+            else:
+                builder.buildFileFormat = "json"
+            build.builder = builder
+            build.getSteps()
+            build.getTestResults()
+        except:
+            if not silent: print " unable to load build %d, skipping" % number
+            continue
+
+        shard = shard_name(number)
+        sharddir = os.path.join(builderdir, shard)
+        if not os.path.isdir(sharddir):
+            os.makedirs(sharddir)
+        flat_logs = [l for step in build.getSteps() for l in step.getLogs()
+                     if l.filename and os.path.dirname(l.filename) == ""]
+        moving = set(logs.get(number, []))
+        for l in flat_logs:
+            # the buildmaster recognizes moved logs by their index
+            if logindex.index_log(os.path.join(builderdir, l.filename)):
+                moving.add(l.filename + ".idx")
+        for logfile in sorted(moving):
+            os.rename(os.path.join(builderdir, logfile),
+                      os.path.join(sharddir, logfile))
+        for l in flat_logs:
+            l.filename = os.path.join(shard, l.filename)
+
+        # this saves it in its shard, then removes the flat copy
+        build.saveYourself()
+        if os.path.exists(filename):
+            if not silent: print " unable to move build %d" % number
+            continue
+        count += 1
+        if delay:
+            time.sleep(delay)
+    return count
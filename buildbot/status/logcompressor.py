@@ -0,0 +1,114 @@
+# -*- test-case-name: buildbot.test.unit.test_status_logcompressor -*-
+
+import heapq, itertools, time
+
+from twisted.python import failure, threadpool
+from twisted.internet import reactor, defer
+
+class LogCompressor:
+    """I compress finished logfiles in the background, using a small pool
+    of threads of my own, so that compression does not compete with the
+    database (which uses the reactor's thread pool) and so that a few huge
+    logs cannot hold up everything else.
+
+    Jobs wait in a queue until one of my WORKERS threads is free, smallest
+    log first. At most MAX_QUEUED jobs can be waiting: anything submitted
+    beyond that is refused, and that log is simply left uncompressed."""
+
+    def __init__(self, workers=2, max_queued=1000):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.pool = None
+        self.queue = [] # heap of (size, seqnum, func, args, deferred)
+        self.seqnum = itertools.count()
+        self.running = 0
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'refused': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'compress_time': 0.0,
+            'max_queued': 0,
+            }
+
+    def setWorkers(self, workers):
+        self.workers = workers
+        if self.pool:
+            self.pool.adjustPoolsize(0, workers)
+        self._startJobs()
+
+    def submit(self, size, func, *args):
+        """Run FUNC(*ARGS) in one of my threads, to compress a log of SIZE
+        bytes. FUNC should return the size of the compressed file. Return a
+        Deferred that fires with that when the job is done, or None if the
+        queue is full and the job was refused."""
+        if len(self.queue) >= self.max_queued:
+            self.stats['refused'] += 1
+            return None
+        self.stats['submitted'] += 1
+        d = defer.Deferred()
+        heapq.heappush(self.queue, (size, self.seqnum.next(), func, args, d))
+        self.stats['max_queued'] = max(self.stats['max_queued'],
+                                       len(self.queue))
+        self._startJobs()
+        return d
+
+    def _startPool(self):
+        self.pool = threadpool.ThreadPool(0, self.workers)
+        self.pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self._stopPool)
+
+    def _stopPool(self):
+        if self.pool:
+            self.pool.stop()
+            self.pool = None
+
+    def _startJobs(self):
+        while self.queue and self.running < self.workers:
+            if not self.pool:
+                self._startPool()
+            size, seqnum, func, args, d = heapq.heappop(self.queue)
+            self.running += 1
+            self.pool.callInThread(self._runJob, size, func, args, d)
+
+    def _runJob(self, size, func, args, d):
+        # this runs in a worker thread
+        start = time.time()
+        try:
+            result = func(*args)
+        except:
+            result = failure.Failure()
+        elapsed = time.time() - start
+        reactor.callFromThread(self._jobDone, size, elapsed, result, d)
+
+    def _jobDone(self, size, elapsed, result, d):
+        self.running -= 1
+        if isinstance(result, failure.Failure):
+            self.stats['failed'] += 1
+        else:
+            self.stats['completed'] += 1
+            self.stats['compress_time'] += elapsed
+            self.stats['bytes_in'] += size
+            self.stats['bytes_out'] += result or 0
+        self._startJobs()
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def getStats(self):
+        """Return a dictionary describing the queue and the work done so
+        far."""
+        stats = self.stats.copy()
+        stats['workers'] = self.workers
+        stats['queued'] = len(self.queue)
+        stats['queued_bytes'] = sum([job[0] for job in self.queue])
+        stats['running'] = self.running
+        if stats['bytes_out']:
+            stats['ratio'] = float(stats['bytes_in']) / stats['bytes_out']
+        if stats['compress_time']:
+            stats['bytes_per_second'] = (stats['bytes_in']
+                                         / stats['compress_time'])
+        return stats
@@ -0,0 +1,405 @@
+# -*- test-case-name: buildbot.test.unit.test_status_logindex -*-
+
+"""
+Random access to the contents of LogFiles.
+
+A LogFile's entries are stored as a stream of netstrings, each holding one
+chunk ('<length>:<channel><text>,'), which can only be parsed from the
+beginning. Next to that stream, an index file (named like the logfile plus
+'.idx') holds one fixed-size record per chunk:
+
+ - the offset of the chunk's netstring in the (uncompressed) stream
+ - the number of bytes of text before the chunk
+ - the number of newlines in the text before the chunk
+ - the offset of the compressed block holding the chunk, and the offset in
+   the stream at which that block starts
+ - the chunk's channel
+
+'Text' means stdout and stderr: header chunks are not counted, so text
+offsets and line numbers match what the web status shows as the plain-text
+version of the log. Finding the chunk that holds a given byte or line is a
+binary search through the index, which never has to be read into memory.
+
+When a log is compressed, the stream is cut into blocks of about BLOCKSIZE
+bytes (on chunk boundaries) which are compressed independently and
+concatenated, so that any part of the log can be read by decompressing a
+single block. The result is still an ordinary multi-member (or
+multi-frame) file that zcat, bzcat, zstdcat or lz4cat can read. zstd and
+lz4 are only available if the 'zstandard' or 'lz4' module is installed.
+"""
+
+import os, struct, zlib, bz2
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from buildbot import interfaces
+
+HEADER = interfaces.LOG_CHANNEL_HEADER
+
+MAGIC = "BBLOGIDX"
+VERSION = 1
+# magic, version, compression method ('' if the log is not compressed)
+_header = struct.Struct("!8sI8s")
+_record = struct.Struct("!QQQQQB")
+OFFSET, TEXTPOS, LINENO, BLOCK, BLOCKSTART, CHANNEL = range(6)
+
+# uncompressed bytes in each compressed block
+BLOCKSIZE = 256*1024
+
+def _gz_compress(data):
+    c = zlib.compressobj(9, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+def _gz_decompress(data):
+    return zlib.decompress(data, 16+zlib.MAX_WBITS)
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+# every compression method, and the suffix of the files it writes
+METHODS = {
+    'bz2': '.bz2',
+    'gz': '.gz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+    }
+
+# maps each compression method that is available to (filename suffix,
+# compress, decompress)
+CODECS = {
+    'bz2': ('.bz2', bz2.compress, bz2.decompress),
+    'gz': ('.gz', _gz_compress, _gz_decompress),
+    }
+if zstandard:
+    CODECS['zstd'] = ('.zst', _zstd_compress, _zstd_decompress)
+if lz4:
+    CODECS['lz4'] = ('.lz4', lz4.frame.compress, lz4.frame.decompress)
+
+def choose_method(method):
+    """Return METHOD if it is available, or 'gz' if the module it needs is
+    not installed."""
+    if method in CODECS:
+        return method
+    return 'gz'
+
+def iter_netstrings(f, bufsize=64*1024):
+    """Parse the netstring stream in file F, yielding (offset, channel,
+    text, raw) for each chunk, where 'raw' is the whole netstring. A
+    truncated chunk at the end of the stream is ignored."""
+    buf = ""
+    pos = 0 # of the next netstring in buf
+    offset = 0 # of buf[pos] in the stream
+    eof = False
+    while True:
+        colon = buf.find(":", pos)
+        if colon != -1:
+            end = colon + 1 + int(buf[pos:colon]) + 1
+            if end <= len(buf):
+                raw = buf[pos:end]
+                yield (offset, int(buf[colon+1]), buf[colon+2:end-1], raw)
+                offset += end - pos
+                pos = end
+                continue
+        if eof:
+            return
+        data = f.read(bufsize)
+        if not data:
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+class IndexWriter:
+    """I write an index file, one record per chunk."""
+
+    def __init__(self, filename, method=""):
+        self.f = open(filename, "wb")
+        self.f.write(_header.pack(MAGIC, VERSION, method))
+        self.textpos = 0
+        self.lineno = 0
+
+    def add(self, offset, channel, text, block=0, blockstart=0):
+        self.f.write(_record.pack(offset, self.textpos, self.lineno,
+                                  block, blockstart, channel))
+        if channel != HEADER:
+            self.textpos += len(text)
+            self.lineno += text.count("\n")
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class LogIndex:
+    """I give read access to an index file. Records are tuples, indexed by
+    OFFSET, TEXTPOS, LINENO, BLOCK, BLOCKSTART and CHANNEL. Records that
+    are appended after I was opened are not seen."""
+
+    def __init__(self, filename):
+        self.f = open(filename, "rb")
+        magic, version, method = _header.unpack(self.f.read(_header.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a logfile index" % filename)
+        self.method = method.rstrip("\0")
+        size = os.fstat(self.f.fileno()).st_size
+        # a partly-written record at the end is ignored
+        self.count = (size - _header.size) // _record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        self.f.seek(_header.size + i * _record.size)
+        return _record.unpack(self.f.read(_record.size))
+
+    def close(self):
+        self.f.close()
+
+    def _bisect(self, field, value):
+        # return the number of records whose FIELD is less than VALUE; every
+        # field is non-decreasing from one record to the next
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid][field] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def findTextOffset(self, pos):
+        """Return the number of the last record whose chunk starts at or
+        before text offset POS, or None if there is none."""
+        i = self._bisect(TEXTPOS, pos + 1) - 1
+        if i < 0:
+            return None
+        return i
+
+    def findLine(self, line):
+        """Return the number of the record whose chunk holds the newline
+        that ends line LINE-1 (so that line LINE starts after it), or None
+        if LINE is 0 or the index is empty."""
+        i = self._bisect(LINENO, line) - 1
+        if i < 0:
+            return None
+        return i
+
+    def findStreamOffset(self, offset):
+        """Return the number of the last record whose chunk starts at or
+        before OFFSET in the stream, or None."""
+        i = self._bisect(OFFSET, offset + 1) - 1
+        if i < 0:
+            return None
+        return i
+
+    def blockEnd(self, block):
+        """Return the offset of the compressed block that follows the one at
+        BLOCK, or None if it is the last one."""
+        i = self._bisect(BLOCK, block + 1)
+        if i < self.count:
+            return self[i][BLOCK]
+        return None
+
+class BlockWriter:
+    """I write a netstring stream to OUTFILE as a series of independently
+    compressed blocks, and its index (with the positions of those blocks)
+    to INDEXFILENAME."""
+
+    def __init__(self, outfile, indexfilename, method, blocksize=BLOCKSIZE):
+        self.outfile = outfile
+        self.index = IndexWriter(indexfilename, method)
+        self.compress = CODECS[method][1]
+        self.blocksize = blocksize
+        self.buffer = []
+        self.buffered = 0
+        self.block = self.blockstart = None
+
+    def add(self, offset, channel, text, raw):
+        if self.buffered >= self.blocksize:
+            self._flush()
+        if self.blockstart is None:
+            self.block = self.outfile.tell()
+            self.blockstart = offset
+        self.index.add(offset, channel, text, self.block, self.blockstart)
+        self.buffer.append(raw)
+        self.buffered += len(raw)
+
+    def _flush(self):
+        self.outfile.write(self.compress("".join(self.buffer)))
+        self.buffer = []
+        self.buffered = 0
+        self.block = self.blockstart = None
+
+    def close(self):
+        if self.buffer:
+            self._flush()
+        self.index.close()
+
+def compress_log(infile, outfile, indexfilename, method,
+                 blocksize=BLOCKSIZE):
+    """Write the netstring stream in INFILE to OUTFILE in compressed blocks,
+    and its new index to INDEXFILENAME."""
+    w = BlockWriter(outfile, indexfilename, method, blocksize)
+    for (offset, channel, text, raw) in iter_netstrings(infile):
+        w.add(offset, channel, text, raw)
+    w.close()
+
+class BlockFile:
+    """I am a read-only file object for a log that was written by a
+    BlockWriter. Reading from any position only decompresses the blocks
+    that hold the data."""
+
+    def __init__(self, filename, index):
+        self.f = open(filename, "rb")
+        self.index = index
+        self.decompress = CODECS[index.method][2]
+        self.pos = 0
+        self._block = None # (stream offset, data) of the last block read
+
+    def _load(self, pos):
+        # return the (stream offset, data) of the block holding POS
+        if self._block:
+            start, data = self._block
+            if start <= pos < start + len(data):
+                return self._block
+        i = self.index.findStreamOffset(pos)
+        if i is None:
+            return (pos, "")
+        rec = self.index[i]
+        block = rec[BLOCK]
+        self.f.seek(block)
+        end = self.index.blockEnd(block)
+        if end is None:
+            compressed = self.f.read()
+        else:
+            compressed = self.f.read(end - block)
+        self._block = (rec[BLOCKSTART], self.decompress(compressed))
+        return self._block
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            start, data = self._load(self.pos)
+            piece = data[self.pos - start:]
+            if size > 0:
+                piece = piece[:size]
+                size -= len(piece)
+            if not piece:
+                break
+            pieces.append(piece)
+            self.pos += len(piece)
+        return "".join(pieces)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            if len(self.index):
+                start, data = self._load(self.index[-1][OFFSET])
+                offset += start + len(data)
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+
+def index_log(filename, blocksize=BLOCKSIZE):
+    """Create the index of the finished logfile FILENAME (the name of the
+    uncompressed file), which was written before logs were indexed. A log
+    which has already been compressed is compressed again, in blocks.
+    Return True if an index was created."""
+    indexfilename = filename + ".idx"
+    if os.path.exists(indexfilename):
+        return False
+    tmp = indexfilename + ".tmp"
+    if os.path.exists(filename):
+        w = IndexWriter(tmp)
+        f = open(filename, "rb")
+        for (offset, channel, text, raw) in iter_netstrings(f):
+            w.add(offset, channel, text)
+        f.close()
+        w.close()
+        os.rename(tmp, indexfilename)
+        return True
+    # older buildbots only compressed logs with bzip2 or gzip
+    for method in ('bz2', 'gz'):
+        compressed = filename + METHODS[method]
+        if not os.path.exists(compressed):
+            continue
+        if method == "bz2":
+            infile = bz2.BZ2File(compressed, "r")
+        else:
+            import gzip
+            infile = gzip.GzipFile(compressed, "r")
+        outfile = open(compressed + ".tmp", "wb")
+        compress_log(infile, outfile, tmp, method, blocksize)
+        infile.close()
+        outfile.close()
+        # the index goes first: with the old compressed file, it would be
+        # ignored
+        os.rename(tmp, indexfilename)
+        if os.path.exists(compressed):
+            os.unlink(compressed)
+        os.rename(compressed + ".tmp", compressed)
+        return True
+    return False
+
+class TextWindow:
+    """I select part of the text of a log from its chunks, as they go past:
+    everything after the first SKIP_BYTES bytes or SKIP_LINES lines of text,
+    up to LIMIT bytes of text (if given). Header chunks are dropped while
+    skipping, and kept (without counting them) after that."""
+
+    def __init__(self, skip_bytes=0, skip_lines=0, limit=None):
+        self.skip_bytes = skip_bytes
+        self.skip_lines = skip_lines
+        self.limit = limit
+        self.done = (limit == 0)
+
+    def filter(self, channel, text):
+        """Return the part of TEXT that is inside the window, which may be
+        empty."""
+        if self.done:
+            return ""
+        if self.skip_bytes or self.skip_lines:
+            if channel == HEADER:
+                return ""
+            if self.skip_bytes:
+                if len(text) <= self.skip_bytes:
+                    self.skip_bytes -= len(text)
+                    return ""
+                text = text[self.skip_bytes:]
+                self.skip_bytes = 0
+            else:
+                newlines = text.count("\n")
+                if newlines < self.skip_lines:
+                    self.skip_lines -= newlines
+                    return ""
+                pos = -1
+                for i in range(self.skip_lines):
+                    pos = text.index("\n", pos + 1)
+                text = text[pos+1:]
+                self.skip_lines = 0
+        if self.limit is not None and channel != HEADER:
+            text = text[:self.limit]
+            self.limit -= len(text)
+            if not self.limit:
+                self.done = True
+        return text
@@ -0,0 +1,123 @@
+# -*- test-case-name: buildbot.test.unit.test_status_pruner -*-
+
+import os
+
+from twisted.python import log
+from twisted.internet import reactor, defer, threads
+
+from buildbot.status import logindex, layout
+
+# the files a logfile named FILENAME may have left behind: itself, its index,
+# and its compressed versions, any of them possibly half-written
+LOG_SUFFIXES = [".idx"] + logindex.METHODS.values()
+LOG_SUFFIXES = [s + t for s in LOG_SUFFIXES for t in (".tmp", "")] + [".tmp"]
+
+def log_files(filename):
+    """Return the names of all the files that logfile FILENAME may use."""
+    return [filename] + [filename + suffix for suffix in LOG_SUFFIXES]
+
+def scan_builds(basedir):
+    """List BASEDIR, a builder's directory, and its shards, and return a
+    dict mapping the number of each build found there to the set of its
+    logfile names (as given to L{log_files}). This is slow for big
+    directories, so it runs in a thread, and only when the builder has no
+    better record of its files."""
+    builds = {}
+    for dirname in layout.list_build_dirs(basedir):
+        for filename in os.listdir(os.path.join(basedir, dirname)):
+            mo = layout.build_file_re.match(filename)
+            if not mo:
+                continue
+            logs = builds.setdefault(int(mo.group(1)), set())
+            if mo.group(2):
+                for suffix in LOG_SUFFIXES:
+                    if filename.endswith(suffix):
+                        filename = filename[:-len(suffix)]
+                        break
+                logs.add(os.path.join(dirname, filename))
+    return builds
+
+def delete_files(paths):
+    # this runs in a thread. Paths that end in a separator are directories,
+    # which are only removed if they are empty.
+    deleted = 0
+    for path in paths:
+        try:
+            if path.endswith(os.sep):
+                os.rmdir(path)
+            else:
+                os.unlink(path)
+            deleted += 1
+        except OSError:
+            pass # never written, already gone, or not empty
+    return deleted
+
+class FilePruner:
+    """I delete the files of expired builds and logs in a thread, at most
+    BATCH_SIZE of them at a time, and wait INTERVAL seconds between batches
+    so that expiring a large backlog does not monopolize the disk."""
+
+    def __init__(self, batch_size=200, interval=1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = []
+        self.running = False
+        self.timer = None
+        self.idle_waiters = []
+        self.stats = {
+            'queued': 0,
+            'deleted': 0,
+            'batches': 0,
+            }
+
+    def delete(self, basedir, filenames):
+        """Delete each of FILENAMES (relative to BASEDIR), soon. Files that
+        do not exist are ignored."""
+        self.queue.extend([os.path.join(basedir, fn) for fn in filenames])
+        self.stats['queued'] += len(filenames)
+        if not self.timer:
+            self._startBatch()
+
+    def _startBatch(self):
+        self.timer = None
+        if self.running:
+            return
+        if not self.queue:
+            waiters, self.idle_waiters = self.idle_waiters, []
+            for d in waiters:
+                d.callback(None)
+            return
+        batch = self.queue[:self.batch_size]
+        del self.queue[:self.batch_size]
+        self.running = True
+        d = threads.deferToThread(delete_files, batch)
+        d.addCallback(self._batchDeleted)
+        d.addErrback(log.err, "unable to delete files")
+        # whatever happened, the next batch must be able to start, or
+        # nothing would be deleted again and whenIdle() would never fire
+        d.addBoth(self._batchDone)
+
+    def _batchDeleted(self, deleted):
+        self.stats['batches'] += 1
+        self.stats['deleted'] += deleted
+
+    def _batchDone(self, ign):
+        self.running = False
+        if self.queue:
+            self.timer = reactor.callLater(self.interval, self._startBatch)
+        else:
+            self._startBatch()
+
+    def whenIdle(self):
+        """Return a Deferred that fires when everything queued so far has
+        been deleted."""
+        if not (self.queue or self.running):
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.idle_waiters.append(d)
+        return d
+
+    def getStats(self):
+        stats = self.stats.copy()
+        stats['pending'] = len(self.queue)
+        return stats
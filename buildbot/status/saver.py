@@ -0,0 +1,145 @@
+# -*- test-case-name: buildbot.test.unit.test_status_saver -*-
+
+import os, sys, time
+from cPickle import dumps
+
+from twisted.python import log
+from twisted.internet import reactor, defer, threads
+
+def write_files(files):
+    # this runs in a thread. Each file is written to a temporary file first,
+    # then renamed over the old one, so a crash leaves either the old or
+    # the new version in place. Returns the names of the files written.
+    written = []
+    for (filename, data) in files:
+        tmpfilename = filename + ".tmp"
+        try:
+            f = open(tmpfilename, "wb")
+            f.write(data)
+            f.close()
+            if sys.platform == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(filename):
+                    os.unlink(filename)
+            os.rename(tmpfilename, filename)
+            written.append(filename)
+        except (IOError, OSError):
+            log.msg("unable to write %s" % filename)
+            log.err()
+    return written
+
+class BuilderSaver:
+    """I save BuilderStatus pickles in the background. A builder that asks
+    to be saved is only marked dirty; DELAY seconds after the first one was,
+    every dirty builder is pickled (on the reactor thread, so that the
+    pickle is consistent) and the pickles are written in a thread. A builder
+    that asks again before that is saved only once."""
+
+    def __init__(self, delay=5.0):
+        self.delay = delay
+        self.dirty = {} # maps builder name to (builder, time marked dirty)
+        self.timer = None
+        self.running = False
+        self.idle_waiters = []
+        self.stats = {
+            'requested': 0,
+            'saved': 0,
+            'failed': 0,
+            'batches': 0,
+            'bytes': 0,
+            'pickle_time': 0.0,
+            'total_latency': 0.0,
+            'max_latency': 0.0,
+            }
+
+    def save(self, builder):
+        """Save BUILDER (a BuilderStatus) soon."""
+        self.stats['requested'] += 1
+        if builder.name not in self.dirty:
+            self.dirty[builder.name] = (builder, time.time())
+        if not (self.timer or self.running):
+            self.timer = reactor.callLater(self.delay, self._startBatch)
+
+    def _startBatch(self):
+        self.timer = None
+        if self.running:
+            return
+        if not self.dirty:
+            waiters, self.idle_waiters = self.idle_waiters, []
+            for d in waiters:
+                d.callback(None)
+            return
+        batch, self.dirty = self.dirty, {}
+        files = []
+        marked = {}
+        start = time.time()
+        for (builder, since) in batch.values():
+            filename = os.path.join(builder.basedir, "builder")
+            try:
+                data = dumps(builder, -1)
+            except:
+                log.msg("unable to save builder %s" % builder.name)
+                log.err()
+                self.stats['failed'] += 1
+                continue
+            files.append((filename, data))
+            marked[filename] = (since, len(data))
+        self.stats['pickle_time'] += time.time() - start
+        self.running = True
+        d = threads.deferToThread(write_files, files)
+        d.addCallback(self._batchWritten, marked)
+        d.addErrback(self._batchFailed, marked)
+        # whatever happened, the next batch must be able to start, or
+        # nothing would be saved again and flush() would never fire
+        d.addBoth(self._batchDone)
+
+    def _batchWritten(self, written, marked):
+        self.stats['batches'] += 1
+        now = time.time()
+        for filename in written:
+            since, size = marked[filename]
+            self.stats['saved'] += 1
+            self.stats['bytes'] += size
+            self.stats['total_latency'] += now - since
+            self.stats['max_latency'] = max(self.stats['max_latency'],
+                                            now - since)
+        self.stats['failed'] += len(marked) - len(written)
+
+    def _batchFailed(self, why, marked):
+        log.err(why, "unable to save builders")
+        self.stats['failed'] += len(marked)
+
+    def _batchDone(self, ign):
+        self.running = False
+        if self.dirty and not self.idle_waiters:
+            self.timer = reactor.callLater(self.delay, self._startBatch)
+        else:
+            # done, or somebody is waiting for a flush
+            self._startBatch()
+
+    def flush(self):
+        """Save every dirty builder now. Return a Deferred that fires when
+        they are all written."""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        d = self.whenIdle()
+        if not self.running:
+            self._startBatch()
+        return d
+
+    def whenIdle(self):
+        """Return a Deferred that fires when every builder that asked to be
+        saved so far has been written."""
+        if not (self.dirty or self.running):
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.idle_waiters.append(d)
+        return d
+
+    def getStats(self):
+        stats = self.stats.copy()
+        stats['dirty'] = len(self.dirty)
+        if stats['saved']:
+            stats['average_latency'] = stats['total_latency'] / stats['saved']
+        return stats
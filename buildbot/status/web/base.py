@@ -3,7 +3,7 @@ import urlparse, urllib, time, re
 import os, cgi, sys
 import jinja2
 from zope.interface import Interface
-from twisted.web import resource, static
+from twisted.web import resource, static, http
 from twisted.python import log
 from buildbot.status import builder
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, EXCEPTION, RETRY
@@ -70,7 +70,7 @@ def build_get_class(b):
     # FIXME: this getResults duplicity might need to be fixed
     result = b.getResults()
     #print "THOMAS: result for b %r: %r" % (b, result)
-    if isinstance(b, builder.BuildStatus):
+    if isinstance(b, (builder.BuildStatus, builder.BuildSummary)):
         result = b.getResults()
     elif isinstance(b, builder.BuildStepStatus):
         result = b.getResults()[0]
@@ -218,6 +218,11 @@ class HtmlResource(resource.Resource, ContextMixin):
             request.redirect(new_url)
             return ''
 
+        etag = self.getETag(request)
+        if etag and request.setETag(etag) == http.CACHED:
+            # the client already has this version of the page
+            return ''
+
         ctx = self.getContext(request)
 
         data = self.content(request, ctx)
@@ -229,6 +234,12 @@ class HtmlResource(resource.Resource, ContextMixin):
             return ''
         return data
 
+    def getETag(self, request):
+        """Return an entity tag that changes whenever the page does, or None
+        if the page cannot tell. Requests that carry the current tag in
+        If-None-Match are answered with a 304, without rendering."""
+        return None
+
     def getAuthz(self, request):
         return request.site.buildbot_service.authz
 
@@ -14,6 +14,9 @@ from buildbot.status.web.base import StaticFile, createJinjaEnv
 from buildbot.status.web.feeds import Rss20StatusResource, \
      Atom10StatusResource
 from buildbot.status.web.waterfall import WaterfallStatusResource
+from buildbot.status.web.eventgrid import EventGrid
+from buildbot.status.web.consolemodel import ConsoleModel
+from buildbot.status.web.stampindex import StampIndex
 from buildbot.status.web.console import ConsoleStatusResource
 from buildbot.status.web.olpb import OneLinePerBuild
 from buildbot.status.web.grid import GridStatusResource, TransposedGridStatusResource
@@ -283,6 +286,11 @@ class WebStatus(service.MultiService):
         # down. See ticket #102 for more details.
         self.channels = weakref.WeakKeyDictionary()
 
+        # the waterfall's events, kept up to date once it has been shown
+        self.eventGrid = None
+        self.consoleModel = None
+        self.stampIndex = None
+
         if self.http_port is not None:
             s = strports.service(self.http_port, self.site)
             s.setServiceParent(self)
@@ -374,6 +382,16 @@ class WebStatus(service.MultiService):
                 log.msg("WebStatus.stopService: error while disconnecting"
                         " leftover clients")
                 log.err()
+        if self.eventGrid:
+            self.eventGrid.stop()
+            self.eventGrid = None
+        if self.consoleModel:
+            self.consoleModel.save()
+            self.consoleModel.stop()
+            self.consoleModel = None
+        if self.stampIndex:
+            self.stampIndex.stop()
+            self.stampIndex = None
         return service.MultiService.stopService(self)
 
     def getStatus(self):
@@ -382,6 +400,24 @@ class WebStatus(service.MultiService):
     def getChangeSvc(self):
         return self.master.change_svc
 
+    def getEventGrid(self):
+        if self.eventGrid is None:
+            self.eventGrid = EventGrid(self.getStatus(), self.getChangeSvc())
+        return self.eventGrid
+
+    def getConsoleModel(self):
+        if self.consoleModel is None:
+            self.consoleModel = ConsoleModel(self.getStatus(),
+                                             self.getChangeSvc(),
+                                             os.path.join(self.master.basedir,
+                                                          "console.pck"))
+        return self.consoleModel
+
+    def getStampIndex(self):
+        if self.stampIndex is None:
+            self.stampIndex = StampIndex(self.getStatus())
+        return self.stampIndex
+
     def getPortnum(self):
         # this is for the benefit of unit tests
         s = list(self)[0]
@@ -2,6 +2,7 @@
 from zope.interface import implements
 from twisted.python import components
 from twisted.web.error import NoResource
+from twisted.web.util import DeferredResource
 
 from buildbot.changes.changes import Change
 from buildbot.status.web.base import HtmlResource, IBox, Box
@@ -29,13 +30,18 @@ class ChangesResource(HtmlResource):
     def getChild(self, path, req):
         try:
             num = int(path)
-            c = self.getStatus(req).getChange(num)
         except ValueError:
-            c = None
-            num = path
-        if not c:
-            return NoResource("No change number '%s'" % path)    
-        return ChangeResource(c, num)
+            num = -1
+        if num < 0:
+            return NoResource("No change number '%s'" % path)
+        # look the change up without blocking the reactor
+        d = self.getStatus(req).getChangeAsync(num)
+        def _got_change(c):
+            if not c:
+                return NoResource("No change number '%s'" % path)
+            return ChangeResource(c, num)
+        d.addCallback(_got_change)
+        return DeferredResource(d)
     
 class ChangeBox(components.Adapter):
     implements(IBox)
@@ -98,63 +98,19 @@ class ConsoleStatusResource(HtmlResource):
     ## Data gathering functions
     ##
 
-    def getHeadBuild(self, builder):
-        """Get the most recent build for the given builder.
-        """
-        build = builder.getBuild(-1)
+    def getConsoleModel(self, request):
+        return request.site.buildbot_service.getConsoleModel()
 
-        # HACK: Work around #601, the head build may be None if it is
-        # locked.
-        if build is None:
-            build = builder.getBuild(-2)
+    def getETag(self, request):
+        # the page only changes when the ConsoleModel does
+        model = self.getConsoleModel(request)
+        return '"console-%s-%d"' % (model.generation, model.version)
 
-        return build
+    def getAllChanges(self, model, status, debugInfo):
+        """Return the latest changes (the last 25) known to |model|, sorted
+        and without duplicate revisions."""
 
-    def fetchChangesFromHistory(self, status, max_depth, max_builds, debugInfo):
-        """Look at the history of the builders and try to fetch as many changes
-        as possible. We need this when the main source does not contain enough
-        sourcestamps. 
-
-        max_depth defines how many builds we will parse for a given builder.
-        max_builds defines how many builds total we want to parse. This is to
-            limit the amount of time we spend in this function.
-        
-        This function is sub-optimal, but the information returned by this
-        function is cached, so this function won't be called more than once.
-        """
-        
-        allChanges = list()
-        build_count = 0
-        for builderName in status.getBuilderNames()[:]:
-            if build_count > max_builds:
-                break
-            
-            builder = status.getBuilder(builderName)
-            build = self.getHeadBuild(builder)
-            depth = 0
-            while build and depth < max_depth and build_count < max_builds:
-                depth += 1
-                build_count += 1
-                sourcestamp = build.getSourceStamp()
-                allChanges.extend(sourcestamp.changes[:])
-                build = build.getPreviousBuild()
-
-        debugInfo["source_fetch_len"] = len(allChanges)
-        return allChanges                
-
-    def getAllChanges(self, source, status, debugInfo):
-        """Return all the changes we can find at this time. If |source| does not
-        not have enough (less than 25), we try to fetch more from the builders
-        history."""
-
-        g = source.eventGenerator()
-        allChanges = []
-        while len(allChanges) < 25:
-            try:
-                c = g.next()
-            except StopIteration:
-                break
-            allChanges.append(c)
+        allChanges = list(model.getChanges())
 
         allChanges.sort(key=self.comparator.getSortingKey())
 
@@ -204,39 +160,34 @@ class ConsoleStatusResource(HtmlResource):
         return revisions
 
     def getBuildDetails(self, request, builderName, build):
-        """Returns an HTML list of failures for a given build."""
+        """Returns an HTML list of failures for a given ConsoleBuild."""
         details = {}
-        if not build.getLogs():
+        if not build.failure:
             return details
-        
-        for step in build.getSteps():
-            (result, reason) = step.getResults()
-            if result == builder.FAILURE:
-                name = step.getName()
-
-                # Remove html tags from the error text.
-                stripHtml = re.compile(r'<.*?>')
-                strippedDetails = stripHtml.sub('', ' '.join(step.getText()))
-                
-                details['buildername'] = builderName
-                details['status'] = strippedDetails
-                details['reason'] = reason
-                logs = details['logs'] = []
-
-                if step.getLogs():
-                    for log in step.getLogs():
-                        logname = log.getName()
-                        logurl = request.childLink(
-                          "../builders/%s/builds/%s/steps/%s/logs/%s" % 
-                            (urllib.quote(builderName),
-                             build.getNumber(),
-                             urllib.quote(name),
-                             urllib.quote(logname)))
-                        logs.append(dict(url=logurl, name=logname))
+
+        (name, text, reason, lognames) = build.failure
+
+        # Remove html tags from the error text.
+        stripHtml = re.compile(r'<.*?>')
+        strippedDetails = stripHtml.sub('', ' '.join(text))
+
+        details['buildername'] = builderName
+        details['status'] = strippedDetails
+        details['reason'] = reason
+        logs = details['logs'] = []
+
+        for logname in lognames:
+            logurl = request.childLink(
+              "../builders/%s/builds/%s/steps/%s/logs/%s" % 
+                (urllib.quote(builderName),
+                 build.number,
+                 urllib.quote(name),
+                 urllib.quote(logname)))
+            logs.append(dict(url=logurl, name=logname))
         return details
 
     def getBuildsForRevision(self, request, builder, builderName, lastRevision,
-                             numBuilds, debugInfo):
+                             numBuilds, model, debugInfo):
         """Return the list of all the builds for a given builder that we will
         need to be able to display the console page. We start by the most recent
         build, and we go down until we find a build that was built prior to the
@@ -245,30 +196,18 @@ class ConsoleStatusResource(HtmlResource):
         revision = lastRevision 
 
         builds = []
-        build = self.getHeadBuild(builder)
-        number = 0
-        while build and number < numBuilds:
+        for build in model.getBuilds(builder)[:numBuilds]:
             debugInfo["builds_scanned"] += 1
-            number += 1
 
             # Get the last revision in this build.
             # We first try "got_revision", but if it does not work, then
             # we try "revision".
-            got_rev = -1
-            try:
-                got_rev = build.getProperty("got_revision")
-                if not self.comparator.isValidRevision(got_rev):
+            got_rev = build.got_revision
+            if got_rev is None or not self.comparator.isValidRevision(got_rev):
+                got_rev = build.revision
+                if got_rev is None or \
+                        not self.comparator.isValidRevision(got_rev):
                     got_rev = -1
-            except KeyError:
-                pass
-
-            try:
-                if got_rev == -1:
-                    got_rev = build.getProperty("revision")
-                if not self.comparator.isValidRevision(got_rev):
-                    got_rev = -1
-            except:
-                pass
 
             # We ignore all builds that don't have last revisions.
             # TODO(nsylvain): If the build is over, maybe it was a problem
@@ -276,13 +215,13 @@ class ConsoleStatusResource(HtmlResource):
             # user that his change might have broken the source update.
             if got_rev and got_rev != -1:
                 details = self.getBuildDetails(request, builderName, build)
-                devBuild = DevBuild(got_rev, build.getResults(),
-                                             build.getNumber(),
-                                             build.isFinished(),
-                                             build.getText(),
-                                             build.getETA(),
+                devBuild = DevBuild(got_rev, build.results,
+                                             build.number,
+                                             build.isFinished,
+                                             build.text,
+                                             build.eta,
                                              details,
-                                             build.getTimes()[0])
+                                             build.when)
 
                 builds.append(devBuild)
 
@@ -293,33 +232,32 @@ class ConsoleStatusResource(HtmlResource):
                     devBuild, current_revision):
                     break
 
-            build = build.getPreviousBuild()
-
         return builds
 
     def getChangeForBuild(self, build, revision):
-        if not build or not build.getChanges(): # Forced build
-            devBuild = DevBuild(revision, build.getResults(),
-                                build.getNumber(),
-                                build.isFinished(),
-                                build.getText(),
-                                build.getETA(),
+        if not build or not build.changes: # Forced build
+            devBuild = DevBuild(revision, build.results,
+                                build.number,
+                                build.isFinished,
+                                build.text,
+                                build.eta,
                                 None,
-                                build.getTimes()[0])
+                                build.when)
 
             return devBuild
-        
-        for change in build.getChanges():
+
+        changes = [DevRevision(rev, None, None, None, None, when)
+                   for (rev, when) in build.changes]
+        for change in changes:
             if change.revision == revision:
                 return change
 
         # No matching change, return the last change in build.
-        changes = list(build.getChanges())
         changes.sort(key=self.comparator.getSortingKey())
         return changes[-1]
     
     def getAllBuildsForRevision(self, status, request, lastRevision, numBuilds,
-                                categories, builders, debugInfo):
+                                categories, builders, model, debugInfo):
         """Returns a dictionnary of builds we need to inspect to be able to
         display the console page. The key is the builder name, and the value is
         an array of build we care about. We also returns a dictionnary of
@@ -368,6 +306,7 @@ class ConsoleStatusResource(HtmlResource):
                                                                builderName,
                                                                lastRevision,
                                                                numBuilds,
+                                                               model,
                                                                debugInfo)
 
         return (builderList, allBuilds)
@@ -405,7 +344,7 @@ class ConsoleStatusResource(HtmlResource):
             
         return cs
 
-    def displaySlaveLine(self, status, builderList, debugInfo):
+    def displaySlaveLine(self, status, builderList, model, debugInfo):
         """Display a line the shows the current status for all the builders we
         care about."""
 
@@ -438,13 +377,11 @@ class ConsoleStatusResource(HtmlResource):
                 else:
                     # If not offline, then display the result of the last
                     # finished build.
-                    build = self.getHeadBuild(status.getBuilder(builder))
-                    while build and not build.isFinished():
-                        build = build.getPreviousBuild()
-
-                    if build:
-                        s["color"] = getResultsClass(build.getResults(), None,
-                                                      False)
+                    for build in model.getBuilds(status.getBuilder(builder)):
+                        if build.isFinished:
+                            s["color"] = getResultsClass(build.results, None,
+                                                         False)
+                            break
 
                 slaves[category].append(s)
 
@@ -535,7 +472,7 @@ class ConsoleStatusResource(HtmlResource):
         return (builds, details)
 
     def displayPage(self, request, status, builderList, allBuilds, revisions,
-                    categories, branch, debugInfo):
+                    categories, branch, model, debugInfo):
         """Display the console page."""
         # Build the main template directory with all the informations we have.
         subs = dict()
@@ -549,7 +486,8 @@ class ConsoleStatusResource(HtmlResource):
 
         if builderList:
             subs["categories"] = self.displayCategories(builderList, debugInfo)
-            subs['slaves'] = self.displaySlaveLine(status, builderList, debugInfo)
+            subs['slaves'] = self.displaySlaveLine(status, builderList, model,
+                                                   debugInfo)
         else:
             subs["categories"] = []
 
@@ -626,8 +564,8 @@ class ConsoleStatusResource(HtmlResource):
         status = self.getStatus(request)
 
         # Get all revisions we can find.
-        source = self.getChangeManager(request)
-        allChanges = self.getAllChanges(source, status, debugInfo)
+        model = self.getConsoleModel(request)
+        allChanges = self.getAllChanges(model, status, debugInfo)
 
         debugInfo["source_all"] = len(allChanges)
 
@@ -658,12 +596,14 @@ class ConsoleStatusResource(HtmlResource):
                                                 numBuilds,
                                                 categories,
                                                 builders,
+                                                model,
                                                 debugInfo)
 
         debugInfo["added_blocks"] = 0
 
         cxt.update(self.displayPage(request, status, builderList, allBuilds,
-                                    revisions, categories, branch, debugInfo))
+                                    revisions, categories, branch, model,
+                                    debugInfo))
 
         template = request.site.buildbot_service.templates.get_template("console.html")
         data = template.render(cxt)
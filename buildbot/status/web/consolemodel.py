@@ -0,0 +1,235 @@
+# -*- test-case-name: buildbot.test.unit.test_status_web_consolemodel -*-
+
+import os, time
+from cPickle import load, dumps
+
+from twisted.python import log
+
+from buildbot.status import builder, saver
+from buildbot.status.base import StatusReceiver
+from buildbot.status.web.eventgrid import subscribeToCurrentBuilds
+
+class ConsoleChange:
+    """What the console shows of a Change."""
+
+    def __init__(self, change):
+        self.number = change.number
+        self.revision = change.revision
+        self.who = change.who
+        self.comments = change.comments
+        self.when = change.when
+        self.branch = change.branch
+        self.revlink = getattr(change, 'revlink', None)
+
+    def getTime(self):
+        if not self.when:
+            return "?"
+        return time.strftime("%a %d %b %Y %H:%M:%S",
+                             time.localtime(self.when))
+
+class ConsoleBuild:
+    """What the console needs to know about a build, so that it does not
+    have to load it."""
+
+    def __init__(self, build):
+        self.number = build.getNumber()
+        self.got_revision = self._getProperty(build, "got_revision")
+        self.revision = self._getProperty(build, "revision")
+        self.results = build.getResults()
+        self.isFinished = build.isFinished()
+        self.text = build.getText()
+        self.eta = build.getETA()
+        self.when = build.getTimes()[0]
+        # (revision, when) of each change, for the revision comparators
+        self.changes = [(c.revision, c.when) for c in build.getChanges()]
+        self.failure = None
+        if build.getLogs():
+            for step in build.getSteps():
+                (result, reason) = step.getResults()
+                if result == builder.FAILURE:
+                    # the last failing step is the one that is shown
+                    self.failure = (step.getName(), step.getText(), reason,
+                                    [l.getName() for l in step.getLogs()])
+
+    def _getProperty(self, build, name):
+        try:
+            return build.getProperty(name)
+        except KeyError:
+            return None
+
+class ConsoleModel(StatusReceiver):
+    """I keep what the console page shows: the latest changes, and for each
+    builder, a summary of its latest builds. I am kept up to date as changes
+    arrive and builds start and finish, so that the console does not load
+    builds to render a page, and I am saved in FILENAME when the WebStatus
+    stops, so that a restarted buildmaster does not load them either.
+
+    Builders I know nothing about (new ones, or all of them the first time)
+    are read from their history when they are first shown, as are the builds
+    they ran since I was saved.
+
+    .version is incremented each time anything shown changes."""
+
+    maxChanges = 25
+    maxBuilds = 80
+    VERSION = 1
+
+    def __init__(self, status, changeSource, filename=None):
+        self.status = status
+        self.changeSource = changeSource
+        self.filename = filename
+        self.changes = None # ConsoleChanges, oldest first, once loaded
+        self.builds = {} # maps builder name to ConsoleBuilds, newest first
+        self.running = {} # maps builder name to its running BuildStatuses
+        self.loaded = set() # builders whose builds are up to date
+        self.builders = {}
+        self.version = 0
+        # tells this process's versions from those of earlier ones
+        self.generation = "%x" % int(time.time() * 1000)
+        self.stats = {
+            'builds_read': 0,
+            }
+        if filename and os.path.exists(filename):
+            self._load()
+        status.subscribe(self)
+
+    def _load(self):
+        try:
+            f = open(self.filename, "rb")
+            try:
+                state = load(f)
+            finally:
+                f.close()
+            if state.get('version') != self.VERSION:
+                return
+            self.changes = state['changes']
+            self.builds = state['builds']
+        except:
+            log.msg("unable to load the console from %s" % self.filename)
+            log.err()
+            self.changes = None
+            self.builds = {}
+
+    def save(self):
+        if not self.filename:
+            return
+        state = {'version': self.VERSION,
+                 'changes': self.changes,
+                 'builds': self.builds}
+        saver.write_files([(self.filename, dumps(state, -1))])
+
+    def stop(self):
+        self.status.unsubscribe(self)
+        for b in self.builders.values():
+            b.unsubscribe(self)
+        self.builders = {}
+
+    def changed(self):
+        self.version += 1
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        self.builders[builderName] = builder
+        self.loaded.discard(builderName)
+        subscribeToCurrentBuilds(builder, self)
+        self.changed()
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builders.pop(builderName, None)
+        self.builds.pop(builderName, None)
+        self.running.pop(builderName, None)
+        self.loaded.discard(builderName)
+        self.changed()
+
+    def builderChangedState(self, builderName, state):
+        self.changed()
+
+    def buildStarted(self, builderName, build):
+        if builderName in self.loaded:
+            self.running.setdefault(builderName, {})[build.getNumber()] = build
+        self.changed()
+        return self # to hear about its steps
+
+    def stepStarted(self, build, step):
+        self.changed()
+
+    def stepFinished(self, build, step, results):
+        self.changed()
+
+    def buildFinished(self, builderName, build, results):
+        running = self.running.get(builderName, {})
+        if running.pop(build.getNumber(), None):
+            self._addBuild(builderName, ConsoleBuild(build))
+        self.changed()
+
+    def changeAdded(self, change):
+        if self.changes is not None:
+            self.changes.append(ConsoleChange(change))
+            del self.changes[:-self.maxChanges]
+        self.changed()
+
+    def _addBuild(self, builderName, cb):
+        builds = self.builds.setdefault(builderName, [])
+        i = 0
+        while i < len(builds) and builds[i].number > cb.number:
+            i += 1
+        builds.insert(i, cb)
+        del builds[self.maxBuilds:]
+
+    # reading
+
+    def getChanges(self):
+        """Return the latest changes, oldest first."""
+        if self.changes is None:
+            changes = []
+            for c in self.changeSource.eventGenerator():
+                changes.append(ConsoleChange(c))
+                if len(changes) >= self.maxChanges:
+                    break
+            changes.reverse()
+            self.changes = changes
+        return self.changes
+
+    def getBuilds(self, builder_status):
+        """Return ConsoleBuilds for the latest builds of BUILDER_STATUS,
+        newest first, running ones included."""
+        name = builder_status.getName()
+        if name not in self.loaded:
+            self._readHistory(name, builder_status)
+        running = self.running.get(name, {})
+        numbers = running.keys()
+        numbers.sort()
+        numbers.reverse()
+        return ([ConsoleBuild(running[n]) for n in numbers]
+                + self.builds.get(name, []))
+
+    def _readHistory(self, name, builder_status):
+        builds = self.builds.get(name, [])
+        last = builder_status.nextBuildNumber - 1
+        if builds and builds[0].number > last:
+            # this is not the history we remember
+            builds = []
+        newest = -1
+        if builds:
+            newest = builds[0].number
+        running = {}
+        for build in builder_status.getCurrentBuilds():
+            running[build.getNumber()] = build
+        new = []
+        number = last
+        while number > newest and len(new) < self.maxBuilds:
+            if number not in running:
+                build = builder_status.getBuild(number)
+                self.stats['builds_read'] += 1
+                if build is None:
+                    if number < last:
+                        # pruned, or never saved: there is nothing older
+                        break
+                else:
+                    new.append(ConsoleBuild(build))
+            number -= 1
+        self.builds[name] = (new + builds)[:self.maxBuilds]
+        self.running[name] = running
+        self.loaded.add(name)
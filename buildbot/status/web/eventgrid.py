@@ -0,0 +1,280 @@
+# -*- test-case-name: buildbot.test.unit.test_status_web_eventgrid -*-
+
+import bisect
+
+from buildbot.status import builder
+from buildbot.status.base import StatusReceiver
+
+class EventColumn:
+    """The events of one source of the waterfall (the changes, or one
+    builder), oldest first, from the most recent one back to as many as
+    were loaded. Unless .complete is True, older events exist that are not
+    here."""
+
+    def __init__(self):
+        self.keys = []
+        self.events = []
+        self.complete = False
+
+    def add(self, key, event):
+        # KEY sorts the events in the order the source's eventGenerator
+        # yields them, reversed. Events usually arrive in order, so this is
+        # nearly always an append.
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.events.insert(i, event)
+
+    def trim(self, max_events):
+        excess = len(self.events) - max_events
+        if excess > 0:
+            del self.keys[:excess]
+            del self.events[:excess]
+            self.complete = False
+
+# the order of events of a builder that started at the same time: point
+# events first, then a build, then its steps (see
+# BuilderStatus.eventGenerator, which yields them the other way round)
+EVENT, BUILD, STEP = range(3)
+
+def event_key(event):
+    if isinstance(event, builder.BuildStepStatus):
+        build = event.getBuild()
+        return (event.getTimes()[0], STEP, build.getNumber(),
+                build.getSteps().index(event))
+    if isinstance(event, builder.BuildStatus):
+        return (event.getTimes()[0], BUILD, event.getNumber())
+    return (event.getTimes()[0], EVENT)
+
+def change_key(change):
+    return change.number
+
+class BuildRef:
+    """A build, or one of its steps, in a column: only its number and when
+    it started, so that the column does not keep the whole build in memory
+    past the build cache. The build is fetched from its builder again when
+    it is shown."""
+
+    def __init__(self, number, started, step=None):
+        self.number = number
+        self.started = started
+        self.step = step
+
+    def resolve(self, builder_status):
+        """Return the build or step, or None if it no longer exists."""
+        build = builder_status.getBuild(self.number)
+        if build is None or self.step is None:
+            return build
+        steps = build.getSteps()
+        if self.step >= len(steps):
+            return None
+        return steps[self.step]
+
+def event_record(event):
+    # what a column keeps of EVENT, a builder's event
+    key = event_key(event)
+    if key[1] == STEP:
+        return BuildRef(key[2], key[0], key[3])
+    if key[1] == BUILD:
+        return BuildRef(key[2], key[0])
+    return event # a point event, which is small
+
+def subscribeToCurrentBuilds(builder_status, receiver):
+    # builds that were already running when RECEIVER subscribed to
+    # BUILDER_STATUS were never announced to it
+    for build in builder_status.getCurrentBuilds():
+        build.subscribe(receiver)
+        d = build.waitUntilFinished()
+        d.addCallback(lambda build: build.unsubscribe(receiver))
+
+class EventGrid(StatusReceiver):
+    """I keep the recent events of every builder, and the recent changes,
+    in memory for the waterfall, so that rendering it does not walk through
+    each builder's history (loading every build it shows) on every hit.
+
+    Each column remembers the events that pages have been shown from its
+    source's eventGenerator, and is kept up to date as builds and steps
+    start and changes arrive. At most MAXEVENTS events are kept per column:
+    pages that reach further back than that continue with the source's own
+    eventGenerator. Builds and steps are remembered as L{BuildRef}s, so
+    only the build cache decides which builds stay in memory.
+    """
+
+    maxEvents = 500
+
+    def __init__(self, status, changeSource):
+        self.status = status
+        self.changeSource = changeSource
+        self.columns = {} # maps builder name to EventColumn
+        self.changes = None # an EventColumn, once loaded
+        # the last point event seen for each builder (builders do not
+        # announce those, so they are picked up when a column is used)
+        self.lastEvents = {}
+        self.builders = {}
+        self.stats = {
+            'hits': 0, # events shown from memory
+            'misses': 0, # pages that went further back than that
+            'loaded': 0, # events remembered from those
+            }
+        status.subscribe(self)
+
+    def stop(self):
+        self.status.unsubscribe(self)
+        for b in self.builders.values():
+            b.unsubscribe(self)
+        self.builders = {}
+        self.columns = {}
+        self.changes = None
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        # a reconfigured builder may have a new BuilderStatus
+        self.columns.pop(builderName, None)
+        self.lastEvents.pop(builderName, None)
+        self.builders[builderName] = builder
+        subscribeToCurrentBuilds(builder, self)
+        return self
+
+    def builderRemoved(self, builderName):
+        self.columns.pop(builderName, None)
+        self.lastEvents.pop(builderName, None)
+        self.builders.pop(builderName, None)
+
+    def buildStarted(self, builderName, build):
+        column = self.columns.get(builderName)
+        if column:
+            column.add(event_key(build), event_record(build))
+            column.trim(self.maxEvents)
+        return self # to hear about its steps
+
+    def stepStarted(self, build, step):
+        column = self.columns.get(build.getBuilder().getName())
+        if column:
+            column.add(event_key(step), event_record(step))
+            column.trim(self.maxEvents)
+
+    def changeAdded(self, change):
+        if self.changes:
+            self.changes.add(change_key(change), change)
+            self.changes.trim(self.maxEvents)
+
+    def getBuilderColumn(self, builder_status):
+        name = builder_status.getName()
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = EventColumn()
+            self.lastEvents[name] = builder_status.getEvent(-1)
+        else:
+            self._addPointEvents(name, builder_status, column)
+        return column
+
+    def _addPointEvents(self, name, builder_status, column):
+        last = self.lastEvents.get(name)
+        new = []
+        for i in range(len(builder_status.events) - 1, -1, -1):
+            e = builder_status.events[i]
+            if e is last:
+                break
+            new.append(e)
+        if new:
+            self.lastEvents[name] = new[0]
+            new.reverse()
+            for e in new:
+                column.add(event_key(e), event_record(e))
+            column.trim(self.maxEvents)
+
+    def getChangesColumn(self):
+        if self.changes is None:
+            self.changes = EventColumn()
+        return self.changes
+
+    # rendering
+
+    def eventGenerator(self, source, branches=[], categories=[],
+                       committers=[], minTime=0):
+        """Like SOURCE.eventGenerator, where SOURCE is a BuilderStatus or
+        the change source, but from memory as far as possible.
+
+        Columns start out empty. When a page goes further back than a
+        column remembers, the rest comes from SOURCE.eventGenerator, and if
+        the page is not filtered, those events are remembered as well (up
+        to MAXEVENTS), so the next page will not need them again."""
+        if source is self.changeSource:
+            column = self.getChangesColumn()
+            key = change_key
+            record = lambda change: change
+            wanted = self._wantedChange
+        else:
+            column = self.getBuilderColumn(source)
+            key = event_key
+            record = event_record
+            wanted = self._wantedBuildEvent
+        # a copy, so that events added meanwhile do not upset us
+        events = column.events[:]
+        events.reverse()
+        for e in events:
+            if isinstance(e, BuildRef):
+                if minTime and e.started < minTime:
+                    return
+                e = e.resolve(source)
+                if e is None:
+                    continue # pruned since
+            elif minTime and e.getTimes()[0] < minTime:
+                return
+            if wanted(e, branches, categories, committers):
+                self.stats['hits'] += 1
+                yield e
+        if column.complete:
+            return
+
+        # the page goes further back than we remember. Unfiltered pages
+        # see every event of the source, newest first, so they can fill
+        # the column in.
+        self.stats['misses'] += 1
+        filling = not (branches or categories or committers or minTime)
+        oldest = None
+        if column.keys:
+            oldest = column.keys[0]
+        for e in source.eventGenerator(branches, categories, committers,
+                                       minTime):
+            k = key(e)
+            if oldest is not None and k >= oldest:
+                continue # already shown
+            if filling:
+                if len(column.events) < self.maxEvents:
+                    column.add(k, record(e))
+                    self.stats['loaded'] += 1
+                else:
+                    filling = False
+            yield e
+        if filling:
+            column.complete = True
+
+    def _wantedChange(self, change, branches, categories, committers):
+        if branches and change.branch not in branches:
+            return False
+        if categories and change.category not in categories:
+            return False
+        if committers and change.who not in committers:
+            return False
+        return True
+
+    def _wantedBuildEvent(self, e, branches, categories, committers):
+        if isinstance(e, builder.BuildStepStatus):
+            e = e.getBuild()
+        elif not isinstance(e, builder.BuildStatus):
+            return True # point events are always shown
+        if branches and e.getSourceStamp().branch not in branches:
+            return False
+        if categories and e.getBuilder().getCategory() not in categories:
+            return False
+        if committers and not [True for c in e.getChanges()
+                               if c.who in committers]:
+            return False
+        return True
+
+    def getStats(self):
+        stats = self.stats.copy()
+        stats['columns'] = len(self.columns)
+        stats['events'] = sum([len(c.events) for c in self.columns.values()])
+        return stats
@@ -99,45 +99,19 @@ class FeedResource(XmlResource):
 
         maxFeeds = 25
 
-        # Copy all failed builds in a new list.
-        # This could clearly be implemented much better if we had
-        # access to a global list of builds.
-        for b in builders:
-            lastbuild = b.getLastFinishedBuild()
-            if lastbuild is None:
-                continue
-
-            lastnr = lastbuild.getNumber()
-
-            totalbuilds = 0
-            i = lastnr
-            while i >= 0:
-                build = b.getBuild(i)
-                i -= 1
-                if not build:
-                    continue
-
-                results = build.getResults()
-
-                # only add entries for failed builds!
-                if results == FAILURE:
-                    totalbuilds += 1
-                    builds.append(build)
-
-                # stop for this builder when our total nr. of feeds is reached
-                if totalbuilds >= maxFeeds:
+        # Collect the most recent failed builds of all these builders.
+        # Builds that are not failures are only looked at in the database
+        # summary of each build.
+        names = [b.getName() for b in builders]
+        if not names:
+            # (an empty list would mean all builders)
+            return builds
+        for build in self.status.generateFinishedBuilds(builders=names,
+                                                        max_search=None):
+            if build.getResults() == FAILURE:
+                builds.append(build)
+                if len(builds) >= maxFeeds:
                     break
-
-        # Sort build list by date, youngest first.
-        # To keep compatibility with python < 2.4, use this for sorting instead:
-        # We apply Decorate-Sort-Undecorate
-        deco = [(build.getTimes(), build) for build in builds]
-        deco.sort()
-        deco.reverse()
-        builds = [build for (b1, build) in deco]
-
-        if builds:
-            builds = builds[:min(len(builds), maxFeeds)]
         return builds
 
     def content(self, request):
@@ -2,10 +2,13 @@ from __future__ import generators
 
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import build_get_class, path_to_builder, path_to_build
-
-class ANYBRANCH: pass # a flag value, used below
+from buildbot.status.web.stampindex import ANYBRANCH, stamp_key
 
 class GridStatusMixin(object):
+    # read the builders' source stamps from the WebStatus's StampIndex,
+    # rather than from their histories
+    useStampIndex = True
+
     def getTitle(self, request):
         status = self.getStatus(request)
         p = status.getProjectName()
@@ -75,29 +78,37 @@ class GridStatusMixin(object):
         return cxt
 
     def getSourceStampKey(self, ss):
-        """Given two source stamps, we want to assign them to the same row if
-        they are the same version of code, even if they differ in minor detail.
+        """Return the key that assigns source stamps to rows (see
+        stampindex.stamp_key)."""
+        return stamp_key(ss)
 
-        This function returns an appropriate comparison key for that.
-        """
-        return (ss.branch, ss.revision, ss.patch)
+    def getBuilders(self, status, categories):
+        builders = []
+        for bn in status.getBuilderNames():
+            builder = status.getBuilder(bn)
+            if categories and builder.category not in categories:
+                continue
+            builders.append(builder)
+        return builders
 
-    def getRecentSourcestamps(self, status, numBuilds, categories, branch):
+    def getRecentSourcestamps(self, request, status, numBuilds, categories,
+                              branch):
         """
         get a list of the most recent NUMBUILDS SourceStamp tuples, sorted
         by the earliest start we've seen for them
         """
-        # TODO: use baseweb's getLastNBuilds?
+        if self.useStampIndex:
+            index = request.site.buildbot_service.getStampIndex()
+            return index.getRecentSourcestamps(
+                self.getBuilders(status, categories), numBuilds, branch)
+
         sourcestamps = { } # { ss-tuple : earliest time }
-        for bn in status.getBuilderNames():
-            builder = status.getBuilder(bn)
-            if categories and builder.category not in categories:
-                continue
-            build = builder.getBuild(-1)
-            while build:
+        for builder in self.getBuilders(status, categories):
+            for build in builder.generateBuilds():
+                if not build:
+                    break
                 ss = build.getSourceStamp(absolute=True)
                 start = build.getTimes()[0]
-                build = build.getPreviousBuild()
 
                 # skip un-started builds
                 if not start: continue
@@ -117,6 +128,24 @@ class GridStatusMixin(object):
 
         return sourcestamps
 
+    def getBuildsForStamps(self, request, builder, stamps):
+        """Return the most recent build of BUILDER for each of STAMPS, or
+        None where it has none."""
+        if self.useStampIndex:
+            index = request.site.buildbot_service.getStampIndex()
+            return index.getBuilds(builder, stamps)
+
+        builds = [None] * len(stamps)
+        for build in builder.generateBuilds():
+            if not build or None not in builds:
+                break
+            ss = build.getSourceStamp(absolute=True)
+            key = self.getSourceStampKey(ss)
+            for i in range(len(stamps)):
+                if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
+                    builds[i] = build
+        return builds
+
 class GridStatusResource(HtmlResource, GridStatusMixin):
     # TODO: docs
     status = None
@@ -135,7 +164,8 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
 
         # and the data we want to render
         status = self.getStatus(request)
-        stamps = self.getRecentSourcestamps(status, numBuilds, categories, branch)
+        stamps = self.getRecentSourcestamps(request, status, numBuilds,
+                                            categories, branch)
 
         cxt['refresh'] = self.get_reload_time(request)
 
@@ -151,20 +181,11 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
         cxt['builders'] = []
 
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key= self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(request, builder, stamps)
 
             b = self.builder_cxt(request, builder)
             b['builds'] = []
@@ -196,7 +217,8 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
 
         # and the data we want to render
         status = self.getStatus(request)
-        stamps = self.getRecentSourcestamps(status, numBuilds, categories, branch)
+        stamps = self.getRecentSourcestamps(request, status, numBuilds,
+                                            categories, branch)
 
         cxt.update({'categories': categories,
                     'branch': branch,
@@ -213,20 +235,11 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
         cxt['range'] = range(len(stamps))
         
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key = self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(request, builder, stamps)
 
             builders.append(self.builder_cxt(request, builder))
             builder_builds.append(map(lambda b: self.build_cxt(request, b), builds))
@@ -1,8 +1,10 @@
 
+import re
+
 from zope.interface import implements
 from twisted.python import components
 from twisted.spread import pb
-from twisted.web import server
+from twisted.web import server, http
 from twisted.web.resource import Resource
 from twisted.web.error import NoResource
 
@@ -33,7 +35,22 @@ class ChunkConsumer:
         self.textlog.finished()
 
 
+def _intArg(req, name):
+    try:
+        value = int(req.args.get(name, [""])[0])
+    except ValueError:
+        return None
+    if value < 0:
+        return None
+    return value
+
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 # /builders/$builder/builds/$buildnum/steps/$stepname/logs/$logname
+#
+# ?tail=N shows only the last N lines, and ?offset=N starts N bytes into the
+# text. The /text version also honors a single-range HTTP Range header once
+# the log has finished.
 class TextLog(Resource):
     # a new instance of this Resource is created for each client who views
     # it, so we can afford to track the request in the Resource.
@@ -84,10 +101,51 @@ class TextLog(Resource):
         req.setHeader("content-length", self.original.length)
         return ''
 
+    def _getWindow(self, req):
+        # return the (offset, line, limit) of the part of the log to send,
+        # or None if the requested range cannot be satisfied
+        offset = line = limit = None
+        tail = _intArg(req, "tail")
+        if tail is not None:
+            size, lines = self.original.getTextSize()
+            line = max(0, lines - tail)
+        else:
+            offset = _intArg(req, "offset")
+        range_header = req.getHeader("range")
+        if (self.asText and range_header and self.original.isFinished()
+            and tail is None and offset is None):
+            mo = _range_re.match(range_header.strip())
+            if mo and (mo.group(1) or mo.group(2)):
+                size, lines = self.original.getTextSize()
+                if mo.group(1):
+                    first = int(mo.group(1))
+                    last = size - 1
+                    if mo.group(2):
+                        last = min(int(mo.group(2)), size - 1)
+                else:
+                    # the last N bytes
+                    first = max(0, size - int(mo.group(2)))
+                    last = size - 1
+                if first >= size or first > last:
+                    req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    req.setHeader("content-range", "bytes */%d" % size)
+                    return None
+                req.setResponseCode(http.PARTIAL_CONTENT)
+                req.setHeader("content-range",
+                              "bytes %d-%d/%d" % (first, last, size))
+                req.setHeader("content-length", str(last - first + 1))
+                offset, limit = first, last - first + 1
+        return (offset, line, limit)
+
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
 
+        window = self._getWindow(req)
+        if window is None:
+            return ''
+        offset, line, limit = window
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")                
             
@@ -98,7 +156,8 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        self.original.subscribeConsumer(ChunkConsumer(req, self),
+                                        offset=offset, line=line, limit=limit)
         return server.NOT_DONE_YET
 
     def _setContentType(self, req):
@@ -0,0 +1,192 @@
+# -*- test-case-name: buildbot.test.unit.test_status_web_stampindex -*-
+
+import bisect
+
+from buildbot.status.base import StatusReceiver
+
+class ANYBRANCH: pass # a flag value, used below
+
+def stamp_key(ss):
+    """Given two source stamps, we want to assign them to the same row if
+    they are the same version of code, even if they differ in minor detail.
+
+    This function returns an appropriate comparison key for that.
+    """
+    return (ss.branch, ss.revision, ss.patch)
+
+class BuilderStamps:
+    """The source stamps of one builder's finished builds, ordered by the
+    earliest start of a build of each, from the most recent one back to as
+    many as were kept. For each, I remember the most recent build of it."""
+
+    def __init__(self):
+        self.starts = [] # earliest start of each stamp, oldest first
+        self.keys = [] # the matching keys
+        self.stamps = {} # maps key to [sourcestamp, earliest start, number]
+
+    def add(self, ss, start, number):
+        key = stamp_key(ss)
+        entry = self.stamps.get(key)
+        if entry is None:
+            self.stamps[key] = [ss, start, number]
+            self._insert(key, start)
+            return
+        if number > entry[2]:
+            entry[2] = number
+        if start < entry[1]:
+            self._remove(key, entry[1])
+            entry[1] = start
+            self._insert(key, start)
+
+    def _insert(self, key, start):
+        i = bisect.bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.keys.insert(i, key)
+
+    def _remove(self, key, start):
+        i = bisect.bisect_left(self.starts, start)
+        while self.keys[i] != key:
+            i += 1
+        del self.starts[i]
+        del self.keys[i]
+
+    def trim(self, max_stamps):
+        excess = len(self.keys) - max_stamps
+        if excess > 0:
+            for key in self.keys[:excess]:
+                del self.stamps[key]
+            del self.starts[:excess]
+            del self.keys[:excess]
+
+    def recent(self, num, branch):
+        """Return up to NUM [sourcestamp, earliest start, number] entries
+        on BRANCH (or on any branch, if BRANCH is ANYBRANCH), most recent
+        first."""
+        entries = []
+        for i in range(len(self.keys) - 1, -1, -1):
+            if len(entries) >= num:
+                break
+            entry = self.stamps[self.keys[i]]
+            if branch is ANYBRANCH or entry[0].branch == branch:
+                entries.append(entry)
+        return entries
+
+class StampIndex(StatusReceiver):
+    """I keep, for every builder, the source stamps its recent builds were
+    built from, for the grid displays, so that finding the most recent N
+    stamps does not walk through each builder's whole history (loading its
+    builds) on every hit.
+
+    Each builder's stamps are read from its history (at most MAXSEARCH
+    builds back) the first time they are needed, and kept up to date as its
+    builds finish. At most MAXSTAMPS stamps are kept per builder. Running
+    builds are looked at on each query, since their stamps may change (as
+    they learn their got_revision) until they finish."""
+
+    maxStamps = 100
+    maxSearch = 200
+
+    def __init__(self, status):
+        self.status = status
+        self.builders = {}
+        self.stamps = {} # maps builder name to BuilderStamps, once loaded
+        self.stats = {
+            'builds_read': 0, # builds read from history
+            }
+        status.subscribe(self)
+
+    def stop(self):
+        self.status.unsubscribe(self)
+        for b in self.builders.values():
+            b.unsubscribe(self)
+        self.builders = {}
+        self.stamps = {}
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        # a reconfigured builder may have a new BuilderStatus
+        self.stamps.pop(builderName, None)
+        self.builders[builderName] = builder
+        return self
+
+    def builderRemoved(self, builderName):
+        self.stamps.pop(builderName, None)
+        self.builders.pop(builderName, None)
+
+    def buildFinished(self, builderName, build, results):
+        stamps = self.stamps.get(builderName)
+        if stamps is not None:
+            self._addBuild(stamps, build)
+            stamps.trim(self.maxStamps)
+
+    def _addBuild(self, stamps, build):
+        start = build.getTimes()[0]
+        if start: # skip un-started builds
+            stamps.add(build.getSourceStamp(absolute=True), start,
+                       build.getNumber())
+
+    # reading
+
+    def getBuilderStamps(self, builder_status):
+        name = builder_status.getName()
+        stamps = self.stamps.get(name)
+        if stamps is None:
+            stamps = self.stamps[name] = BuilderStamps()
+            for build in builder_status.generateBuilds(self.maxSearch):
+                if not build:
+                    break
+                self.stats['builds_read'] += 1
+                if build.isFinished():
+                    self._addBuild(stamps, build)
+                    if len(stamps.keys) > self.maxStamps:
+                        break
+            stamps.trim(self.maxStamps)
+        return stamps
+
+    def _getEntries(self, builder_status, num, branch):
+        # the BuilderStamps entries, plus the running builds
+        entries = self.getBuilderStamps(builder_status).recent(num, branch)
+        for build in builder_status.getCurrentBuilds():
+            ss = build.getSourceStamp(absolute=True)
+            if branch is ANYBRANCH or ss.branch == branch:
+                entries.append([ss, build.getTimes()[0], build.getNumber()])
+        return entries
+
+    def getRecentSourcestamps(self, builders, num, branch):
+        """Return the NUM most recent SourceStamps built by BUILDERS (a list
+        of BuilderStatus) on BRANCH, sorted by the earliest start seen for
+        them. Only the NUM most recent stamps of each builder are
+        considered."""
+        sourcestamps = {} # { ss-tuple : (ss, earliest time) }
+        for b in builders:
+            for ss, start, number in self._getEntries(b, num, branch):
+                if not start:
+                    continue
+                key = stamp_key(ss)
+                if key not in sourcestamps or sourcestamps[key][1] > start:
+                    sourcestamps[key] = (ss, start)
+        sourcestamps = sourcestamps.values()
+        sourcestamps.sort(lambda x, y: cmp(x[1], y[1]))
+        return [ss for ss, start in sourcestamps[-num:]]
+
+    def getBuilds(self, builder_status, stamps):
+        """Return the most recent build of BUILDER_STATUS for each of
+        STAMPS, or None where it has none that I know of."""
+        numbers = {}
+        for build in builder_status.getCurrentBuilds():
+            key = stamp_key(build.getSourceStamp(absolute=True))
+            numbers[key] = max(numbers.get(key, -1), build.getNumber())
+        builderStamps = self.getBuilderStamps(builder_status)
+        builds = []
+        for ss in stamps:
+            key = stamp_key(ss)
+            number = numbers.get(key)
+            entry = builderStamps.stamps.get(key)
+            if entry and (number is None or entry[2] > number):
+                number = entry[2]
+            if number is None:
+                builds.append(None)
+            else:
+                builds.append(builder_status.getBuild(number))
+        return builds
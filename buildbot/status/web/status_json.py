@@ -61,6 +61,8 @@ EXAMPLES = """\
     - Builder information plus details information about its slaves. Neat eh?
   - /json/slaves/<A_SLAVE>
     - A specific slave.
+  - /json/metrics/db
+    - Database query counts and latencies, by query shape.
   - /json?select=slaves/<A_SLAVE>/&select=project&select=builders/<A_BUILDER>/builds/<A_BUILD>
     - A selection of random unrelated stuff as an random example. :)
 """
@@ -386,8 +388,8 @@ class AllBuildsJsonResource(JsonResource):
 
     def asDict(self, request):
         results = {}
-        # If max > buildCacheSize, it'll trash the cache...
-        max = int(RequestArg(request, 'max', self.builder_status.buildCacheSize))
+        # A large max will push other builds out of the build cache...
+        max = int(RequestArg(request, 'max', 15))
         for i in range(0, max):
             child = self.getChildWithDefault(-i, request)
             if not isinstance(child, BuildJsonResource):
@@ -533,6 +535,98 @@ class ChangeSourcesJsonResource(JsonResource):
         return result
 
 
+class DBMetricsJsonResource(JsonResource):
+    help = """Database query statistics.
+
+'queries' maps the shape of each SQL query (the query with its values
+replaced by '?') to its number of executions, total time, rows returned and
+latency percentiles. 'interactions' does the same for each database
+transaction, by name.
+"""
+    title = 'DB metrics'
+    cache_seconds = 0
+
+    def asDict(self, request):
+        if not self.status.db:
+            return {}
+        return self.status.db.query_stats.asDict()
+
+
+class CacheMetricsJsonResource(JsonResource):
+    help = """Size and hit rate of the change, sourcestamp and build caches.
+For the build cache, also the number of builds loaded from disk (and of
+those, how many were prefetched) and the time spent loading them.
+"""
+    title = 'Cache metrics'
+    cache_seconds = 0
+
+    def asDict(self, request):
+        stats = {}
+        if self.status.db:
+            stats.update(self.status.db.getCacheStats())
+        stats['builds'] = self.status.buildCache.getStats()
+        return stats
+
+
+class LogCompressionMetricsJsonResource(JsonResource):
+    help = """Progress of the background compression of finished logs.
+
+'queued' and 'running' describe the current work, 'refused' counts logs that
+were left uncompressed because the queue was full, and 'bytes_per_second'
+is the compression throughput.
+"""
+    title = 'Log compression metrics'
+    cache_seconds = 0
+
+    def asDict(self, request):
+        return self.status.logCompressor.getStats()
+
+
+class SaveMetricsJsonResource(JsonResource):
+    help = """Background saving of builder status.
+
+'requested' counts the times a builder asked to be saved, and 'saved' the
+times one actually was, along with the 'bytes' written. The latency of a
+save is the time from the first request to the file being written.
+"""
+    title = 'Save metrics'
+    cache_seconds = 0
+
+    def asDict(self, request):
+        return self.status.builderSaver.getStats()
+
+
+class SchedulerMetricsJsonResource(JsonResource):
+    help = """How the schedulers have been running.
+
+'concurrency' is how many schedulers may run at once, and 'running' and
+'queued' describe the current work. 'processors' gives, for each scheduler,
+its number of runs, their run time and their queue delay (the time from a
+new change or timer to the run starting). 'classifier' counts the changes
+classified for the schedulers.
+"""
+    title = 'Scheduler metrics'
+    cache_seconds = 0
+
+    def asDict(self, request):
+        return self.status.getSchedulerStats()
+
+
+class MetricsJsonResource(JsonResource):
+    help = """Performance metrics of the buildmaster.
+"""
+    title = 'Metrics'
+
+    def __init__(self, status):
+        JsonResource.__init__(self, status)
+        self.putChild('db', DBMetricsJsonResource(status))
+        self.putChild('caches', CacheMetricsJsonResource(status))
+        self.putChild('logcompression',
+                      LogCompressionMetricsJsonResource(status))
+        self.putChild('saves', SaveMetricsJsonResource(status))
+        self.putChild('schedulers', SchedulerMetricsJsonResource(status))
+
+
 class ProjectJsonResource(JsonResource):
     help = """Project-wide settings.
 """
@@ -603,6 +697,7 @@ For help on any sub directory, use url /child/help
         self.level = 1
         self.putChild('builders', BuildersJsonResource(status))
         self.putChild('change_sources', ChangeSourcesJsonResource(status))
+        self.putChild('metrics', MetricsJsonResource(status))
         self.putChild('project', ProjectJsonResource(status))
         self.putChild('slaves', SlavesJsonResource(status))
         # This needs to be called before the first HelpResource().body call.
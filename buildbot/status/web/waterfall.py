@@ -294,6 +294,10 @@ class WaterfallStatusResource(HtmlResource):
     """This builds the main status page, with the waterfall display, and
     all child pages."""
 
+    # take the events from the WebStatus's EventGrid, rather than walking
+    # through the history of every builder on every hit
+    cacheEvents = True
+
     def __init__(self, categories=None, num_events=200, num_events_max=None):
         HtmlResource.__init__(self)
         self.categories = categories
@@ -451,7 +455,6 @@ class WaterfallStatusResource(HtmlResource):
     
     def buildGrid(self, request, builders):
         debug = False
-        # TODO: see if we can use a cached copy
 
         showEvents = False
         if request.args.get("show_events", ["false"])[0].lower() == "true":
@@ -481,6 +484,13 @@ class WaterfallStatusResource(HtmlResource):
         # array of events, and stop when we have a reasonable number.
 
         commit_source = self.getChangeManager(request)
+        if self.cacheEvents:
+            eventGrid = request.site.buildbot_service.getEventGrid()
+            def eventGenerator(source, *args):
+                return eventGrid.eventGenerator(source, *args)
+        else:
+            def eventGenerator(source, *args):
+                return source.eventGenerator(*args)
 
         lastEventTime = util.now()
         sources = [commit_source] + builders
@@ -510,10 +520,10 @@ class WaterfallStatusResource(HtmlResource):
             return event
 
         for s in sources:
-            gen = insertGaps(s.eventGenerator(filterBranches,
-                                              filterCategories,
-                                              filterCommitters,
-                                              minTime),
+            gen = insertGaps(eventGenerator(s, filterBranches,
+                                            filterCategories,
+                                            filterCommitters,
+                                            minTime),
                              showEvents,
                              lastEventTime)
             sourceGenerators.append(gen)
@@ -65,8 +65,8 @@ class HLint(ShellCommand):
         # submitted to hlint) because it is available in the logfile and
         # mostly exists to give the user an idea of how long the step will
         # take anyway).
-        lines = cmd.logs['stdio'].getText().split("\n")
-        warningLines = filter(lambda line:':' in line, lines)
+        lines = cmd.logs['stdio'].readTextLines()
+        warningLines = [line for line in lines if ':' in line]
         if warningLines:
             self.addCompleteLog("warnings", "".join(warningLines))
         warnings = len(warningLines)
@@ -492,8 +492,13 @@ class Trial(ShellCommand):
         # different pieces of it
 
         # 'cmd' is the original trial command, so cmd.logs['stdio'] is the
-        # trial output. We don't have access to test.log from here.
-        output = cmd.logs['stdio'].getText()
+        # trial output. We don't have access to test.log from here. The
+        # counts are near the end, so only read that part of it.
+        stdio = cmd.logs['stdio']
+        size, lines = stdio.getTextSize()
+        output = "".join(stdio.getChunks([builder.STDOUT, builder.STDERR],
+                                         onlyText=True,
+                                         offset=max(0, size - 10000)))
         counts = countFailedTests(output)
 
         total = counts['total']
@@ -575,14 +580,10 @@ class Trial(ShellCommand):
         self.build.build_status.addTestResult(tr)
 
     def createSummary(self, loog):
-        output = loog.getText()
         problems = ""
-        sio = StringIO.StringIO(output)
+        lines = loog.readTextLines()
         warnings = {}
-        while 1:
-            line = sio.readline()
-            if line == "":
-                break
+        for line in lines:
             if line.find(" exceptions.DeprecationWarning: ") != -1:
                 # no source
                 warning = line # TODO: consider stripping basedir prefix here
@@ -590,7 +591,10 @@ class Trial(ShellCommand):
             elif (line.find(" DeprecationWarning: ") != -1 or
                 line.find(" UserWarning: ") != -1):
                 # next line is the source
-                warning = line + sio.readline()
+                try:
+                    warning = line + lines.next()
+                except StopIteration:
+                    warning = line
                 warnings[warning] = warnings.get(warning, 0) + 1
             elif line.find("Warning: ") != -1:
                 warning = line
@@ -598,7 +602,7 @@ class Trial(ShellCommand):
 
             if line.find("=" * 60) == 0 or line.find("-" * 60) == 0:
                 problems += line
-                problems += sio.read()
+                problems += "".join(lines)
                 break
 
         if problems:
@@ -687,14 +691,13 @@ class ProcessDocs(ShellCommand):
         ShellCommand.__init__(self, **kwargs)
 
     def createSummary(self, log):
-        output = log.getText()
         # hlint warnings are of the format: 'WARNING: file:line:col: stuff
         # latex warnings start with "WARNING: LaTeX Warning: stuff", but
         # sometimes wrap around to a second line.
-        lines = output.split("\n")
         warningLines = []
         wantNext = False
-        for line in lines:
+        for line in log.readTextLines():
+            line = line.rstrip("\n")
             wantThis = wantNext
             wantNext = False
             if line.startswith("WARNING: "):
@@ -751,10 +754,8 @@ class BuildDebs(ShellCommand):
 
     def commandComplete(self, cmd):
         errors, warnings = 0, 0
-        output = cmd.logs['stdio'].getText()
         summary = ""
-        sio = StringIO.StringIO(output)
-        for line in sio.readlines():
+        for line in cmd.logs['stdio'].readTextLines():
             if line.find("E: ") == 0:
                 summary += line
                 errors += 1
@@ -532,9 +532,8 @@ class WarningCountingShellCommand(ShellCommand):
         # warnings regular expressions. If did, bump the warnings count and
         # add the line to the collection of lines with warnings
         warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
+        for line in log.readTextLines():
+            line = line.rstrip("\n")
             if directoryEnterRe:
                 match = directoryEnterRe.search(line)
                 if match:
@@ -0,0 +1,79 @@
+"""
+Fakes shared by the unit tests of the web status pages and of the indexes
+they read (StampIndex, EventGrid, ConsoleModel).
+"""
+
+import os
+
+from buildbot.status import builder, buildcache
+
+class FakeStatus:
+    db = None
+    def __init__(self):
+        self.buildCache = buildcache.BuildCache()
+        self.builders = {}
+        self.watchers = []
+    def subscribe(self, target):
+        self.watchers.append(target)
+        for name, b in self.builders.items():
+            t = target.builderAdded(name, b)
+            if t:
+                b.subscribe(t)
+    def unsubscribe(self, target):
+        self.watchers.remove(target)
+    def getBuilderNames(self):
+        names = self.builders.keys()
+        names.sort()
+        return names
+    def getBuilder(self, name):
+        return self.builders[name]
+
+class FakeChangeSource:
+    def __init__(self):
+        self.changes = []
+    def addChange(self, change):
+        change.number = len(self.changes) + 1
+        self.changes.append(change)
+    def eventGenerator(self, branches=[], categories=[], committers=[],
+                       minTime=0):
+        for c in reversed(self.changes):
+            if branches and c.branch not in branches:
+                continue
+            yield c
+
+class FakeService:
+    def __init__(self, index=None, grid=None, model=None, changes=None):
+        self.index = index
+        self.grid = grid
+        self.model = model
+        self.changes = changes
+    def getStampIndex(self):
+        return self.index
+    def getEventGrid(self):
+        return self.grid
+    def getConsoleModel(self):
+        return self.model
+    def getChangeSvc(self):
+        return self.changes
+
+class FakeSite:
+    pass
+
+class FakeRequest:
+    def __init__(self, service, args=None):
+        if args is None:
+            args = {}
+        self.args = args
+        self.site = FakeSite()
+        self.site.buildbot_service = service
+
+def makeBuilderStatus(status, basedir, name):
+    """Return an empty BuilderStatus named NAME, saving its builds in a new
+    directory under BASEDIR, and add it to the FakeStatus STATUS."""
+    b = builder.BuilderStatus(name)
+    b.basedir = os.path.join(basedir, name)
+    os.makedirs(b.basedir)
+    b.status = status
+    b.determineNextBuildNumber()
+    status.builders[name] = b
+    return b
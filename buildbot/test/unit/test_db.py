@@ -3,8 +3,13 @@ import threading
 
 from zope.interface import implements
 from twisted.trial import unittest
+from twisted.internet import defer
 
-from buildbot import db
+from buildbot import db, util
+from buildbot.changes.changes import Change
+from buildbot.sourcestamp import SourceStamp
+from buildbot.process.properties import Properties
+from buildbot.util.eventual import flushEventualQueue
 
 class DBSpec(unittest.TestCase):
     # a dburl of "sqlite:///.." can use either the third-party sqlite3
@@ -153,13 +158,31 @@ class DBSpec_funcs(unittest.TestCase):
         return conn
 
     # put together a fake database, with just a version table
-    def makeFakeDB(self):
+    def makeFakeDB(self, version=db.CURRENT_VERSION):
         conn = self.trackConn(db.DBConnector(self.dbspec))
         conn.start()
         conn.runQueryNow("CREATE TABLE version (`version` integer)")
-        conn.runQueryNow("INSERT INTO version values (1)")
+        conn.runQueryNow("INSERT INTO version values (%d)" % version)
         conn.stop()
 
+    # put together a real database at schema version 1
+    def makeVersion1DB(self):
+        conn = self.trackConn(db.DBConnector(self.dbspec))
+        conn.start()
+        for t in db.TABLES:
+            conn.runQueryNow(t)
+        conn.stop()
+
+    def getIndexNames(self, conn):
+        rows = conn.runQueryNow("SELECT name FROM sqlite_master"
+                                " WHERE type='index'"
+                                " AND name NOT LIKE 'sqlite_autoindex_%'")
+        return set([ str(name) for (name,) in rows ])
+
+    def expectedIndexNames(self):
+        return set([ name for (name, _, _) in db.INDEXES_V2 ] +
+                   [ "build_summaries_number" ])
+
     ## tests
 
     def test_open_db_missingFails(self):
@@ -168,14 +191,20 @@ class DBSpec_funcs(unittest.TestCase):
     def test_open_db_existingOK(self):
         self.makeFakeDB()
         conn = self.trackConn(db.open_db(self.dbspec))
-        self.assertEqual(conn.get_version(), 1)
+        self.assertEqual(conn.get_version(), db.CURRENT_VERSION)
         conn.stop()
 
+    def test_open_db_oldVersionFails(self):
+        self.makeFakeDB(version=1)
+        self.assertRaises(db.DatabaseNotReadyError, db.open_db, self.dbspec)
+
     def test_create_db_missingOK(self):
         db.create_db(self.dbspec) # note this does not return a DBConnector
         conn = self.trackConn(db.DBConnector(self.dbspec))
         conn.start()
-        self.assertEqual(conn.runQueryNow("SELECT * from version"), [(1,)])
+        self.assertEqual(conn.runQueryNow("SELECT * from version"),
+                         [(db.CURRENT_VERSION,)])
+        self.assertEqual(self.getIndexNames(conn), self.expectedIndexNames())
         conn.stop()
 
     def test_create_db_existingFails(self):
@@ -184,12 +213,51 @@ class DBSpec_funcs(unittest.TestCase):
 
     def test_create_or_upgrade_db_missingOK(self):
         conn = self.trackConn(db.create_or_upgrade_db(self.dbspec))
-        self.assertEqual(conn.runQueryNow("SELECT * from version"), [(1,)])
+        self.assertEqual(conn.runQueryNow("SELECT * from version"),
+                         [(db.CURRENT_VERSION,)])
 
     def test_create_or_upgrade_db_existingOK(self):
         self.makeFakeDB()
         conn = self.trackConn(db.create_or_upgrade_db(self.dbspec))
-        self.assertEqual(conn.runQueryNow("SELECT * from version"), [(1,)])
+        self.assertEqual(conn.runQueryNow("SELECT * from version"),
+                         [(db.CURRENT_VERSION,)])
+
+    def test_create_or_upgrade_db_version1(self):
+        self.makeVersion1DB()
+        conn = self.trackConn(db.create_or_upgrade_db(self.dbspec))
+        self.assertEqual(conn.runQueryNow("SELECT * from version"),
+                         [(db.CURRENT_VERSION,)])
+        self.assertEqual(self.getIndexNames(conn), self.expectedIndexNames())
+
+    def test_create_or_upgrade_db_interrupted(self):
+        # an upgrade that stopped after some of its CREATEs were committed
+        self.makeVersion1DB()
+        conn = self.trackConn(db.DBConnector(self.dbspec))
+        conn.start()
+        (name, table, columns) = db.INDEXES_V2[0]
+        conn.runQueryNow(db.index_sql("sqlite3", name, table, columns))
+        conn.stop()
+        conn = self.trackConn(db.create_or_upgrade_db(self.dbspec))
+        self.assertEqual(self.getIndexNames(conn), self.expectedIndexNames())
+        # and the same again, from version 2
+        conn.runQueryNow("DROP INDEX build_summaries_number")
+        conn.runQueryNow("UPDATE version SET version = 2")
+        conn.stop()
+        conn = self.trackConn(db.create_or_upgrade_db(self.dbspec))
+        self.assertEqual(conn.runQueryNow("SELECT * from version"),
+                         [(db.CURRENT_VERSION,)])
+        self.assertEqual(self.getIndexNames(conn), self.expectedIndexNames())
+
+    def test_create_or_upgrade_db_tooNewFails(self):
+        self.makeFakeDB(version=db.CURRENT_VERSION+1)
+        self.assertRaises(db.DatabaseNotReadyError,
+                          db.create_or_upgrade_db, self.dbspec)
+
+    def test_index_sql_mysqlPrefix(self):
+        self.assertEqual(db.index_sql("MySQLdb", "i", "t", [("a", 10), "b"]),
+                         "CREATE INDEX i ON t (a(10), b)")
+        self.assertEqual(db.index_sql("sqlite3", "i", "t", [("a", 10), "b"]),
+                         "CREATE INDEX i ON t (a, b)")
 
 class DBConnector_Basic(unittest.TestCase):
     """
@@ -258,3 +326,433 @@ class DBConnector_Basic(unittest.TestCase):
             self.assertEqual(res, [(1,)])
         d.addCallback(cb)
         return d
+
+    def test_runInteractionNow_stallLogged(self):
+        self.dbc.SYNC_STALL_THRESHOLD = 0
+        self.dbc.runQueryNow("SELECT 1")
+        self.assertEqual(self.dbc._sync_stalls, 1)
+
+    def test_runInteractionNow_noStall(self):
+        self.dbc.SYNC_STALL_THRESHOLD = 3600
+        self.dbc.runQueryNow("SELECT 1")
+        self.assertEqual(self.dbc._sync_stalls, 0)
+
+class CountingCursor:
+    # wraps a DBAPI cursor, counting the queries that are executed
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.queries = []
+    def execute(self, *args):
+        self.queries.append(args[0])
+        return self.cursor.execute(*args)
+    def executemany(self, *args):
+        self.queries.append(args[0])
+        return self.cursor.executemany(*args)
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class DBConnector_BuildRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.dbfile = os.path.abspath("dbconnector_buildrequests.sqlite")
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        self.dbspec = db.DBSpec.from_url("sqlite:///" + self.dbfile)
+        db.create_db(self.dbspec)
+        self.dbc = db.DBConnector(self.dbspec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        return flushEventualQueue()
+
+    def addBuildSets(self, count, buildername="b1"):
+        for i in range(count):
+            c = Change("who%d" % i, ["file%d" % i, "other%d" % i],
+                       "comment %d" % i, revision="r%d" % i,
+                       properties={"prop": i})
+            self.dbc.addChangeToDatabase(c)
+            ss = SourceStamp(changes=[c])
+            props = Properties(bsprop=i)
+            def _txn(t):
+                ssid = self.dbc.get_sourcestampid(ss, t)
+                return self.dbc.create_buildset(ssid, "reason %d" % i, props,
+                                                [buildername], t)
+            self.dbc.runInteractionNow(_txn)
+
+    def countQueries(self, interaction, *args):
+        cursors = []
+        def _txn(t):
+            cursors.append(CountingCursor(t))
+            return interaction(cursors[0], *args)
+        res = self.dbc.runInteractionNow(_txn)
+        return res, len(cursors[0].queries)
+
+    def get_unclaimed(self, t):
+        return self.dbc.get_unclaimed_buildrequests("b1", 1, "master",
+                                                    "incarnation", t)
+
+    def emptyCaches(self):
+        self.dbc._change_cache = util.LRUCache()
+        self.dbc._sourcestamp_cache = util.LRUCache()
+
+    def test_get_unclaimed_buildrequests(self):
+        self.addBuildSets(3)
+        self.addBuildSets(1, buildername="b2")
+        self.emptyCaches()
+        requests = self.dbc.runInteractionNow(self.get_unclaimed)
+        self.assertEqual([br.reason for br in requests],
+                         ["reason 0", "reason 1", "reason 2"])
+        br = requests[1]
+        self.assertEqual(br.builderName, "b1")
+        self.assertEqual(br.properties["bsprop"], 1)
+        self.assertEqual(br.source.revision, "r1")
+        (change,) = br.source.changes
+        self.assertEqual(change.who, "who1")
+        self.assertEqual(change.files, ["file1", "other1"])
+        # the bulk loader must build the same Change as the one-at-a-time
+        # loader does
+        single = self.dbc.runInteractionNow(self.dbc._txn_getChangeNumberedNow,
+                                            change.number)
+        self.assertEqual(change.properties, single.properties)
+
+    def test_get_unclaimed_buildrequests_queryCount(self):
+        self.addBuildSets(2)
+        self.emptyCaches()
+        requests, few_queries = self.countQueries(self.get_unclaimed)
+        self.assertEqual(len(requests), 2)
+
+        self.addBuildSets(48)
+        self.emptyCaches()
+        requests, many_queries = self.countQueries(self.get_unclaimed)
+        self.assertEqual(len(requests), 50)
+        # one query for the requests, then sourcestamps and their changes,
+        # then changes with their links, files and properties, and finally
+        # the buildset properties
+        self.assertEqual(many_queries, few_queries)
+        self.assertEqual(many_queries, 8)
+
+    def test_get_unclaimed_buildrequests_missingChange(self):
+        self.addBuildSets(2)
+        self.dbc.runQueryNow("DELETE FROM changes WHERE changeid = 1")
+        self.emptyCaches()
+        requests = self.dbc.runInteractionNow(self.get_unclaimed)
+        self.assertEqual([len(br.source.changes) for br in requests], [0, 1])
+
+    def test_getBuildRequestsWithNumbers(self):
+        self.addBuildSets(3)
+        brs = self.dbc.getBuildRequestsWithNumbers([3, 99, 1])
+        self.assertEqual(brs[1], None)
+        self.assertEqual((brs[0].id, brs[2].id), (3, 1))
+        self.assertEqual(self.dbc.getBuildRequestWithNumber(2).reason,
+                         "reason 1")
+
+    def test_get_active_buildset_ids_async(self):
+        self.addBuildSets(2)
+        d = self.dbc.get_active_buildset_ids_async()
+        def _check(bsids):
+            self.assertEqual(sorted(bsids),
+                             sorted(self.dbc.get_active_buildset_ids()))
+            self.assertEqual(len(bsids), 2)
+            return self.dbc.examine_buildset_async(bsids[0])
+        d.addCallback(_check)
+        def _examined(res):
+            # nothing has been built yet
+            self.assertEqual(res, (None, False))
+        d.addCallback(_examined)
+        return d
+
+    def test_get_oldest_request_times(self):
+        self.addBuildSets(2)
+        self.addBuildSets(1, buildername="b2")
+        self.dbc.claim_buildrequests(util.now(), "master", "incarnation", [1])
+        # claims older than this have timed out
+        old = util.now() - 3600
+        def _txn(t, brids=None):
+            return self.dbc._txn_get_oldest_request_times(t, old, "master",
+                                                          "incarnation", brids)
+        times = self.dbc.runInteractionNow(_txn)
+        self.assertEqual(sorted(times.keys()), ["b1", "b2"])
+        # once request 2 is claimed too, b1 has nothing left
+        self.dbc.claim_buildrequests(util.now(), "master", "incarnation", [2])
+        times = self.dbc.runInteractionNow(_txn, [2])
+        self.assertEqual(times, {"b1": None})
+
+    def test_get_buildernames_for_buildrequests(self):
+        self.addBuildSets(2)
+        self.addBuildSets(1, buildername="b2")
+        d = self.dbc.get_buildernames_for_buildrequests([1, 2])
+        def _check(names):
+            self.assertEqual(names, set(["b1"]))
+            return self.dbc.get_buildernames_for_buildrequests([2, 3, 99])
+        d.addCallback(_check)
+        d.addCallback(self.assertEqual, set(["b1", "b2"]))
+        return d
+
+    def test_scheduler_get_buildset_subscribers(self):
+        self.addBuildSets(2)
+        def _txn(t):
+            self.dbc.scheduler_subscribe_to_buildset(1, 1, t)
+            self.dbc.scheduler_subscribe_to_buildset(2, 1, t)
+            self.dbc.scheduler_subscribe_to_buildset(3, 2, t)
+            self.dbc.scheduler_unsubscribe_buildset(2, 1, t)
+        self.dbc.runInteractionNow(_txn)
+        d = self.dbc.scheduler_get_buildset_subscribers([1])
+        d.addCallback(self.assertEqual, set([1]))
+        d.addCallback(lambda ign:
+                      self.dbc.scheduler_get_buildset_subscribers([1, 2]))
+        d.addCallback(self.assertEqual, set([1, 3]))
+        return d
+
+class DBConnector_Changes(unittest.TestCase):
+
+    def setUp(self):
+        self.dbfile = os.path.abspath("dbconnector_changes.sqlite")
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        self.dbspec = db.DBSpec.from_url("sqlite:///" + self.dbfile)
+        db.create_db(self.dbspec)
+        self.dbc = db.DBConnector(self.dbspec)
+        self.dbc.start()
+        self.notifications = []
+        self.dbc.subscribe_to("add-change",
+                              lambda cat, *args:
+                                  self.notifications.append(args))
+
+    def tearDown(self):
+        self.dbc.stop()
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        return flushEventualQueue()
+
+    def makeChanges(self, count):
+        return [Change("who%d" % i, ["file%d" % i, "other%d" % i],
+                       "comment %d" % i, revision="r%d" % i,
+                       links=["http://example.com/r%d" % i],
+                       properties={"prop": i})
+                for i in range(count)]
+
+    def test_addChangesToDatabase(self):
+        self.dbc.addChangeToDatabase(self.makeChanges(1)[0])
+        changes = self.makeChanges(3)
+        d = self.dbc.addChangesToDatabase(changes)
+        def _check(res):
+            self.assertEqual(res, changes)
+            self.assertEqual([c.number for c in changes], [2, 3, 4])
+            self.dbc._change_cache = util.LRUCache()
+            c = self.dbc.getChangeNumberedNow(3)
+            self.assertEqual((c.who, c.files, c.links, c.revision),
+                             ("who1", ["file1", "other1"],
+                              ["http://example.com/r1"], "r1"))
+            rows = self.dbc.runQueryNow("SELECT property_name, property_value"
+                                        " FROM change_properties"
+                                        " WHERE changeid = 3")
+            self.assertEqual(rows, [("prop", '[1, "Change"]')])
+            # and the counter moved past all of them
+            self.dbc.addChangeToDatabase(self.makeChanges(1)[0])
+            return flushEventualQueue()
+        d.addCallback(_check)
+        def _notified(ign):
+            self.assertEqual(self.notifications, [(1,), (2, 3, 4), (5,)])
+        d.addCallback(_notified)
+        return d
+
+    def test_load_properties(self):
+        c = Change("bob", ["f"], "c", properties={"p": "v"})
+        self.dbc.addChangeToDatabase(c)
+        def check(c):
+            self.assertEqual(c.properties.getProperty("p"), "v")
+            self.assertEqual(c.properties.getPropertySource("p"), "Change")
+        self.dbc._change_cache = util.LRUCache()
+        check(self.dbc.getChangeNumberedNow(c.number))
+        self.dbc._change_cache = util.LRUCache()
+        check(self.dbc.runInteractionNow(self.dbc._txn_getChangesNumberedNow,
+                                         [c.number])[c.number])
+        self.dbc._change_cache = util.LRUCache()
+        d = self.dbc.getChangeByNumber(c.number)
+        def _loaded(loaded):
+            check(loaded)
+            # and what it left in the cache for everybody else is the same
+            check(self.dbc.getChangeNumberedNow(c.number))
+            return self.dbc.getChangesByNumber([c.number, 99])
+        d.addCallback(_loaded)
+        def _loaded_many(changes):
+            self.assertEqual(changes[1], None)
+            check(changes[0])
+        d.addCallback(_loaded_many)
+        return d
+
+    def test_missing_with_max_bytes(self):
+        self.dbc.setCacheSizes({"changes": {"max_bytes": 10000},
+                                "sourcestamps": {"max_bytes": 10000}})
+        self.assertEqual(self.dbc.getChangeNumberedNow(99), None)
+        self.assertEqual(self.dbc.getSourceStampNumberedNow(99), None)
+
+    def test_addChangesToDatabase_numbered(self):
+        changes = self.makeChanges(2)
+        changes[1].number = 10
+        d = self.dbc.addChangesToDatabase(changes)
+        def _check(ign):
+            self.assertEqual([c.number for c in changes], [1, 10])
+            c = self.makeChanges(1)[0]
+            self.dbc.addChangeToDatabase(c)
+            self.assertEqual(c.number, 11)
+        d.addCallback(_check)
+        return d
+
+    def test_addChangesToDatabase_failure(self):
+        changes = self.makeChanges(2)
+        self.dbc.runQueryNow("DROP TABLE change_files")
+        d = self.dbc.addChangesToDatabase(changes)
+        def _failed(f):
+            # nothing was added, so nothing keeps a number
+            self.assertEqual([c.number for c in changes], [None, None])
+            self.assertEqual(self.dbc.runQueryNow("SELECT * FROM changes"),
+                             [])
+        d.addCallbacks(lambda ign: self.fail("should have failed"), _failed)
+        return d
+
+    def test_addChangesToDatabase_queryCount(self):
+        counts = []
+        def _txn(t, changes):
+            cursor = CountingCursor(t)
+            self.dbc._txn_addChangesToDatabase(cursor, changes)
+            counts.append(len(cursor.queries))
+        self.dbc.runInteractionNow(_txn, self.makeChanges(2))
+        self.dbc.runInteractionNow(_txn, self.makeChanges(50))
+        # the counter, the changes, then their links, files and properties
+        self.assertEqual(counts, [6, 6])
+
+class DBConnector_BuildSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.dbfile = os.path.abspath("dbconnector_buildsummaries.sqlite")
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        self.dbspec = db.DBSpec.from_url("sqlite:///" + self.dbfile)
+        db.create_db(self.dbspec)
+        self.dbc = db.DBConnector(self.dbspec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        return flushEventualQueue()
+
+    def summary(self, number):
+        return {'start_time': 100.0 + number,
+                'finish_time': 200.5 + number,
+                'results': number % 3,
+                'branch': "trunk",
+                'revision': None,
+                'got_revision': "r%d" % number,
+                'has_patch': False,
+                'changeids': [number, number + 1],
+                'slavename': "bot1",
+                'text': ["build", "successful"],
+                }
+
+    def addSummaries(self, numbers, buildername="b1"):
+        dl = []
+        for number in numbers:
+            dl.append(self.dbc.add_build_summary("master", buildername,
+                                                 number, self.summary(number)))
+        return defer.gatherResults(dl)
+
+    def test_roundtrip(self):
+        d = self.addSummaries(range(5))
+        d.addCallback(lambda ign: self.addSummaries([3], buildername="b2"))
+        def _check(ign):
+            summaries = self.dbc.get_build_summaries("master", "b1", 1, 3)
+            self.assertEqual(sorted(summaries.keys()), [1, 2, 3])
+            self.assertEqual(summaries[2], self.summary(2))
+            self.assertEqual(self.dbc.get_summarized_build_numbers("master",
+                                                                   "b2"),
+                             set([3]))
+            self.assertEqual(self.dbc.get_build_summaries("other", "b1",
+                                                          0, 10), {})
+        d.addCallback(_check)
+        return d
+
+    def test_with_changes(self):
+        for i in range(3):
+            self.dbc.addChangeToDatabase(Change("bob", ["f"], "c%d" % i))
+        d = self.addSummaries([1, 2, 3])
+        def _check(ign):
+            summaries = self.dbc.get_build_summaries("master", "b1", 1, 3,
+                                                     with_changes=True)
+            self.assertEqual([c.comments for c in summaries[1]['changes']],
+                             ["c0", "c1"])
+            self.assertEqual([c.comments for c in summaries[2]['changes']],
+                             ["c1", "c2"])
+            # change 4 does not exist
+            self.assertEqual(summaries[3]['changes'], None)
+        d.addCallback(_check)
+        return d
+
+    def test_replace_and_unknown_changes(self):
+        d = self.addSummaries([1])
+        def _replace(ign):
+            s = self.summary(1)
+            s['changeids'] = None
+            s['has_patch'] = True
+            return self.dbc.add_build_summary("master", "b1", 1, s)
+        d.addCallback(_replace)
+        def _check(ign):
+            s = self.dbc.get_build_summaries("master", "b1", 1, 1)[1]
+            self.assertEqual(s['changeids'], None)
+            self.assertEqual(s['has_patch'], True)
+        d.addCallback(_check)
+        return d
+
+    def test_delete(self):
+        d = self.addSummaries(range(5))
+        d.addCallback(lambda ign:
+                      self.dbc.delete_build_summaries("master", "b1", 3))
+        def _check(ign):
+            self.assertEqual(self.dbc.get_summarized_build_numbers("master",
+                                                                   "b1"),
+                             set([3, 4]))
+        d.addCallback(_check)
+        return d
+
+class QueryStats(unittest.TestCase):
+
+    def test_query_shape(self):
+        self.assertEqual(db.query_shape("SELECT a FROM t WHERE b='x''y'"
+                                        "  AND c IN (%s,%s,%s) LIMIT 1"),
+                         "SELECT a FROM t WHERE b=? AND c IN (...) LIMIT ?")
+
+    def test_query_shape_sameForDifferentLists(self):
+        self.assertEqual(db.query_shape("SELECT a FROM t WHERE c IN (?)"),
+                         db.query_shape("SELECT a FROM t WHERE c IN (?,?)"))
+
+    def test_asDict(self):
+        stats = db.QueryStats()
+        for i in range(100):
+            stats.record_query("SELECT a FROM t WHERE id=%d" % i, i/100.0, 2)
+        stats.record_interaction(self.test_asDict, 0.5)
+        d = stats.asDict()
+        q = d['queries']["SELECT a FROM t WHERE id=?"]
+        self.assertEqual((q['count'], q['rows']), (100, 200))
+        self.assertEqual((q['p50'], q['p95'], q['p99']), (0.5, 0.95, 0.99))
+        self.assertEqual(d['interactions']['test_asDict']['count'], 1)
+
+    def test_connector(self):
+        dbc = db.DBConnector(db.DBSpec.from_url("sqlite://"))
+        dbc.start()
+        try:
+            dbc.runQueryNow("SELECT 1")
+            def _txn(t):
+                t.execute("SELECT 2")
+                return t.fetchall()
+            dbc.runInteractionNow(_txn)
+        finally:
+            dbc.stop()
+        d = dbc.query_stats.asDict()
+        self.assertEqual(d['queries']["SELECT ?"]['count'], 2)
+        self.assertEqual(d['queries']["SELECT ?"]['rows'], 2)
+        self.assertEqual(d['interactions']['_txn']['count'], 1)
@@ -0,0 +1,124 @@
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+
+from buildbot import dbnotify
+from buildbot.util.eventual import flushEventualQueue
+
+class FakeDB:
+    def __init__(self):
+        self.publisher = None
+        self.received = []
+    def set_notification_publisher(self, publisher):
+        self.publisher = publisher
+    def send_notification(self, category, args):
+        self.received.append((category, args))
+
+class Notifications(unittest.TestCase):
+
+    def setUp(self):
+        self.server = dbnotify.DBNotificationServer("tcp:0:interface=127.0.0.1")
+        self.server.startService()
+        port = self.server.getPort()
+        self.dbs = []
+        self.clients = []
+        self.connects = []
+        for i in range(3):
+            db = FakeDB()
+            c = dbnotify.DBNotificationClient("127.0.0.1:%d" % port, db,
+                    on_connect=lambda i=i: self.connects.append(i))
+            c.startService()
+            self.dbs.append(db)
+            self.clients.append(c)
+        return defer.gatherResults([c.when_connected() for c in self.clients])
+
+    def tearDown(self):
+        dl = [defer.maybeDeferred(c.stopService) for c in self.clients]
+        dl.append(defer.maybeDeferred(self.server.stopService))
+        d = defer.gatherResults(dl)
+        # give the server a chance to notice the disconnections
+        d.addCallback(lambda ign: self.wait())
+        return d
+
+    def wait(self, delay=0.1):
+        d = defer.Deferred()
+        reactor.callLater(delay, d.callback, None)
+        return d
+
+    def test_connect(self):
+        self.assertEqual(sorted(self.connects), [0, 1, 2])
+        for c, db in zip(self.clients, self.dbs):
+            self.assertEqual(db.publisher, c.publish)
+
+    def test_fanout(self):
+        self.dbs[0].publisher("add-buildrequest", (12, 13))
+        self.dbs[1].publisher("add-change", (5,))
+        d = self.wait()
+        def check(ign):
+            self.assertEqual(self.dbs[0].received, [("add-change", (5,))])
+            self.assertEqual(self.dbs[1].received,
+                             [("add-buildrequest", (12, 13))])
+            # there is no ordering between different publishers
+            self.assertEqual(sorted(self.dbs[2].received),
+                             [("add-buildrequest", (12, 13)),
+                              ("add-change", (5,))])
+        d.addCallback(check)
+        return d
+
+    def test_large_batch(self):
+        # one line of 3000 ids would exceed LineReceiver.MAX_LENGTH and make
+        # the server drop the connection
+        ids = tuple(range(1000000, 1003000))
+        self.dbs[0].publisher("add-change", ids)
+        self.dbs[0].publisher("modify-buildset", (1,))
+        d = self.wait()
+        def check(ign):
+            received = self.dbs[1].received
+            self.failUnless(len(received) > 2)
+            self.assertEqual(received[-1], ("modify-buildset", (1,)))
+            got = ()
+            for (category, args) in received[:-1]:
+                self.assertEqual(category, "add-change")
+                got += args
+            self.assertEqual(got, ids)
+            self.failUnless(self.clients[0].is_connected())
+        d.addCallback(check)
+        return d
+
+    def test_malformed(self):
+        self.clients[0]._protocol.sendLine("add-change five")
+        self.clients[0]._protocol.sendLine("")
+        self.dbs[0].publisher("modify-buildset", (1,))
+        d = self.wait()
+        def check(ign):
+            self.assertEqual(self.dbs[1].received, [("modify-buildset", (1,))])
+        d.addCallback(check)
+        return d
+
+    def test_stop_unpublishes(self):
+        c = self.clients.pop()
+        d = defer.maybeDeferred(c.stopService)
+        def check(ign):
+            self.assertEqual(self.dbs[2].publisher, None)
+            self.failIf(c.is_connected())
+        d.addCallback(check)
+        return d
+
+class DBConnectorPublishing(unittest.TestCase):
+
+    def test_end_operation_publishes(self):
+        from buildbot import db
+        dbc = db.DBConnector(db.DBSpec.from_url("sqlite://"))
+        published = []
+        local = []
+        dbc.subscribe_to("add-change", lambda cat, *args: local.append(args))
+        dbc.set_notification_publisher(
+                lambda cat, args: published.append((cat, args)))
+        t = dbc._start_operation()
+        dbc.notify("add-change", 7)
+        dbc._end_operation(t)
+        d = flushEventualQueue()
+        def check(ign):
+            self.assertEqual(published, [("add-change", (7,))])
+            self.assertEqual(local, [(7,)])
+        d.addCallback(check)
+        return d
@@ -0,0 +1,69 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from buildbot import master
+
+class FakeDB:
+    def __init__(self):
+        self.brid_builders = {}
+    def get_buildernames_for_buildrequests(self, brids):
+        names = set()
+        for brid in brids:
+            names.add(self.brid_builders[brid])
+        return defer.succeed(names)
+
+class FakeRequestIndex:
+    def get_oldest_request_times(self, master_name, master_incarnation):
+        return defer.succeed({})
+    def resync(self):
+        pass
+
+class FakeBuilder:
+    running = True
+    def __init__(self, name, runs):
+        self.name = name
+        self.runs = runs
+    def run(self):
+        self.runs.append(self.name)
+
+class TargetedRuns(unittest.TestCase):
+
+    def setUp(self):
+        self.runs = []
+        self.botmaster = master.BotMaster()
+        self.botmaster.setMasterName("master", "incarnation")
+        self.botmaster.db = FakeDB()
+        self.botmaster.db.brid_builders = {1: "b1", 2: "b3", 3: "b3"}
+        self.botmaster.request_index = FakeRequestIndex()
+        for name in ("b1", "b2", "b3"):
+            self.botmaster.builders[name] = FakeBuilder(name, self.runs)
+            self.botmaster.builderNames.append(name)
+        self.clock = self.botmaster.loop._reactor = task.Clock()
+        self.botmaster.loop.startService()
+
+    def tearDown(self):
+        return self.botmaster.loop.stopService()
+
+    def test_add_buildrequest(self):
+        self.botmaster.trigger_add_buildrequest("add-buildrequest", 2, 3)
+        self.clock.advance(0)
+        self.assertEqual(self.runs, ["b3"])
+        self.botmaster.trigger_add_buildrequest("add-buildrequest", 1, 2)
+        self.clock.advance(0)
+        self.assertEqual(self.runs, ["b3", "b1", "b3"])
+
+    def test_new_build_check(self):
+        self.botmaster.triggerNewBuildCheck()
+        # a targeted trigger does not narrow down a pending full one
+        self.botmaster.trigger_add_buildrequest("add-buildrequest", 1)
+        self.clock.advance(0)
+        self.assertEqual(sorted(self.runs), ["b1", "b2", "b3"])
+        del self.runs[:]
+        self.botmaster.trigger_resync()
+        self.clock.advance(0)
+        self.assertEqual(sorted(self.runs), ["b1", "b2", "b3"])
+
+    def test_removed_builder(self):
+        self.botmaster.trigger_builders(["b1", "gone"])
+        self.clock.advance(0)
+        self.assertEqual(self.runs, ["b1"])
@@ -0,0 +1,72 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from buildbot import master
+
+class FakeDB:
+    def __init__(self):
+        self.times = {}
+        self.calls = []
+    def get_oldest_request_times(self, old, master_name, master_incarnation,
+                                 brids=None):
+        self.calls.append(brids)
+        if brids is None:
+            return defer.succeed(dict(self.times))
+        return defer.succeed(dict([(name, self.times.get(name))
+                                   for name in self.brid_builders[brids[0]]]))
+
+class OldestRequestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDB()
+        self.db.times = {"b1": 10, "b2": 20}
+        self.index = master.OldestRequestIndex(self.db)
+
+    def get(self):
+        return self.index.get_oldest_request_times("master", "incarnation")
+
+    def test_initialResync(self):
+        d = self.get()
+        def check(times):
+            self.assertEqual(times, {"b1": 10, "b2": 20})
+            self.assertEqual(self.db.calls, [None])
+        d.addCallback(check)
+        return d
+
+    def test_noChanges(self):
+        d = self.get()
+        d.addCallback(lambda _ : self.get())
+        def check(times):
+            self.assertEqual(times, {"b1": 10, "b2": 20})
+            # the second call did not go to the database
+            self.assertEqual(self.db.calls, [None])
+        d.addCallback(check)
+        return d
+
+    def test_changedBuilders(self):
+        d = self.get()
+        def change(_):
+            # request 5 (of b1) was claimed and b1 has nothing else to do
+            del self.db.times["b1"]
+            self.db.brid_builders = {5: ["b1"]}
+            self.index.buildrequests_changed("claim-buildrequest", 5)
+            return self.get()
+        d.addCallback(change)
+        def check(times):
+            self.assertEqual(times, {"b2": 20})
+            self.assertEqual(self.db.calls, [None, [5]])
+        d.addCallback(check)
+        return d
+
+    def test_resync(self):
+        d = self.get()
+        def change(_):
+            self.db.times["b3"] = 5
+            self.index.resync()
+            return self.get()
+        d.addCallback(change)
+        def check(times):
+            self.assertEqual(times, {"b1": 10, "b2": 20, "b3": 5})
+            self.assertEqual(self.db.calls, [None, None])
+        d.addCallback(check)
+        return d
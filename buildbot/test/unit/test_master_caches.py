@@ -0,0 +1,29 @@
+from twisted.trial import unittest
+
+from buildbot import master
+
+class ParseCacheSizes(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(master.parse_cache_sizes(
+                {'changes': 1000,
+                 'sourcestamps': {'max_size': 10, 'max_bytes': 2048},
+                 'builds': {'max_size': 0}}),
+                         {'changes': {'max_size': 1000},
+                          'sourcestamps': {'max_size': 10,
+                                           'max_bytes': 2048},
+                          'builds': {'max_size': 0}})
+
+    def test_max_bytes_only(self):
+        # the byte budget alone bounds the cache
+        self.assertEqual(master.parse_cache_sizes(
+                {'changes': {'max_bytes': 100000}}),
+                         {'changes': {'max_size': None, 'max_bytes': 100000}})
+
+    def test_bad(self):
+        for caches in ([], {'logs': 10}, {'changes': -1},
+                       {'changes': None}, {'changes': {'max_size': None}},
+                       {'changes': {'max_bytes': None}},
+                       {'changes': {'max_size': "10"}},
+                       {'changes': {'max_items': 10}}):
+            self.assertRaises(ValueError, master.parse_cache_sizes, caches)
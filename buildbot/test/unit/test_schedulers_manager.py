@@ -0,0 +1,328 @@
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.application import service
+
+from buildbot import db
+from buildbot.changes.changes import Change
+from buildbot.schedulers import manager, basic, timed
+from buildbot.util.eventual import flushEventualQueue
+
+class FakeChangeSource:
+    def __init__(self, dbc):
+        self.dbc = dbc
+    def getChangesGreaterThan(self, last_changeid, t=None):
+        return self.dbc.getChangesGreaterThan(last_changeid, t)
+
+def isImportant(change):
+    return "important" in change.comments
+
+def brokenIsImportant(change):
+    raise RuntimeError("oops")
+
+class OtherBranchScheduler(basic.Scheduler):
+    # written before getChangeFilter existed
+    def changeIsRelevant(self, change):
+        return change.branch in (self.branch, "other")
+
+class ClassifyMixin:
+
+    def setUp(self):
+        self.dbfile = os.path.abspath("schedulermanager_classify.sqlite")
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        self.dbspec = db.DBSpec.from_url("sqlite:///" + self.dbfile)
+        db.create_db(self.dbspec)
+        self.dbc = db.DBConnector(self.dbspec)
+        self.dbc.start()
+        self.sm = manager.SchedulerManager(None, self.dbc,
+                                           FakeChangeSource(self.dbc))
+
+    def tearDown(self):
+        self.dbc.stop()
+        if os.path.exists(self.dbfile):
+            os.unlink(self.dbfile)
+        return flushEventualQueue()
+
+    def addSchedulers(self, *schedulers):
+        for s in schedulers:
+            s.setServiceParent(self.sm)
+        self.dbc.runInteractionNow(self.dbc._addSchedulers, schedulers)
+
+    def addChange(self, comments, branch=None, category=None):
+        c = Change("bob", ["foo.c"], comments, branch=branch,
+                   category=category)
+        self.dbc.addChangeToDatabase(c)
+        return c.number
+
+    def classify(self):
+        return self.dbc.runInteractionNow(self.sm.classify_changes_txn,
+                                          self.sm.get_classifiers())
+
+    def getClassified(self, s):
+        important, unimportant = self.dbc.runInteractionNow(
+            lambda t: self.dbc.scheduler_get_classified_changes(s.schedulerid,
+                                                                t))
+        return (sorted([c.number for c in important]),
+                sorted([c.number for c in unimportant]))
+
+    def getState(self, s):
+        return self.dbc.runInteractionNow(s.get_state)
+
+class ClassifyChanges(ClassifyMixin, unittest.TestCase):
+
+    def test_dispatch(self):
+        trunk = basic.Scheduler("trunk", None, None, ["b"])
+        b1 = basic.Scheduler("b1", "b1", None, ["b"], categories=["cat"])
+        anybranch = basic.AnyBranchScheduler("any", None, ["b"],
+                                             fileIsImportant=isImportant)
+        nightly = timed.Nightly("nightly", ["b"], branch="b2",
+                                onlyIfChanged=True)
+        always = timed.Nightly("always", ["b"])
+        self.addSchedulers(trunk, b1, anybranch, nightly, always)
+        self.assertEqual(self.sm.get_classifiers(),
+                         [trunk, b1, anybranch, nightly])
+
+        c1 = self.addChange("important fix")
+        c2 = self.addChange("fix", branch="b1", category="cat")
+        c3 = self.addChange("fix", branch="b1", category="other")
+        c4 = self.addChange("important fix", branch="b2")
+        self.assertEqual(self.classify(), set([trunk, b1, anybranch,
+                                               nightly]))
+        self.assertEqual(self.getClassified(trunk), ([c1], []))
+        self.assertEqual(self.getClassified(b1), ([c2], []))
+        self.assertEqual(self.getClassified(anybranch), ([c1, c4],
+                                                         [c2, c3]))
+        self.assertEqual(self.getClassified(nightly), ([c4], []))
+        # c3 was only looked at by the AnyBranchScheduler
+        self.assertEqual(self.sm.classifier_stats['candidates'], 7)
+        self.assertEqual(self.sm.classifier_stats['changes'], 4)
+        for s in (trunk, b1, anybranch, nightly):
+            self.assertEqual(self.getState(s)["last_processed"], c4)
+        self.assertEqual(self.getState(nightly)["last_build"], None)
+        # not paying attention to changes
+        self.assertEqual(self.getState(always)["last_processed"], 0)
+
+        # nothing new: nothing is classified twice
+        self.assertEqual(self.classify(), set())
+        self.assertEqual(self.getClassified(anybranch), ([c1, c4],
+                                                         [c2, c3]))
+        self.assertEqual(self.sm.classifier_stats['classified'], 7)
+
+    def test_changeIsRelevant_override(self):
+        s = OtherBranchScheduler("s", None, None, ["b"])
+        self.addSchedulers(s)
+        c1 = self.addChange("fix", branch="other")
+        self.addChange("fix", branch="third")
+        c3 = self.addChange("fix")
+        self.classify()
+        self.assertEqual(self.getClassified(s), ([c1, c3], []))
+
+    def test_state_kept(self):
+        # a scheduler that changes its state meanwhile (as Nightly does
+        # when it builds) keeps the change: only last_processed is written
+        nightly = timed.Nightly("nightly", ["b"], onlyIfChanged=True)
+        self.addSchedulers(nightly)
+        self.classify()
+        c1 = self.addChange("fix")
+        get_states = self.dbc.scheduler_get_states
+        def get_states_and_build(schedulerids, t):
+            states = get_states(schedulerids, t)
+            self.patch(self.dbc, "scheduler_get_states", get_states)
+            state = nightly.get_state(t)
+            state["last_build"] = 1234
+            nightly.set_state(t, state)
+            return states
+        self.patch(self.dbc, "scheduler_get_states", get_states_and_build)
+        self.classify()
+        self.assertEqual(self.getState(nightly),
+                         {"last_build": 1234, "last_processed": c1})
+
+    def test_new_scheduler(self):
+        trunk = basic.Scheduler("trunk", None, None, ["b"])
+        self.addSchedulers(trunk)
+        c1 = self.addChange("fix")
+        self.classify()
+        # a new scheduler ignores the changes that came before it
+        late = basic.Scheduler("late", None, None, ["b"])
+        self.addSchedulers(late)
+        c2 = self.addChange("fix")
+        self.classify()
+        self.assertEqual(self.getClassified(trunk), ([c1, c2], []))
+        self.assertEqual(self.getClassified(late), ([c2], []))
+        self.assertEqual(self.sm.classifier_stats['changes'], 2)
+
+    def test_nightly_without_last_processed(self):
+        nightly = timed.Nightly("nightly", ["b"], onlyIfChanged=True)
+        self.addSchedulers(nightly)
+        c1 = self.addChange("fix")
+        # as saved before Nightly kept track of the changes it had seen
+        self.dbc.runInteractionNow(nightly.set_state, {"last_build": None})
+        self.classify()
+        self.assertEqual(self.getClassified(nightly), ([], []))
+        self.assertEqual(self.getState(nightly),
+                         {"last_build": None, "last_processed": c1})
+        c2 = self.addChange("fix")
+        self.classify()
+        self.assertEqual(self.getClassified(nightly), ([c2], []))
+
+class ClassifyErrors(ClassifyMixin, unittest.TestCase):
+    # a class of its own, so that its logged errors are not mixed up with
+    # those of other tests
+
+    def test_raising_scheduler(self):
+        good = basic.Scheduler("good", None, None, ["b"])
+        broken = basic.Scheduler("broken", None, None, ["b"],
+                                 fileIsImportant=brokenIsImportant)
+        self.addSchedulers(good, broken)
+        c1 = self.addChange("fix")
+        self.assertEqual(self.classify(), set([good]))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.getClassified(good), ([c1], []))
+        self.assertEqual(self.getState(good)["last_processed"], c1)
+        # the broken one is given the change again next time
+        self.assertEqual(self.getState(broken)["last_processed"], 0)
+        self.classify()
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.getClassified(broken), ([], []))
+
+class FakeDB:
+    def __init__(self):
+        self.subscribers = {}
+    def scheduler_get_buildset_subscribers(self, bsids):
+        schedulerids = set()
+        for bsid in bsids:
+            schedulerids.update(self.subscribers.get(bsid, []))
+        return defer.succeed(schedulerids)
+
+class FakeScheduler(service.Service):
+    def __init__(self, name, events):
+        self.name = name
+        self.schedulerid = int(name[1:])
+        self.events = events
+        self.pending = []
+    def run(self):
+        self.events.append(self.name)
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+class ConcurrentRuns(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.classifying = []
+        self.classified = []
+        self.sm = manager.SchedulerManager(None, FakeDB(), None)
+        self.clock = self.sm._reactor = task.Clock()
+        self.sm.classify_changes = self.classify_changes
+        self.sm.concurrency = 2
+        self.schedulers = [FakeScheduler(name, self.events)
+                           for name in ("s1", "s2", "s3")]
+        for s in self.schedulers:
+            s.setServiceParent(self.sm)
+        self.sm.startService()
+
+    def tearDown(self):
+        self.sm.concurrency = 3
+        while self.classifying or [s for s in self.schedulers if s.pending]:
+            self.finishClassifying()
+            for s in self.schedulers:
+                self.finish(s)
+        return self.sm.stopService()
+
+    def classify_changes(self):
+        self.events.append("classify")
+        d = defer.Deferred()
+        d.addCallback(lambda ign: set(self.classified))
+        self.classifying.append(d)
+        return d
+
+    def finishClassifying(self):
+        while self.classifying:
+            self.classifying.pop(0).callback(None)
+        self.clock.advance(0)
+
+    def finish(self, s):
+        while s.pending:
+            s.pending.pop(0).callback(None)
+        self.clock.advance(0)
+
+    def test_classified_first(self):
+        self.sm.trigger()
+        self.clock.advance(0)
+        # both of the running schedulers wait for one classification
+        self.assertEqual(self.events, ["classify"])
+        self.finishClassifying()
+        self.assertEqual(self.events, ["classify", "s1", "s2"])
+        # a slow scheduler does not hold up the others
+        self.finish(self.schedulers[1])
+        self.assertEqual(self.events, ["classify", "s1", "s2", "s3"])
+        self.assertEqual(self.sm.getStats()['running'], 2)
+
+    def test_trigger_while_classifying(self):
+        self.sm.trigger()
+        self.clock.advance(0)
+        self.sm.trigger()
+        self.clock.advance(0)
+        self.finishClassifying()
+        # changes that came during the first classification are classified
+        # before anything runs again, and once nothing is running
+        self.assertEqual(self.events, ["classify", "s1", "s2"])
+        self.finish(self.schedulers[0])
+        self.assertEqual(self.events, ["classify", "s1", "s2"])
+        self.finish(self.schedulers[1])
+        self.assertEqual(self.events, ["classify", "s1", "s2", "classify"])
+        self.finishClassifying()
+        # the two that were running when the second trigger came run again
+        self.assertEqual(self.events,
+                         ["classify", "s1", "s2", "classify", "s3", "s1"])
+
+    def test_timer_runs_without_classifying(self):
+        self.sm.trigger()
+        self.clock.advance(0)
+        self.finishClassifying()
+        for s in self.schedulers:
+            self.finish(s)
+        del self.events[:]
+        d = self.sm.when_classified()
+        self.failUnless(d.called)
+        self.assertEqual(self.events, [])
+
+    def test_add_change(self):
+        # only the schedulers that were given the change run
+        self.classified = self.schedulers[1:2]
+        self.sm.trigger_add_change("add-change", 1)
+        self.clock.advance(0)
+        self.assertEqual(self.events, ["classify"])
+        self.finishClassifying()
+        self.assertEqual(self.events, ["classify", "s2"])
+        self.finish(self.schedulers[1])
+        self.classified = []
+        # a batch of changes comes in one notification
+        self.sm.trigger_add_change("add-change", 2, 3, 4)
+        self.finishClassifying()
+        self.assertEqual(self.events, ["classify", "s2", "classify"])
+
+    def test_add_change_while_running(self):
+        # even one at a time, a scheduler that is running is not raced by
+        # the classification of a new change
+        self.sm.concurrency = 1
+        self.sm.trigger()
+        self.clock.advance(0)
+        self.finishClassifying()
+        self.assertEqual(self.events, ["classify", "s1"])
+        self.sm.trigger_add_change("add-change", 1)
+        self.clock.advance(0)
+        self.assertEqual(self.events, ["classify", "s1"])
+        self.finish(self.schedulers[0])
+        self.assertEqual(self.events, ["classify", "s1", "classify"])
+        self.finishClassifying()
+        self.assertEqual(self.events, ["classify", "s1", "classify", "s2"])
+
+    def test_modify_buildset(self):
+        self.sm.db.subscribers = {10: [3], 11: [1, 3]}
+        self.sm.trigger_modify_buildset("modify-buildset", 10, 11)
+        self.clock.advance(0)
+        self.assertEqual(sorted(self.events), ["s1", "s3"])
@@ -0,0 +1,139 @@
+import os, time, random
+
+from twisted.trial import unittest
+
+from buildbot.schedulers import timed
+
+def bruteForceNextRunTime(s, now, years=2):
+    # the original algorithm: try every minute until one matches
+    dateTime = time.localtime(now)
+    dateTime = time.localtime(time.mktime(dateTime) + 60 - dateTime[5])
+    yearLimit = dateTime[0] + years
+    while not s._isRunTime(dateTime):
+        dateTime = time.localtime(time.mktime(dateTime) + 60)
+        assert dateTime[0] < yearLimit
+    return time.mktime(dateTime)
+
+class TimeZoneMixin:
+
+    def setTimeZone(self, tz):
+        if not os.path.exists(os.path.join("/usr/share/zoneinfo", tz)):
+            raise unittest.SkipTest("time zone %s is not available" % tz)
+        self.addCleanup(self.restoreTimeZone, os.environ.get("TZ"))
+        os.environ["TZ"] = tz
+        time.tzset()
+
+    def restoreTimeZone(self, tz):
+        if tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = tz
+        time.tzset()
+
+class Fields(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(timed._parseField("minute", '*/15', 0, 59),
+                         [0, 15, 30, 45])
+        self.assertEqual(timed._parseField("hour", '1-3,20/2', 0, 23),
+                         [1, 2, 3, 20, 22])
+        self.assertEqual(timed._parseField("hour", [5, '0-10/5'], 0, 23),
+                         [0, 5, 10])
+        self.assertEqual(timed._parseField("minute", 0, 0, 59), [0])
+        self.assertEqual(timed._parseField("month", '*', 1, 12),
+                         range(1, 13))
+
+    def test_bad(self):
+        for value in ('60', '5-1', '*/0', 'x', [1, 61]):
+            self.assertRaises(ValueError, timed._parseField, "minute",
+                              value, 0, 59)
+        self.assertRaises(ValueError, timed.Nightly, "n", ["b"],
+                          month=2, dayOfMonth=30)
+        # either of the days is enough
+        timed.Nightly("n", ["b"], month=2, dayOfMonth=30, dayOfWeek=0)
+
+class NextRunTime(unittest.TestCase, TimeZoneMixin):
+
+    def assertSameAsBruteForce(self, s, now):
+        self.assertEqual((now, s._calculateNextRunTimeFrom(now)),
+                         (now, bruteForceNextRunTime(s, now)))
+
+    def test_examples(self):
+        self.setTimeZone("America/New_York")
+        MIN=60; HOUR=60*MIN; DAY=24*3600
+        now = time.mktime((2005, 11, 15, 0, 5, 36, 1, 319, -1))
+        for (kwargs, delay) in [
+            (dict(hour=3), 2*HOUR+54*MIN+24),
+            (dict(minute=[3,8,54]), 2*MIN+24),
+            (dict(dayOfMonth=16, hour=1, minute=6), DAY+HOUR+24),
+            (dict(dayOfMonth=16, hour=1, minute=3), DAY+57*MIN+24),
+            (dict(dayOfMonth=15, hour=1, minute=3), 57*MIN+24),
+            (dict(dayOfMonth=15, hour=0, minute=3), 30*DAY-3*MIN+24),
+            ]:
+            s = timed.Nightly('nightly', ["a"], **kwargs)
+            self.assertEqual(int(s._calculateNextRunTimeFrom(now) - now),
+                             delay)
+
+    def test_leap_day(self):
+        self.setTimeZone("Europe/London")
+        s = timed.Nightly('leap', ["a"], month=2, dayOfMonth=29, hour=12)
+        now = time.mktime((2097, 3, 1, 0, 0, 0, 0, 0, -1))
+        # 2100 is not a leap year
+        self.assertEqual(time.localtime(s._calculateNextRunTimeFrom(now))[:5],
+                         (2104, 2, 29, 12, 0))
+        now = time.mktime((2027, 3, 1, 0, 0, 0, 0, 0, -1))
+        self.assertSameAsBruteForce(s, now)
+
+    def test_dst(self):
+        # every minute of the days around the clock changes, both ways
+        for (tz, dates) in [("America/New_York", [(2010, 3, 14),
+                                                  (2010, 11, 7)]),
+                            ("Australia/Lord_Howe", [(2010, 4, 4),
+                                                     (2010, 10, 3)])]:
+            self.setTimeZone(tz)
+            schedules = [timed.Nightly('hourly', ["a"], minute=30),
+                         timed.Nightly('nightly', ["a"], hour=2, minute=15),
+                         timed.Nightly('often', ["a"], minute='*/7',
+                                       hour='0-3')]
+            for (y, m, d) in dates:
+                start = int(time.mktime((y, m, d - 1, 20, 0, 0, 0, 0, -1)))
+                for now in range(start, start + 10*3600, 60*5 + 7):
+                    for s in schedules:
+                        self.assertSameAsBruteForce(s, now)
+
+    def randomField(self, rnd, low, high, wildcard=0.5):
+        if rnd.random() < wildcard:
+            return '*'
+        kind = rnd.choice(["int", "list", "step", "range"])
+        if kind == "int":
+            return rnd.randint(low, high)
+        if kind == "list":
+            return rnd.sample(range(low, high+1),
+                              rnd.randint(1, min(4, high - low + 1)))
+        if kind == "step":
+            return "%d/%d" % (rnd.randint(low, low + 3), rnd.randint(2, 7))
+        start = rnd.randint(low, high)
+        return "%d-%d" % (start, rnd.randint(start, high))
+
+    def test_random(self):
+        rnd = random.Random(4)
+        for tz in ("UTC", "America/New_York", "Europe/London",
+                   "Australia/Lord_Howe"):
+            self.setTimeZone(tz)
+            for i in range(25):
+                # days that match often enough for the brute force to be
+                # quick
+                dom = self.randomField(rnd, 1, 31, 0.7)
+                dow = self.randomField(rnd, 0, 6, 0.5)
+                if dom != '*' and dow == '*':
+                    dom = '*/2'
+                try:
+                    s = timed.Nightly('random', ["a"],
+                                      minute=self.randomField(rnd, 0, 59, 0.2),
+                                      hour=self.randomField(rnd, 0, 23),
+                                      dayOfMonth=dom, dayOfWeek=dow,
+                                      month=self.randomField(rnd, 1, 12, 0.9))
+                except ValueError:
+                    continue
+                now = rnd.randint(1262304000, 1577836800) + rnd.random()
+                self.assertSameAsBruteForce(s, now)
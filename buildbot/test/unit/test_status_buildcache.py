@@ -0,0 +1,59 @@
+from twisted.trial import unittest
+
+from buildbot.process.properties import Properties
+from buildbot.status import buildcache
+
+class FakeStep:
+    text = ["compile"]
+    text2 = []
+    logs = ["stdio"]
+    urls = {}
+
+class FakeBuild:
+    def __init__(self, number, steps=1):
+        self.number = number
+        self.text = ["build", "successful"]
+        self.properties = Properties()
+        self.steps = [FakeStep()] * steps
+
+class BuildCache(unittest.TestCase):
+
+    def test_shared_between_builders(self):
+        cache = buildcache.BuildCache(max_size=3)
+        for name in ("b1", "b2"):
+            for number in range(2):
+                cache.add(name, FakeBuild(number))
+        self.failIf(cache.has("b1", 0))
+        self.failUnless(cache.has("b1", 1))
+        self.assertEqual(sorted(cache.getNumbers("b2")), [0, 1])
+        self.assertEqual(cache.get("b1", 0), None)
+        self.assertEqual(cache.get("b2", 1).number, 1)
+
+    def test_max_bytes(self):
+        size = buildcache.build_size(FakeBuild(0, steps=10))
+        cache = buildcache.BuildCache(max_size=100, max_bytes=size * 2)
+        for number in range(5):
+            cache.add("b1", FakeBuild(number, steps=10))
+        self.assertEqual(sorted(cache.getNumbers("b1")), [3, 4])
+        self.failUnless(buildcache.build_size(FakeBuild(0, steps=1)) < size)
+
+    def test_stats(self):
+        cache = buildcache.BuildCache()
+        cache.add("b1", FakeBuild(0))
+        cache.get("b1", 0)
+        cache.get("b1", 1)
+        cache.buildLoaded(0.5)
+        cache.buildLoaded(1.5, prefetch=True)
+        cache.buildLoadFailed()
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual((stats['loads'], stats['prefetched'],
+                          stats['load_failures']), (2, 1, 1))
+        self.assertEqual(stats['average_load_time'], 1.0)
+
+    def test_resize(self):
+        cache = buildcache.BuildCache()
+        for number in range(5):
+            cache.add("b1", FakeBuild(number))
+        cache.resize(max_size=2)
+        self.assertEqual(sorted(cache.getNumbers("b1")), [3, 4])
@@ -0,0 +1,426 @@
+import os, shutil
+from cPickle import load
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.persisted import styles
+
+from buildbot import db
+from buildbot.changes.changes import Change
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder, buildcache, pruner, saver
+from buildbot.util.eventual import flushEventualQueue
+
+class FakeBotMaster:
+    master_name = "master"
+    def __init__(self):
+        self.builderNames = []
+        self.builders = {}
+
+class FakeBuilder:
+    def __init__(self, builder_status):
+        self.builder_status = builder_status
+
+class FakeStatus:
+    def __init__(self, db):
+        self.db = db
+        self.botmaster = FakeBotMaster()
+        self.buildCache = buildcache.BuildCache()
+        self.filePruner = pruner.FilePruner(interval=0)
+        self.builderSaver = saver.BuilderSaver(delay=0)
+
+class BuildSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_builder_BuilderStatus")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.dbspec = db.DBSpec.from_url("sqlite:///" +
+                                         os.path.join(self.basedir, "state"))
+        db.create_db(self.dbspec)
+        self.dbc = db.DBConnector(self.dbspec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+        return flushEventualQueue()
+
+    def cached(self, b):
+        return sorted(b.status.buildCache.getNumbers(b.name))
+
+    def makeBuilderStatus(self, name="b1", status=None):
+        b = builder.BuilderStatus(name)
+        b.basedir = os.path.join(self.basedir, name)
+        if not os.path.exists(b.basedir):
+            os.makedirs(b.basedir)
+        b.status = status or FakeStatus(self.dbc)
+        b.determineNextBuildNumber()
+        return b
+
+    def addBuilds(self, count, name="b1", spacing=1.0, offset=0.0):
+        b = self.makeBuilderStatus(name)
+        dl = []
+        for i in range(count):
+            s = b.newBuild()
+            branch = ["trunk", "release"][i % 2]
+            s.setSourceStamp(SourceStamp(branch, str(100 + i)))
+            s.started = 1000.0 + offset + i * spacing
+            s.finished = 1010.0 + offset + i * spacing
+            s.results = builder.SUCCESS
+            s.text = ["build", "successful"]
+            s.slavename = "bot1"
+            s.saveYourself()
+            dl.append(b._addBuildSummary(s))
+        return defer.gatherResults(dl)
+
+    def test_generateBuilds(self):
+        d = self.addBuilds(5)
+        def check(ign):
+            b = self.makeBuilderStatus()
+            builds = list(b.generateBuilds())
+            self.assertEqual([s.getNumber() for s in builds], [4, 3, 2, 1, 0])
+            for s in builds:
+                self.failUnless(isinstance(s, builder.BuildSummary))
+            s = builds[1]
+            self.assertEqual(s.getTimes(), (1003.0, 1013.0))
+            self.assertEqual(s.getText(), ["build", "successful"])
+            self.assertEqual(s.getResults(), builder.SUCCESS)
+            self.assertEqual(s.getSourceStamp(), SourceStamp("release", "103"))
+            # nothing was loaded so far
+            self.assertEqual(self.cached(b), [])
+            # other attributes come from the full build
+            self.assertEqual(s.getSteps(), [])
+            self.assertEqual(self.cached(b), [3])
+            self.assertEqual(len(list(b.generateBuilds(max_search=2))), 2)
+        d.addCallback(check)
+        return d
+
+    def test_generateBuilds_changes(self):
+        c = Change("bob", ["f"], "fix", revision="105")
+        self.dbc.addChangeToDatabase(c)
+        b = self.makeBuilderStatus()
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp("trunk", "105", changes=[c]))
+        s.started, s.finished = 1000.0, 1010.0
+        s.results = builder.SUCCESS
+        s.text = []
+        s.saveYourself()
+        d = b._addBuildSummary(s)
+        def check(ign):
+            b = self.makeBuilderStatus()
+            self.dbc._change_cache.clear()
+            before = self.interactions()
+            (summary,) = list(b.generateBuilds())
+            # the changes came with the summaries, in the same transaction
+            self.assertEqual(self.interactions(), before + 1)
+            self.assertEqual([ch.comments for ch in summary.getChanges()],
+                             ["fix"])
+            self.assertEqual(summary.getSourceStamp().changes[0].number,
+                             c.number)
+            self.assertEqual(self.interactions(), before + 1)
+            self.assertEqual(self.cached(b), [])
+        d.addCallback(check)
+        return d
+
+    def interactions(self):
+        return sum([i['count'] for i in
+                    self.dbc.query_stats.asDict()['interactions'].values()])
+
+    def test_generateBuilds_batches(self):
+        d = self.addBuilds(5)
+        def check(ign):
+            b = self.makeBuilderStatus()
+            b.summaryBatchSize = 2
+            self.assertEqual([s.getNumber() for s in b.generateBuilds()],
+                             [4, 3, 2, 1, 0])
+        d.addCallback(check)
+        return d
+
+    def test_recent_summaries(self):
+        d = self.addBuilds(5)
+        def load(ign):
+            self.b = self.makeBuilderStatus()
+            self.b.summaryWindow = 3
+            return self.b.loadRecentSummaries()
+        d.addCallback(load)
+        def check(ign):
+            b = self.b
+            self.assertEqual(sorted(b._recentSummaries), [2, 3, 4])
+            before = self.interactions()
+            builds = list(b.generateBuilds(max_search=3))
+            # read without blocking, before we were asked
+            self.assertEqual(self.interactions(), before)
+            self.assertEqual([s.getNumber() for s in builds], [4, 3, 2])
+            self.assertEqual(builds[0].getSourceStamp(),
+                             SourceStamp("trunk", "104"))
+            # older builds are read from the database, in one batch
+            builds = list(b.generateBuilds())
+            self.assertEqual(self.interactions(), before + 1)
+            self.assertEqual([s.getNumber() for s in builds], [4, 3, 2, 1, 0])
+            # but not remembered, being outside of the window
+            self.assertEqual(sorted(b._recentSummaries), [2, 3, 4])
+        d.addCallback(check)
+        return d
+
+    def test_finished_summaries_remembered(self):
+        c = Change("bob", ["f"], "fix", revision="105")
+        self.dbc.addChangeToDatabase(c)
+        b = self.makeBuilderStatus()
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp("trunk", "105", changes=[c]))
+        s.started, s.finished = 1000.0, 1010.0
+        s.results = builder.SUCCESS
+        s.text = []
+        s.saveYourself()
+        d = b._addBuildSummary(s)
+        def check(ign):
+            b.status.buildCache.remove("b1", 0)
+            before = self.interactions()
+            (summary,) = list(b.generateBuilds())
+            self.failUnless(isinstance(summary, builder.BuildSummary))
+            self.assertEqual(summary.getChanges(), [c])
+            self.assertEqual(self.interactions(), before)
+        d.addCallback(check)
+        return d
+
+    def test_unsummarized(self):
+        # builds from before the table existed are loaded from their pickle
+        d = self.addBuilds(3)
+        d.addCallback(lambda ign:
+                      self.dbc.delete_build_summaries("master", "b1", 2))
+        def check(ign):
+            b = self.makeBuilderStatus()
+            builds = list(b.generateBuilds())
+            self.failUnless(isinstance(builds[0], builder.BuildSummary))
+            self.failUnless(isinstance(builds[1], builder.BuildStatus))
+            self.assertEqual([s.getNumber() for s in builds], [2, 1, 0])
+        d.addCallback(check)
+        return d
+
+    def test_generateFinishedBuilds(self):
+        d = self.addBuilds(5)
+        def check(ign):
+            b = self.makeBuilderStatus()
+            builds = b.generateFinishedBuilds(branches=["trunk"],
+                                              num_builds=2)
+            self.assertEqual([s.getNumber() for s in builds], [4, 2])
+            self.assertEqual(self.cached(b), [])
+        d.addCallback(check)
+        return d
+
+    def test_prefetch(self):
+        d = self.addBuilds(10)
+        def walk(ign):
+            self.b = self.makeBuilderStatus()
+            self.b.buildPrefetch = 3
+            self.b.getBuild(9)
+            self.b.getBuild(8)
+            self.b.getBuild(5)
+            # plain lookups, even of consecutive builds, load nothing more
+            return flushEventualQueue()
+        d.addCallback(walk)
+        def walkBack(ign):
+            self.assertEqual(self.cached(self.b), [5, 8, 9])
+            self.build = self.b.getBuild(5).getPreviousBuild()
+            self.assertEqual(self.build.getNumber(), 4)
+            self.assertEqual(self.cached(self.b), [4, 5, 8, 9])
+            return flushEventualQueue()
+        d.addCallback(walkBack)
+        def check(ign):
+            self.assertEqual(self.cached(self.b), [1, 2, 3, 4, 5, 8, 9])
+            stats = self.b.status.buildCache.getStats()
+            self.assertEqual((stats['loads'], stats['prefetched']), (7, 3))
+            # the walk goes on from the prefetched builds
+            build = self.build
+            for n in (3, 2, 1, 0):
+                build = build.getPreviousBuild()
+                self.assertEqual(build.getNumber(), n)
+            self.assertEqual(build.getPreviousBuild(), None)
+            return flushEventualQueue()
+        d.addCallback(check)
+        def checkAgain(ign):
+            self.assertEqual(self.cached(self.b), [0, 1, 2, 3, 4, 5, 8, 9])
+            stats = self.b.status.buildCache.getStats()
+            self.assertEqual((stats['hits'], stats['loads']), (4, 8))
+        d.addCallback(checkAgain)
+        return d
+
+    def test_status_generateFinishedBuilds(self):
+        # b1 finishes builds at 1010, 1011, ..., b2 at 1010.5, 1012.75, ...
+        d = self.addBuilds(5)
+        d.addCallback(lambda ign: self.addBuilds(3, "b2", spacing=2.25,
+                                                 offset=0.5))
+        def check(ign):
+            status = builder.Status(FakeBotMaster(), self.basedir)
+            status.db = self.dbc
+            for name in ("b1", "b2"):
+                status.botmaster.builderNames.append(name)
+                b = self.makeBuilderStatus(name, status)
+                status.botmaster.builders[name] = FakeBuilder(b)
+            builds = list(status.generateFinishedBuilds())
+            self.assertEqual([(s.getBuilder().getName(), s.getNumber())
+                              for s in builds],
+                             [("b2", 2), ("b1", 4), ("b1", 3), ("b2", 1),
+                              ("b1", 2), ("b1", 1), ("b2", 0), ("b1", 0)])
+            # nothing was loaded to merge them
+            self.assertEqual(status.buildCache.getNumbers("b1"), [])
+            builds = list(status.generateFinishedBuilds(builders=["b2"],
+                                                        num_builds=2))
+            self.assertEqual([s.getNumber() for s in builds], [2, 1])
+            last = status.getBuilder("b1").getLastFinishedBuild()
+            self.assertEqual(last.getNumber(), 4)
+            self.failUnless(isinstance(last, builder.BuildSummary))
+        d.addCallback(check)
+        return d
+
+class Pruning(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_builder_Pruning")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self):
+        b = builder.BuilderStatus("b1")
+        b.basedir = self.basedir
+        b.status = FakeStatus(None)
+        b.buildHorizon = 4
+        b.logHorizon = 2
+        b.determineNextBuildNumber()
+        b.setBigState("offline") # as Status.builderAdded does
+        return b
+
+    def runBuilds(self, b, count):
+        for i in range(count):
+            s = b.newBuild()
+            b.currentBuilds.append(s)
+            s.started = 1000.0
+            step = s.addStepWithName("compile")
+            step.started = 1000.0
+            loog = step.addLog("stdio")
+            loog.addStdout("compiling\n")
+            loog.finish()
+            s.finished = 1010.0
+            b._buildFinished(s)
+        d = b.status.filePruner.whenIdle()
+        d.addCallback(lambda ign: b.status.builderSaver.whenIdle())
+        return d
+
+    def files(self):
+        return sorted(os.listdir(self.basedir))
+
+    def expectedFiles(self, builds, logs):
+        files = ["builder"] + ["%d" % n for n in builds]
+        for n in logs:
+            files.extend(["%d-log-compile-stdio" % n,
+                          "%d-log-compile-stdio.idx" % n])
+        return sorted(files)
+
+    def test_prune_tracked(self):
+        b = self.makeBuilderStatus()
+        # a new builder's directory is scanned once
+        d = b._scanBuildFiles()
+        d.addCallback(lambda ign: self.runBuilds(b, 7))
+        def check(ign):
+            self.assertEqual(self.files(),
+                             self.expectedFiles(range(3, 7), [5, 6]))
+            self.assertEqual(sorted(b.buildFiles.keys()), [3, 4, 5, 6])
+            self.assertEqual(b.buildFiles[4], [])
+            self.assertEqual((b.buildsPrunedBelow, b.logsPrunedBelow), (3, 5))
+        d.addCallback(check)
+        return d
+
+    def test_prune_untracked(self):
+        # builds saved without a horizon are found by a scan once there is
+        # one
+        b = self.makeBuilderStatus()
+        b.buildHorizon = None
+        d = self.runBuilds(b, 7)
+        def setHorizon(ign):
+            self.assertEqual(b.buildFiles, {})
+            self.assertEqual(len(self.files()), 22)
+            b.buildHorizon = 4
+            return b._scanBuildFiles()
+        d.addCallback(setHorizon)
+        d.addCallback(lambda ign: b.status.filePruner.whenIdle())
+        d.addCallback(lambda ign: b.status.builderSaver.whenIdle())
+        def check(ign):
+            self.assertEqual(self.files(),
+                             self.expectedFiles(range(3, 7), [5, 6]))
+            self.assertEqual(b.buildFiles[5], ["5-log-compile-stdio"])
+        d.addCallback(check)
+        return d
+
+    def test_prune_interrupted(self):
+        # files still waiting to be deleted when the builder is saved are
+        # found by a scan once it is loaded again
+        b = self.makeBuilderStatus()
+        d = b._scanBuildFiles()
+        d.addCallback(lambda ign: self.runBuilds(b, 5))
+        def stop(ign):
+            self.assertEqual(b.deletionsPending, 0)
+            # the pruner is busy until the buildmaster stops
+            b.status.filePruner.running = True
+            self.runBuilds(b, 2)
+            self.assertEqual(b.deletionsPending, 2)
+            return b.status.builderSaver.whenIdle()
+        d.addCallback(stop)
+        def restart(ign):
+            self.assertEqual(self.files(),
+                             self.expectedFiles(range(1, 7), [3, 4, 5, 6]))
+            f = open(os.path.join(self.basedir, "builder"), "rb")
+            self.b = load(f)
+            f.close()
+            styles.doUpgrade()
+            self.b.basedir = self.basedir
+            self.b.status = FakeStatus(None)
+            self.b.determineNextBuildNumber()
+            self.b.setBigState("offline")
+            self.assertEqual(self.b.deletionsPending, 0)
+            self.assertEqual(self.b.buildsPrunedBelow, None)
+            return self.b._scanBuildFiles()
+        d.addCallback(restart)
+        d.addCallback(lambda ign: self.b.status.filePruner.whenIdle())
+        d.addCallback(lambda ign: self.b.status.builderSaver.whenIdle())
+        def check(ign):
+            self.assertEqual(self.files(),
+                             self.expectedFiles(range(3, 7), [5, 6]))
+            self.assertEqual(self.b.buildFiles[4], [])
+            self.assertEqual(self.b.deletionsPending, 0)
+        d.addCallback(check)
+        return d
+
+    def test_determineNextBuildNumber_hint(self):
+        for n in range(5):
+            open(os.path.join(self.basedir, "%d" % n), "w").close()
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 5)
+        b.buildsPrunedBelow = b.logsPrunedBelow = 0
+        b.buildNumberHint = 5
+        b.determineNextBuildNumber()
+        self.assertEqual(b.nextBuildNumber, 5)
+        self.assertEqual(b.buildsPrunedBelow, 0)
+        # builds saved after the builder was are not tracked
+        b.buildNumberHint = 3
+        b.determineNextBuildNumber()
+        self.assertEqual(b.nextBuildNumber, 5)
+        self.assertEqual(b.buildsPrunedBelow, None)
+
+    def test_determineNextBuildNumber_gap(self):
+        # builds 5 and 6 were still running when the buildmaster stopped,
+        # but 7 and 8 finished and were saved
+        for n in range(5) + [7, 8]:
+            open(os.path.join(self.basedir, "%d" % n), "w").close()
+        b = self.makeBuilderStatus()
+        self.assertEqual(b.nextBuildNumber, 9)
+        b.buildsPrunedBelow = b.logsPrunedBelow = 0
+        b.buildNumberHint = 5
+        b.determineNextBuildNumber()
+        self.assertEqual(b.nextBuildNumber, 9)
+        self.assertEqual(b.buildsPrunedBelow, None)
@@ -0,0 +1,113 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.status import builder
+
+class FakeBuilder:
+    buildStorageLayout = "flat"
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+class FakeBuild:
+    def __init__(self, basedir):
+        self.builder = FakeBuilder(basedir)
+
+class FakeStep:
+    def __init__(self, basedir):
+        self.build = FakeBuild(basedir)
+
+class TestLogFile(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_builder_LogFile")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.log = builder.LogFile(FakeStep(self.basedir), "stdio",
+                                   "1-log-stdio")
+        self.log.addHeader("running command\n")
+        self.log.addStdout("line 0\nline 1\nline")
+        self.log.addStderr(" 2\nerror\n")
+        self.log.addHeader("exit 0\n")
+        self.log.addStdout("line 4\nno newline")
+        self.log.finish()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def compress(self):
+        compressed = self.log.getFilename() + ".bz2.tmp"
+        self.log._compressLog(compressed)
+        self.log._renameCompressedLog(None, compressed)
+        self.failIf(os.path.exists(self.log.getFilename()))
+
+    def test_readlines(self):
+        # only the stdout text is split, so "line" runs into "line 4"
+        self.assertEqual(list(self.log.readlines()),
+                         ["line 0\n", "line 1\n", "lineline 4\n",
+                          "no newline"])
+        self.assertEqual(list(self.log.readlines(builder.STDERR)),
+                         [" 2\n", "error\n"])
+
+    def test_readTextLines(self):
+        self.assertEqual(list(self.log.readTextLines()),
+                         ["line 0\n", "line 1\n", "line 2\n", "error\n",
+                          "line 4\n", "no newline"])
+        self.assertEqual("".join(self.log.readTextLines()),
+                         self.log.getText())
+
+    def test_getTextSize(self):
+        self.assertEqual(self.log.getTextSize(),
+                         (len(self.log.getText()), 6))
+
+    def test_getChunks_offset(self):
+        text = self.log.getText()
+        for offset in range(len(text) + 1):
+            self.assertEqual(
+                "".join(self.log.getChunks([builder.STDOUT, builder.STDERR],
+                                           onlyText=True, offset=offset)),
+                text[offset:])
+
+    def test_getChunks_line(self):
+        lines = list(self.log.readTextLines())
+        for line in range(len(lines) + 1):
+            self.assertEqual(
+                "".join(self.log.getChunks([builder.STDOUT, builder.STDERR],
+                                           onlyText=True, line=line)),
+                "".join(lines[line:]))
+
+    def test_compressed(self):
+        text = self.log.getText()
+        self.compress()
+        self.assertEqual(self.log.getText(), text)
+        self.assertEqual(list(self.log.readTextLines())[-2:],
+                         ["line 4\n", "no newline"])
+        self.assertEqual(
+            "".join(self.log.getChunks([builder.STDOUT, builder.STDERR],
+                                       onlyText=True, offset=10)),
+            text[10:])
+
+class SplitLines(unittest.TestCase):
+
+    def test_split(self):
+        texts = ["a\nb", "", "c\n\nd\n", "e", "f"]
+        self.assertEqual(list(builder._splitLines(texts)),
+                         ["a\n", "bc\n", "\n", "d\n", "ef"])
+
+    def test_empty(self):
+        self.assertEqual(list(builder._splitLines([])), [])
+        self.assertEqual(list(builder._splitLines(["", ""])), [])
+
+    def test_lazy(self):
+        # lines are produced without reading further than necessary, which
+        # is what keeps memory use constant for large logs
+        pulled = []
+        def texts():
+            for i in range(1000):
+                pulled.append(i)
+                yield "line %d\n" % i
+        lines = builder._splitLines(texts())
+        self.assertEqual(lines.next(), "line 0\n")
+        self.assertEqual(lines.next(), "line 1\n")
+        self.assertEqual(pulled, [0, 1])
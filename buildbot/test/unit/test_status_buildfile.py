@@ -0,0 +1,197 @@
+import os, shutil, cPickle
+
+import jinja2
+from twisted.trial import unittest
+
+from buildbot.changes.changes import Change
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder, buildfile, buildcache
+from buildbot.status.web import base
+
+# found before trial changes directory, since this checkout may be run
+# without being installed
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(base.__file__),
+                                         "templates"))
+
+class FakeBotMaster:
+    master_name = "master"
+
+class FakeStatus:
+    db = None
+    def __init__(self):
+        self.botmaster = FakeBotMaster()
+        self.buildCache = buildcache.BuildCache()
+
+class BuildFile(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_buildfile")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.builder = builder.BuilderStatus("b1")
+        self.builder.basedir = self.basedir
+        self.builder.status = FakeStatus()
+        self.builder.determineNextBuildNumber()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuild(self):
+        s = self.builder.newBuild()
+        c = Change("bob", ["foo.c"], "fix foo", revision="1234",
+                   when=1000.0, branch="trunk", properties={'pr': 1})
+        ss = SourceStamp("trunk", "1234", changes=[c])
+        ss.patch = (1, "a patch")
+        s.setSourceStamp(ss)
+        s.setReason("a reason")
+        s.setBlamelist(["bob"])
+        s.setProperty("prop", {'a': [1, 2]}, "test")
+        s.started = 1000.0
+        s.finished = 1010.0
+        s.results = builder.WARNINGS
+        s.text = ["build", "warnings"]
+        s.slavename = "bot1"
+        s.addStepWithName("not run")
+        step = s.addStepWithName("compile")
+        step.started = 1001.0
+        step.finished = 1009.0
+        step.setText(["compile"])
+        step.setText2(["3 warnings"])
+        step.results = builder.WARNINGS
+        step.addURL("docs", "http://example.com/docs")
+        step.setStatistic("warnings", 3)
+        s.addTestResult(builder.TestResult(("foo", "test_bar"),
+                                           builder.SUCCESS, ["passed"],
+                                           {'log': "ok"}))
+        return s
+
+    def loadBuild(self, number):
+        return self.builder._loadBuild(number)
+
+    def test_roundtrip(self):
+        s = self.makeBuild()
+        s.saveYourself()
+        data = open(os.path.join(self.basedir, "0"), "rb").read()
+        self.failUnless(data.startswith("{"))
+
+        b = self.loadBuild(0)
+        self.assertEqual(b.getNumber(), 0)
+        self.failUnless(b.getBuilder() is self.builder)
+        self.assertEqual(b.getTimes(), (1000.0, 1010.0))
+        self.assertEqual(b.getResults(), builder.WARNINGS)
+        self.assertEqual(b.text, ["build", "warnings"])
+        self.assertEqual(b.getSlavename(), "bot1")
+        self.assertEqual(b.getReason(), "a reason")
+        self.assertEqual(b.getResponsibleUsers(), ["bob"])
+        self.assertEqual(b.getProperty("prop"), {'a': [1, 2]})
+        ss = b.getSourceStamp()
+        self.assertEqual((ss.branch, ss.revision), ("trunk", "1234"))
+        self.assertEqual(ss.patch, (1, "a patch"))
+        self.assertEqual(b.getChanges()[0].asText(),
+                         s.getChanges()[0].asText())
+        self.assertEqual(b.getChanges()[0].properties.getProperty("pr"), 1)
+
+        steps = b.getSteps()
+        self.assertEqual(len(steps), 2)
+        self.assertEqual(steps[0].getResults(), ((None, []), []))
+        step = steps[1]
+        self.failUnless(step.getBuild() is b)
+        self.assertEqual(step.getName(), "compile")
+        self.assertEqual(step.getTimes(), (1001.0, 1009.0))
+        self.assertEqual(step.getText(), ["compile"])
+        self.assertEqual(step.getResults(), (builder.WARNINGS, ["3 warnings"]))
+        self.assertEqual(step.getURLs(), {'docs': "http://example.com/docs"})
+        self.assertEqual(step.getStatistic("warnings"), 3)
+
+        results = b.getTestResults()
+        self.assertEqual(results.keys(), [("foo", "test_bar")])
+        tr = results[("foo", "test_bar")]
+        self.assertEqual(tr.getResults(), builder.SUCCESS)
+        self.assertEqual(tr.getText(), ["passed"])
+        self.assertEqual(tr.getLogs(), {'log': "ok"})
+
+    def test_non_ascii(self):
+        s = self.makeBuild()
+        c = Change(u"Jos\xe9", ["foo.c"], u"caf\xe9 fix", when=1000.0)
+        s.getSourceStamp().changes = (c,)
+        s.changes = [c]
+        s.getSteps()[1].setText(["comp\xc3\xa9"]) # a utf-8 str
+        s.saveYourself()
+        b = self.loadBuild(0)
+        loaded = b.getChanges()[0]
+        self.assertEqual((loaded.who, loaded.comments),
+                         (u"Jos\xe9", u"caf\xe9 fix"))
+        self.assertEqual(b.getSteps()[1].getText(), [u"comp\xe9"])
+        self.assertEqual(type(b.getSteps()[1].getName()), str)
+        # the build page renders it just as it did before it was saved
+        env = base.createJinjaEnv()
+        env.loader = jinja2.FileSystemLoader(TEMPLATES)
+        change = env.get_template("change_macros.html").module.change
+        self.assertEqual(change(**loaded.html_dict()),
+                         change(**c.html_dict()))
+
+    def test_lazy_sections(self):
+        self.makeBuild().saveYourself()
+        b = self.loadBuild(0)
+        self.assertEqual(sorted(b._sections.keys()), list(buildfile.SECTIONS))
+        self.failIf('steps' in b.__dict__)
+        # sizing it for the build cache does not load anything
+        buildcache.build_size(b)
+        self.failIf('steps' in b.__dict__)
+        b.getSteps()
+        # the test results are still on disk
+        self.failUnless('steps' in b.__dict__)
+        self.assertEqual(b._sections.keys(), ["testResults"])
+        self.failIf('testResults' in b.__dict__)
+
+    def test_resave(self):
+        # saving a build that was loaded lazily saves all of it
+        self.makeBuild().saveYourself()
+        self.loadBuild(0).saveYourself()
+        b = self.loadBuild(0)
+        self.assertEqual(len(b.getSteps()), 2)
+        self.assertEqual(len(b.getTestResults()), 1)
+
+    def test_pickle_format(self):
+        self.builder.setBuildFileFormat("pickle")
+        self.makeBuild().saveYourself()
+        data = open(os.path.join(self.basedir, "0"), "rb").read()
+        self.failIf(data.startswith("{"))
+        b = self.loadBuild(0)
+        self.assertEqual(len(b.getSteps()), 2)
+
+    def test_unsupported_pickled(self):
+        # a property JSON cannot hold makes the build fall back to a pickle
+        s = self.makeBuild()
+        s.setProperty("complex", 1j, "test")
+        self.assertRaises(buildfile.UnsupportedBuild,
+                          buildfile.encode_build, s)
+        s.saveYourself()
+        data = open(os.path.join(self.basedir, "0"), "rb").read()
+        self.failIf(data.startswith("{"))
+        b = self.loadBuild(0)
+        self.assertEqual(b.getProperty("complex"), 1j)
+
+    def test_unknown_attribute(self):
+        s = self.makeBuild()
+        s.someExtension = "x"
+        self.assertRaises(buildfile.UnsupportedBuild,
+                          buildfile.encode_build, s)
+
+    def test_old_pickle(self):
+        # builds pickled by earlier versions still load
+        s = self.makeBuild()
+        f = open(os.path.join(self.basedir, "0"), "wb")
+        cPickle.dump(s, f, -1)
+        f.close()
+        self.assertEqual(buildfile.load_build(os.path.join(self.basedir, "0")),
+                         None)
+        b = self.loadBuild(0)
+        self.assertEqual(b.text, ["build", "warnings"])
+        self.assertEqual(len(b.getTestResults()), 1)
+
+    def test_newer_version(self):
+        fn = os.path.join(self.basedir, "0")
+        open(fn, "wb").write('{"format": "buildbot-build", "version": 99}\n')
+        self.assertRaises(IndexError, self.loadBuild, 0)
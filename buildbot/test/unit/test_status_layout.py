@@ -0,0 +1,132 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.status import builder, buildcache, buildfile, layout
+from buildbot.scripts import runner
+
+class FakeStatus:
+    db = None
+    def __init__(self):
+        self.buildCache = buildcache.BuildCache()
+
+class Layout(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_layout")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.builderdir = os.path.join(self.basedir, "b1")
+        os.makedirs(self.builderdir)
+        # marks it as a builder directory, for the runner
+        open(os.path.join(self.builderdir, "builder"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self, storageLayout):
+        b = builder.BuilderStatus("b1")
+        b.basedir = self.builderdir
+        b.status = FakeStatus()
+        b.setBuildStorageLayout(storageLayout)
+        b.determineNextBuildNumber()
+        return b
+
+    def addBuilds(self, b, count):
+        for i in range(count):
+            s = b.newBuild()
+            s.started = 1000.0
+            step = s.addStepWithName("compile")
+            step.started = 1000.0
+            loog = step.addLog("stdio")
+            loog.addStdout("build %d\n" % s.number)
+            loog.finish()
+            s.finished = 1010.0
+            s.saveYourself()
+
+    def files(self, dirname=""):
+        return sorted(os.listdir(os.path.join(self.builderdir, dirname)))
+
+    def test_shard_name(self):
+        self.assertEqual(layout.shard_name(0), "0xxx")
+        self.assertEqual(layout.shard_name(999), "0xxx")
+        self.assertEqual(layout.shard_name(12345), "12xxx")
+        self.assertEqual(layout.build_filenames(12345, "sharded"),
+                         [os.path.join("12xxx", "12345"), "12345"])
+        self.assertEqual(layout.build_filenames(12345, "flat"),
+                         ["12345", os.path.join("12xxx", "12345")])
+
+    def test_find_build_file(self):
+        os.makedirs(os.path.join(self.builderdir, "1xxx"))
+        open(os.path.join(self.builderdir, "1xxx", "1002"), "w").close()
+        open(os.path.join(self.builderdir, "7"), "w").close()
+        find = layout.find_build_file
+        self.assertEqual(find(self.builderdir, 1002, "flat"),
+                         os.path.join(self.builderdir, "1xxx", "1002"))
+        self.assertEqual(find(self.builderdir, 7, "sharded"),
+                         os.path.join(self.builderdir, "7"))
+        # not saved yet: where the layout would put it
+        self.assertEqual(find(self.builderdir, 8, "sharded"),
+                         os.path.join(self.builderdir, "0xxx", "8"))
+        self.assertEqual(layout.find_last_build(self.builderdir), 1002)
+
+    def test_sharded(self):
+        b = self.makeBuilderStatus("sharded")
+        self.addBuilds(b, 2)
+        self.assertEqual(self.files(), ["0xxx", "builder"])
+        self.assertEqual(self.files("0xxx"),
+                         ["0", "0-log-compile-stdio", "0-log-compile-stdio.idx",
+                          "1", "1-log-compile-stdio", "1-log-compile-stdio.idx"])
+        b = self.makeBuilderStatus("sharded")
+        self.assertEqual(b.nextBuildNumber, 2)
+        s = b.getBuild(1)
+        self.assertEqual(s.getSteps()[0].getLogs()[0].getText(), "build 1\n")
+
+    def test_migrate(self):
+        b = self.makeBuilderStatus("flat")
+        self.addBuilds(b, 3)
+        b.setBuildStorageLayout("sharded")
+        # loaded before their files are moved
+        loaded = b.getBuild(2)
+        loaded.getSteps()
+        lazy = b.getBuild(1)
+        self.assertEqual(runner.shard_builds(self.basedir, silent=True), 3)
+        self.assertEqual(self.files(), ["0xxx", "builder"])
+        self.assertEqual(len(self.files("0xxx")), 9)
+        self.assertEqual(loaded.getSteps()[0].getLogs()[0].getText(),
+                         "build 2\n")
+        self.assertEqual(lazy.getSteps()[0].getLogs()[0].getText(),
+                         "build 1\n")
+        b = self.makeBuilderStatus("sharded")
+        self.assertEqual(b.nextBuildNumber, 3)
+        loog = b.getBuild(0).getSteps()[0].getLogs()[0]
+        self.assertEqual(loog.filename,
+                         os.path.join("0xxx", "0-log-compile-stdio"))
+        self.assertEqual(loog.getText(), "build 0\n")
+        # a second run has nothing left to do
+        self.assertEqual(runner.shard_builds(self.basedir, silent=True), 0)
+
+    def test_migrate_keeps_format(self):
+        b = self.makeBuilderStatus("flat")
+        b.setBuildFileFormat("pickle")
+        self.addBuilds(b, 2)
+        b.setBuildFileFormat("json")
+        self.addBuilds(b, 1)
+        self.assertEqual(runner.shard_builds(self.basedir, silent=True), 3)
+        shard = os.path.join(self.builderdir, "0xxx")
+        self.assertEqual(buildfile.load_build(os.path.join(shard, "0")), None)
+        self.assertEqual(buildfile.load_build(os.path.join(shard, "1")), None)
+        self.assertEqual(buildfile.load_build(os.path.join(shard, "2")).number,
+                         2)
+        b = self.makeBuilderStatus("sharded")
+        self.assertEqual(b.getBuild(0).getSteps()[0].getLogs()[0].getText(),
+                         "build 0\n")
+
+    def test_resave_moves(self):
+        # a build saved again after the layout changed moves to its shard
+        b = self.makeBuilderStatus("flat")
+        self.addBuilds(b, 1)
+        b.setBuildStorageLayout("sharded")
+        b.getBuild(0).saveYourself()
+        self.assertEqual(self.files("0xxx"), ["0"])
+        self.failIf("0" in self.files())
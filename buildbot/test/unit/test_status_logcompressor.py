@@ -0,0 +1,71 @@
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from buildbot.status import logcompressor
+
+class LogCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.compressor = logcompressor.LogCompressor(workers=1,
+                                                      max_queued=3)
+        self.order = []
+
+    def tearDown(self):
+        self.compressor._stopPool()
+
+    def job(self, name, event=None):
+        if event:
+            event.wait()
+        self.order.append(name)
+        return 10
+
+    def test_smallest_first(self):
+        release = threading.Event()
+        dl = [self.compressor.submit(1000, self.job, "blocker", release)]
+        # these wait until the blocker is done
+        for (size, name) in [(300, "big"), (100, "small"), (200, "medium")]:
+            dl.append(self.compressor.submit(size, self.job, name))
+        self.assertEqual(self.compressor.getStats()['queued'], 3)
+        release.set()
+        d = defer.gatherResults(dl)
+        def check(results):
+            self.assertEqual(results, [10, 10, 10, 10])
+            self.assertEqual(self.order,
+                             ["blocker", "small", "medium", "big"])
+            stats = self.compressor.getStats()
+            self.assertEqual(stats['completed'], 4)
+            self.assertEqual(stats['bytes_in'], 1600)
+            self.assertEqual(stats['bytes_out'], 40)
+            self.assertEqual(stats['queued'], 0)
+            self.assertEqual(stats['running'], 0)
+        d.addCallback(check)
+        return d
+
+    def test_refused(self):
+        release = threading.Event()
+        dl = [self.compressor.submit(1, self.job, "blocker", release)]
+        for i in range(3):
+            dl.append(self.compressor.submit(1, self.job, i))
+        self.assertEqual(self.compressor.submit(1, self.job, "extra"), None)
+        self.assertEqual(self.compressor.getStats()['refused'], 1)
+        release.set()
+        d = defer.gatherResults(dl)
+        def check(results):
+            self.failIf("extra" in self.order)
+        d.addCallback(check)
+        return d
+
+    def test_failure(self):
+        def fail():
+            raise RuntimeError("bad log")
+        d = self.compressor.submit(1, fail)
+        def ok(res):
+            self.fail("should have failed")
+        def check(f):
+            f.trap(RuntimeError)
+            self.assertEqual(self.compressor.getStats()['failed'], 1)
+            self.assertEqual(self.compressor.running, 0)
+        d.addCallbacks(ok, check)
+        return d
@@ -0,0 +1,235 @@
+import os, shutil, bz2
+from cStringIO import StringIO
+
+from twisted.trial import unittest
+
+from buildbot.status import logindex
+
+def netstring(channel, text):
+    data = "%d%s" % (channel, text)
+    return "%d:%s," % (len(data), data)
+
+# (channel, text) chunks of a small log; channel 2 is a header
+CHUNKS = [
+    (2, "running command\n"),
+    (0, "line 0\nline 1\n"),
+    (1, "line 2\nli"),
+    (2, "some header\n"),
+    (0, "ne 3\n"),
+    (0, "line 4\nline 5\nline 6\n"),
+    ]
+
+def stream():
+    return "".join([netstring(c, t) for (c, t) in CHUNKS])
+
+def text():
+    return "".join([t for (c, t) in CHUNKS if c != 2])
+
+class LogIndexMixin:
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.__class__.__name__)
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def writeLog(self, name="1-log-stdio"):
+        fn = os.path.join(self.basedir, name)
+        f = open(fn, "wb")
+        f.write(stream())
+        f.close()
+        return fn
+
+class Index(LogIndexMixin, unittest.TestCase):
+
+    def makeIndex(self):
+        fn = os.path.join(self.basedir, "idx")
+        w = logindex.IndexWriter(fn)
+        for (offset, channel, t, raw) in \
+                logindex.iter_netstrings(StringIO(stream())):
+            w.add(offset, channel, t)
+        w.close()
+        return logindex.LogIndex(fn)
+
+    def test_iter_netstrings(self):
+        chunks = [(c, t) for (o, c, t, r)
+                  in logindex.iter_netstrings(StringIO(stream()), bufsize=5)]
+        self.assertEqual(chunks, CHUNKS)
+
+    def test_iter_netstrings_truncated(self):
+        data = stream()[:-3]
+        chunks = [(c, t) for (o, c, t, r)
+                  in logindex.iter_netstrings(StringIO(data))]
+        self.assertEqual(chunks, CHUNKS[:-1])
+
+    def test_records(self):
+        index = self.makeIndex()
+        self.assertEqual(len(index), len(CHUNKS))
+        self.assertEqual(index.method, "")
+        s = stream()
+        for i in range(len(CHUNKS)):
+            rec = index[i]
+            self.assertEqual(s[rec[logindex.OFFSET]:].split(":")[1][0],
+                             str(CHUNKS[i][0]))
+        self.assertEqual([index[i][logindex.TEXTPOS] for i in range(6)],
+                         [0, 0, 14, 23, 23, 28])
+        self.assertEqual([index[i][logindex.LINENO] for i in range(6)],
+                         [0, 0, 2, 3, 3, 4])
+        self.assertEqual(index[-1], index[5])
+        self.assertRaises(IndexError, lambda: index[6])
+        index.close()
+
+    def test_findTextOffset(self):
+        index = self.makeIndex()
+        self.assertEqual(index.findTextOffset(0), 1)
+        self.assertEqual(index.findTextOffset(13), 1)
+        self.assertEqual(index.findTextOffset(14), 2)
+        self.assertEqual(index.findTextOffset(25), 4)
+        self.assertEqual(index.findTextOffset(1000), 5)
+        index.close()
+
+    def test_findLine(self):
+        index = self.makeIndex()
+        self.assertEqual(index.findLine(0), None)
+        self.assertEqual(index.findLine(1), 1)
+        self.assertEqual(index.findLine(3), 2)
+        self.assertEqual(index.findLine(4), 4)
+        self.assertEqual(index.findLine(6), 5)
+        index.close()
+
+    def test_bad_index(self):
+        fn = os.path.join(self.basedir, "bad")
+        open(fn, "wb").write("x" * 100)
+        self.assertRaises(ValueError, logindex.LogIndex, fn)
+
+class Compression(LogIndexMixin, unittest.TestCase):
+
+    def compress(self, method, blocksize):
+        fn = self.writeLog()
+        out = fn + logindex.CODECS[method][0]
+        outfile = open(out, "wb")
+        logindex.compress_log(open(fn, "rb"), outfile, fn + ".idx",
+                              method, blocksize)
+        outfile.close()
+        index = logindex.LogIndex(fn + ".idx")
+        return out, index
+
+    def check_blockfile(self, method):
+        out, index = self.compress(method, 20)
+        self.assertEqual(index.method, method)
+        # several blocks were written
+        self.failUnless(index.blockEnd(0) is not None)
+        s = stream()
+        f = logindex.BlockFile(out, index)
+        self.assertEqual(f.read(), s)
+        for pos in range(len(s)):
+            f.seek(pos)
+            self.assertEqual(f.read(7), s[pos:pos+7])
+            self.assertEqual(f.tell(), min(len(s), pos+7))
+        f.seek(-4, 2)
+        self.assertEqual(f.read(), s[-4:])
+        f.close()
+        index.close()
+
+    def test_blockfile_bz2(self):
+        self.check_blockfile("bz2")
+
+    def test_blockfile_gz(self):
+        self.check_blockfile("gz")
+
+    def test_blockfile_zstd(self):
+        if "zstd" not in logindex.CODECS:
+            raise unittest.SkipTest("zstandard module not installed")
+        self.check_blockfile("zstd")
+
+    def test_blockfile_lz4(self):
+        if "lz4" not in logindex.CODECS:
+            raise unittest.SkipTest("lz4 module not installed")
+        self.check_blockfile("lz4")
+
+    def test_choose_method(self):
+        self.assertEqual(logindex.choose_method("bz2"), "bz2")
+        for method in logindex.METHODS:
+            self.failUnless(logindex.choose_method(method) in logindex.CODECS)
+
+    def test_bz2_multistream(self):
+        # the blocks form a file that other tools can still read
+        out, index = self.compress("bz2", 20)
+        index.close()
+        data = open(out, "rb").read()
+        chunks = []
+        while data:
+            d = bz2.BZ2Decompressor()
+            chunks.append(d.decompress(data))
+            data = d.unused_data
+        self.assertEqual("".join(chunks), stream())
+
+    def test_index_log_raw(self):
+        fn = self.writeLog()
+        self.failUnless(logindex.index_log(fn))
+        index = logindex.LogIndex(fn + ".idx")
+        self.assertEqual(len(index), len(CHUNKS))
+        index.close()
+        # a second time is a no-op
+        self.failIf(logindex.index_log(fn))
+
+    def test_index_log_bz2(self):
+        fn = self.writeLog()
+        f = open(fn + ".bz2", "wb")
+        f.write(bz2.compress(stream()))
+        f.close()
+        os.unlink(fn)
+        self.failUnless(logindex.index_log(fn, blocksize=20))
+        self.failIf(os.path.exists(fn + ".bz2.tmp"))
+        index = logindex.LogIndex(fn + ".idx")
+        self.assertEqual(index.method, "bz2")
+        f = logindex.BlockFile(fn + ".bz2", index)
+        self.assertEqual(f.read(), stream())
+        f.close()
+        index.close()
+
+    def test_index_log_missing(self):
+        self.failIf(logindex.index_log(os.path.join(self.basedir, "nope")))
+
+class TextWindow(unittest.TestCase):
+
+    def window(self, *args, **kwargs):
+        w = logindex.TextWindow(*args, **kwargs)
+        out = []
+        for (channel, t) in CHUNKS:
+            t = w.filter(channel, t)
+            if t:
+                out.append((channel, t))
+        return w, out
+
+    def test_everything(self):
+        w, out = self.window()
+        self.assertEqual(out, CHUNKS)
+        self.failIf(w.done)
+
+    def test_skip_bytes(self):
+        w, out = self.window(skip_bytes=21)
+        self.assertEqual("".join([t for (c, t) in out if c != 2]),
+                         text()[21:])
+        # the header before the window is dropped, the one inside it kept
+        self.assertEqual(out[0], (1, "li"))
+        self.assertEqual(out[1], (2, "some header\n"))
+
+    def test_skip_lines(self):
+        w, out = self.window(skip_lines=3)
+        self.assertEqual("".join([t for (c, t) in out if c != 2]),
+                         "line 3\nline 4\nline 5\nline 6\n")
+
+    def test_limit(self):
+        w, out = self.window(skip_bytes=7, limit=10)
+        self.assertEqual("".join([t for (c, t) in out if c != 2]),
+                         text()[7:17])
+        self.failUnless(w.done)
+
+    def test_limit_zero(self):
+        w, out = self.window(limit=0)
+        self.assertEqual(out, [])
+        self.failUnless(w.done)
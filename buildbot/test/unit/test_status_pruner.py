@@ -0,0 +1,72 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.status import pruner
+
+class Scan(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_pruner")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def touch(self, *filenames):
+        for fn in filenames:
+            open(os.path.join(self.basedir, fn), "w").close()
+
+    def test_log_files(self):
+        files = pruner.log_files("1-log-compile-stdio")
+        for fn in ("1-log-compile-stdio", "1-log-compile-stdio.bz2",
+                   "1-log-compile-stdio.idx", "1-log-compile-stdio.gz.tmp"):
+            self.failUnless(fn in files)
+
+    def test_scan_builds(self):
+        self.touch("builder", "1", "1-log-compile-stdio.bz2",
+                   "1-log-compile-stdio.idx", "2", "2-log-test-stdio",
+                   "3-log-test-stdio.gz.tmp")
+        self.assertEqual(pruner.scan_builds(self.basedir),
+                         {1: set(["1-log-compile-stdio"]),
+                          2: set(["2-log-test-stdio"]),
+                          3: set(["3-log-test-stdio"])})
+
+    def test_delete(self):
+        self.touch(*["%d" % n for n in range(10)])
+        p = pruner.FilePruner(batch_size=3, interval=0)
+        p.delete(self.basedir, ["%d" % n for n in range(8)] + ["nothere"])
+        d = p.whenIdle()
+        def check(ign):
+            self.assertEqual(sorted(os.listdir(self.basedir)), ["8", "9"])
+            stats = p.getStats()
+            self.assertEqual((stats['queued'], stats['deleted'],
+                              stats['batches'], stats['pending']),
+                             (9, 8, 3, 0))
+        d.addCallback(check)
+        return d
+
+    def test_delete_fails(self):
+        self.touch("a", "b")
+        p = pruner.FilePruner(interval=0)
+        delete_files = pruner.delete_files
+        def broken_delete_files(paths):
+            raise RuntimeError("disk on fire")
+        self.patch(pruner, "delete_files", broken_delete_files)
+        p.delete(self.basedir, ["a"])
+        d = p.whenIdle()
+        def checkFailed(ign):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            self.failIf(p.running)
+            # the pruner is not wedged: later deletions still happen
+            self.patch(pruner, "delete_files", delete_files)
+            p.delete(self.basedir, ["b"])
+            return p.whenIdle()
+        d.addCallback(checkFailed)
+        def check(ign):
+            self.assertEqual(os.listdir(self.basedir), ["a"])
+            self.assertEqual(p.getStats()['deleted'], 1)
+        d.addCallback(check)
+        return d
@@ -0,0 +1,130 @@
+import os, shutil
+from cPickle import load
+
+from twisted.trial import unittest
+from twisted.persisted import styles
+
+from buildbot.status import builder, saver
+
+class BuilderSaver(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_saver")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self, name):
+        b = builder.BuilderStatus(name)
+        b.basedir = os.path.join(self.basedir, name)
+        os.makedirs(b.basedir)
+        b.status = None
+        b.determineNextBuildNumber()
+        b.setBigState("offline")
+        return b
+
+    def loadBuilderStatus(self, b):
+        f = open(os.path.join(b.basedir, "builder"), "rb")
+        loaded = load(f)
+        f.close()
+        styles.doUpgrade()
+        return loaded
+
+    def test_write_files(self):
+        fn = os.path.join(self.basedir, "a")
+        open(fn, "w").write("old")
+        written = saver.write_files([(fn, "new")])
+        self.assertEqual(written, [fn])
+        self.assertEqual(open(fn).read(), "new")
+        self.assertEqual(os.listdir(self.basedir), ["a"])
+
+    def test_coalesce(self):
+        s = saver.BuilderSaver(delay=0)
+        b1 = self.makeBuilderStatus("b1")
+        b2 = self.makeBuilderStatus("b2")
+        for i in range(3):
+            b1.nextBuildNumber += 1
+            s.save(b1)
+        s.save(b2)
+        self.assertEqual(s.getStats()['dirty'], 2)
+        d = s.whenIdle()
+        def check(ign):
+            stats = s.getStats()
+            self.assertEqual((stats['requested'], stats['saved'],
+                              stats['batches'], stats['dirty']),
+                             (4, 2, 1, 0))
+            self.failUnless(stats['bytes'] > 0)
+            self.failUnless('average_latency' in stats)
+            # the latest state was saved
+            self.assertEqual(self.loadBuilderStatus(b1).buildNumberHint, 3)
+            self.failIf(os.path.exists(os.path.join(b1.basedir,
+                                                    "builder.tmp")))
+        d.addCallback(check)
+        return d
+
+    def test_flush(self):
+        # flushing does not wait for the delay
+        s = saver.BuilderSaver(delay=3600)
+        b1 = self.makeBuilderStatus("b1")
+        s.save(b1)
+        self.failUnless(s.timer)
+        d = s.flush()
+        def check(ign):
+            self.failIf(s.timer)
+            self.assertEqual(s.getStats()['saved'], 1)
+            self.failUnless(os.path.exists(os.path.join(b1.basedir,
+                                                        "builder")))
+        d.addCallback(check)
+        return d
+
+    def test_flush_while_writing(self):
+        s = saver.BuilderSaver(delay=3600)
+        b1 = self.makeBuilderStatus("b1")
+        b2 = self.makeBuilderStatus("b2")
+        s.save(b1)
+        s.flush()
+        # b2 becomes dirty while b1 is being written
+        self.failUnless(s.running)
+        s.save(b2)
+        d = s.flush()
+        def check(ign):
+            self.assertEqual(s.getStats()['saved'], 2)
+            self.failIf(s.timer)
+        d.addCallback(check)
+        return d
+
+    def test_write_fails(self):
+        s = saver.BuilderSaver(delay=3600)
+        b1 = self.makeBuilderStatus("b1")
+        b2 = self.makeBuilderStatus("b2")
+        write_files = saver.write_files
+        def broken_write_files(files):
+            raise RuntimeError("disk on fire")
+        self.patch(saver, "write_files", broken_write_files)
+        s.save(b1)
+        d = s.flush()
+        def checkFailed(ign):
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+            self.failIf(s.running)
+            stats = s.getStats()
+            self.assertEqual((stats['saved'], stats['failed']), (0, 1))
+            # the saver is not wedged: later saves still happen
+            self.patch(saver, "write_files", write_files)
+            s.save(b2)
+            return s.flush()
+        d.addCallback(checkFailed)
+        def check(ign):
+            self.assertEqual(s.getStats()['saved'], 1)
+            self.failUnless(os.path.exists(os.path.join(b2.basedir,
+                                                        "builder")))
+        d.addCallback(check)
+        return d
+
+    def test_saveYourself(self):
+        b1 = self.makeBuilderStatus("b1")
+        b1.nextBuildNumber = 7
+        b1.saveYourself()
+        self.assertEqual(self.loadBuilderStatus(b1).buildNumberHint, 7)
@@ -0,0 +1,136 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.changes.changes import Change
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder
+from buildbot.status.web import consolemodel, console
+from buildbot.test.fakeweb import FakeStatus, FakeChangeSource, \
+     FakeService, FakeRequest, makeBuilderStatus
+
+class ConsoleModel(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_web_consolemodel")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.filename = os.path.join(self.basedir, "console.pck")
+        self.status = FakeStatus()
+        self.changes = FakeChangeSource()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self, name, builds):
+        b = makeBuilderStatus(self.status, self.basedir, name)
+        for i in range(builds):
+            self.addBuild(b)
+        return b
+
+    def addBuild(self, b):
+        s = b.newBuild()
+        rev = str(100 + s.number)
+        s.setSourceStamp(SourceStamp(revision=rev))
+        s.setProperty("got_revision", rev, "test")
+        s.started = 1000.0 + 100 * s.number
+        s.text = ["build", "successful"]
+        s.finished = s.started + 50
+        s.saveYourself()
+        return s
+
+    def makeModel(self):
+        return consolemodel.ConsoleModel(self.status, self.changes,
+                                         self.filename)
+
+    def test_history(self):
+        b = self.makeBuilderStatus("b1", 3)
+        model = self.makeModel()
+        builds = model.getBuilds(b)
+        self.assertEqual([(cb.number, cb.got_revision, cb.isFinished)
+                          for cb in builds],
+                         [(2, "102", True), (1, "101", True),
+                          (0, "100", True)])
+        self.assertEqual(model.stats['builds_read'], 3)
+        model.getBuilds(b)
+        self.assertEqual(model.stats['builds_read'], 3)
+
+    def test_incremental(self):
+        b = self.makeBuilderStatus("b1", 1)
+        model = self.makeModel()
+        model.getBuilds(b)
+        version = model.version
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp(revision="101"))
+        s.buildStarted(None)
+        self.failUnless(model.version > version)
+        builds = model.getBuilds(b)
+        self.assertEqual([(cb.number, cb.isFinished) for cb in builds],
+                         [(1, False), (0, True)])
+        version = model.version
+        s.finished = s.started + 10
+        b.currentBuilds.remove(s)
+        model.buildFinished("b1", s, builder.SUCCESS)
+        self.failUnless(model.version > version)
+        builds = model.getBuilds(b)
+        self.assertEqual([(cb.number, cb.isFinished) for cb in builds],
+                         [(1, True), (0, True)])
+        self.assertEqual(model.stats['builds_read'], 1)
+
+    def test_changes(self):
+        for i in range(3):
+            self.changes.addChange(Change("bob", ["foo.c"], "fix %d" % i,
+                                          revision=str(i), when=1000.0 + i))
+        model = self.makeModel()
+        model.maxChanges = 3
+        self.assertEqual([c.revision for c in model.getChanges()],
+                         ["0", "1", "2"])
+        version = model.version
+        c = Change("bob", ["foo.c"], "fix 3", revision="3", when=1003.0)
+        self.changes.addChange(c)
+        model.changeAdded(c)
+        self.failUnless(model.version > version)
+        self.assertEqual([c.revision for c in model.getChanges()],
+                         ["1", "2", "3"])
+
+    def test_persistence(self):
+        b = self.makeBuilderStatus("b1", 3)
+        self.changes.addChange(Change("bob", ["foo.c"], "fix",
+                                      revision="102", when=1000.0))
+        model = self.makeModel()
+        model.getBuilds(b)
+        model.getChanges()
+        model.save()
+        model.stop()
+        self.assertEqual(self.status.watchers, [])
+
+        # a build finishes while the console is not watching
+        self.addBuild(b)
+        model = self.makeModel()
+        self.assertEqual([c.revision for c in model.getChanges()], ["102"])
+        self.assertEqual([cb.number for cb in model.getBuilds(b)],
+                         [3, 2, 1, 0])
+        self.assertEqual(model.stats['builds_read'], 1)
+
+    def test_persistence_other_history(self):
+        b = self.makeBuilderStatus("b1", 3)
+        model = self.makeModel()
+        model.getBuilds(b)
+        model.save()
+        model.stop()
+        # the builder's history was removed since
+        shutil.rmtree(b.basedir)
+        del self.status.builders["b1"]
+        b = self.makeBuilderStatus("b1", 1)
+        model = self.makeModel()
+        self.assertEqual([cb.number for cb in model.getBuilds(b)], [0])
+
+    def test_etag(self):
+        model = self.makeModel()
+        c = console.ConsoleStatusResource()
+        request = FakeRequest(FakeService(model=model))
+        etag = c.getETag(request)
+        self.assertEqual(c.getETag(request), etag)
+        model.changeAdded(Change("bob", ["foo.c"], "fix", revision="1"))
+        self.failIfEqual(c.getETag(request), etag)
@@ -0,0 +1,147 @@
+import os, shutil, gc, weakref
+
+from twisted.trial import unittest
+
+from buildbot.changes.changes import Change
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status.web import eventgrid, waterfall
+from buildbot.status.web import changes # registers IBox for Change
+from buildbot.test.fakeweb import FakeStatus, FakeChangeSource, \
+     FakeService, FakeRequest, makeBuilderStatus
+
+def summarize(events):
+    return [(e.__class__.__name__, e.getTimes()[0], tuple(e.getText()))
+            for e in events]
+
+class EventGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_web_eventgrid")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.status = FakeStatus()
+        self.changes = FakeChangeSource()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self, name, builds):
+        b = makeBuilderStatus(self.status, self.basedir, name)
+        b.addPointEvent(["created"]).started = 500.0
+        for i in range(builds):
+            s = b.newBuild()
+            s.setSourceStamp(SourceStamp(branch=["trunk", "stable"][i % 2]))
+            s.started = 1000.0 + 100 * i
+            s.text = ["build", str(i)]
+            for n, stepname in enumerate(["compile", "test"]):
+                step = s.addStepWithName(stepname)
+                step.started = s.started + 10 * (n + 1)
+                step.finished = s.started + 10 * (n + 2)
+                step.setText([stepname])
+            s.finished = s.started + 50
+            s.saveYourself()
+        return b
+
+    def makeGrid(self):
+        return eventgrid.EventGrid(self.status, self.changes)
+
+    def test_load(self):
+        b = self.makeBuilderStatus("b1", 3)
+        grid = self.makeGrid()
+        expected = summarize(b.eventGenerator())
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(summarize(grid.eventGenerator(b)), expected)
+        self.assertEqual(summarize(grid.eventGenerator(b)), expected)
+        stats = grid.getStats()
+        self.assertEqual((stats['loaded'], stats['hits'], stats['misses'],
+                          stats['events']), (10, 10, 1, 10))
+        self.failUnless(grid.columns["b1"].complete)
+
+    def test_builds_not_kept(self):
+        # only the build cache keeps builds in memory
+        b = self.makeBuilderStatus("b1", 3)
+        grid = self.makeGrid()
+        expected = summarize(grid.eventGenerator(b))
+        build = b.getBuild(1)
+        ref = weakref.ref(build)
+        del build
+        for n in range(3):
+            self.status.buildCache.remove("b1", n)
+        gc.collect()
+        self.assertEqual(ref(), None)
+        # and are loaded again to be shown
+        self.assertEqual(summarize(grid.eventGenerator(b)), expected)
+        self.assertEqual(grid.getStats()['misses'], 1)
+
+    def test_filter(self):
+        b = self.makeBuilderStatus("b1", 3)
+        grid = self.makeGrid()
+        # filtered pages are not remembered
+        self.assertEqual(summarize(grid.eventGenerator(b, ["stable"])),
+                         summarize(b.eventGenerator(["stable"])))
+        self.assertEqual(grid.getStats()['loaded'], 0)
+        list(grid.eventGenerator(b))
+        self.assertEqual(summarize(grid.eventGenerator(b, ["stable"])),
+                         summarize(b.eventGenerator(["stable"])))
+        self.assertEqual([e.getTimes()[0]
+                          for e in grid.eventGenerator(b, minTime=1150)],
+                         [1220.0, 1210.0, 1200.0])
+
+    def test_incremental(self):
+        b = self.makeBuilderStatus("b1", 2)
+        grid = self.makeGrid()
+        list(grid.eventGenerator(b))
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp(branch="trunk"))
+        step = s.addStepWithName("compile")
+        s.buildStarted(None)
+        step.stepStarted()
+        b.addPointEvent(["ping"])
+        events = list(grid.eventGenerator(b))
+        self.failUnless(events[0].getText() == ["ping"])
+        self.failUnless(events[1] is step)
+        self.failUnless(events[2] is s)
+        self.assertEqual(summarize(events), summarize(b.eventGenerator()))
+        self.assertEqual(grid.getStats()['misses'], 1)
+
+    def test_fallback(self):
+        b = self.makeBuilderStatus("b1", 3)
+        grid = self.makeGrid()
+        grid.maxEvents = 4
+        expected = summarize(b.eventGenerator())
+        self.assertEqual(summarize(grid.eventGenerator(b)), expected)
+        self.assertEqual(summarize(grid.eventGenerator(b)), expected)
+        stats = grid.getStats()
+        self.assertEqual((stats['loaded'], stats['hits'], stats['misses']),
+                         (4, 4, 2))
+
+    def test_changes(self):
+        for i in range(3):
+            self.changes.addChange(Change("bob", ["foo.c"], "fix %d" % i,
+                                          when=1000.0 + i, branch="trunk"))
+        grid = self.makeGrid()
+        self.assertEqual(len(list(grid.eventGenerator(self.changes))), 3)
+        c = Change("bob", ["foo.c"], "fix 4", when=1010.0, branch="stable")
+        self.changes.addChange(c)
+        grid.changeAdded(c)
+        events = list(grid.eventGenerator(self.changes))
+        self.failUnless(events[0] is c)
+        self.assertEqual(len(list(grid.eventGenerator(self.changes,
+                                                      ["trunk"]))), 3)
+
+    def test_waterfall(self):
+        # the waterfall is the same either way
+        builders = [self.makeBuilderStatus("b%d" % i, 3) for i in range(3)]
+        self.changes.addChange(Change("bob", ["foo.c"], "fix", when=1120.0))
+        service = FakeService(grid=self.makeGrid(), changes=self.changes)
+        w = waterfall.WaterfallStatusResource()
+        args = {'last_time': ["2000"]}
+        cached = w.buildGrid(FakeRequest(service, args), builders)
+        w.cacheEvents = False
+        uncached = w.buildGrid(FakeRequest(service, args), builders)
+        self.assertEqual(cached[2], uncached[2]) # timestamps
+        self.assertEqual([[summarize(cell) for cell in row]
+                          for row in cached[3]],
+                         [[summarize(cell) for cell in row]
+                          for row in uncached[3]])
@@ -0,0 +1,113 @@
+import os, shutil
+
+from twisted.trial import unittest
+
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder
+from buildbot.status.web import stampindex, grid
+from buildbot.test.fakeweb import FakeStatus, FakeService, FakeRequest, \
+     makeBuilderStatus
+
+class StampIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("test_status_web_stampindex")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.status = FakeStatus()
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makeBuilderStatus(self, name, revisions, offset=0):
+        b = makeBuilderStatus(self.status, self.basedir, name)
+        for rev in revisions:
+            self.addBuild(b, rev, offset)
+        return b
+
+    def addBuild(self, b, rev, offset=0, branch=None):
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp(branch=branch, revision=rev))
+        s.started = 1000.0 + 100 * int(rev) + offset
+        s.text = ["build", "successful"]
+        s.finished = s.started + 50
+        s.saveYourself()
+        return s
+
+    def makeIndex(self):
+        return stampindex.StampIndex(self.status)
+
+    def getGrid(self, mixin, request, num, branch=stampindex.ANYBRANCH):
+        stamps = mixin.getRecentSourcestamps(request, self.status, num, [],
+                                             branch)
+        rows = []
+        for bn in self.status.getBuilderNames():
+            builds = mixin.getBuildsForStamps(request,
+                                              self.status.getBuilder(bn),
+                                              stamps)
+            rows.append([b and b.getNumber() for b in builds])
+        return [ss.revision for ss in stamps], rows
+
+    def test_same_as_history(self):
+        self.makeBuilderStatus("b1", ["1", "2", "2", "4", "5"])
+        self.makeBuilderStatus("b2", ["1", "3", "4"], offset=10)
+        index = self.makeIndex()
+        request = FakeRequest(FakeService(index=index))
+        mixin = grid.GridStatusMixin()
+        for num in (1, 3, 5, 10):
+            mixin.useStampIndex = True
+            indexed = self.getGrid(mixin, request, num)
+            mixin.useStampIndex = False
+            self.assertEqual(indexed, self.getGrid(mixin, request, num))
+        self.assertEqual(indexed, (["1", "2", "3", "4", "5"],
+                                   [[0, 2, None, 3, 4],
+                                    [0, None, 1, 2, None]]))
+        self.assertEqual(index.stats['builds_read'], 8)
+
+    def test_incremental(self):
+        b = self.makeBuilderStatus("b1", ["1", "2"])
+        index = self.makeIndex()
+        self.assertEqual([ss.revision for ss in
+                          index.getRecentSourcestamps([b], 5,
+                                                      stampindex.ANYBRANCH)],
+                         ["1", "2"])
+        s = b.newBuild()
+        s.setSourceStamp(SourceStamp(revision="3"))
+        s.started = 1300.0
+        b.currentBuilds.append(s)
+        self.assertEqual([ss.revision for ss in
+                          index.getRecentSourcestamps([b], 5,
+                                                      stampindex.ANYBRANCH)],
+                         ["1", "2", "3"])
+        ss = SourceStamp(revision="3")
+        self.assertEqual(index.getBuilds(b, [ss]), [s])
+        s.finished = 1350.0
+        b.currentBuilds.remove(s)
+        index.buildFinished("b1", s, builder.SUCCESS)
+        self.assertEqual(index.getBuilderStamps(b).stamps[(None, "3",
+                                                           None)][2], 2)
+        self.assertEqual(index.stats['builds_read'], 2)
+
+    def test_branch(self):
+        b = self.makeBuilderStatus("b1", ["1"])
+        self.addBuild(b, "2", branch="stable")
+        index = self.makeIndex()
+        # None is the trunk, not any branch
+        self.assertEqual([ss.revision for ss in
+                          index.getRecentSourcestamps([b], 5, None)], ["1"])
+        self.assertEqual([ss.revision for ss in
+                          index.getRecentSourcestamps([b], 5, "stable")],
+                         ["2"])
+
+    def test_bounded(self):
+        b = self.makeBuilderStatus("b1", [str(i) for i in range(10)])
+        index = self.makeIndex()
+        index.maxStamps = 3
+        stamps = index.getBuilderStamps(b)
+        self.assertEqual([k[1] for k in stamps.keys], ["7", "8", "9"])
+        self.assertEqual(index.stats['builds_read'], 4)
+        s = self.addBuild(b, "10")
+        index.buildFinished("b1", s, builder.SUCCESS)
+        self.assertEqual([k[1] for k in stamps.keys], ["8", "9", "10"])
+        self.assertEqual(len(stamps.stamps), 3)
@@ -175,6 +175,96 @@ class LRUCache(unittest.TestCase):
         self.lru.add("x", self.x)
         self.assertEqual(self.lru.get("z"), 0)
 
+    def test_stats(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.add("y", self.y)
+        self.lru.get("a")
+        self.lru.get("y")
+        stats = self.lru.getStats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']),
+                         (1, 1, 1))
+        self.assertEqual((stats['items'], stats['hit_rate']), (3, 0.5))
+
+    def test_get_many_add_many(self):
+        self.lru.add_many([("a", self.a), ("b", self.b)])
+        self.assertEqual(self.lru.get_many(["a", "x", "b"]),
+                         {"a": self.a, "b": self.b})
+
+    def test_add_many_overflow(self):
+        self.lru.add_many([("a", self.a), ("b", self.b),
+                           ("x", self.x), ("y", self.y)])
+        self.assertEqual(self.lru.get_many(["a", "b", "x", "y"]),
+                         {"b": self.b, "x": self.x, "y": self.y})
+
+    def test_max_bytes(self):
+        lru = util.LRUCache(max_size=100, max_bytes=7, sizefunc=len)
+        lru.add("a", self.a)
+        lru.add("b", self.b)
+        lru.add("x", self.x)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("x")),
+                         (None, self.b, self.x))
+        self.assertEqual(lru.getStats()['bytes'], 6)
+
+    def test_max_bytes_oversized(self):
+        # an item bigger than the whole budget is still cached, alone
+        lru = util.LRUCache(max_size=100, max_bytes=2, sizefunc=len)
+        lru.add("a", self.a)
+        lru.add("b", self.b)
+        self.assertEqual((lru.get("a"), lru.get("b")), (None, self.b))
+
+    def test_none_not_cached(self):
+        lru = util.LRUCache(max_size=100, max_bytes=7, sizefunc=len)
+        lru.add("a", None)
+        lru.add_many([("b", None)])
+        self.assertEqual(len(lru), 0)
+
+    def test_max_size_zero(self):
+        lru = util.LRUCache(max_size=0)
+        lru.add("a", self.a)
+        self.assertEqual(lru.get("a"), None)
+        self.lru.add("a", self.a)
+        self.lru.resize(max_size=0)
+        self.assertEqual(len(self.lru), 0)
+
+    def test_max_bytes_without_max_size(self):
+        lru = util.LRUCache(max_size=None, max_bytes=100000, sizefunc=len)
+        for i in range(200):
+            lru.add(i, "x" * 10)
+        self.assertEqual(len(lru), 200)
+        lru.resize(max_size=None, max_bytes=1000)
+        self.assertEqual(len(lru), 100)
+
+    def test_resize(self):
+        self.lru.add_many([("a", self.a), ("b", self.b), ("x", self.x)])
+        self.lru.resize(max_size=1)
+        self.assertEqual(len(self.lru), 1)
+        self.assertEqual(self.lru.get("x"), self.x)
+
+    def test_contains(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        # checking for a is not a use, so it is still the first to go
+        self.failUnless("a" in self.lru)
+        self.lru.add("y", self.y)
+        self.failIf("a" in self.lru)
+        self.assertEqual(sorted(self.lru.keys()), ["b", "x", "y"])
+        self.assertEqual(self.lru.getStats()['hits'], 0)
+
+    def test_remove(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.remove("b")
+        self.lru.remove("nothere")
+        self.assertEqual(sorted(self.lru.keys()), ["a", "x"])
+        self.assertEqual(self.lru.get("b"), None)
+        # the freed space is reused
+        self.lru.add("y", self.y)
+        self.assertEqual(sorted(self.lru.keys()), ["a", "x", "y"])
+
 class none_or_str(unittest.TestCase):
 
     def test_none(self):
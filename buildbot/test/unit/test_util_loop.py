@@ -178,6 +178,145 @@ class Loop(unittest.TestCase, TestLoopMixin):
             self.assertEqual(res, [ 'p', 't', 'p', 't', 'p', 't', 'p', 't', 'p', 'p' ])
         return self.whenQuiet(check)
 
+class Concurrency(unittest.TestCase, TestLoopMixin):
+
+    def setUp(self):
+        self.setUpTestLoop()
+        self.clock = self.loop._reactor = task.Clock()
+        self.pending = {}
+
+    def tearDown(self):
+        self.finishAll()
+        self.clock.advance(0)
+        self.tearDownTestLoop()
+
+    def make_slow(self, tag):
+        # a processor which is active until finish(tag) is called
+        def proc():
+            self.results.append(tag)
+            d = self.pending[tag] = defer.Deferred()
+            return d
+        proc.__name__ = tag
+        return proc
+
+    def finish(self, tag):
+        self.pending.pop(tag).callback(None)
+        self.clock.advance(0)
+
+    def finishAll(self):
+        while self.pending:
+            self.finish(self.pending.keys()[0])
+
+    def test_one_at_a_time(self):
+        self.loop.add(self.make_slow('x'))
+        self.loop.add(self.make_slow('y'))
+        self.loop.trigger()
+        self.clock.advance(0)
+        self.assertEqual(len(self.results), 1)
+        self.finishAll()
+        self.assertEqual(sorted(self.results), ['x', 'y'])
+
+    def test_concurrent(self):
+        self.loop.concurrency = 2
+        for tag in 'xyz':
+            self.loop.add(self.make_slow(tag))
+        self.loop.trigger()
+        self.clock.advance(0)
+        self.assertEqual(len(self.results), 2)
+        self.assertEqual(self.loop.getStats()['running'], 2)
+        self.assertEqual(self.loop.getStats()['queued'], 1)
+        # a slow one does not hold the others up
+        first = self.results[0]
+        self.finish(self.results[1])
+        self.assertEqual(len(self.results), 3)
+        self.assertEqual(self.results[0], first)
+        self.finishAll()
+        self.assertEqual(sorted(self.results), ['x', 'y', 'z'])
+
+    def test_rerun_after_trigger(self):
+        self.loop.concurrency = 2
+        self.loop.add(self.make_slow('x'))
+        self.loop.trigger()
+        self.clock.advance(0)
+        # triggered while x is active: x must run again, but not twice at
+        # the same time
+        self.loop.trigger()
+        self.clock.advance(0)
+        self.assertEqual(self.results, ['x'])
+        self.finish('x')
+        self.assertEqual(self.results, ['x', 'x'])
+        self.finish('x')
+        self.assertEqual(self.results, ['x', 'x'])
+
+    def test_stats(self):
+        self.loop.add(self.make_slow('x'))
+        self.loop.add(self.make_slow('y'))
+        self.loop.trigger()
+        self.clock.advance(0)
+        first = self.results[0]
+        self.clock.advance(3)
+        self.finish(first)
+        self.clock.advance(1)
+        self.finishAll()
+        stats = self.loop.getStats()['processors']
+        self.assertEqual(stats[first]['runs'], 1)
+        self.assertEqual(stats[first]['run_time'], 3.0)
+        self.assertEqual(stats[first]['queue_delay'], 0.0)
+        second = self.results[1]
+        self.assertEqual(stats[second]['average_queue_delay'], 3.0)
+        self.assertEqual(stats[second]['max_run_time'], 1.0)
+
+class TriggerProcessors(unittest.TestCase, TestLoopMixin):
+
+    def setUp(self):
+        self.setUpTestLoop()
+
+    def tearDown(self):
+        self.tearDownTestLoop()
+
+    def test_only_those(self):
+        x = self.make_cb('x')
+        self.loop.add(x)
+        self.loop.add(self.make_cb('y'))
+        self.loop.trigger_processors([x])
+        def check(res):
+            self.assertEqual(res, ['x'])
+            self.assertEqual(self.loop.getStats()['triggers'],
+                             {'everything': 0, 'targeted': 1})
+        return self.whenQuiet(check)
+
+    def test_with_trigger(self):
+        x = self.make_cb('x')
+        self.loop.add(x)
+        self.loop.add(self.make_cb('y'))
+        self.loop.trigger_processors([x])
+        self.loop.trigger()
+        def check(res):
+            self.assertEqual(sorted(res), ['x', 'y'])
+        return self.whenQuiet(check)
+
+    def test_removed(self):
+        x = self.make_cb('x')
+        self.loop.add(x)
+        self.loop.trigger_processors([x, self.make_cb('gone')])
+        def check(res):
+            self.assertEqual(res, ['x'])
+        return self.whenQuiet(check)
+
+    def test_rerun_while_running(self):
+        state = State(count=2)
+        def proc():
+            self.results.append('p')
+            state.count -= 1
+            if state.count:
+                self.loop.trigger_processors([proc])
+        self.loop.add(proc)
+        self.loop.add(self.make_cb('y'))
+        self.loop.trigger_processors([proc])
+        def check(res):
+            self.assertEqual(res, ['p', 'p'])
+        return self.whenQuiet(check)
+
 class DelegateLoop(unittest.TestCase, TestLoopMixin):
 
     def setUp(self):
@@ -3,7 +3,7 @@
 from twisted.internet.defer import Deferred
 from twisted.spread import pb
 from twisted.python import threadable
-import time, re, string
+import sys, time, re, string
 
 def naturalSort(l):
     """Returns a sorted copy of l, so that numbers in strings are sorted in the
@@ -90,38 +90,163 @@ def remove_userpassword(url):
 
 class LRUCache:
     """
-    A simple least-recently-used cache, with a fixed maximum size.  Note that
-    an item's memory will not necessarily be free if other code maintains a reference
-    to it, but this class will "lose track" of it all the same.  Without caution, this
-    can lead to duplicate items in memory simultaneously.
+    A least-recently-used cache, bounded by a maximum number of items and,
+    optionally, by the approximate number of bytes they use, as measured by
+    sizefunc (which defaults to sys.getsizeof). A max_size of None leaves
+    only the byte budget, if any, to bound it. All operations take constant
+    time. Note that an item's memory will not necessarily be free if other
+    code maintains a reference to it, but this class will "lose track" of it
+    all the same.  Without caution, this can lead to duplicate items in
+    memory simultaneously.
+
+    The hits, misses and evictions attributes count what their names say.
     """
 
-    synchronized = ["get", "add"]
+    synchronized = ["get", "add", "get_many", "add_many", "resize", "clear",
+                    "keys", "remove"]
+
+    # the fields of each entry: a node in a circular doubly-linked list
+    # ordered from least to most recently used
+    PREV, NEXT, KEY, VALUE, SIZE = range(5)
 
-    def __init__(self, max_size=50):
+    def __init__(self, max_size=50, max_bytes=None, sizefunc=None):
         self._max_size = max_size
-        self._cache = {} # basic LRU cache
-        self._cached_ids = [] # = [LRU .. MRU]
+        self._max_bytes = max_bytes
+        self._sizefunc = sizefunc or sys.getsizeof
+        self.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def clear(self):
+        self._cache = {} # maps id to entry
+        self._root = root = [None, None, None, None, 0]
+        root[self.PREV] = root[self.NEXT] = root
+        self._bytes = 0
+
+    def _touch(self, entry):
+        # move ENTRY to the most-recently-used end of the list
+        PREV, NEXT = self.PREV, self.NEXT
+        entry[PREV][NEXT] = entry[NEXT]
+        entry[NEXT][PREV] = entry[PREV]
+        root = self._root
+        last = root[PREV]
+        entry[PREV], entry[NEXT] = last, root
+        last[NEXT] = root[PREV] = entry
+
+    def _lookup(self, id):
+        entry = self._cache.get(id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(entry)
+        return entry[self.VALUE]
 
     def get(self, id):
-        thing = self._cache.get(id, None)
-        if thing is not None:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
-        return thing
+        return self._lookup(id)
     __getitem__ = get
 
-    def add(self, id, thing):
-        if id in self._cache:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
+    def get_many(self, ids):
+        """Return a dict mapping each of the given ids that is in the cache
+        to its item."""
+        found = {}
+        for id in ids:
+            thing = self._lookup(id)
+            if thing is not None:
+                found[id] = thing
+        return found
+
+    def _store(self, id, thing):
+        if thing is None:
+            # get() could not tell it from a miss, and sizefunc may not
+            # cope with it
+            return
+        entry = self._cache.get(id)
+        if entry is not None:
+            self._touch(entry)
             return
-        while len(self._cached_ids) >= self._max_size:
-            del self._cache[self._cached_ids.pop(0)]
-        self._cache[id] = thing
-        self._cached_ids.append(id)
+        size = 0
+        if self._max_bytes is not None:
+            size = self._sizefunc(thing)
+        root = self._root
+        last = root[self.PREV]
+        entry = [last, root, id, thing, size]
+        last[self.NEXT] = root[self.PREV] = entry
+        self._cache[id] = entry
+        self._bytes += size
+
+    def _evict(self):
+        # keep the most recent item, even if it is bigger than max_bytes
+        # (but not if max_size is 0, which turns the cache off)
+        while (self._max_size is not None
+               and len(self._cache) > self._max_size) or (
+                len(self._cache) > 1 and self._max_bytes is not None
+                and self._bytes > self._max_bytes):
+            oldest = self._root[self.NEXT]
+            oldest[self.PREV][self.NEXT] = oldest[self.NEXT]
+            oldest[self.NEXT][self.PREV] = oldest[self.PREV]
+            del self._cache[oldest[self.KEY]]
+            self._bytes -= oldest[self.SIZE]
+            self.evictions += 1
+
+    def add(self, id, thing):
+        self._store(id, thing)
+        self._evict()
     __setitem__ = add
 
+    def add_many(self, items):
+        """Add each of the (id, thing) pairs in ITEMS."""
+        for (id, thing) in items:
+            self._store(id, thing)
+        self._evict()
+
+    def remove(self, id):
+        """Forget the item with the given id, if it is in the cache."""
+        entry = self._cache.pop(id, None)
+        if entry is None:
+            return
+        entry[self.PREV][self.NEXT] = entry[self.NEXT]
+        entry[self.NEXT][self.PREV] = entry[self.PREV]
+        self._bytes -= entry[self.SIZE]
+
+    def resize(self, max_size=50, max_bytes=None):
+        if max_bytes is not None and self._max_bytes is None:
+            # sizes were not measured until now
+            entry = self._root[self.NEXT]
+            while entry is not self._root:
+                entry[self.SIZE] = self._sizefunc(entry[self.VALUE])
+                self._bytes += entry[self.SIZE]
+                entry = entry[self.NEXT]
+        elif max_bytes is None:
+            entry = self._root[self.NEXT]
+            while entry is not self._root:
+                entry[self.SIZE] = 0
+                entry = entry[self.NEXT]
+            self._bytes = 0
+        self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._evict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, id):
+        # unlike get(), this is neither a use nor a hit
+        return id in self._cache
+
+    def keys(self):
+        return self._cache.keys()
+
+    def getStats(self):
+        """Return a dict describing the cache's size and effectiveness."""
+        lookups = self.hits + self.misses
+        hit_rate = None
+        if lookups:
+            hit_rate = float(self.hits) / lookups
+        return dict(items=len(self._cache), max_size=self._max_size,
+                    bytes=self._bytes, max_bytes=self._max_bytes,
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, hit_rate=hit_rate)
+
 threadable.synchronize(LRUCache)
 
 
@@ -36,23 +36,25 @@
 # ***** END LICENSE BLOCK *****
 
 """
-One-at-a-time notification-triggered Deferred event loop. Each such loop has a
-'doorbell' named trigger() and a set of processing functions.  The processing
-functions are expected to be callables like Scheduler methods, which examine a
-database for work to do. The doorbell will be rung by other code that writes
-into the database (possibly in a separate process).
-
-At some point after the doorbell is rung, each function will be run in turn,
-one at a time.  Each function can return a Deferred, and the next function will
-not be run until the previous one's Deferred has fired.  That is, at all times,
-at most one processing function will be active. 
-
-If the doorbell is rung during a run, the loop will be run again later.
-Multiple rings may be handled by a single run, but the class guarantees that
-there will be at least one full run that begins after the last ring.  The
-relative order of processing functions within a run is not preserved.  If a
-processing function is added to the loop more than once, it will still only be
-called once per run.
+Notification-triggered Deferred event loop. Each such loop has a 'doorbell'
+named trigger() and a set of processing functions.  The processing functions
+are expected to be callables like Scheduler methods, which examine a database
+for work to do. The doorbell will be rung by other code that writes into the
+database (possibly in a separate process).
+
+At some point after the doorbell is rung, each function will be run in turn.
+Each function can return a Deferred, and the function is active until that
+Deferred has fired. At most .concurrency functions (by default, one) are
+active at any time; the others wait for their turn. A function is never
+active more than once at the same time.
+
+If the doorbell is rung while a function is active, that function will be run
+again after it finishes. Multiple rings may be handled by a single run, but
+the class guarantees that, for each function, there will be at least one run
+that begins after the last ring. Functions that are not active are not held
+up by the ones that are, beyond the concurrency limit. The relative order of
+processing functions is not preserved.  If a processing function is added to
+the loop more than once, it will still only be called once per run.
 
 If the Deferred returned by the processing function fires with a number, the
 event loop will call that function again at or after the given time
@@ -60,7 +62,7 @@ event loop will call that function again at or after the given time
 when they want to 'sleep' until some amount of time has passed, such as for a
 Scheduler that is waiting for a tree-stable-timer to expire, or a Periodic
 scheduler that wants to fire once every six hours. This delayed call will
-obey the same one-at-a-time behavior as the run-everything trigger.
+obey the same concurrency limit as the run-everything trigger.
 
 Each function's return-value-timer value will replace the previous timer. Any
 outstanding timer will be cancelled just before invoking a processing
@@ -75,8 +77,16 @@ don't cause 'OCD Alarm Clock Syndrome' (in which they get woken up a moment
 too early and then try to sleep repeatedly for zero seconds). The event loop
 will silently impose a 5-second minimum delay time to avoid this.
 
+The doorbell can also be rung for just some of the functions, with
+trigger_processors(), when the caller knows which of them have work to do.
+The same guarantee holds for each of those functions, and the others are not
+run at all.
+
 Any errors in the processing functions are written to log.err and then
 ignored.
+
+getStats() reports, for each processing function, how long its runs took and
+how long it waited to start after becoming runnable.
 """
 
 import time
@@ -84,17 +94,34 @@ from twisted.internet import reactor, defer
 from twisted.application import service
 from twisted.python import log
 
+def processor_name(p):
+    # schedulers are known by name; anything else by its function name
+    name = getattr(getattr(p, 'im_self', None), 'name', None)
+    if name is None:
+        name = getattr(p, '__name__', repr(p))
+    return name
+
 class LoopBase(service.MultiService):
     OCD_MINIMUM_DELAY = 5.0
+    concurrency = 1 # how many processing functions may be active at once
 
     def __init__(self):
         service.MultiService.__init__(self)
         self._loop_running = False
         self._everything_needs_to_run = False
+        self._triggered_at = None
+        self._targeted = {} # maps processors to when they were triggered
         self._wakeup_timer = None
         self._timers = {}
         self._when_quiet_waiters = set()
         self._start_timer = None
+        self._queue = [] # runnable processors, in the order they will run
+        self._queued = {} # maps queued processors to when they became runnable
+        self._running = set()
+        self._dirty = {} # running processors that must run again, likewise
+        self._starting = False
+        self.processor_stats = {}
+        self.trigger_stats = {'everything': 0, 'targeted': 0}
         self._reactor = reactor # seam for tests to use t.i.t.Clock
 
     def stopService(self):
@@ -114,56 +141,141 @@ class LoopBase(service.MultiService):
 
     def trigger(self):
         assert self.running
+        self.trigger_stats['everything'] += 1
         self._mark_runnable(run_everything=True)
 
+    def trigger_processors(self, processors):
+        """Ring the doorbell for PROCESSORS only: each of them will run at
+        least once after this call, and the other processing functions are
+        left alone."""
+        assert self.running
+        self.trigger_stats['targeted'] += 1
+        now = self._reactor.seconds()
+        for p in processors:
+            self._targeted.setdefault(p, now)
+        self._mark_runnable(run_everything=False)
+
     def _mark_runnable(self, run_everything):
         if run_everything:
             self._everything_needs_to_run = True
+            if self._triggered_at is None:
+                self._triggered_at = self._reactor.seconds()
             # timers are now redundant, so cancel any existing ones
             self._timers.clear() ; self._set_wakeup_timer()
-        if self._loop_running:
+        if self._start_timer and self._start_timer.active():
             return
         self._loop_running = True
         self._start_timer = self._reactor.callLater(0, self._loop_start)
 
     # subclasses must implement get_processors()
 
+    def run_processor(self, p):
+        # subclasses can override this to do something before (or after)
+        # each processing function
+        return p()
+
     def _loop_start(self):
+        all_processors = self.get_processors()
         if self._everything_needs_to_run:
             self._everything_needs_to_run = False
             self._timers.clear() ; self._set_wakeup_timer()
-            self._remaining = list(self.get_processors())
+            since = self._triggered_at
+            self._triggered_at = None
+            for p in all_processors:
+                self._enqueue(p, since)
         else:
-            self._remaining = []
             now = self._reactor.seconds()
-            all_processors = self.get_processors()
             for p in list(self._timers.keys()):
                 if self._timers[p] <= now:
-                    del self._timers[p]
+                    since = self._timers.pop(p)
                     # don't run a processor that was removed while it still
                     # had a timer running
                     if p in all_processors:
-                        self._remaining.append(p)
+                        self._enqueue(p, since)
                 # consider sorting by 'when'
+        targeted = self._targeted
+        self._targeted = {}
+        for (p, since) in targeted.items():
+            # likewise for one that was removed since it was triggered
+            if p in all_processors:
+                self._enqueue(p, since)
         self._loop_next()
 
+    def _enqueue(self, p, since):
+        if p in self._running:
+            # it must start again after it finishes, since it may have
+            # missed whatever made it runnable
+            self._dirty[p] = min(self._dirty.get(p, since), since)
+        elif p not in self._queued:
+            self._queue.append(p)
+            self._queued[p] = since
+
     def _loop_next(self):
-        if not self._remaining:
-            return self._loop_done()
-        p = self._remaining.pop(0)
-        self._timers.pop(p, None)
-        d = defer.maybeDeferred(p)
-        d.addCallback(self._set_timer, p)
-        d.addErrback(log.err)
-        d.addBoth(self._one_done)
+        if self._starting:
+            return # our caller will start the next ones
+        self._starting = True
+        try:
+            while self._queue and len(self._running) < self.concurrency:
+                p = self._queue.pop(0)
+                since = self._queued.pop(p)
+                self._timers.pop(p, None)
+                self._running.add(p)
+                started = self._reactor.seconds()
+                d = defer.maybeDeferred(self.run_processor, p)
+                d.addCallback(self._set_timer, p)
+                d.addErrback(log.err)
+                d.addBoth(self._one_done, p, since, started)
+        finally:
+            self._starting = False
+        if not self._queue and not self._running:
+            self._loop_done()
         return None # no long Deferred chains
-    def _one_done(self, ignored):
+
+    def _one_done(self, ignored, p, since, started):
+        self._running.discard(p)
+        self._record_run(p, since, started)
+        if p in self._dirty:
+            self._enqueue(p, self._dirty.pop(p))
         self._loop_next()
 
+    def _record_run(self, p, since, started):
+        now = self._reactor.seconds()
+        name = processor_name(p)
+        s = self.processor_stats.get(name)
+        if s is None:
+            s = self.processor_stats[name] = {
+                'runs': 0,
+                'run_time': 0.0, 'max_run_time': 0.0,
+                'queue_delay': 0.0, 'max_queue_delay': 0.0,
+                }
+        s['runs'] += 1
+        s['run_time'] += now - started
+        s['max_run_time'] = max(s['max_run_time'], now - started)
+        if since is not None:
+            delay = max(started - since, 0.0)
+            s['queue_delay'] += delay
+            s['max_queue_delay'] = max(s['max_queue_delay'], delay)
+
+    def getStats(self):
+        """Return the run time of each processing function, the time it
+        spent waiting to start after becoming runnable (its queue delay), and
+        how many times the doorbell was rung for everything and for only
+        some of the functions."""
+        processors = {}
+        for name, s in self.processor_stats.items():
+            s = s.copy()
+            s['average_run_time'] = s['run_time'] / s['runs']
+            s['average_queue_delay'] = s['queue_delay'] / s['runs']
+            processors[name] = s
+        return {'concurrency': self.concurrency,
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'triggers': self.trigger_stats.copy(),
+                'processors': processors}
+
     def _loop_done(self):
-        if self._everything_needs_to_run:
-            self._loop_start()
-            return
+        if self._start_timer and self._start_timer.active():
+            return # we are about to start again
         self._loop_running = False
         self._set_wakeup_timer()
         if not self._timers:
@@ -175,8 +287,8 @@ class LoopBase(service.MultiService):
 
     def loop_done(self):
         # this can be overridden by subclasses to do more work when we've
-        # finished a pass through the loop and don't need to immediately
-        # start a new one
+        # run everything that was runnable and don't need to immediately
+        # start again
         pass
 
     def _set_timer(self, res, p):
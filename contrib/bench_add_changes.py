@@ -0,0 +1,94 @@
+#! /usr/bin/python
+
+"""
+Measure how long a buildmaster takes to store a backlog of changes, as a
+poller catching up after an outage delivers them, one at a time (each in a
+blocking transaction of its own, as ChangeManager.addChange does) and all
+at once (in one transaction in a database thread, as addChanges does). For
+each, it also reports the longest time the reactor went without running.
+
+This adds CHANGES changes of FILES files each (by default 500 changes of 20
+files) to a scratch sqlite database both ways.
+
+  python contrib/bench_add_changes.py [CHANGES [FILES]]
+"""
+
+import sys, time, tempfile, shutil
+
+from twisted.internet import reactor, defer, task
+from twisted.python import log
+
+from buildbot import db
+from buildbot.changes.changes import Change
+
+class StallMeter:
+    # the longest gap between ticks of a LoopingCall that should run every
+    # INTERVAL seconds
+    INTERVAL = 0.01
+    def __init__(self):
+        self.longest = 0
+        self.last = time.time()
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.start(self.INTERVAL)
+    def tick(self):
+        now = time.time()
+        self.longest = max(self.longest, now - self.last)
+        self.last = now
+    def stop(self):
+        self.tick()
+        self.loop.stop()
+        return self.longest
+
+def make_changes(num_changes, num_files, revision):
+    return [Change("bob", ["src/dir%d/file%d.c" % (i, j)
+                           for j in range(num_files)],
+                   "change %d" % i, revision="r%d-%d" % (revision, i),
+                   links=["http://example.com/r%d" % i],
+                   properties={"poller": "bench"})
+            for i in range(num_changes)]
+
+def one_at_a_time(dbc, changes):
+    for c in changes:
+        dbc.addChangeToDatabase(c)
+
+def all_at_once(dbc, changes):
+    return dbc.addChangesToDatabase(changes)
+
+def measure(dbc, name, add, changes):
+    meter = StallMeter()
+    # let the StallMeter start ticking first
+    d = task.deferLater(reactor, 0.1, lambda: None)
+    start = []
+    def _start(ign):
+        start.append(time.time())
+        return add(dbc, changes)
+    d.addCallback(_start)
+    def _report(ign):
+        elapsed = time.time() - start[0]
+        print "%-16s %7.3fs, reactor blocked for up to %7.3fs" \
+              % (name + ":", elapsed, meter.stop())
+    d.addCallback(_report)
+    return d
+
+def main(args):
+    num_changes = int(args[0]) if args else 500
+    num_files = int(args[1]) if len(args) > 1 else 20
+    tmpdir = tempfile.mkdtemp()
+    spec = db.DBSpec.from_url("sqlite:///bench.sqlite", tmpdir)
+    dbc = db.create_or_upgrade_db(spec)
+    print "%d changes of %d files" % (num_changes, num_files)
+    d = measure(dbc, "one at a time", one_at_a_time,
+                make_changes(num_changes, num_files, 1))
+    d.addCallback(lambda ign: measure(dbc, "all at once", all_at_once,
+                                      make_changes(num_changes, num_files,
+                                                   2)))
+    d.addErrback(log.err)
+    def _done(ign):
+        dbc.stop()
+        shutil.rmtree(tmpdir)
+        reactor.stop()
+    d.addBoth(_done)
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main, sys.argv[1:])
+    reactor.run()
@@ -0,0 +1,98 @@
+#! /usr/bin/python
+
+"""
+Measure how long a buildmaster takes to find and claim its pending build
+requests, before and after the version-2 schema indexes are added.
+
+This fills a scratch sqlite database with NUM buildrequests (by default one
+million) spread over a number of builders, almost all of them already
+complete, just like the database of a long-lived buildmaster. It then times
+the same transaction that Builder.run performs for each builder, once
+against the unindexed version-1 schema and once after upgrading to the
+current schema.
+
+  python contrib/bench_claim_buildrequests.py [NUM [BUILDERS [PENDING]]]
+"""
+
+import sys, time, tempfile, shutil
+
+from buildbot import db
+
+def fill(conn, num, builders, pending):
+    c = conn.cursor()
+    now = int(time.time())
+    c.execute("INSERT INTO sourcestamps (id, branch, revision)"
+              " VALUES (1, NULL, NULL)")
+    batch = 10000
+    brid = 1
+    while brid <= num:
+        buildsets = []
+        requests = []
+        for i in range(brid, min(brid + batch, num + 1)):
+            complete = int(i <= num - pending)
+            buildsets.append((i, "bench", 1, now - num + i, complete))
+            requests.append((i, i, "builder%d" % (i % builders),
+                             now - num + i, complete))
+        c.executemany("INSERT INTO buildsets"
+                      " (id, reason, sourcestampid, submitted_at, complete)"
+                      " VALUES (?,?,?,?,?)", buildsets)
+        c.executemany("INSERT INTO buildrequests"
+                      " (id, buildsetid, buildername, submitted_at, complete)"
+                      " VALUES (?,?,?,?,?)", requests)
+        brid += batch
+    conn.commit()
+
+def claim_all(dbc, builders):
+    # this is what Builder._claim_buildreqs does, for every builder
+    def _txn(t, buildername):
+        now = time.time()
+        brs = dbc.get_unclaimed_buildrequests(buildername, now - 3600,
+                                              "bench", "bench-incarnation", t)
+        dbc.claim_buildrequests(now, "bench", "bench-incarnation",
+                                [br.id for br in brs], t)
+        return len(brs)
+    start = time.time()
+    claimed = 0
+    for i in range(builders):
+        claimed += dbc.runInteractionNow(_txn, "builder%d" % i)
+    return time.time() - start, claimed
+
+def reset_claims(dbc):
+    dbc.runQueryNow("UPDATE buildrequests SET claimed_at=0,"
+                    " claimed_by_name=NULL, claimed_by_incarnation=NULL")
+
+def main(args):
+    num = int(args[0]) if args else 1000000
+    builders = int(args[1]) if len(args) > 1 else 100
+    pending = int(args[2]) if len(args) > 2 else 500
+    tmpdir = tempfile.mkdtemp()
+    try:
+        spec = db.DBSpec.from_url("sqlite:///bench.sqlite", tmpdir)
+        dbapi = __import__(spec.dbapiName, {}, {}, ["connect"])
+        conn = dbapi.connect(*spec.connargs)
+        for t in db.TABLES:
+            conn.cursor().execute(t)
+        print "filling db with %d buildrequests (%d pending, %d builders)" \
+              % (num, pending, builders)
+        fill(conn, num, builders, pending)
+        conn.close()
+
+        dbc = db.DBConnector(spec)
+        dbc.start()
+        elapsed, claimed = claim_all(dbc, builders)
+        print "version 1: claimed %d requests in %.3fs (%.2fms per builder)" \
+              % (claimed, elapsed, 1000.0 * elapsed / builders)
+        dbc.stop()
+
+        dbc = db.create_or_upgrade_db(spec)
+        reset_claims(dbc)
+        elapsed, claimed = claim_all(dbc, builders)
+        print "version %d: claimed %d requests in %.3fs (%.2fms per builder)" \
+              % (db.CURRENT_VERSION, claimed, elapsed,
+                 1000.0 * elapsed / builders)
+        dbc.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
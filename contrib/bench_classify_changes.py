@@ -0,0 +1,83 @@
+#! /usr/bin/python
+
+"""
+Measure how long the buildmaster takes to classify new changes for many
+schedulers, one scheduler per transaction (as each Scheduler used to do in
+its own run) and all at once (as the SchedulerManager does now).
+
+This adds SCHEDULERS Schedulers (by default 400), each watching one of
+BRANCHES branches (by default 20), to a scratch sqlite database, then adds
+CHANGES changes of FILES files each (by default 5 changes of 2000 files)
+and times how long classifying them takes both ways.
+
+  python contrib/bench_classify_changes.py [SCHEDULERS [BRANCHES [CHANGES [FILES]]]]
+"""
+
+import sys, time, tempfile, shutil
+
+from buildbot import db
+from buildbot.changes.changes import Change
+from buildbot.schedulers import manager, basic
+
+class FakeChangeSource:
+    def __init__(self, dbc):
+        self.dbc = dbc
+    def getChangesGreaterThan(self, last_changeid, t=None):
+        # like the ChangeManager, without the change cache
+        self.dbc._change_cache.clear()
+        return self.dbc.getChangesGreaterThan(last_changeid, t)
+
+def isSourceFile(change):
+    for fn in change.files:
+        if fn.endswith(".c"):
+            return True
+    return False
+
+def reset(dbc, schedulers):
+    dbc.runQueryNow("DELETE FROM scheduler_changes")
+    def _txn(t):
+        for s in schedulers:
+            s.set_state(t, {"last_processed": 0})
+    dbc.runInteractionNow(_txn)
+
+def main(args):
+    num_schedulers = int(args[0]) if args else 400
+    num_branches = int(args[1]) if len(args) > 1 else 20
+    num_changes = int(args[2]) if len(args) > 2 else 5
+    num_files = int(args[3]) if len(args) > 3 else 2000
+    tmpdir = tempfile.mkdtemp()
+    try:
+        spec = db.DBSpec.from_url("sqlite:///bench.sqlite", tmpdir)
+        dbc = db.create_or_upgrade_db(spec)
+        sm = manager.SchedulerManager(None, dbc, FakeChangeSource(dbc))
+        schedulers = []
+        for i in range(num_schedulers):
+            s = basic.Scheduler("s%d" % i, "branch%d" % (i % num_branches),
+                                None, ["b"], fileIsImportant=isSourceFile)
+            s.setServiceParent(sm)
+            schedulers.append(s)
+        dbc.runInteractionNow(dbc._addSchedulers, schedulers)
+        files = ["src/file%d.c" % i for i in range(num_files)]
+        for i in range(num_changes):
+            dbc.addChangeToDatabase(Change("bob", files, "merge",
+                                           branch="branch%d"
+                                           % (i % num_branches)))
+        print "%d schedulers on %d branches, %d changes of %d files" \
+              % (num_schedulers, num_branches, num_changes, num_files)
+
+        reset(dbc, schedulers)
+        start = time.time()
+        for s in schedulers:
+            dbc.runInteractionNow(sm.classify_changes_txn, [s])
+        print "one scheduler at a time: %6.3fs" % (time.time() - start)
+
+        reset(dbc, schedulers)
+        start = time.time()
+        dbc.runInteractionNow(sm.classify_changes_txn, schedulers)
+        print "all schedulers at once:  %6.3fs" % (time.time() - start)
+        dbc.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
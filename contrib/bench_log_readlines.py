@@ -0,0 +1,92 @@
+#! /usr/bin/python
+
+"""
+Measure how much memory it takes to scan every line of a large build log,
+the way a step's createSummary does.
+
+This writes a scratch LogFile of SIZE megabytes (by default 200) of
+compiler-like output, then counts its warning lines in a fresh process for
+each method, and reports the peak memory use of that process:
+
+ - getText: log.getText().split("\\n"), the old way
+ - readTextLines: log.readTextLines(), which reads one chunk at a time
+
+  python contrib/bench_log_readlines.py [SIZE]
+"""
+
+import sys, os, time, tempfile, shutil, resource, subprocess
+
+from buildbot.status import builder
+
+class FakeBuilder:
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+class FakeBuild:
+    def __init__(self, basedir):
+        self.builder = FakeBuilder(basedir)
+
+class FakeStep:
+    def __init__(self, basedir):
+        self.build = FakeBuild(basedir)
+
+def make_log(basedir, megabytes):
+    log = builder.LogFile(FakeStep(basedir), "stdio", "1-log-stdio")
+    lines = []
+    for i in range(1000):
+        if i % 50 == 0:
+            lines.append("foo.c:%d: warning: unused variable 'x'\n" % i)
+        else:
+            lines.append("gcc -c -O2 -Wall -o obj/file%d.o src/file%d.c\n"
+                         % (i, i))
+    block = "".join(lines)
+    written = 0
+    while written < megabytes * 1024 * 1024:
+        log.addStdout(block)
+        written += len(block)
+    log.finish()
+    return log
+
+def open_log(basedir):
+    log = builder.LogFile.__new__(builder.LogFile)
+    log.step = FakeStep(basedir)
+    log.filename = "1-log-stdio"
+    log.finished = True
+    log.runEntries = []
+    return log
+
+def scan(basedir, method):
+    log = open_log(basedir)
+    start = time.time()
+    warnings = 0
+    if method == "getText":
+        for line in log.getText().split("\n"):
+            if "warning:" in line:
+                warnings += 1
+    else:
+        for line in log.readTextLines():
+            if "warning:" in line:
+                warnings += 1
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%-14s %d warnings in %.2fs, peak RSS %.1f MB" \
+          % (method, warnings, elapsed, maxrss / 1024.0)
+
+def main(args):
+    if len(args) == 3 and args[0] == "--scan":
+        scan(args[1], args[2])
+        return
+    megabytes = int(args[0]) if args else 200
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print "writing a %d MB log" % megabytes
+        make_log(tmpdir, megabytes)
+        for method in ("getText", "readTextLines"):
+            subprocess.call([sys.executable, os.path.abspath(__file__),
+                             "--scan", tmpdir, method])
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
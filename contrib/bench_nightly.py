@@ -0,0 +1,60 @@
+#! /usr/bin/python
+
+"""
+Time how long a Nightly scheduler takes to work out when it should next
+run, by trying each minute in turn until one matches (as it used to) and by
+looking only at the matching days, hours and minutes (as it does now).
+
+Each schedule is asked for its next run time ROUNDS times (by default 3)
+from a few fixed times in March 2027, in the local time zone (set TZ to try
+another one).
+
+  python contrib/bench_nightly.py [ROUNDS]
+"""
+
+import sys, time
+
+from buildbot.schedulers import timed
+
+SCHEDULES = [
+    ("hourly", dict()),
+    ("nightly", dict(hour=3)),
+    ("weekdays", dict(hour=6, minute=30, dayOfWeek='0-4')),
+    ("weekly", dict(hour=1, dayOfWeek=6)),
+    ("monthly", dict(hour=0, dayOfMonth=1)),
+    ("yearly", dict(hour=0, dayOfMonth=24, month=12)),
+    ("leap day", dict(hour=12, dayOfMonth=29, month=2)),
+    ]
+
+def bruteForceNextRunTime(s, now):
+    # the old algorithm: try every minute until one matches
+    dateTime = time.localtime(now)
+    dateTime = time.localtime(time.mktime(dateTime) + 60 - dateTime[5])
+    yearLimit = dateTime[0] + 2
+    while not s._isRunTime(dateTime):
+        dateTime = time.localtime(time.mktime(dateTime) + 60)
+        assert dateTime[0] < yearLimit, 'Something is wrong with this code'
+    return time.mktime(dateTime)
+
+def main(args):
+    rounds = int(args[0]) if args else 3
+    # the brute force gives up after two years, so start after the last
+    # February 29th
+    nows = [time.mktime((2027, 3, day, hour, 17, 23, 0, 0, -1))
+            for (day, hour) in [(1, 0), (10, 12), (20, 23)]]
+    print "%-10s %12s %12s" % ("schedule", "every minute", "direct")
+    for (name, kwargs) in SCHEDULES:
+        s = timed.Nightly(name, ["b"], **kwargs)
+        times = []
+        for f in (lambda now: bruteForceNextRunTime(s, now),
+                  s._calculateNextRunTimeFrom):
+            start = time.time()
+            for i in range(rounds):
+                results = [f(now) for now in nows]
+            times.append((time.time() - start) / (rounds * len(nows)))
+        assert results == [bruteForceNextRunTime(s, now) for now in nows]
+        print "%-10s %10.3fms %10.3fms" % (name, times[0] * 1000,
+                                            times[1] * 1000)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,185 @@
+#! /usr/bin/python
+
+"""
+Count the database transactions the buildmaster runs for each buildset that
+is submitted and completed, when every notification runs all of the
+builders and schedulers (as it used to) and when it only runs the ones it
+is about (as it does now).
+
+This sets up a BotMaster with BUILDERS builders (by default 300), each of
+which has an idle slave and so runs a claim transaction whenever it is run,
+and a SchedulerManager with one Scheduler and DEPENDENTS Dependent
+schedulers (by default 50), of which only one follows that Scheduler. It
+then submits BUILDSETS buildsets (by default 20) for a single builder from
+the Scheduler, completes each of them, and counts the transactions run by
+the builders and schedulers in response.
+
+  python contrib/bench_targeted_triggers.py [BUILDERS [DEPENDENTS [BUILDSETS]]]
+"""
+
+import sys, time, tempfile, shutil
+
+from twisted.internet import reactor, defer
+from twisted.python import log
+
+from buildbot import db, master
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status.builder import SUCCESS
+from buildbot.schedulers import manager, basic
+
+# the transactions run by this script itself, rather than in response
+BENCH_INTERACTIONS = ("_txn_submit", "_txn_retire_buildreqs",
+                      "_txn_get_buildrequestids_for_buildset")
+
+class FakeChangeSource:
+    def __init__(self, dbc):
+        self.dbc = dbc
+    def getChangesGreaterThan(self, last_changeid, t=None):
+        return self.dbc.getChangesGreaterThan(last_changeid, t)
+
+class ClaimingBuilder:
+    """Like a Builder with an idle slave: each run claims whatever build
+    requests are waiting for it (but does not start any builds)."""
+    running = True
+    def __init__(self, name, dbc):
+        self.name = name
+        self.dbc = dbc
+    def run(self):
+        return self.dbc.runInteraction(self._claim_buildreqs)
+    def _claim_buildreqs(self, t):
+        now = time.time()
+        brs = self.dbc.get_unclaimed_buildrequests(self.name, now - 3600,
+                                                   "bench", "incarnation", t)
+        self.dbc.claim_buildrequests(now, "bench", "incarnation",
+                                     [br.id for br in brs], t)
+
+class Bench:
+    def __init__(self, dbc, num_builders, num_dependents):
+        self.dbc = dbc
+        self.botmaster = master.BotMaster()
+        self.botmaster.setMasterName("bench", "incarnation")
+        self.botmaster.db = dbc
+        self.botmaster.request_index = master.OldestRequestIndex(dbc)
+        for i in range(num_builders):
+            name = "builder%d" % i
+            self.botmaster.builders[name] = ClaimingBuilder(name, dbc)
+            self.botmaster.builderNames.append(name)
+        self.sm = manager.SchedulerManager(None, dbc, FakeChangeSource(dbc))
+        self.upstream = basic.Scheduler("upstream", None, None, ["builder0"])
+        other = basic.Scheduler("other", None, None, ["builder1"])
+        self.schedulers = [self.upstream, other]
+        for i in range(num_dependents):
+            parent = (i == 0) and self.upstream or other
+            self.schedulers.append(basic.Dependent("dependent%d" % i, parent,
+                                                   ["builder0"]))
+        self.targeted = True
+        dbc.subscribe_to("add-buildrequest", self.add_buildrequest)
+        dbc.subscribe_to("modify-buildset", self.modify_buildset)
+
+    def add_buildrequest(self, category, *brids):
+        if self.targeted:
+            return self.botmaster.trigger_add_buildrequest(category, *brids)
+        self.botmaster.triggerNewBuildCheck()
+
+    def modify_buildset(self, category, *bsids):
+        if self.targeted:
+            return self.sm.trigger_modify_buildset(category, *bsids)
+        self.sm.trigger()
+
+    def start(self):
+        self.botmaster.loop.startService()
+        self.sm.startService()
+        d = self.sm.updateSchedulers(self.schedulers)
+        d.addCallback(lambda ign: self.settle())
+        return d
+
+    def stop(self):
+        d = self.sm.stopService()
+        d.addCallback(lambda ign: self.botmaster.loop.stopService())
+        return d
+
+    def settle(self):
+        # wait until notifications have been delivered and both loops
+        # have finished running in response
+        d = defer.Deferred()
+        state = {'quiet': 0}
+        def _check():
+            if (self.sm.is_quiet() and self.botmaster.loop.is_quiet()
+                and not self.dbc._pending_operation_count):
+                state['quiet'] += 1
+            else:
+                state['quiet'] = 0
+            if state['quiet'] >= 5:
+                d.callback(None)
+            else:
+                reactor.callLater(0.01, _check)
+        _check()
+        return d
+
+    def _txn_submit(self, t):
+        ssid = self.dbc.get_sourcestampid(SourceStamp(), t)
+        return self.upstream.create_buildset(ssid, "bench", t)
+
+    def submit_and_complete(self):
+        d = self.dbc.runInteraction(self._txn_submit)
+        def _submitted(bsid):
+            d = self.settle()
+            def _complete(ign):
+                brids = self.dbc.get_buildrequestids_for_buildset(bsid)
+                self.dbc.retire_buildrequests(brids.values(), SUCCESS)
+                return self.settle()
+            d.addCallback(_complete)
+            return d
+        d.addCallback(_submitted)
+        return d
+
+    def count(self):
+        interactions = self.dbc.query_stats.asDict()['interactions']
+        return dict([(name, d['count']) for (name, d) in interactions.items()
+                     if name not in BENCH_INTERACTIONS])
+
+    def measure(self, targeted, num_buildsets):
+        self.targeted = targeted
+        before = self.count()
+        d = defer.succeed(None)
+        for i in range(num_buildsets):
+            d.addCallback(lambda ign: self.submit_and_complete())
+        def _report(ign):
+            after = self.count()
+            counts = [(after[name] - before.get(name, 0), name)
+                      for name in after]
+            counts = [(n, name) for (n, name) in counts if n]
+            counts.sort(reverse=True)
+            total = sum([n for (n, name) in counts])
+            print "%s: %.1f transactions per buildset" \
+                  % (targeted and "targeted" or "everything",
+                     float(total) / num_buildsets)
+            for (n, name) in counts:
+                print "  %8.1f %s" % (float(n) / num_buildsets, name)
+        d.addCallback(_report)
+        return d
+
+def main(args):
+    num_builders = int(args[0]) if args else 300
+    num_dependents = int(args[1]) if len(args) > 1 else 50
+    num_buildsets = int(args[2]) if len(args) > 2 else 20
+    tmpdir = tempfile.mkdtemp()
+    spec = db.DBSpec.from_url("sqlite:///bench.sqlite", tmpdir)
+    dbc = db.create_or_upgrade_db(spec)
+    bench = Bench(dbc, num_builders, num_dependents)
+    print "%d builders, 1 scheduler with 1 of %d dependents, %d buildsets" \
+          % (num_builders, num_dependents, num_buildsets)
+    d = bench.start()
+    d.addCallback(lambda ign: bench.measure(False, num_buildsets))
+    d.addCallback(lambda ign: bench.measure(True, num_buildsets))
+    d.addCallback(lambda ign: bench.stop())
+    d.addErrback(log.err)
+    def _done(ign):
+        dbc.stop()
+        shutil.rmtree(tmpdir)
+        reactor.stop()
+    d.addBoth(_done)
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main, sys.argv[1:])
+    reactor.run()
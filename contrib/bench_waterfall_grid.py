@@ -0,0 +1,123 @@
+#! /usr/bin/python
+
+"""
+Measure how long the waterfall takes to gather its events, with and without
+the EventGrid that keeps them in memory.
+
+This saves BUILDS finished builds (by default 100) of ten steps each for
+each of BUILDERS builders (by default 150) in a scratch directory, then
+times WaterfallStatusResource.buildGrid for a default-sized page:
+
+ - uncached: every hit walks each builder's history, loading its builds
+ - first cached hit: the EventGrid loads each builder's recent events once
+ - cached: later hits only read the EventGrid
+
+The build cache is kept small, as it would be on a busy buildmaster where
+the waterfall competes with everything else for it.
+
+  python contrib/bench_waterfall_grid.py [BUILDERS [BUILDS]]
+"""
+
+import sys, os, time, tempfile, shutil
+
+from buildbot.status import builder, buildcache
+from buildbot.status.web import eventgrid, waterfall
+from buildbot.status.web import changes # registers IBox for Change
+
+class FakeStatus:
+    db = None
+    def __init__(self):
+        self.buildCache = buildcache.BuildCache(max_size=50)
+        self.builders = {}
+    def subscribe(self, target):
+        for name, b in self.builders.items():
+            t = target.builderAdded(name, b)
+            if t:
+                b.subscribe(t)
+
+class FakeChangeSource:
+    def eventGenerator(self, branches=[], categories=[], committers=[],
+                       minTime=0):
+        return iter([])
+
+class FakeService:
+    def __init__(self, grid, changes):
+        self.grid = grid
+        self.changes = changes
+    def getEventGrid(self):
+        return self.grid
+    def getChangeSvc(self):
+        return self.changes
+
+class FakeSite:
+    pass
+
+class FakeRequest:
+    def __init__(self, service):
+        self.args = {}
+        self.site = FakeSite()
+        self.site.buildbot_service = service
+
+def make_builders(basedir, status, num_builders, num_builds):
+    now = time.time()
+    builders = []
+    for i in range(num_builders):
+        name = "builder%d" % i
+        b = builder.BuilderStatus(name)
+        b.basedir = os.path.join(basedir, name)
+        os.makedirs(b.basedir)
+        b.status = status
+        b.determineNextBuildNumber()
+        for n in range(num_builds):
+            s = b.newBuild()
+            # builders take turns, so every page shows all of them
+            s.started = now - (num_builds - n) * 600 + i
+            for k in range(10):
+                step = s.addStepWithName("step%d" % k)
+                step.started = s.started + 30 * k
+                step.finished = step.started + 30
+                step.setText(["step%d" % k])
+            s.finished = s.started + 300
+            s.text = ["build", "successful"]
+            s.saveYourself()
+        status.builders[name] = b
+        builders.append(b)
+    return builders
+
+def timed(w, request, builders):
+    start = time.time()
+    rows = len(w.buildGrid(request, builders)[2])
+    return time.time() - start, rows
+
+def main(args):
+    num_builders = int(args[0]) if args else 150
+    num_builds = int(args[1]) if len(args) > 1 else 100
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print "saving %d builds for each of %d builders" % (num_builds,
+                                                            num_builders)
+        status = FakeStatus()
+        builders = make_builders(tmpdir, status, num_builders, num_builds)
+        change_source = FakeChangeSource()
+        grid = eventgrid.EventGrid(status, change_source)
+        request = FakeRequest(FakeService(grid, change_source))
+        w = waterfall.WaterfallStatusResource()
+
+        w.cacheEvents = False
+        elapsed, rows = timed(w, request, builders)
+        print "uncached:         %6.3fs (%d rows)" % (elapsed, rows)
+        w.cacheEvents = True
+        elapsed, rows = timed(w, request, builders)
+        print "first cached hit: %6.3fs (%d rows)" % (elapsed, rows)
+        hits = 5
+        total = 0
+        for i in range(hits):
+            elapsed, rows = timed(w, request, builders)
+            total += elapsed
+        print "cached:           %6.3fs (%d rows, average of %d hits)" \
+              % (total / hits, rows, hits)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])